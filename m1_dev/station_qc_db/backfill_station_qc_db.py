@@ -0,0 +1,813 @@
+#!/usr/bin/python3.6
+
+"""
+Backfill a QC database over a long range of hours by running
+update_station_qc_db.py on time shards in parallel.
+
+The range is split into shards of --shard_hours hours. Each shard is
+processed in its own QC database file (a "shard file") covering the shard
+and the --lead_in_hours hours before it, initialized with the stations of
+the target database and with zero QC flags (for lead-in hours before the
+backfill range, the flags of the target database). Since the QC tests for
+an hour depend on the QC flags of the preceding num_hrs_prev_snwd hours,
+update_station_qc_db.py is first run over the lead-in hours, to rebuild
+that flag history, and a snapshot of the lead-in flags is saved. It is
+then run over the hours of the shard itself.
+
+Shards are stitched into the target database in chronological order, as
+they finish:
+
+- Flags for the hours of the shard replace those in the target.
+- Some tests (e.g. the gap check) also flag earlier values. Bits set in
+  the lead-in hours while processing the shard's own hours (i.e., not in
+  the snapshot) are ORed into the target, carrying them over into the
+  previous shard.
+- Stations added to the shard file are matched to target stations by
+  station_obj_identifier, and appended to the target if they are new.
+
+The result is an approximation of a serial update: flags near the start
+of a shard can differ from those of a serial update where the flag
+history before the lead-in would have changed the flags within it. A
+longer lead-in makes that less likely. --verify_boundary measures it for
+one shard boundary, by rerunning the previous shard and the hours after
+the boundary serially in a separate file (see verify_boundary) and
+comparing the flags around the boundary with those in the target.
+
+Progress is kept in the work directory. Rerunning the same command
+resumes: update_station_qc_db.py continues each shard from its
+"last_datetime_updated", and shards already stitched are skipped.
+"""
+
+import argparse
+import concurrent.futures
+import datetime as dt
+import fcntl
+import json
+import os
+import subprocess
+import sys
+import time
+import numpy as np
+from netCDF4 import Dataset, num2date, date2num
+from create_station_qc_db import DEFAULT_CHUNK_PROFILE, qc_chunk_shape
+from rechunk_station_qc_db import copy_global_attrs, copy_var_def, is_qc_var
+
+# Hours of QC flag history used by the snow depth QC tests
+# (num_hrs_prev_snwd in update_station_qc_db.py).
+NUM_HRS_PREV_SNWD = 15 * 24
+
+NEVER_UPDATED = '1970-01-01 00:00:00 UTC'
+DATETIME_ATTR_FORMAT = '%Y-%m-%d %H:%M:%S UTC'
+
+UPDATE_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             'update_station_qc_db.py')
+
+
+def parse_args():
+    """
+    Parse command line arguments.
+    """
+
+    parser = argparse.ArgumentParser(description='Backfill a QC database ' +
+                                     'by running update_station_qc_db.py ' +
+                                     'on time shards in parallel.')
+    parser.add_argument('database_path',
+                        type=str,
+                        metavar='database',
+                        help='QC database file (full path)')
+    parser.add_argument('-s', '--start_date',
+                        type=str,
+                        metavar='YYYYMMDDHH',
+                        help='First hour to backfill (default: the hour ' +
+                             'after "last_datetime_updated", or the start ' +
+                             'of the database).')
+    parser.add_argument('-f', '--finish_date',
+                        type=str,
+                        metavar='YYYYMMDDHH',
+                        help='Last hour to backfill (default: the end of ' +
+                             'the database).')
+    parser.add_argument('-n', '--shard_hours',
+                        type=int,
+                        metavar='# of hours',
+                        default=30 * 24,
+                        help='Hours per shard; default={}.'.format(30 * 24))
+    parser.add_argument('-l', '--lead_in_hours',
+                        type=int,
+                        metavar='# of hours',
+                        default=NUM_HRS_PREV_SNWD,
+                        help='Hours processed before each shard to ' +
+                             'rebuild QC flag history (at least {}). '.
+                             format(NUM_HRS_PREV_SNWD) +
+                             'Flags near the start of each shard are an ' +
+                             'approximation of a serial update, which a ' +
+                             'longer lead-in improves; see ' +
+                             '--verify_boundary. ' +
+                             'default={}.'.format(NUM_HRS_PREV_SNWD))
+    parser.add_argument('-j', '--num_processes',
+                        type=int,
+                        metavar='# of processes',
+                        default=2,
+                        help='Number of shards processed at once; ' +
+                             'default=2.')
+    parser.add_argument('-w', '--work_dir',
+                        type=str,
+                        metavar='dir',
+                        help='Directory for shard files, logs and ' +
+                             'progress (default: database path + ' +
+                             '".backfill").')
+    parser.add_argument('-k', '--keep_shards',
+                        action='store_true',
+                        help='Keep shard files after they are stitched.')
+    parser.add_argument('-b', '--verify_boundary',
+                        type=int,
+                        metavar='shard #',
+                        help='After the backfill, rerun the shard before ' +
+                             'shard # (counting from 0) and the first ' +
+                             '--verify_hours hours of shard # serially, ' +
+                             'and compare the QC flags around the ' +
+                             'boundary between them with the target.')
+    parser.add_argument('-r', '--verify_hours',
+                        type=int,
+                        metavar='# of hours',
+                        default=2 * NUM_HRS_PREV_SNWD,
+                        help='Hours after the boundary rerun by ' +
+                             '--verify_boundary (more than {}); '.
+                             format(NUM_HRS_PREV_SNWD) +
+                             'default={}.'.format(2 * NUM_HRS_PREV_SNWD))
+    parser.add_argument('-c', '--check_climatology',
+                        action='store_true',
+                        help='Enhance QC tests using SNODAS climatology.')
+    parser.add_argument('-p', '--pkl_dir',
+                        type=str,
+                        metavar='dir',
+                        help='Passed to update_station_qc_db.py.')
+    parser.add_argument('-v', '--verbose',
+                        action='store_true',
+                        help='Provide verbose output.')
+
+    args = parser.parse_args()
+
+    if not os.path.isfile(args.database_path):
+        print('ERROR: {} not found.'.format(args.database_path),
+              file=sys.stderr)
+        sys.exit(1)
+
+    for name in ['start_date', 'finish_date']:
+        date_str = getattr(args, name)
+        if date_str is None:
+            continue
+        try:
+            setattr(args, name,
+                    dt.datetime.strptime(date_str, '%Y%m%d%H'))
+        except ValueError:
+            print('ERROR: invalid date "{}".'.format(date_str),
+                  file=sys.stderr)
+            sys.exit(1)
+
+    if args.shard_hours < 1:
+        print('ERROR: --shard_hours argument must be positive.',
+              file=sys.stderr)
+        sys.exit(1)
+
+    if args.lead_in_hours < NUM_HRS_PREV_SNWD:
+        print('ERROR: --lead_in_hours argument must be at least {}.'.
+              format(NUM_HRS_PREV_SNWD),
+              file=sys.stderr)
+        sys.exit(1)
+
+    if args.verify_boundary is not None and args.verify_boundary < 1:
+        print('ERROR: --verify_boundary argument must be positive.',
+              file=sys.stderr)
+        sys.exit(1)
+
+    if args.verify_hours <= NUM_HRS_PREV_SNWD:
+        print('ERROR: --verify_hours argument must be more than {}.'.
+              format(NUM_HRS_PREV_SNWD),
+              file=sys.stderr)
+        sys.exit(1)
+
+    if args.num_processes < 1:
+        print('ERROR: --num_processes argument must be positive.',
+              file=sys.stderr)
+        sys.exit(1)
+
+    if args.work_dir is None:
+        args.work_dir = args.database_path + '.backfill'
+
+    if args.pkl_dir is not None and not os.path.isdir(args.pkl_dir):
+        print('ERROR: directory {} not found.'.format(args.pkl_dir),
+              file=sys.stderr)
+        sys.exit(1)
+
+    return args
+
+
+def plan_shards(time_num, first_ind, end_ind, shard_hours, lead_in_hours):
+    """
+    Split the time indices [first_ind:end_ind] of a QC database, whose
+    "time" variable has values time_num, into shards. Returns a list of
+    dictionaries giving the time indices of each shard's lead-in
+    ("lead_in_ind"), first hour ("first_ind") and end ("end_ind"), and a
+    name for it.
+    """
+    shards = []
+    for shard_first_ind in range(first_ind, end_ind, shard_hours):
+        shard_end_ind = min(shard_first_ind + shard_hours, end_ind)
+        shards.append({'lead_in_ind': max(shard_first_ind - lead_in_hours,
+                                          0),
+                       'first_ind': shard_first_ind,
+                       'end_ind': shard_end_ind,
+                       'name': 'shard_{}_to_{}'.
+                       format(int(time_num[shard_first_ind]),
+                              int(time_num[shard_end_ind - 1]))})
+    return shards
+
+
+def station_rows(obj_id):
+    """
+    Map station object identifiers (a masked array) to rows, ignoring
+    masked (unwritten) rows.
+    """
+    return {int(oid): row
+            for row, oid in enumerate(np.ma.getdata(obj_id))
+            if not np.ma.getmaskarray(obj_id)[row]}
+
+
+def create_shard(database_path, shard_path, shard, seed_end_ind, verbose):
+    """
+    Create the shard file for a shard, covering its lead-in and its own
+    hours, with the definitions, attributes and stations of the target
+    database. QC flags are zero, except for lead-in hours before
+    seed_end_ind (the start of the backfill), which are copied from the
+    target.
+    """
+
+    nc_in = Dataset(database_path, 'r')
+    temp_path = shard_path + '.tmp'
+    nc_out = Dataset(temp_path, 'w', format=nc_in.data_model)
+
+    copy_global_attrs(nc_in, nc_out)
+    nc_out.setncattr_string('last_datetime_updated', NEVER_UPDATED)
+
+    lead_in_ind = shard['lead_in_ind']
+    end_ind = shard['end_ind']
+    num_hours = end_ind - lead_in_ind
+    for dim_name, dim in nc_in.dimensions.items():
+        if dim_name == 'time':
+            nc_out.createDimension(dim_name, num_hours)
+        else:
+            nc_out.createDimension(dim_name,
+                                   None if dim.isunlimited() else len(dim))
+
+    if 'chunk_profile' in nc_in.ncattrs():
+        chunk_profile = nc_in.getncattr('chunk_profile')
+    else:
+        chunk_profile = DEFAULT_CHUNK_PROFILE
+
+    num_stations = len(nc_in.dimensions['station'])
+    seed_end = min(max(seed_end_ind - lead_in_ind, 0), num_hours)
+    for var_name, var in nc_in.variables.items():
+
+        if is_qc_var(var):
+            var_out = copy_var_def(var,
+                                   nc_out,
+                                   qc_chunk_shape(chunk_profile, num_hours))
+            block = 1000
+            for first_station in range(0, num_stations, block):
+                end_station = min(first_station + block, num_stations)
+                flags = np.zeros((end_station - first_station, num_hours),
+                                 dtype=var.dtype)
+                if seed_end > 0:
+                    flags = np.ma.masked_array(flags)
+                    flags[:, 0:seed_end] = \
+                        var[first_station:end_station,
+                            lead_in_ind:lead_in_ind + seed_end]
+                var_out[first_station:end_station, :] = flags
+            continue
+
+        chunksizes = None
+        if 'time' in var.dimensions and var.chunking() != 'contiguous':
+            chunksizes = [min(size, len(nc_out.dimensions[dim_name]))
+                          for size, dim_name in zip(var.chunking(),
+                                                    var.dimensions)]
+        var_out = copy_var_def(var, nc_out, chunksizes)
+        if var.dimensions == ('time',):
+            var_out[:] = var[lead_in_ind:end_ind]
+        elif var.size > 0:
+            var_out[:] = var[:]
+
+    nc_out.close()
+    nc_in.close()
+    os.replace(temp_path, shard_path)
+
+    if verbose:
+        print('INFO: created {} ({} stations, {} hours).'.
+              format(shard_path, num_stations, num_hours))
+
+
+def last_updated_ind(nc):
+    """
+    Time index of the "last_datetime_updated" attribute of a QC database
+    (-1 if it precedes the database).
+    """
+    time_var = nc.variables['time']
+    last_updated = \
+        dt.datetime.strptime(nc.getncattr('last_datetime_updated'),
+                             DATETIME_ATTR_FORMAT)
+    last_num = date2num(last_updated, time_var.getncattr('units'))
+    return max(int(round(float(last_num - time_var[0]))), -1)
+
+
+def run_update(shard_path, log_path, max_update_hours, update_args):
+    """
+    Run update_station_qc_db.py on a shard file, appending its output to
+    log_path. Returns its exit status.
+    """
+    cmd = [sys.executable, UPDATE_SCRIPT, shard_path] + update_args
+    if max_update_hours is not None:
+        cmd += ['-x', str(max_update_hours)]
+    with open(log_path, 'a') as log_file:
+        log_file.write('# ' + ' '.join(cmd) + '\n')
+        log_file.flush()
+        return subprocess.call(cmd, stdout=log_file, stderr=log_file)
+
+
+def last_log_line(log_path):
+    """
+    Get the last non-blank line of an update log (e.g. the exception that
+    ended a failed run), or an empty string.
+    """
+    last_line = ''
+    with open(log_path, 'r', errors='replace') as log_file:
+        for line in log_file:
+            if line.strip() != '':
+                last_line = line.strip()
+    return last_line
+
+
+def process_shard(shard, shard_path, update_args):
+    """
+    Run update_station_qc_db.py over the lead-in hours of a shard file,
+    save a snapshot of the lead-in flags, and run it over the shard's own
+    hours. Steps already completed (according to the shard file and
+    snapshot) are skipped. Runs in a worker process. Returns the shard
+    name and an error message (None on success).
+    """
+
+    log_path = shard_path + '.log'
+    snapshot_path = shard_path + '.lead_in.npz'
+    num_lead_in_hours = shard['first_ind'] - shard['lead_in_ind']
+    num_hours = shard['end_ind'] - shard['lead_in_ind']
+
+    nc = Dataset(shard_path, 'r')
+    done_ind = last_updated_ind(nc)
+    nc.close()
+
+    # Lead-in hours.
+    if done_ind + 1 < num_lead_in_hours:
+        status = run_update(shard_path,
+                            log_path,
+                            num_lead_in_hours - done_ind - 1,
+                            update_args)
+        if status != 0:
+            return shard['name'], 'lead-in update failed ' + \
+                '(status {}): {}; '.format(status,
+                                           last_log_line(log_path)) + \
+                'see {}.'.format(log_path)
+
+    if not os.path.exists(snapshot_path):
+        nc = Dataset(shard_path, 'r')
+        if last_updated_ind(nc) != num_lead_in_hours - 1:
+            nc.close()
+            return shard['name'], 'lead-in hours were not all updated; ' + \
+                'see {}.'.format(log_path)
+        snapshot = {var_name: np.ma.filled(var[:, 0:num_lead_in_hours], 0)
+                    for var_name, var in nc.variables.items()
+                    if is_qc_var(var)}
+        nc.close()
+        np.savez(snapshot_path + '.tmp.npz', **snapshot)
+        os.replace(snapshot_path + '.tmp.npz', snapshot_path)
+
+    # Shard hours.
+    status = run_update(shard_path, log_path, None, update_args)
+    if status != 0:
+        return shard['name'], 'update failed ' + \
+            '(status {}): {}; '.format(status, last_log_line(log_path)) + \
+            'see {}.'.format(log_path)
+    nc = Dataset(shard_path, 'r')
+    done_ind = last_updated_ind(nc)
+    nc.close()
+    if done_ind != num_hours - 1:
+        return shard['name'], 'hours were not all updated; ' + \
+            'see {}.'.format(log_path)
+
+    return shard['name'], None
+
+
+def target_runs(target_rows):
+    """
+    Split an array of target rows, one for each of a sequence of source
+    rows, into runs in which both increase by one. Returns a list of
+    (first_source_row, end_source_row, first_target_row) tuples.
+    """
+    if len(target_rows) == 0:
+        return []
+    run_start = np.flatnonzero(np.diff(target_rows) != 1) + 1
+    bounds = np.concatenate(([0], run_start, [len(target_rows)]))
+    return [(int(bounds[i]), int(bounds[i + 1]),
+             int(target_rows[bounds[i]]))
+            for i in range(len(bounds) - 1)]
+
+
+def stitch_shard(qcdb, shard, shard_path, verbose):
+    """
+    Stitch a processed shard file into the (open) target QC database.
+    Stitching a shard again (e.g. after an interruption) gives the same
+    result, as long as later shards have not been stitched.
+    """
+
+    nc = Dataset(shard_path, 'r')
+    snapshot = np.load(shard_path + '.lead_in.npz')
+    lead_in_ind = shard['lead_in_ind']
+    first = shard['first_ind'] - lead_in_ind
+    end = shard['end_ind'] - lead_in_ind
+
+    # Match shard stations to target stations. Rows at the end of the
+    # target with no object identifier were left by an interrupted stitch,
+    # and are reused.
+    target_obj_id = qcdb.variables['station_obj_identifier'][:]
+    target_row = station_rows(target_obj_id)
+    num_target_stations = len(target_obj_id)
+    while num_target_stations > 0 and \
+          np.ma.getmaskarray(target_obj_id)[num_target_stations - 1]:
+        num_target_stations -= 1
+    shard_obj_id = np.ma.getdata(nc.variables['station_obj_identifier'][:])
+    rows = np.empty(len(shard_obj_id), dtype=np.int64)
+    new_rows = []
+    for shard_row, oid in enumerate(shard_obj_id.tolist()):
+        if oid in target_row:
+            rows[shard_row] = target_row[oid]
+        else:
+            rows[shard_row] = num_target_stations
+            new_rows.append(shard_row)
+            num_target_stations += 1
+
+    # Append new stations. Their QC flags are zeroed for all hours, as
+    # update_station_qc_db.py does, and their object identifiers written
+    # last, so an interrupted append is not mistaken for a station.
+    station_vars = [var for var in qcdb.variables.values()
+                    if var.dimensions == ('station',) and
+                    var.name != 'station_obj_identifier']
+    for shard_row in new_rows:
+        for var in station_vars:
+            var[rows[shard_row]] = nc.variables[var.name][shard_row]
+        for var in qcdb.variables.values():
+            if is_qc_var(var):
+                var[rows[shard_row], :] = \
+                    np.zeros(var.shape[1], dtype=var.dtype)
+        qcdb.variables['station_obj_identifier'][rows[shard_row]] = \
+            shard_obj_id[shard_row]
+    if verbose and len(new_rows) > 0:
+        print('INFO: {}: added {} stations.'.
+              format(shard['name'], len(new_rows)))
+
+    num_carried = 0
+    for var_name, var in nc.variables.items():
+        if not is_qc_var(var):
+            continue
+        qcdb_var = qcdb.variables[var_name]
+        for src_first, src_end, dst_first in target_runs(rows):
+            dst_end = dst_first + src_end - src_first
+
+            # Flags for the shard's own hours.
+            qcdb_var[dst_first:dst_end,
+                     shard['first_ind']:shard['end_ind']] = \
+                var[src_first:src_end, first:end]
+
+            # Flags set in lead-in hours while processing the shard's own
+            # hours.
+            if first == 0:
+                continue
+            lead_in = np.ma.filled(var[src_first:src_end, 0:first], 0)
+            before = np.zeros_like(lead_in)
+            saved = snapshot[var_name][src_first:src_end]
+            before[0:saved.shape[0]] = saved
+            carry = lead_in & ~before
+            carry_rows = np.flatnonzero(carry.any(axis=1))
+            for row in carry_rows.tolist():
+                qcdb_row = qcdb_var[dst_first + row,
+                                    lead_in_ind:shard['first_ind']]
+                qcdb_var[dst_first + row,
+                         lead_in_ind:shard['first_ind']] = \
+                    np.ma.filled(qcdb_row, 0) | carry[row]
+            num_carried += np.count_nonzero(carry)
+
+    if verbose:
+        print('INFO: {}: carried over {} lead-in flags.'.
+              format(shard['name'], num_carried))
+
+    # Advance "last_datetime_updated" to the end of the shard.
+    time_var = qcdb.variables['time']
+    shard_last = num2date(time_var[shard['end_ind'] - 1],
+                          time_var.getncattr('units'))
+    qcdb_last = dt.datetime.strptime(qcdb.getncattr('last_datetime_updated'),
+                                     DATETIME_ATTR_FORMAT)
+    if shard_last > qcdb_last:
+        qcdb.setncattr_string('last_datetime_updated',
+                              shard_last.strftime(DATETIME_ATTR_FORMAT))
+
+    snapshot.close()
+    nc.close()
+    qcdb.sync()
+
+
+def verify_boundary(database_path,
+                    work_dir,
+                    shards,
+                    shard_num,
+                    verify_hours,
+                    seed_end_ind,
+                    update_args,
+                    keep_files,
+                    verbose):
+    """
+    Check the flags stitched into the target QC database around the
+    boundary at the start of shards[shard_num] against a serial update.
+
+    A verification file covering shards[shard_num - 1] (with its lead-in)
+    and the first verify_hours hours of shards[shard_num] is created and
+    updated serially, just as a shard is. Its flags for the hours from the
+    start of the lead-in of shards[shard_num] (or of the previous shard,
+    if later) up to NUM_HRS_PREV_SNWD hours before its end, which later
+    hours can no longer change, are compared with the target. Returns the
+    number of differing flag values.
+    """
+
+    prev_shard = shards[shard_num - 1]
+    shard = shards[shard_num]
+    boundary_ind = shard['first_ind']
+    verify = {'lead_in_ind': prev_shard['lead_in_ind'],
+              'first_ind': prev_shard['first_ind'],
+              'end_ind': min(boundary_ind + verify_hours, shard['end_ind']),
+              'name': 'verify_' + shard['name']}
+    compare_first_ind = max(shard['lead_in_ind'], prev_shard['first_ind'])
+    compare_end_ind = verify['end_ind'] - NUM_HRS_PREV_SNWD
+    if compare_end_ind <= boundary_ind:
+        print('ERROR: shard {} is too short to verify its boundary.'.
+              format(shard['name']),
+              file=sys.stderr)
+        return None
+
+    verify_path = os.path.join(work_dir, verify['name'] + '.nc')
+    if not os.path.exists(verify_path):
+        create_shard(database_path, verify_path, verify, seed_end_ind,
+                     verbose)
+    if verbose:
+        print('INFO: updating {} serially.'.format(verify_path))
+    name, error = process_shard(verify, verify_path, update_args)
+    if error is not None:
+        print('ERROR: boundary verification: {}'.format(error),
+              file=sys.stderr)
+        return None
+
+    nc = Dataset(verify_path, 'r')
+    qcdb = Dataset(database_path, 'r')
+    target_row = station_rows(qcdb.variables['station_obj_identifier'][:])
+    verify_obj_id = \
+        np.ma.getdata(nc.variables['station_obj_identifier'][:]).tolist()
+    missing = [oid for oid in verify_obj_id if oid not in target_row]
+    if len(missing) > 0:
+        print('WARNING: {} stations in {} '.format(len(missing), verify_path) +
+              'are not in the target.',
+              file=sys.stderr)
+
+    src_first = compare_first_ind - verify['lead_in_ind']
+    src_end = compare_end_ind - verify['lead_in_ind']
+    num_differ = 0
+    for var_name, var in nc.variables.items():
+        if not is_qc_var(var):
+            continue
+        qcdb_var = qcdb.variables[var_name]
+        var_differ = 0
+        differ_hours = np.zeros(compare_end_ind - compare_first_ind,
+                                dtype=bool)
+        for verify_row, oid in enumerate(verify_obj_id):
+            if oid not in target_row:
+                continue
+            serial = np.ma.filled(var[verify_row, src_first:src_end], 0)
+            stitched = np.ma.filled(qcdb_var[target_row[oid],
+                                             compare_first_ind:
+                                             compare_end_ind], 0)
+            differ = serial != stitched
+            var_differ += np.count_nonzero(differ)
+            differ_hours |= differ
+        if var_differ > 0:
+            differ_ind = np.flatnonzero(differ_hours) + compare_first_ind
+            print('INFO: {}: {} flag values differ, '.
+                  format(var_name, var_differ) +
+                  'in hours {} to {} relative to the boundary.'.
+                  format(int(differ_ind[0]) - boundary_ind,
+                         int(differ_ind[-1]) - boundary_ind))
+        num_differ += var_differ
+
+    time_var = qcdb.variables['time']
+    time_units = time_var.getncattr('units')
+    print('INFO: boundary at {}: '.
+          format(num2date(time_var[boundary_ind], time_units).
+                 strftime(DATETIME_ATTR_FORMAT)) +
+          '{} flag values differ from a serial update '.format(num_differ) +
+          'for {} hours before and {} hours after it.'.
+          format(boundary_ind - compare_first_ind,
+                 compare_end_ind - boundary_ind))
+
+    qcdb.close()
+    nc.close()
+    if not keep_files:
+        for path in [verify_path,
+                     verify_path + '.lead_in.npz',
+                     verify_path + '.log',
+                     verify_path + '.lock']:
+            if os.path.exists(path):
+                os.remove(path)
+
+    return num_differ
+
+
+def main():
+    """
+    Backfill a QC database in time shards.
+    """
+
+    args = parse_args()
+
+    # Lock the QC database, as update_station_qc_db.py does, for the
+    # whole backfill.
+    lock_file = open(args.database_path + '.lock', 'a')
+    try:
+        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        print('ERROR: QC database {} '.format(args.database_path) +
+              'is locked by another update.',
+              file=sys.stderr)
+        sys.exit(1)
+    if os.path.exists(args.database_path + '.journal'):
+        print('ERROR: QC database {} has a journal that has not been '.
+              format(args.database_path) +
+              'applied; run update_station_qc_db.py to recover it first.',
+              file=sys.stderr)
+        sys.exit(1)
+
+    os.makedirs(args.work_dir, exist_ok=True)
+
+    # Progress file. A backfill can only be resumed with the same plan.
+    state_path = os.path.join(args.work_dir, 'backfill_state.json')
+    state = None
+    if os.path.exists(state_path):
+        with open(state_path) as state_file:
+            state = json.load(state_file)
+
+    qcdb = Dataset(args.database_path, 'r')
+    time_var = qcdb.variables['time']
+    time_num = time_var[:]
+    time_units = time_var.getncattr('units')
+    if args.start_date is None and state is not None:
+        # Resuming; "last_datetime_updated" has moved on.
+        first_ind = state['plan']['first_ind']
+    elif args.start_date is None:
+        first_ind = last_updated_ind(qcdb) + 1
+    else:
+        first_ind = int(round(float(date2num(args.start_date, time_units) -
+                              time_num[0])))
+    if args.finish_date is None:
+        end_ind = len(time_num)
+    else:
+        end_ind = int(round(float(date2num(args.finish_date, time_units) -
+                            time_num[0]))) + 1
+    qcdb.close()
+
+    if first_ind < 0 or end_ind > len(time_num) or first_ind >= end_ind:
+        print('ERROR: backfill range is empty or outside the QC database.',
+              file=sys.stderr)
+        sys.exit(1)
+
+    shards = plan_shards(time_num,
+                         first_ind,
+                         end_ind,
+                         args.shard_hours,
+                         args.lead_in_hours)
+
+    if args.verify_boundary is not None and \
+       args.verify_boundary >= len(shards):
+        print('ERROR: --verify_boundary argument must be less than the ' +
+              'number of shards ({}).'.format(len(shards)),
+              file=sys.stderr)
+        sys.exit(1)
+
+    plan = {'database_path': os.path.abspath(args.database_path),
+            'first_ind': first_ind,
+            'end_ind': end_ind,
+            'shards': shards}
+    if state is not None:
+        if state['plan'] != plan:
+            print('ERROR: {} describes a different backfill; '.
+                  format(state_path) +
+                  'use another --work_dir or remove it.',
+                  file=sys.stderr)
+            sys.exit(1)
+    else:
+        state = {'plan': plan, 'stitched': []}
+
+    def save_state():
+        with open(state_path + '.tmp', 'w') as state_file:
+            json.dump(state, state_file, indent=1)
+        os.replace(state_path + '.tmp', state_path)
+
+    save_state()
+
+    update_args = ['-m', '0']
+    if args.check_climatology:
+        update_args.append('-c')
+    if args.pkl_dir is not None:
+        update_args += ['-p', args.pkl_dir]
+    if args.verbose:
+        update_args.append('-v')
+
+    pending = [shard for shard in shards
+               if shard['name'] not in state['stitched']]
+    if args.verbose:
+        print('INFO: backfilling {} hours in {} shards ({} done).'.
+              format(end_ind - first_ind, len(shards),
+                     len(shards) - len(pending)))
+
+    # Create shard files and process them in parallel. Worker processes
+    # are forked as shards are submitted, when no netCDF files are open
+    # here.
+    t1 = time.perf_counter()
+    executor = \
+        concurrent.futures.ProcessPoolExecutor(max_workers=
+                                               args.num_processes)
+    futures = {}
+    for shard in pending:
+        shard_path = os.path.join(args.work_dir, shard['name'] + '.nc')
+        if not os.path.exists(shard_path):
+            create_shard(args.database_path,
+                         shard_path,
+                         shard,
+                         first_ind,
+                         args.verbose)
+        futures[shard['name']] = executor.submit(process_shard,
+                                                 shard,
+                                                 shard_path,
+                                                 update_args)
+
+    # Stitch shards into the target in order as they finish.
+    qcdb = Dataset(args.database_path, 'r+')
+    for shard in pending:
+        shard_path = os.path.join(args.work_dir, shard['name'] + '.nc')
+        name, error = futures[shard['name']].result()
+        if error is not None:
+            print('ERROR: shard {}: {}'.format(name, error),
+                  file=sys.stderr)
+            qcdb.close()
+            for future in futures.values():
+                future.cancel()
+            executor.shutdown(wait=True)
+            sys.exit(1)
+        stitch_shard(qcdb, shard, shard_path, args.verbose)
+        state['stitched'].append(shard['name'])
+        save_state()
+        if not args.keep_shards:
+            for path in [shard_path,
+                         shard_path + '.lead_in.npz',
+                         shard_path + '.lock']:
+                if os.path.exists(path):
+                    os.remove(path)
+        print('INFO: stitched {} ({} of {}, {:.0f} seconds).'.
+              format(shard['name'],
+                     len(state['stitched']),
+                     len(shards),
+                     time.perf_counter() - t1))
+    qcdb.close()
+    executor.shutdown(wait=True)
+
+    if args.verify_boundary is not None:
+        num_differ = verify_boundary(args.database_path,
+                                     args.work_dir,
+                                     shards,
+                                     args.verify_boundary,
+                                     args.verify_hours,
+                                     first_ind,
+                                     update_args,
+                                     args.keep_shards,
+                                     args.verbose)
+        if num_differ != 0:
+            lock_file.close()
+            sys.exit(1)
+
+    lock_file.close()
+
+    print('INFO: backfill of {} complete.'.format(args.database_path))
+
+
+if __name__ == '__main__':
+    main()
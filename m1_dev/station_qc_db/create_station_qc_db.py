@@ -14,11 +14,38 @@ import sys
 import os
 
 
+# Chunk shapes (station_chunk, time_chunk) for the [station, time] QC
+# variables. "station-extract" (one station by up to 1024 hours) suits
+# reading the QC time series of individual stations, but
+# update_station_qc_db.py reads a window of a few hundred hours for all
+# stations and updates a single hour for all stations, which in that
+# layout touches one chunk per station. "hourly-update" chunks (256
+# stations by 64 hours) serve those accesses with tens (window reads) to
+# hundreds (hourly updates) of times fewer chunks, at the cost of reading
+# whole chunks of other stations when a single station is extracted.
+# "balanced" lies in between. All three profiles use chunks of at most
+# 64 KiB (uncompressed).
+CHUNK_PROFILES = {'station-extract': (1, 1024),
+                  'balanced': (32, 512),
+                  'hourly-update': (256, 64)}
+DEFAULT_CHUNK_PROFILE = 'station-extract'
+
+
 class Opt:
     def __init__(self):
         self.start_datetime = []
         self.finish_datetime = []
         self.db_dir = []
+        self.chunk_profile = []
+
+
+def qc_chunk_shape(chunk_profile, num_hours):
+    """
+    Chunk shape for the [station, time] QC variables of a database with
+    num_hours hours, for a CHUNK_PROFILES chunk profile.
+    """
+    station_chunk, time_chunk = CHUNK_PROFILES[chunk_profile]
+    return (station_chunk, min(time_chunk, num_hours))
 
 
 def parse_args():
@@ -47,6 +74,14 @@ def parse_args():
                         nargs='?',
                         help='Directory in which output database files are ' +
                         'stored.')
+    parser.add_argument('-c', '--chunk_profile',
+                        type=str,
+                        choices=sorted(CHUNK_PROFILES.keys()),
+                        default=DEFAULT_CHUNK_PROFILE,
+                        help='Chunk layout of the QC variables, suited to ' +
+                        'extracting station time series or to hourly ' +
+                        'updates (default: {}).'.
+                        format(DEFAULT_CHUNK_PROFILE))
     args = parser.parse_args()
 
     if args.start_date:
@@ -110,6 +145,8 @@ def parse_args():
               file=sys.stderr)
         exit(1)
 
+    Opt.chunk_profile = args.chunk_profile
+
     return Opt
 
 
@@ -149,6 +186,9 @@ def main():
     nc_out.setncattr_string('last_station_update_datetime',
                             '1970-01-01 00:00:00 UTC')
 
+    # Record the chunk layout of the QC variables.
+    nc_out.setncattr_string('chunk_profile', opt.chunk_profile)
+
     # nc_out.setncattr('metadata_update_interval_hours', 12)
 
     # Define dimensions.
@@ -391,9 +431,7 @@ def main():
     # Define QC variables.
 
     dims = ('station', 'time')
-    station_chunk = 1
-    time_chunk = min(1024, num_hours)
-    chunk = (station_chunk, time_chunk)
+    chunk = qc_chunk_shape(opt.chunk_profile, num_hours)
 
     var_snow_depth_qc_checked = \
         nc_out.createVariable('snow_depth_qc_checked',
@@ -447,9 +485,7 @@ def main():
     # Define QC variables.
 
     dims = ('station', 'time')
-    station_chunk = 1
-    time_chunk = min(1024, num_hours)
-    chunk = (station_chunk, time_chunk)
+    chunk = qc_chunk_shape(opt.chunk_profile, num_hours)
 
     var_swe_qc_checked = \
         nc_out.createVariable('swe_qc_checked',
@@ -487,7 +523,9 @@ def main():
 
     nc_out.close()
 
-    print('INFO: Created ' + os.path.join(opt.db_dir, db_file) + '.')
+    print('INFO: Created ' + os.path.join(opt.db_dir, db_file) +
+          ' with "' + opt.chunk_profile + '" chunks ' +
+          '({} stations x {} hours).'.format(*chunk))
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,280 @@
+#!/usr/bin/python3.6
+
+"""
+Rewrite a QC database created by create_station_qc_db.py with a different
+chunk layout for its [station, time] QC variables (see
+create_station_qc_db.CHUNK_PROFILES). Data are streamed in blocks aligned
+to both the old and new chunks, so memory use is bounded by --block_mb
+regardless of the size of the database. Other variables and all
+attributes are copied unchanged.
+"""
+
+import argparse
+import fcntl
+import math
+import os
+import sys
+import time
+from netCDF4 import Dataset
+from create_station_qc_db import CHUNK_PROFILES, qc_chunk_shape
+
+# Text attributes that create_station_qc_db.py writes as NC_CHAR; others
+# are written as NC_STRING with setncattr_string.
+CHAR_ATTRS = ['_Encoding', 'units', 'calendar']
+
+
+def parse_args():
+    """
+    Parse command line arguments.
+    """
+
+    parser = argparse.ArgumentParser(description='Rewrite a QC database ' +
+                                     'with a new chunk layout.')
+    parser.add_argument('database_path',
+                        type=str,
+                        help='QC database to rechunk.')
+    parser.add_argument('output_path',
+                        type=str,
+                        nargs='?',
+                        help='Output database (default: replace ' +
+                        'database_path).')
+    parser.add_argument('-c', '--chunk_profile',
+                        type=str,
+                        choices=sorted(CHUNK_PROFILES.keys()),
+                        required=True,
+                        help='Chunk layout for the QC variables.')
+    parser.add_argument('-b', '--block_mb',
+                        type=float,
+                        default=256.0,
+                        help='Approximate size of the blocks of QC ' +
+                        'variables read and written at a time (MB).')
+    parser.add_argument('-f', '--force',
+                        action='store_true',
+                        help='Overwrite output_path if it exists.')
+    parser.add_argument('-v', '--verbose',
+                        action='store_true',
+                        help='Provide verbose output.')
+
+    args = parser.parse_args()
+
+    if not os.path.isfile(args.database_path):
+        print('ERROR: QC database {} not found.'.format(args.database_path),
+              file=sys.stderr)
+        sys.exit(1)
+
+    if args.output_path is not None and \
+       os.path.exists(args.output_path) and \
+       not args.force:
+        print('ERROR: output {} exists (use --force to overwrite).'.
+              format(args.output_path),
+              file=sys.stderr)
+        sys.exit(1)
+
+    if args.block_mb <= 0.0:
+        print('ERROR: block size must be positive.', file=sys.stderr)
+        sys.exit(1)
+
+    return args
+
+
+def is_qc_var(var):
+    """
+    Identify the [station, time] QC variables.
+    """
+    return var.dimensions == ('station', 'time')
+
+
+def copy_global_attrs(nc_in, nc_out):
+    """
+    Copy the global attributes of nc_in to nc_out.
+    """
+    for attr_name in nc_in.ncattrs():
+        attr_value = nc_in.getncattr(attr_name)
+        if isinstance(attr_value, str) and attr_name not in CHAR_ATTRS:
+            nc_out.setncattr_string(attr_name, attr_value)
+        else:
+            nc_out.setncattr(attr_name, attr_value)
+
+
+def copy_var_def(var, nc_out, chunksizes):
+    """
+    Define a copy of netCDF variable var in nc_out, with chunk shape
+    chunksizes (None to keep that of var), and copy its attributes.
+    """
+
+    filters = var.filters() or {}
+    kwargs = {'zlib': bool(filters.get('zlib', False)),
+              'shuffle': bool(filters.get('shuffle', False)),
+              'fletcher32': bool(filters.get('fletcher32', False))}
+    if kwargs['zlib']:
+        kwargs['complevel'] = filters.get('complevel', 4)
+    if '_FillValue' in var.ncattrs():
+        kwargs['fill_value'] = var.getncattr('_FillValue')
+    if chunksizes is None:
+        chunking = var.chunking()
+        if chunking == 'contiguous':
+            kwargs['contiguous'] = True
+        else:
+            kwargs['chunksizes'] = chunking
+    else:
+        kwargs['chunksizes'] = chunksizes
+
+    var_out = nc_out.createVariable(var.name,
+                                    var.datatype,
+                                    var.dimensions,
+                                    **kwargs)
+
+    for attr_name in var.ncattrs():
+        if attr_name == '_FillValue':
+            continue
+        attr_value = var.getncattr(attr_name)
+        if isinstance(attr_value, str) and attr_name not in CHAR_ATTRS:
+            var_out.setncattr_string(attr_name, attr_value)
+        else:
+            var_out.setncattr(attr_name, attr_value)
+
+    return var_out
+
+
+def lcm(a, b):
+    """
+    Least common multiple of positive integers a and b.
+    """
+    return a * b // math.gcd(a, b)
+
+
+def block_shape(var, chunksizes, block_mb):
+    """
+    Shape of the [station, time] blocks in which QC variable var is copied
+    to a variable with chunk shape chunksizes. Blocks are multiples of both
+    the old and new chunk shapes (so every chunk is read and written
+    once), extended over all times and then over stations as block_mb
+    allows.
+    """
+
+    num_stations, num_hours = var.shape
+    old_chunking = var.chunking()
+    if old_chunking == 'contiguous':
+        old_chunking = (1, num_hours)
+
+    station_step = lcm(int(old_chunking[0]), int(chunksizes[0]))
+    time_step = lcm(int(old_chunking[1]), int(chunksizes[1]))
+
+    max_elements = max(int(block_mb * 1.0e6 / var.dtype.itemsize), 1)
+    if station_step * num_hours <= max_elements:
+        time_block = num_hours
+    else:
+        time_block = min(num_hours,
+                         max(max_elements // station_step // time_step, 1) *
+                         time_step)
+    station_block = max(max_elements // time_block // station_step, 1) * \
+        station_step
+
+    return station_block, time_block
+
+
+def rechunk(database_path, output_path, chunk_profile, block_mb, verbose):
+    """
+    Write a copy of QC database database_path to output_path with QC
+    variables in the chunk layout chunk_profile. Returns the number of
+    blocks of QC variables copied.
+    """
+
+    nc_in = Dataset(database_path, 'r')
+    nc_out = Dataset(output_path, 'w', format=nc_in.data_model)
+
+    copy_global_attrs(nc_in, nc_out)
+    nc_out.setncattr_string('chunk_profile', chunk_profile)
+
+    for dim_name, dim in nc_in.dimensions.items():
+        nc_out.createDimension(dim_name,
+                               None if dim.isunlimited() else len(dim))
+
+    num_hours = len(nc_in.dimensions['time'])
+    num_blocks = 0
+    for var_name, var in nc_in.variables.items():
+
+        if not is_qc_var(var):
+            var_out = copy_var_def(var, nc_out, None)
+            if var.size > 0:
+                var_out[:] = var[:]
+            continue
+
+        chunksizes = qc_chunk_shape(chunk_profile, num_hours)
+        var_out = copy_var_def(var, nc_out, chunksizes)
+        station_block, time_block = block_shape(var, chunksizes, block_mb)
+        if verbose:
+            print('INFO: copying {} in {} x {} blocks.'.
+                  format(var_name, station_block, time_block))
+        for first_station in range(0, var.shape[0], station_block):
+            end_station = min(first_station + station_block, var.shape[0])
+            for first_hour in range(0, var.shape[1], time_block):
+                end_hour = min(first_hour + time_block, var.shape[1])
+                var_out[first_station:end_station, first_hour:end_hour] = \
+                    var[first_station:end_station, first_hour:end_hour]
+                num_blocks += 1
+
+    nc_out.close()
+    nc_in.close()
+
+    return num_blocks
+
+
+def main():
+    """
+    Rechunk a QC database.
+    """
+
+    args = parse_args()
+
+    # Refuse to rechunk a database that update_station_qc_db.py is
+    # updating, or that has journaled updates it has not yet applied.
+    lock_file = open(args.database_path + '.lock', 'a')
+    try:
+        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        print('ERROR: QC database {} is locked by an update.'.
+              format(args.database_path),
+              file=sys.stderr)
+        sys.exit(1)
+    if os.path.exists(args.database_path + '.journal'):
+        print('ERROR: QC database {} has a journal that has not been '.
+              format(args.database_path) +
+              'applied; run update_station_qc_db.py to recover it first.',
+              file=sys.stderr)
+        sys.exit(1)
+
+    if args.output_path is None:
+        output_path = args.database_path
+    else:
+        output_path = args.output_path
+    temp_output_path = output_path + '.rechunk.' + str(os.getpid())
+    input_mb = os.path.getsize(args.database_path) / 1.0e6
+
+    t1 = time.perf_counter()
+    try:
+        num_blocks = rechunk(args.database_path,
+                             temp_output_path,
+                             args.chunk_profile,
+                             args.block_mb,
+                             args.verbose)
+    except:
+        if os.path.exists(temp_output_path):
+            os.remove(temp_output_path)
+        raise
+    os.replace(temp_output_path, output_path)
+    elapsed = time.perf_counter() - t1
+
+    lock_file.close()
+
+    print('INFO: wrote {} with "{}" chunks '.
+          format(output_path, args.chunk_profile) +
+          '({} blocks, {:.1f} seconds, {:.1f} MB -> {:.1f} MB).'.
+          format(num_blocks,
+                 elapsed,
+                 input_mb,
+                 os.path.getsize(output_path) / 1.0e6))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,964 @@
+#!/usr/bin/python3.6
+
+"""
+Benchmark the Durre QC tests, the neighbor search and the hourly update of
+update_station_qc_db.py on synthetic station networks, without access to
+wdb0.
+
+A SyntheticNetwork places stations in clusters (plus a uniform background)
+over the conterminous US, and assigns each a reporting schedule in one of
+the obs_rate_category classes (hourly, synoptic, daily, quasi-daily or
+sporadic). Observations are generated hour by hour from seeded random
+numbers, so any window of hours can be reproduced without keeping a
+[station, hour] history in memory. Some stations have outages (gaps in
+reporting) and some report a constant value (streaks), and a small
+fraction of values have spikes added.
+
+For each network size the following are timed:
+
+- neighbors: find_nearest_neighbors (for a sample of stations, scaled to
+  all of them) and find_nearest_neighbors_tree, for stations reporting snow
+  depth against stations reporting air temperature.
+- snwd.*, swe.*: each qc_durre_snwd_* and qc_durre_swe_* test, in its batch
+  form for all reporting stations ("batch") and in its scalar form for a
+  sample of stations, scaled to all of them ("scalar").
+- hour.*: a full run of update_station_qc_db.main for a few hours, on a QC
+  database created by create_station_qc_db.py and populated with the
+  stations of the network, with the wdb0 query functions replaced by the
+  network. "hour.first" includes reading the windows of preceding
+  observations; "hour.steady" is the mean of the later hours. Times come
+  from the --profile_file output of the updater.
+
+Results may be saved as a baseline (--write_baseline) and compared with one
+(--baseline_file), in which case benchmarks slower than their baseline by
+more than --tolerance are reported as regressions and the exit status is 1.
+Baselines are only meaningful on the machine they were recorded on.
+"""
+
+import argparse
+import datetime as dt
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import numpy as np
+from netCDF4 import Dataset
+from create_station_qc_db import CHUNK_PROFILES, DEFAULT_CHUNK_PROFILE
+import update_station_qc_db as qc
+import wdb0
+
+# Neighborhood parameters, as in update_station_qc_db.main.
+NEIGHBORHOOD_RADIUS_KM = 75.0
+MIN_TAIR_NEIGHBORS = 3
+MAX_TAIR_NEIGHBORS = 7
+
+# Hours of data used by the tests, as in update_station_qc_db.main.
+NUM_HRS_WRE = 24
+NUM_HRS_STREAK = 15 * 24
+NUM_HRS_GAP = 15 * 24
+NUM_HRS_PREV_TAIR = 24
+NUM_HRS_SNOWFALL = 24
+NUM_HRS_PRCP = 24
+NUM_HRS_PREV = max(NUM_HRS_WRE, NUM_HRS_STREAK, NUM_HRS_GAP,
+                   NUM_HRS_PREV_TAIR, NUM_HRS_SNOWFALL, NUM_HRS_PRCP)
+
+# Proportions of stations in each reporting rate category, indexed by the
+# categories of obs_rate_categories (0 = sporadic, ..., 4 = hourly).
+RATE_CATEGORY_PROPORTIONS = [0.05, 0.10, 0.40, 0.15, 0.30]
+
+EPOCH = dt.datetime(1970, 1, 1)
+
+
+def parse_args():
+    """
+    Parse command line arguments.
+    """
+
+    parser = argparse.ArgumentParser(description='Benchmark the Durre QC ' +
+                                     'tests, neighbor search and hourly ' +
+                                     'update on synthetic station networks.')
+    parser.add_argument('-s', '--num_stations',
+                        type=int,
+                        nargs='+',
+                        default=[1000, 10000, 50000],
+                        help='Sizes of the synthetic networks.')
+    parser.add_argument('-o', '--first_hour',
+                        type=str,
+                        metavar='YYYYMMDDHH',
+                        default='2019012100',
+                        help='First hour QCed (synthetic data are ' +
+                        'generated for the preceding {} hours as well).'.
+                        format(NUM_HRS_PREV))
+    parser.add_argument('-u', '--num_update_hours',
+                        type=int,
+                        default=3,
+                        help='Number of hours run through the updater ' +
+                        '(0 to skip it).')
+    parser.add_argument('-r', '--num_repeats',
+                        type=int,
+                        default=3,
+                        help='Number of times to run each test; the best ' +
+                        'time is reported.')
+    parser.add_argument('-e', '--scalar_sample',
+                        type=int,
+                        default=1000,
+                        help='Number of stations for which scalar tests ' +
+                        'and find_nearest_neighbors are timed.')
+    parser.add_argument('-c', '--chunk_profile',
+                        type=str,
+                        choices=sorted(CHUNK_PROFILES.keys()),
+                        default=DEFAULT_CHUNK_PROFILE,
+                        help='Chunk layout of the QC database.')
+    parser.add_argument('-j', '--num_workers',
+                        type=int,
+                        default=1,
+                        help='Number of worker processes for the updater.')
+    parser.add_argument('-b', '--baseline_file',
+                        type=str,
+                        default=None,
+                        help='JSON file of baseline times to compare with.')
+    parser.add_argument('-w', '--write_baseline',
+                        action='store_true',
+                        help='Save results to the baseline file (replacing ' +
+                        'baselines for the same network sizes).')
+    parser.add_argument('-t', '--tolerance',
+                        type=float,
+                        default=0.25,
+                        help='Fraction by which a benchmark may exceed its ' +
+                        'baseline before it is reported as a regression.')
+    parser.add_argument('-m', '--min_seconds',
+                        type=float,
+                        default=0.005,
+                        help='Differences from baselines smaller than ' +
+                        'this (seconds) are never regressions.')
+    parser.add_argument('-a', '--seed',
+                        type=int,
+                        default=0,
+                        help='Random number seed for the networks.')
+    parser.add_argument('-d', '--scratch_dir',
+                        type=str,
+                        default=None,
+                        help='Directory for QC databases and updater ' +
+                        'profiles (default: a temporary directory, ' +
+                        'removed afterwards).')
+    parser.add_argument('-v', '--verbose',
+                        action='store_true',
+                        help='Provide verbose output.')
+
+    args = parser.parse_args()
+
+    if min(args.num_stations) < 1:
+        print('ERROR: numbers of stations must be positive.',
+              file=sys.stderr)
+        sys.exit(1)
+
+    try:
+        args.first_datetime = dt.datetime.strptime(args.first_hour,
+                                                   '%Y%m%d%H')
+    except ValueError:
+        print('ERROR: invalid first hour "{}".'.format(args.first_hour),
+              file=sys.stderr)
+        sys.exit(1)
+
+    if args.num_update_hours < 0 or args.num_repeats < 1 or \
+       args.scalar_sample < 1:
+        print('ERROR: numbers of hours, repeats and sampled stations ' +
+              'must be positive.',
+              file=sys.stderr)
+        sys.exit(1)
+
+    if args.write_baseline and args.baseline_file is None:
+        print('ERROR: --write_baseline requires --baseline_file.',
+              file=sys.stderr)
+        sys.exit(1)
+
+    if args.scratch_dir is not None and not os.path.isdir(args.scratch_dir):
+        print('ERROR: scratch directory {} not found.'.
+              format(args.scratch_dir),
+              file=sys.stderr)
+        sys.exit(1)
+
+    return args
+
+
+def epoch_hour(datetime):
+    """
+    Hours since 1970-01-01 00 UTC.
+    """
+    return int((datetime - EPOCH).total_seconds()) // 3600
+
+
+class SyntheticNetwork:
+
+    """
+    A synthetic network of num_stations stations, all of which report air
+    temperature, about 60% of which report snow depth and about 25% of
+    which report SWE. Observations for any hour are generated on demand
+    (see hour_values), and returned by stand-ins for the wdb0 query
+    functions in the form those functions use (see install).
+    """
+
+    def __init__(self,
+                 num_stations,
+                 seed=0,
+                 streak_fraction=0.05,
+                 outage_fraction=0.1,
+                 spike_rate=0.002):
+
+        rng = np.random.default_rng(seed)
+        self.seed = seed
+        self.num_stations = num_stations
+        self.spike_rate = spike_rate
+
+        self.obj_id = np.arange(1, num_stations + 1) * 7
+        self.station_id = ['S{:07d}'.format(val) for val in self.obj_id]
+
+        # Most stations are clustered (around population centers and in
+        # mountain ranges); the rest are spread uniformly.
+        num_clusters = num_stations // 200 + 1
+        center_lat = rng.uniform(30.0, 48.0, num_clusters)
+        center_lon = rng.uniform(-122.0, -70.0, num_clusters)
+        cluster = rng.integers(0, num_clusters, num_stations)
+        clustered = rng.random(num_stations) < 0.7
+        self.lat = np.where(clustered,
+                            center_lat[cluster] +
+                            rng.normal(0.0, 0.5, num_stations),
+                            rng.uniform(25.0, 50.0, num_stations))
+        self.lon = np.where(clustered,
+                            center_lon[cluster] +
+                            rng.normal(0.0, 0.7, num_stations),
+                            rng.uniform(-125.0, -67.0, num_stations))
+        self.lat = np.clip(self.lat, 25.0, 50.0)
+        self.lon = np.clip(self.lon, -125.0, -67.0)
+        self.elevation = rng.uniform(0.0, 3000.0, num_stations)
+
+        self.reports_snwd = rng.random(num_stations) < 0.6
+        self.reports_swe = rng.random(num_stations) < 0.25
+        self.reports_snfl = self.reports_snwd & \
+            (rng.random(num_stations) < 0.3)
+        self.reports_prcp = self.reports_snwd & \
+            (rng.random(num_stations) < 0.5)
+
+        # Reporting schedules for snow depth and SWE.
+        self.rate_category = rng.choice(len(RATE_CATEGORY_PROPORTIONS),
+                                        size=num_stations,
+                                        p=RATE_CATEGORY_PROPORTIONS)
+        self.report_phase = rng.integers(0, 48, num_stations)
+        self.outage_hours = np.where(rng.random(num_stations) <
+                                     outage_fraction,
+                                     rng.integers(24, 240, num_stations),
+                                     0)
+        self.outage_offset = rng.integers(0, 720, num_stations)
+
+        # Snow depth varies slowly around a station base value, except at
+        # stations with streaks.
+        self.snwd_base_cm = np.round(rng.gamma(2.0, 25.0, num_stations), 1)
+        self.snwd_amp_cm = rng.uniform(0.0, 20.0, num_stations)
+        self.snwd_period_hours = rng.uniform(10.0, 60.0, num_stations) * 24.0
+        self.snwd_phase = rng.uniform(0.0, 2.0 * np.pi, num_stations)
+        self.streak = rng.random(num_stations) < streak_fraction
+        self.swe_density = rng.uniform(0.1, 0.4, num_stations)
+        self.tair_base_deg_c = 10.0 - (self.lat - 25.0) * 0.8 - \
+            self.elevation * 0.0065
+
+    def reported(self, hour, rng):
+        """
+        Stations reporting snow depth/SWE at epoch hour hour.
+        """
+
+        u = rng.random(self.num_stations)
+        k = hour - self.report_phase
+        category = self.rate_category
+        reported = np.select([category == 4,
+                              category == 3,
+                              category == 2,
+                              category == 1],
+                             [u < 0.95,
+                              k % 3 == 0,
+                              k % 24 == 0,
+                              k % 48 == 0],
+                             u < 0.005)
+        in_outage = (hour + self.outage_offset) % 720 < self.outage_hours
+
+        return reported & ~in_outage
+
+    def hour_values(self, hour):
+        """
+        Observations for epoch hour hour: a dictionary of [station] masked
+        arrays, keyed by "snow_depth" (cm), "swe" (mm), "air_temp" (deg C),
+        and "snowfall" (cm) and "precip" (mm), which are accumulations over
+        24 hours reported with snow depth.
+        """
+
+        n = self.num_stations
+        rng = np.random.default_rng([self.seed, hour])
+        reported = self.reported(hour, rng)
+
+        snwd = self.snwd_base_cm + \
+            self.snwd_amp_cm * np.sin(2.0 * np.pi * hour /
+                                      self.snwd_period_hours +
+                                      self.snwd_phase) + \
+            rng.normal(0.0, 0.5, n)
+        snwd = np.where(self.streak, self.snwd_base_cm, np.maximum(snwd, 0.0))
+        spike = rng.random(n) < self.spike_rate
+        snwd = np.round(np.where(spike,
+                                 snwd + rng.choice([-1.0, 1.0], n) *
+                                 rng.uniform(200.0, 1500.0, n),
+                                 snwd), 1)
+        swe = np.round(snwd * 10.0 * self.swe_density)
+
+        tair = self.tair_base_deg_c + \
+            8.0 * np.sin(2.0 * np.pi * (hour % 24) / 24.0 +
+                         np.radians(self.lon)) + \
+            rng.normal(0.0, 2.0, n)
+        snfl = np.where(rng.random(n) < 0.7, 0.0, rng.uniform(0.0, 30.0, n))
+        prcp = np.where(rng.random(n) < 0.6, 0.0, rng.uniform(0.0, 40.0, n))
+
+        return {'snow_depth':
+                np.ma.masked_array(snwd, mask=~(self.reports_snwd &
+                                                reported)),
+                'swe':
+                np.ma.masked_array(swe, mask=~(self.reports_swe & reported)),
+                'air_temp':
+                np.ma.masked_array(np.round(tair, 1),
+                                   mask=rng.random(n) >= 0.9),
+                'snowfall':
+                np.ma.masked_array(np.round(snfl, 1),
+                                   mask=~(self.reports_snfl & reported)),
+                'precip':
+                np.ma.masked_array(np.round(prcp, 1),
+                                   mask=~(self.reports_prcp & reported))}
+
+    def window(self, element, first_hour, num_hours, rows=None):
+        """
+        [station, hour] masked array of element for num_hours hours
+        starting at epoch hour first_hour, for stations rows (default:
+        all).
+        """
+
+        if rows is None:
+            rows = np.arange(self.num_stations)
+        values = np.ma.masked_all((len(rows), num_hours))
+        for ti in range(num_hours):
+            values[:, ti] = self.hour_values(first_hour + ti)[element][rows]
+
+        return values
+
+    def obs(self, rows, values_key, values, obs_datetime, num_hours):
+        """
+        Place values for stations rows in a dictionary in the form returned
+        by the wdb0 get_*_obs functions.
+        """
+
+        result = {'num_stations': len(rows)}
+        if num_hours is not None:
+            result['num_hours'] = num_hours
+        result['station_obj_id'] = self.obj_id[rows].tolist()
+        result['station_id'] = [self.station_id[si] for si in rows]
+        result['station_name'] = result['station_id']
+        result['station_lon'] = self.lon[rows].tolist()
+        result['station_lat'] = self.lat[rows].tolist()
+        result['station_elevation'] = self.elevation[rows].tolist()
+        result['station_rec_elevation'] = result['station_elevation']
+        if num_hours is None:
+            result['obs_datetime'] = obs_datetime
+        else:
+            result['obs_datetime'] = [obs_datetime + dt.timedelta(hours=i)
+                                      for i in range(num_hours)]
+        result[values_key] = values
+
+        return result
+
+    def get_obs(self, element, values_key, begin_datetime, end_datetime):
+        """
+        Stand-in for wdb0.get_snow_depth_obs and similar functions.
+        """
+
+        num_hours = epoch_hour(end_datetime) - epoch_hour(begin_datetime) + 1
+        values = self.window(element, epoch_hour(begin_datetime), num_hours)
+        rows = np.flatnonzero(~np.all(np.ma.getmaskarray(values), axis=1))
+
+        return self.obs(rows, values_key, values[rows], begin_datetime,
+                        num_hours)
+
+    def get_qc_bundle(self,
+                      target_datetime,
+                      num_hrs_prev_snwd=0,
+                      num_hrs_snowfall=24,
+                      num_hrs_prcp=24,
+                      num_hrs_prev_tair=0,
+                      **kwargs):
+        """
+        Stand-in for wdb0.get_qc_bundle.
+        """
+
+        hour = epoch_hour(target_datetime)
+        hour_values = self.hour_values(hour)
+        bundle = {}
+
+        rows = np.flatnonzero(~np.ma.getmaskarray(hour_values['snow_depth']))
+        bundle['snow_depth'] = \
+            self.obs(rows, 'values_cm',
+                     hour_values['snow_depth'][rows][:, np.newaxis],
+                     target_datetime, 1)
+        if num_hrs_prev_snwd is not None and num_hrs_prev_snwd > 0:
+            values = self.window('snow_depth', hour - num_hrs_prev_snwd,
+                                 num_hrs_prev_snwd, rows)
+            prev_rows = \
+                np.flatnonzero(~np.all(np.ma.getmaskarray(values), axis=1))
+            bundle['prev_snow_depth'] = \
+                self.obs(rows[prev_rows], 'values_cm', values[prev_rows],
+                         target_datetime -
+                         dt.timedelta(hours=num_hrs_prev_snwd),
+                         num_hrs_prev_snwd)
+        for name, values_key, num_hrs in \
+            [('snowfall', 'values_cm', num_hrs_snowfall),
+             ('precip', 'values_mm', num_hrs_prcp)]:
+            if num_hrs is None:
+                continue
+            element_rows = \
+                rows[~np.ma.getmaskarray(hour_values[name][rows])]
+            bundle[name] = self.obs(element_rows, values_key,
+                                    hour_values[name][element_rows],
+                                    target_datetime, None)
+        bundle['air_temp'] = \
+            self.get_obs('air_temp', 'values_deg_c',
+                         target_datetime -
+                         dt.timedelta(hours=num_hrs_prev_tair),
+                         target_datetime)
+
+        return bundle
+
+    def install(self):
+        """
+        Replace the wdb0 query functions used by update_station_qc_db.py
+        with stand-ins answered from this network. Returns the original
+        functions, for restore.
+        """
+
+        original = {name: getattr(wdb0, name)
+                    for name in ['get_qc_bundle',
+                                 'get_snow_depth_obs',
+                                 'get_swe_obs',
+                                 'get_air_temp_obs']}
+        wdb0.get_qc_bundle = self.get_qc_bundle
+        wdb0.get_snow_depth_obs = \
+            lambda begin_datetime, end_datetime, **kwargs: \
+            self.get_obs('snow_depth', 'values_cm',
+                         begin_datetime, end_datetime)
+        wdb0.get_swe_obs = \
+            lambda begin_datetime, end_datetime, **kwargs: \
+            self.get_obs('swe', 'values_mm', begin_datetime, end_datetime)
+        wdb0.get_air_temp_obs = \
+            lambda begin_datetime, end_datetime, **kwargs: \
+            self.get_obs('air_temp', 'values_deg_c',
+                         begin_datetime, end_datetime)
+
+        return original
+
+    @staticmethod
+    def restore(original):
+        """
+        Undo install.
+        """
+        for name, func in original.items():
+            setattr(wdb0, name, func)
+
+
+def best_time(func, num_repeats):
+    """
+    Run func num_repeats times and return the shortest elapsed time in
+    seconds, along with the result of the last run.
+    """
+
+    best = None
+    for i in range(num_repeats):
+        t1 = time.perf_counter()
+        result = func()
+        elapsed = time.perf_counter() - t1
+        if best is None or elapsed < best:
+            best = elapsed
+
+    return best, result
+
+
+def best_seconds(func, num_repeats):
+    """
+    Run func, which returns a dictionary of times by test (the "seconds"
+    of a batch test result), num_repeats times and return the shortest
+    time for each test.
+    """
+
+    best = {}
+    for i in range(num_repeats):
+        for name, seconds in func()['seconds'].items():
+            best[name] = min(best.get(name, seconds), seconds)
+
+    return best
+
+
+def time_scalar(func, sample):
+    """
+    Call func(si) for each station index in sample, and return the elapsed
+    time.
+    """
+
+    t1 = time.perf_counter()
+    for si in sample:
+        func(si)
+
+    return time.perf_counter() - t1
+
+
+def time_tests(network, hour, args, rng):
+    """
+    Time the neighbor search and the snow depth and SWE QC tests for the
+    stations of network reporting at epoch hour hour. Returns a dictionary
+    of seconds by benchmark name.
+    """
+
+    results = {}
+    hour_values = network.hour_values(hour)
+
+    def zero_qc(values):
+        return np.ma.masked_array(np.zeros(values.shape, dtype=np.uint32),
+                                  mask=False)
+
+    ##########################
+    # Snow depth and inputs. #
+    ##########################
+
+    snwd_rows = np.flatnonzero(~np.ma.getmaskarray(hour_values['snow_depth']))
+    num_snwd = len(snwd_rows)
+    snwd_val_cm = hour_values['snow_depth'][snwd_rows]
+    prev_snwd_val_cm = network.window('snow_depth', hour - NUM_HRS_PREV,
+                                      NUM_HRS_PREV, snwd_rows)
+    prev_snwd_qc = zero_qc(prev_snwd_val_cm)
+    prev_tair_val_deg_c = network.window('air_temp',
+                                         hour - NUM_HRS_PREV_TAIR,
+                                         NUM_HRS_PREV_TAIR + 1)
+    snfl_val_cm = hour_values['snowfall'][snwd_rows]
+    prcp_val_mm = hour_values['precip'][snwd_rows]
+
+    tair_rows = np.flatnonzero(~np.all(np.ma.getmaskarray(prev_tair_val_deg_c),
+                                       axis=1))
+    snwd_sample = np.sort(rng.choice(num_snwd,
+                                     size=min(args.scalar_sample, num_snwd),
+                                     replace=False))
+    snwd_scale = float(num_snwd) / max(len(snwd_sample), 1)
+
+    if args.verbose:
+        print('INFO: {} stations report snow depth, '.format(num_snwd) +
+              '{} air temperature.'.format(len(tair_rows)))
+
+    ###################
+    # Neighbor search. #
+    ###################
+
+    def neighbors(target_rows, find):
+        return find(network.lat[target_rows],
+                    network.lon[target_rows],
+                    network.lat[tair_rows],
+                    network.lon[tair_rows],
+                    NEIGHBORHOOD_RADIUS_KM,
+                    MIN_TAIR_NEIGHBORS,
+                    MAX_TAIR_NEIGHBORS)
+
+    # find_nearest_neighbors is slow enough that it is only run once.
+    seconds, _ = best_time(lambda: neighbors(snwd_rows[snwd_sample],
+                                             qc.find_nearest_neighbors),
+                           1)
+    results['neighbors.find_nearest_neighbors'] = seconds * snwd_scale
+    seconds, (nhood_ind, nhood_dist_km) = \
+        best_time(lambda: neighbors(snwd_rows,
+                                    qc.find_nearest_neighbors_tree),
+                  args.num_repeats)
+    results['neighbors.find_nearest_neighbors_tree'] = seconds
+
+    #####################
+    # Snow depth tests. #
+    #####################
+
+    snwd_qc_bits = {name: bit + 1
+                    for bit, name in enumerate(qc.SNWD_BATCH_TESTS)}
+    batch_inputs = {'snwd_val_cm': snwd_val_cm,
+                    'prev_snwd_val_cm': prev_snwd_val_cm,
+                    'prev_snwd_qc': prev_snwd_qc,
+                    'prev_tair_val_deg_c': prev_tair_val_deg_c[snwd_rows],
+                    'snfl_val_cm': snfl_val_cm,
+                    'prcp_val_mm': prcp_val_mm,
+                    'qc_bits': snwd_qc_bits,
+                    'num_hrs_wre': NUM_HRS_WRE,
+                    'num_hrs_streak': NUM_HRS_STREAK,
+                    'num_hrs_prev_tair': NUM_HRS_PREV_TAIR,
+                    'num_hrs_snowfall': NUM_HRS_SNOWFALL,
+                    'num_hrs_prcp': NUM_HRS_PRCP}
+    batch = best_seconds(lambda: qc.qc_durre_snwd_batch(**batch_inputs),
+                         args.num_repeats)
+    for qc_test_name, seconds in batch.items():
+        results['snwd.{}.batch'.format(qc_test_name)] = seconds
+    seconds, _ = best_time(lambda:
+                           qc.qc_durre_snwd_gap_batch(snwd_val_cm,
+                                                      prev_snwd_val_cm,
+                                                      prev_snwd_qc,
+                                                      num_hrs_gap=
+                                                      NUM_HRS_GAP),
+                           args.num_repeats)
+    results['snwd.gap.batch'] = seconds
+
+    # Scalar tests, called with the same windows as in
+    # qc_durre_snwd_scalar.
+    def window(values, qc_flags, si, num_hours):
+        return values[si, NUM_HRS_PREV - num_hours:], \
+               qc_flags[si, NUM_HRS_PREV - num_hours:]
+
+    have_snfl = ~np.ma.getmaskarray(snfl_val_cm)
+    have_prcp = ~np.ma.getmaskarray(prcp_val_mm)
+    snwd_scalar = \
+        [('world_record_exceedance',
+          lambda si: qc.qc_durre_snwd_wre(snwd_val_cm[si])),
+         ('world_record_increase_exceedance',
+          lambda si:
+          qc.qc_durre_snwd_change_wre(snwd_val_cm[si],
+                                      *window(prev_snwd_val_cm,
+                                              prev_snwd_qc,
+                                              si, NUM_HRS_WRE))),
+         ('streak',
+          lambda si:
+          qc.qc_durre_snwd_streak(snwd_val_cm[si],
+                                  *window(prev_snwd_val_cm, prev_snwd_qc,
+                                          si, NUM_HRS_STREAK))),
+         ('gap',
+          lambda si:
+          qc.qc_durre_snwd_gap(snwd_val_cm[si],
+                               *window(prev_snwd_val_cm, prev_snwd_qc,
+                                       si, NUM_HRS_GAP))),
+         ('temperature_consistency',
+          lambda si:
+          qc.qc_durre_snwd_temp(snwd_val_cm[si],
+                                *window(prev_snwd_val_cm, prev_snwd_qc,
+                                        si, NUM_HRS_PREV_TAIR),
+                                prev_tair_val_deg_c[snwd_rows[si]])),
+         ('snowfall_consistency',
+          lambda si:
+          have_snfl[si] and
+          qc.qc_durre_snwd_snfl(snwd_val_cm[si],
+                                *window(prev_snwd_val_cm, prev_snwd_qc,
+                                        si, NUM_HRS_SNOWFALL),
+                                snfl_val_cm[si])),
+         ('precip_consistency',
+          lambda si:
+          have_prcp[si] and
+          qc.qc_durre_snwd_prcp(snwd_val_cm[si],
+                                *window(prev_snwd_val_cm, prev_snwd_qc,
+                                        si, NUM_HRS_PRCP),
+                                prcp_val_mm[si])),
+         ('precip_ratio',
+          lambda si:
+          have_prcp[si] and
+          qc.qc_durre_snwd_prcp_ratio(snwd_val_cm[si],
+                                      *window(prev_snwd_val_cm,
+                                              prev_snwd_qc,
+                                              si, NUM_HRS_PRCP),
+                                      prcp_val_mm[si]))]
+
+    # The spatial test (which has no batch form) uses neighborhood
+    # temperatures, assembled as in update_station_qc_db.main.
+    nhood_tair_deg_c = {}
+    for si in snwd_sample:
+        if nhood_ind[si] is None or \
+           len(nhood_ind[si]) < MIN_TAIR_NEIGHBORS:
+            continue
+        nhood_tair_deg_c[si] = \
+            prev_tair_val_deg_c[tair_rows[np.asarray(nhood_ind[si])]]
+    snwd_scalar.append(('spatial_temperature_consistency',
+                        lambda si:
+                        si in nhood_tair_deg_c and
+                        qc.qc_durre_snwd_tair_spatial(
+                            snwd_val_cm[si],
+                            *window(prev_snwd_val_cm, prev_snwd_qc,
+                                    si, NUM_HRS_PREV_TAIR),
+                            nhood_tair_deg_c[si])))
+
+    for qc_test_name, func in snwd_scalar:
+        seconds, _ = best_time(lambda: time_scalar(func, snwd_sample),
+                               args.num_repeats)
+        results['snwd.{}.scalar'.format(qc_test_name)] = seconds * snwd_scale
+
+    ##############
+    # SWE tests. #
+    ##############
+
+    swe_rows = np.flatnonzero(~np.ma.getmaskarray(hour_values['swe']))
+    num_swe = len(swe_rows)
+    swe_val_mm = hour_values['swe'][swe_rows]
+    prev_swe_val_mm = network.window('swe', hour - NUM_HRS_PREV,
+                                     NUM_HRS_PREV, swe_rows)
+    prev_swe_qc = zero_qc(prev_swe_val_mm)
+    swe_prcp_val_mm = hour_values['precip'][swe_rows]
+    swe_sample = np.sort(rng.choice(num_swe,
+                                    size=min(args.scalar_sample, num_swe),
+                                    replace=False))
+    swe_scale = float(num_swe) / max(len(swe_sample), 1)
+
+    swe_qc_bits = {name: bit + 1
+                   for bit, name in enumerate(qc.SWE_BATCH_TESTS)}
+    batch = best_seconds(lambda:
+                         qc.qc_durre_swe_batch(swe_val_mm,
+                                               prev_swe_val_mm,
+                                               prev_swe_qc,
+                                               swe_prcp_val_mm,
+                                               swe_qc_bits,
+                                               num_hrs_wre=NUM_HRS_WRE,
+                                               num_hrs_streak=NUM_HRS_STREAK,
+                                               num_hrs_prcp=NUM_HRS_PRCP),
+                         args.num_repeats)
+    for qc_test_name, seconds in batch.items():
+        results['swe.{}.batch'.format(qc_test_name)] = seconds
+    seconds, _ = best_time(lambda:
+                           qc.qc_durre_swe_gap_batch(swe_val_mm,
+                                                     prev_swe_val_mm,
+                                                     prev_swe_qc,
+                                                     num_hrs_gap=
+                                                     NUM_HRS_GAP),
+                           args.num_repeats)
+    results['swe.gap.batch'] = seconds
+
+    have_swe_prcp = ~np.ma.getmaskarray(swe_prcp_val_mm)
+    swe_scalar = \
+        [('world_record_exceedance',
+          lambda si: qc.qc_durre_swe_wre(swe_val_mm[si])),
+         ('world_record_increase_exceedance',
+          lambda si:
+          qc.qc_durre_swe_change_wre(swe_val_mm[si],
+                                     *window(prev_swe_val_mm, prev_swe_qc,
+                                             si, NUM_HRS_WRE))),
+         ('streak',
+          lambda si:
+          qc.qc_durre_swe_streak(swe_val_mm[si],
+                                 *window(prev_swe_val_mm, prev_swe_qc,
+                                         si, NUM_HRS_STREAK))),
+         ('gap',
+          lambda si:
+          qc.qc_durre_swe_gap(swe_val_mm[si],
+                              *window(prev_swe_val_mm, prev_swe_qc,
+                                      si, NUM_HRS_GAP))),
+         ('precip_consistency',
+          lambda si:
+          have_swe_prcp[si] and
+          qc.qc_durre_swe_prcp(swe_val_mm[si],
+                               *window(prev_swe_val_mm, prev_swe_qc,
+                                       si, NUM_HRS_PRCP),
+                               swe_prcp_val_mm[si])),
+         ('precip_ratio',
+          lambda si:
+          have_swe_prcp[si] and
+          qc.qc_durre_swe_prcp_ratio(swe_val_mm[si],
+                                     *window(prev_swe_val_mm, prev_swe_qc,
+                                             si, NUM_HRS_PRCP),
+                                     swe_prcp_val_mm[si]))]
+
+    for qc_test_name, func in swe_scalar:
+        seconds, _ = best_time(lambda: time_scalar(func, swe_sample),
+                               args.num_repeats)
+        results['swe.{}.scalar'.format(qc_test_name)] = seconds * swe_scale
+
+    return results
+
+
+def create_qc_db(network, scratch_dir, first_datetime, num_hours,
+                 chunk_profile):
+    """
+    Create a QC database with create_station_qc_db.py covering the
+    NUM_HRS_PREV hours before first_datetime and num_hours hours from
+    it, holding all stations of network. QC flags before first_datetime
+    are zero, as if those hours had been updated with nothing flagged.
+    Returns the path of the database.
+    """
+
+    start_datetime = first_datetime - dt.timedelta(hours=NUM_HRS_PREV)
+    finish_datetime = first_datetime + dt.timedelta(hours=num_hours - 1)
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                          'create_station_qc_db.py')
+    subprocess.run([sys.executable, script,
+                    '-s', start_datetime.strftime('%Y%m%d%H'),
+                    '-f', finish_datetime.strftime('%Y%m%d%H'),
+                    '-d', scratch_dir,
+                    '-c', chunk_profile],
+                   check=True)
+    db_path = os.path.join(scratch_dir,
+                           'station_qc_db_' +
+                           start_datetime.strftime('%Y%m%d%H') + '_to_' +
+                           finish_datetime.strftime('%Y%m%d%H') + '.nc')
+
+    qcdb = Dataset(db_path, 'r+')
+    n = network.num_stations
+    qcdb.variables['station_obj_identifier'][0:n] = network.obj_id
+    qcdb.variables['station_id'][0:n] = np.array(network.station_id,
+                                                 dtype=object)
+    qcdb.variables['station_name'][0:n] = np.array(network.station_id,
+                                                   dtype=object)
+    qcdb.variables['station_longitude'][0:n] = network.lon
+    qcdb.variables['station_latitude'][0:n] = network.lat
+    qcdb.variables['station_elevation'][0:n] = network.elevation
+    qcdb.variables['station_recorded_elevation'][0:n] = network.elevation
+
+    block = 1000
+    for var_name in ['snow_depth_qc_checked', 'snow_depth_qc',
+                     'swe_qc_checked', 'swe_qc']:
+        var = qcdb.variables[var_name]
+        for first_station in range(0, n, block):
+            end_station = min(first_station + block, n)
+            var[first_station:end_station, :] = \
+                np.zeros((end_station - first_station, var.shape[1]),
+                         dtype=np.uint32)
+
+    qcdb.setncattr_string('last_datetime_updated',
+                          (first_datetime - dt.timedelta(hours=1)).
+                          strftime('%Y-%m-%d %H:%M:%S UTC'))
+    qcdb.setncattr_string('last_station_update_datetime',
+                          dt.datetime.utcnow().
+                          strftime('%Y-%m-%d %H:%M:%S UTC'))
+    qcdb.close()
+
+    return db_path
+
+
+def time_update(network, args, scratch_dir):
+    """
+    Run update_station_qc_db.main for args.num_update_hours hours on a
+    synthetic QC database and return the times of the first hour and the
+    mean time of the others, by benchmark name.
+    """
+
+    db_path = create_qc_db(network,
+                           scratch_dir,
+                           args.first_datetime,
+                           args.num_update_hours,
+                           args.chunk_profile)
+    profile_file = os.path.join(scratch_dir, 'update_profile.jsonl')
+
+    argv = sys.argv
+    sys.argv = ['update_station_qc_db.py', db_path,
+                '-x', str(args.num_update_hours),
+                '-p', scratch_dir,
+                '-j', str(args.num_workers),
+                '-t', profile_file]
+    original = network.install()
+    try:
+        qc.main()
+    except SystemExit as exc:
+        if exc.code not in [None, 0]:
+            raise
+    finally:
+        SyntheticNetwork.restore(original)
+        sys.argv = argv
+
+    hour_seconds = []
+    with open(profile_file, 'r') as file:
+        for line in file:
+            record = json.loads(line)
+            if record['record'] == 'hour':
+                hour_seconds.append(record['wall_seconds'])
+    if args.verbose:
+        print('INFO: updater profile written to {}.'.format(profile_file))
+
+    results = {}
+    if len(hour_seconds) > 0:
+        results['hour.first'] = hour_seconds[0]
+    if len(hour_seconds) > 1:
+        results['hour.steady'] = float(np.mean(hour_seconds[1:]))
+
+    return results
+
+
+def read_baselines(file_path):
+    """
+    Read baselines, a dictionary keyed by network size (as a string) of
+    dictionaries of seconds by benchmark name.
+    """
+
+    if file_path is None or not os.path.exists(file_path):
+        return {}
+    with open(file_path, 'r') as file:
+        return json.load(file)
+
+
+def main():
+    """
+    Generate synthetic networks and time the QC tests and updater on each.
+    """
+
+    args = parse_args()
+
+    baselines = read_baselines(args.baseline_file)
+
+    if args.scratch_dir is None:
+        scratch_dir = tempfile.mkdtemp(prefix='qc_benchmark_')
+    else:
+        scratch_dir = args.scratch_dir
+
+    print('{:>8s} {:<50s} {:>10s} {:>10s} {:>7s}'.
+          format('stations', 'benchmark', 'seconds', 'baseline', 'ratio'))
+
+    num_regressions = 0
+    for num_stations in args.num_stations:
+
+        t1 = time.perf_counter()
+        network = SyntheticNetwork(num_stations, seed=args.seed)
+        rng = np.random.default_rng(args.seed)
+        results = time_tests(network,
+                             epoch_hour(args.first_datetime),
+                             args,
+                             rng)
+        if args.num_update_hours > 0:
+            size_dir = os.path.join(scratch_dir,
+                                    'stations_{}'.format(num_stations))
+            os.makedirs(size_dir, exist_ok=True)
+            results.update(time_update(network, args, size_dir))
+        if args.verbose:
+            print('INFO: benchmarked {} stations in {:.1f} seconds.'.
+                  format(num_stations, time.perf_counter() - t1))
+
+        baseline = baselines.get(str(num_stations), {})
+        for name in sorted(results.keys()):
+            seconds = results[name]
+            if name in baseline:
+                base_seconds = baseline[name]
+                ratio = seconds / base_seconds if base_seconds > 0.0 \
+                    else float('inf')
+                regression = \
+                    seconds > base_seconds * (1.0 + args.tolerance) and \
+                    seconds - base_seconds > args.min_seconds
+                print('{:8d} {:<50s} {:10.4f} {:10.4f} {:7.2f}{}'.
+                      format(num_stations, name, seconds, base_seconds,
+                             ratio, '  REGRESSION' if regression else ''))
+                if regression:
+                    num_regressions += 1
+            else:
+                print('{:8d} {:<50s} {:10.4f} {:>10s} {:>7s}'.
+                      format(num_stations, name, seconds, '-', '-'))
+
+        if args.write_baseline:
+            baselines[str(num_stations)] = results
+
+    if args.scratch_dir is None:
+        shutil.rmtree(scratch_dir)
+
+    if args.write_baseline:
+        with open(args.baseline_file, 'w') as file:
+            json.dump(baselines, file, indent=2, sort_keys=True)
+        print('INFO: baselines saved to {}.'.format(args.baseline_file))
+
+    if num_regressions > 0:
+        print('ERROR: {} benchmarks regressed by more than {:.0f}%.'.
+              format(num_regressions, args.tolerance * 100.0),
+              file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
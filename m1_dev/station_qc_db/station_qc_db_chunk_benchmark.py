@@ -0,0 +1,243 @@
+#!/usr/bin/python3.6
+
+"""
+Benchmark the QC database chunk profiles (create_station_qc_db.py
+--chunk_profile) for the two ways QC variables are accessed.
+
+A synthetic QC database is written in the "station-extract" layout and
+rewritten in each other profile with rechunk_station_qc_db.rechunk (which
+is timed too). Then for each layout:
+
+- hourly update: for each of a number of consecutive hours, the window of
+  hours preceding it is read for all stations, as update_station_qc_db.py
+  does with QCFlagWindow, and the hour itself is written for all stations,
+  as its QC journal commits do, for both snow depth QC variables.
+- station extract: the full QC time series of randomly chosen stations is
+  read.
+
+Times depend heavily on the operating system page cache; use a database
+larger than memory, or drop caches between runs, for cold-read numbers.
+"""
+
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+import numpy as np
+from netCDF4 import Dataset
+from create_station_qc_db import CHUNK_PROFILES, qc_chunk_shape
+import rechunk_station_qc_db
+
+
+def parse_args():
+    """
+    Parse command line arguments.
+    """
+
+    parser = argparse.ArgumentParser(description='Benchmark QC database ' +
+                                     'chunk profiles.')
+    parser.add_argument('-s', '--num_stations',
+                        type=int,
+                        default=20000,
+                        help='Number of stations in the synthetic database.')
+    parser.add_argument('-n', '--num_hours',
+                        type=int,
+                        default=24 * 92,
+                        help='Number of hours in the synthetic database.')
+    parser.add_argument('-w', '--window_hours',
+                        type=int,
+                        default=15 * 24,
+                        help='Hours preceding each updated hour that are ' +
+                        'read for all stations.')
+    parser.add_argument('-u', '--num_update_hours',
+                        type=int,
+                        default=24,
+                        help='Number of hours updated.')
+    parser.add_argument('-e', '--num_extract',
+                        type=int,
+                        default=200,
+                        help='Number of station time series extracted.')
+    parser.add_argument('-p', '--chunk_profiles',
+                        type=str,
+                        nargs='+',
+                        choices=sorted(CHUNK_PROFILES.keys()),
+                        default=sorted(CHUNK_PROFILES.keys()),
+                        help='Chunk profiles to benchmark.')
+    parser.add_argument('-d', '--scratch_dir',
+                        type=str,
+                        default=None,
+                        help='Directory for the synthetic databases ' +
+                        '(default: a temporary directory, removed ' +
+                        'afterwards).')
+    parser.add_argument('-v', '--verbose',
+                        action='store_true',
+                        help='Provide verbose output.')
+
+    args = parser.parse_args()
+
+    if args.num_stations < 1 or args.num_hours < 1:
+        print('ERROR: numbers of stations and hours must be positive.',
+              file=sys.stderr)
+        sys.exit(1)
+
+    if args.window_hours + args.num_update_hours > args.num_hours:
+        print('ERROR: window and update hours exceed database hours.',
+              file=sys.stderr)
+        sys.exit(1)
+
+    if args.scratch_dir is not None and not os.path.isdir(args.scratch_dir):
+        print('ERROR: scratch directory {} not found.'.
+              format(args.scratch_dir),
+              file=sys.stderr)
+        sys.exit(1)
+
+    return args
+
+
+def synthetic_db(file_path, num_stations, num_hours, rng):
+    """
+    Write a QC database with the snow depth QC variables of
+    create_station_qc_db.py in the "station-extract" layout. Most flags
+    are zero, as in practice; a few have random bits set.
+    """
+
+    nc_out = Dataset(file_path, 'w', format='NETCDF4')
+    nc_out.setncattr_string('chunk_profile', 'station-extract')
+    nc_out.createDimension('time', num_hours)
+    nc_out.createDimension('station', None)
+    chunk = qc_chunk_shape('station-extract', num_hours)
+
+    for var_name in ['snow_depth_qc_checked', 'snow_depth_qc']:
+        var = nc_out.createVariable(var_name,
+                                    'u4',
+                                    ('station', 'time'),
+                                    fill_value=np.iinfo(np.uint32).max,
+                                    zlib=True,
+                                    chunksizes=chunk)
+        block = 1000
+        for first_station in range(0, num_stations, block):
+            end_station = min(first_station + block, num_stations)
+            shape = (end_station - first_station, num_hours)
+            if var_name == 'snow_depth_qc_checked':
+                flags = np.full(shape, 0x7ff, dtype=np.uint32)
+            else:
+                flags = np.where(rng.random(shape) < 0.02,
+                                 np.uint32(1) << rng.integers(0, 12, shape),
+                                 0).astype(np.uint32)
+            var[first_station:end_station, :] = flags
+
+    nc_out.close()
+
+
+def hourly_update(file_path, first_hour, num_update_hours, window_hours):
+    """
+    Read the preceding window and write each of num_update_hours hours
+    for all stations. Returns seconds per hour.
+    """
+
+    nc = Dataset(file_path, 'r+')
+    t1 = time.perf_counter()
+    for hour in range(first_hour, first_hour + num_update_hours):
+        for var_name in ['snow_depth_qc_checked', 'snow_depth_qc']:
+            var = nc.variables[var_name]
+            window = var[:, hour - window_hours:hour + 1]
+            column = np.ma.getdata(window[:, -1]) | np.uint32(1)
+            var[:, hour] = column
+        nc.sync()
+    elapsed = time.perf_counter() - t1
+    nc.close()
+
+    return elapsed / num_update_hours
+
+
+def station_extract(file_path, station_ind):
+    """
+    Read the full QC time series of stations station_ind. Returns seconds
+    per station.
+    """
+
+    nc = Dataset(file_path, 'r')
+    t1 = time.perf_counter()
+    for si in station_ind:
+        for var_name in ['snow_depth_qc_checked', 'snow_depth_qc']:
+            nc.variables[var_name][si, :]
+    elapsed = time.perf_counter() - t1
+    nc.close()
+
+    return elapsed / len(station_ind)
+
+
+def main():
+    """
+    Create, rechunk and time access to synthetic QC databases.
+    """
+
+    args = parse_args()
+
+    rng = np.random.default_rng(0)
+
+    if args.scratch_dir is None:
+        scratch_dir = tempfile.mkdtemp(prefix='qc_chunk_benchmark_')
+    else:
+        scratch_dir = args.scratch_dir
+
+    base_path = os.path.join(scratch_dir, 'qc_station-extract.nc')
+    t1 = time.perf_counter()
+    synthetic_db(base_path, args.num_stations, args.num_hours, rng)
+    if args.verbose:
+        print('INFO: wrote {} ({} stations x {} hours) in {:.1f} seconds.'.
+              format(base_path, args.num_stations, args.num_hours,
+                     time.perf_counter() - t1))
+
+    station_ind = rng.choice(args.num_stations,
+                             size=min(args.num_extract, args.num_stations),
+                             replace=False).tolist()
+    first_hour = args.num_hours - args.num_update_hours
+
+    print('{:>16s} {:>12s} {:>9s} {:>12s} {:>14s} {:>14s}'.
+          format('profile', 'chunk', 'size (MB)', 'rechunk (s)',
+                 'update (s/hr)', 'extract (ms)'))
+
+    # The station-extract database is rechunked to the other layouts, so
+    # it is updated last.
+    for chunk_profile in sorted(args.chunk_profiles,
+                                key=lambda p: p == 'station-extract'):
+
+        if chunk_profile == 'station-extract':
+            file_path = base_path
+            rechunk_seconds = 0.0
+        else:
+            file_path = os.path.join(scratch_dir,
+                                     'qc_{}.nc'.format(chunk_profile))
+            t1 = time.perf_counter()
+            rechunk_station_qc_db.rechunk(base_path,
+                                          file_path,
+                                          chunk_profile,
+                                          256.0,
+                                          args.verbose)
+            rechunk_seconds = time.perf_counter() - t1
+
+        # Extract before updating, so both layouts hold the same data.
+        extract_seconds = station_extract(file_path, station_ind)
+        update_seconds = hourly_update(file_path,
+                                       first_hour,
+                                       args.num_update_hours,
+                                       args.window_hours)
+
+        print('{:>16s} {:>12s} {:9.1f} {:12.2f} {:14.3f} {:14.2f}'.
+              format(chunk_profile,
+                     '{} x {}'.format(*qc_chunk_shape(chunk_profile,
+                                                      args.num_hours)),
+                     os.path.getsize(file_path) / 1.0e6,
+                     rechunk_seconds,
+                     update_seconds,
+                     extract_seconds * 1000.0))
+
+    if args.scratch_dir is None:
+        shutil.rmtree(scratch_dir)
+
+
+if __name__ == '__main__':
+    main()
@@ -6,16 +6,31 @@ from netCDF4 import Dataset, num2date, date2num
 import datetime as dt
 import numpy as np
 import wdb0
+import geodesic
 import sys
-import psycopg2
 import pandas as pd
 import time
 import snodas_clim
-import shutil
-from vincenty import vincenty
 import math
 from geopy import distance
 import errno
+import queue
+import threading
+import fcntl
+import json
+import pickle
+import struct
+import zlib
+import multiprocessing
+try:
+    from scipy.spatial import cKDTree
+except ImportError:
+    cKDTree = None
+try:
+    from multiprocessing import resource_tracker, shared_memory
+except ImportError:
+    # Python < 3.8; --num_workers is unavailable.
+    shared_memory = None
 
 def find_nearest_neighbors(lat1,
                            lon1,
@@ -227,6 +242,419 @@ def find_nearest_neighbors(lat1,
     return nhood_ind, nhood_dist_km
 
 
+def find_nearest_neighbors_tree(lat1,
+                                lon1,
+                                lat2,
+                                lon2,
+                                neighborhood_radius_km,
+                                min_neighbors,
+                                max_neighbors,
+                                ellipsoidal=True,
+                                verbose=None):
+    """
+    Spatial index counterpart of find_nearest_neighbors, returning the same
+    nhood_ind and nhood_dist_km lists for all lat1/lon1 locations at once.
+
+    The lat2/lon2 locations are placed in a k-d tree (scipy.spatial.cKDTree,
+    if available) of 3-D unit vectors, and all lat2/lon2 locations within
+    slightly more than neighborhood_radius_km of each lat1/lon1 location are
+    found in one query. Distances to those candidates are then calculated
+    on the WGS84 ellipsoid (with geodesic.inverse_km) and used to apply the
+    radius exactly, order neighbors and keep at most max_neighbors. If
+    ellipsoidal is False, spherical great circle distances are used
+    instead; these are faster but can differ by up to about 0.5%.
+
+    As in find_nearest_neighbors, lat2/lon2 locations within 1.0e-6 degrees
+    of a lat1/lon1 location in both latitude and longitude are never counted
+    as its neighbors. Unlike find_nearest_neighbors, neighbors across the
+    180th meridian are found, and neighbors at exactly the same distance
+    (e.g. stations sharing coordinates) are always ordered by index.
+    """
+
+    t1 = dt.datetime.utcnow()
+
+    lat1 = np.asarray(lat1, dtype=np.float64)
+    lon1 = np.asarray(lon1, dtype=np.float64)
+    lat2 = np.asarray(lat2, dtype=np.float64)
+    lon2 = np.asarray(lon2, dtype=np.float64)
+
+    nhood_ind = [[] for i in range(len(lat1))]
+    nhood_dist_km = [[] for i in range(len(lat1))]
+
+    if len(lat1) == 0 or len(lat2) == 0:
+        return nhood_ind, nhood_dist_km
+
+    # Locations with missing coordinates have no neighbors and are no
+    # one's neighbor.
+    valid1 = np.flatnonzero(np.isfinite(lat1) & np.isfinite(lon1))
+    valid2 = np.flatnonzero(np.isfinite(lat2) & np.isfinite(lon2))
+    if len(valid1) == 0 or len(valid2) == 0:
+        return nhood_ind, nhood_dist_km
+
+    xyz1 = geodesic.unit_vectors(lat1[valid1], lon1[valid1])
+    xyz2 = geodesic.unit_vectors(lat2[valid2], lon2[valid2])
+
+    # Search slightly beyond the radius, so that no candidate is missed
+    # because its spherical distance exceeds its ellipsoidal distance.
+    search_angle = min(neighborhood_radius_km *
+                       (1.0 + geodesic.PREFILTER_MARGIN) /
+                       geodesic.MEAN_EARTH_RADIUS_KM,
+                       math.pi)
+    search_chord = 2.0 * math.sin(0.5 * search_angle)
+
+    # Get candidate neighbors for all lat1/lon1 locations, as flat arrays
+    # of (ind1, ind2) pairs sorted by ind1, then ind2.
+    if cKDTree is not None:
+        tree = cKDTree(xyz2)
+        candidates = tree.query_ball_point(xyz1, search_chord)
+        num_candidates = np.array([len(cand) for cand in candidates])
+        pair_ind1 = np.repeat(np.arange(len(valid1)), num_candidates)
+        if len(pair_ind1) > 0:
+            pair_ind2 = np.concatenate([np.sort(np.asarray(cand,
+                                                           dtype=np.int64))
+                                        for cand in candidates
+                                        if len(cand) > 0])
+        else:
+            pair_ind2 = np.empty(0, dtype=np.int64)
+    else:
+        # Without scipy, compare blocks of lat1/lon1 locations with all
+        # lat2/lon2 locations.
+        min_cos_angle = math.cos(search_angle)
+        block_size = max(1, 4000000 // len(valid2))
+        pair_ind1_list = []
+        pair_ind2_list = []
+        for block_start in range(0, len(valid1), block_size):
+            block = slice(block_start, block_start + block_size)
+            ind1, ind2 = np.nonzero(np.dot(xyz1[block], xyz2.T) >=
+                                    min_cos_angle)
+            pair_ind1_list.append(ind1 + block_start)
+            pair_ind2_list.append(ind2)
+        pair_ind1 = np.concatenate(pair_ind1_list)
+        pair_ind2 = np.concatenate(pair_ind2_list)
+
+    # Translate to indices into lat1/lon1 and lat2/lon2.
+    pair_ind1 = valid1[pair_ind1]
+    pair_ind2 = valid2[pair_ind2]
+
+    # Eliminate (effectively) colocated sites, as find_nearest_neighbors
+    # does.
+    keep = (np.abs(lat2[pair_ind2] - lat1[pair_ind1]) > 1.0e-6) | \
+           (np.abs(lon2[pair_ind2] - lon1[pair_ind1]) > 1.0e-6)
+    pair_ind1 = pair_ind1[keep]
+    pair_ind2 = pair_ind2[keep]
+
+    if ellipsoidal:
+        pair_dist_km = geodesic.inverse_km(lat1[pair_ind1], lon1[pair_ind1],
+                                           lat2[pair_ind2], lon2[pair_ind2])
+    else:
+        pair_dist_km = geodesic.great_circle_km(lat1[pair_ind1],
+                                                lon1[pair_ind1],
+                                                lat2[pair_ind2],
+                                                lon2[pair_ind2])
+
+    keep = (pair_dist_km > 0.0) & (pair_dist_km <= neighborhood_radius_km)
+    pair_ind1 = pair_ind1[keep]
+    pair_ind2 = pair_ind2[keep]
+    pair_dist_km = pair_dist_km[keep]
+
+    # Order pairs by ind1, then distance (then ind2, for ties).
+    order = np.lexsort((pair_dist_km, pair_ind1))
+    pair_ind1 = pair_ind1[order]
+    pair_ind2 = pair_ind2[order]
+    pair_dist_km = pair_dist_km[order]
+
+    # Split into per-location lists, skipping locations with fewer than
+    # min_neighbors.
+    bounds = np.searchsorted(pair_ind1, np.arange(len(lat1) + 1))
+    for ind1 in range(len(lat1)):
+        first = bounds[ind1]
+        num_neighbors = bounds[ind1 + 1] - first
+        if num_neighbors < min_neighbors or num_neighbors == 0:
+            continue
+        last = first + min(num_neighbors, max_neighbors)
+        nhood_ind[ind1] = list(pair_ind2[first:last])
+        nhood_dist_km[ind1] = list(pair_dist_km[first:last])
+
+    t2 = dt.datetime.utcnow()
+    elapsed_time = t2 - t1
+    if verbose:
+        print('INFO: found nearest neighbors in {} seconds.'.
+              format(elapsed_time.total_seconds()))
+
+    return nhood_ind, nhood_dist_km
+
+
+class NeighborGraphCache:
+
+    """
+    Cache the results of find_nearest_neighbors_tree between QC hours, keyed
+    on station obj_identifier values, for one combination of
+    neighborhood_radius_km, min_neighbors and max_neighbors.
+
+    For each target station (e.g. a snow depth station) the cache holds the
+    obj_identifier values of, and distances to, its nearest (up to
+    max_neighbors) neighbors among the candidate stations (e.g. air
+    temperature stations). When the candidate stations change, only rows
+    that could be affected are dropped: those that include a candidate that
+    disappeared (or moved), and those within the radius of a candidate that
+    appeared (or moved). Rows are then computed only for target stations
+    that have none, so results are the same as calling
+    find_nearest_neighbors_tree every hour.
+
+    If cache_dir is given, the cache is read from and saved to a file there,
+    whose name includes the neighborhood parameters.
+    """
+
+    format_version = 1
+
+    def __init__(self,
+                 neighborhood_radius_km,
+                 min_neighbors,
+                 max_neighbors,
+                 cache_dir=None,
+                 verbose=None):
+
+        self.neighborhood_radius_km = float(neighborhood_radius_km)
+        self.min_neighbors = int(min_neighbors)
+        self.max_neighbors = int(max_neighbors)
+        self.verbose = verbose
+        self.num_rows_reused = 0
+        self.num_rows_computed = 0
+
+        # Candidate stations as of the last call, sorted by obj_id.
+        self._candidate_obj_id = np.empty(0, dtype=np.int64)
+        self._candidate_lat = np.empty(0, dtype=np.float64)
+        self._candidate_lon = np.empty(0, dtype=np.float64)
+        # Rows: target obj_id -> (lat, lon, neighbor obj_ids, distances).
+        self._rows = {}
+
+        self.file_path = None
+        if cache_dir is not None:
+            self.file_path = \
+                os.path.join(cache_dir,
+                             'station_qc_neighbors_' +
+                             '{:g}km_min{}_max{}.npz'.
+                             format(self.neighborhood_radius_km,
+                                    self.min_neighbors,
+                                    self.max_neighbors))
+            if os.path.isfile(self.file_path):
+                self.load()
+
+    @staticmethod
+    def _same_location(lat_a, lon_a, lat_b, lon_b):
+        # Missing coordinates (NaN) compare equal to each other.
+        return(((lat_a == lat_b) | (np.isnan(lat_a) & np.isnan(lat_b))) &
+               ((lon_a == lon_b) | (np.isnan(lon_a) & np.isnan(lon_b))))
+
+    def load(self):
+
+        """
+        Read the cache from file_path.
+        """
+
+        with np.load(self.file_path, allow_pickle=False) as npz:
+            if int(npz['format_version']) != self.format_version:
+                return
+            self._candidate_obj_id = npz['candidate_obj_id']
+            self._candidate_lat = npz['candidate_lat']
+            self._candidate_lon = npz['candidate_lon']
+            bounds = np.concatenate(([0], np.cumsum(npz['row_count'])))
+            neighbor_obj_id = npz['neighbor_obj_id']
+            neighbor_dist_km = npz['neighbor_dist_km']
+            self._rows = {}
+            for ri, obj_id in enumerate(npz['row_obj_id'].tolist()):
+                self._rows[obj_id] = \
+                    (npz['row_lat'][ri],
+                     npz['row_lon'][ri],
+                     neighbor_obj_id[bounds[ri]:bounds[ri + 1]],
+                     neighbor_dist_km[bounds[ri]:bounds[ri + 1]])
+
+        if self.verbose:
+            print('INFO: read {} neighbor graph rows from {}.'.
+                  format(len(self._rows), self.file_path))
+
+    def save(self):
+
+        """
+        Write the cache to file_path, if there is one. The file is written
+        under a temporary name first and then renamed, so readers never see
+        a partial file.
+        """
+
+        if self.file_path is None:
+            return
+
+        row_obj_id = list(self._rows.keys())
+        rows = [self._rows[obj_id] for obj_id in row_obj_id]
+
+        tmp_path = self.file_path + '.tmp{}.npz'.format(os.getpid())
+        np.savez(tmp_path,
+                 format_version=np.array(self.format_version),
+                 candidate_obj_id=self._candidate_obj_id,
+                 candidate_lat=self._candidate_lat,
+                 candidate_lon=self._candidate_lon,
+                 row_obj_id=np.array(row_obj_id, dtype=np.int64),
+                 row_lat=np.array([row[0] for row in rows],
+                                  dtype=np.float64),
+                 row_lon=np.array([row[1] for row in rows],
+                                  dtype=np.float64),
+                 row_count=np.array([len(row[2]) for row in rows],
+                                    dtype=np.int64),
+                 neighbor_obj_id=np.concatenate([np.empty(0, np.int64)] +
+                                                [row[2] for row in rows]),
+                 neighbor_dist_km=np.concatenate([np.empty(0)] +
+                                                 [row[3] for row in rows]))
+        os.replace(tmp_path, self.file_path)
+
+    def _update_candidates(self, obj_id2, lat2, lon2):
+
+        """
+        Drop rows affected by changes in the candidate stations.
+        """
+
+        order = np.argsort(obj_id2, kind='stable')
+        obj_id2 = obj_id2[order]
+        lat2 = lat2[order]
+        lon2 = lon2[order]
+
+        # Candidates that stayed put, by index into the old and new arrays.
+        # obj_id2 may repeat an obj_identifier, so uniqueness is not
+        # assumed; only the first of repeated candidates is matched, and
+        # the others are treated as added (or removed), which only drops
+        # more rows than necessary.
+        common, old_ind, new_ind = \
+            np.intersect1d(self._candidate_obj_id, obj_id2,
+                           return_indices=True)
+        stayed = self._same_location(self._candidate_lat[old_ind],
+                                     self._candidate_lon[old_ind],
+                                     lat2[new_ind],
+                                     lon2[new_ind])
+        old_kept = np.zeros(len(self._candidate_obj_id), dtype=bool)
+        old_kept[old_ind[stayed]] = True
+        new_kept = np.zeros(len(obj_id2), dtype=bool)
+        new_kept[new_ind[stayed]] = True
+
+        removed = self._candidate_obj_id[~old_kept]
+        added = np.flatnonzero(~new_kept)
+
+        self._candidate_obj_id = obj_id2
+        self._candidate_lat = lat2
+        self._candidate_lon = lon2
+
+        if len(self._rows) == 0:
+            return
+
+        row_obj_id = list(self._rows.keys())
+        rows = [self._rows[obj_id] for obj_id in row_obj_id]
+        drop = np.zeros(len(row_obj_id), dtype=bool)
+
+        # Rows including candidates that are gone or have moved.
+        if len(removed) > 0:
+            row_count = np.array([len(row[2]) for row in rows])
+            neighbor_obj_id = np.concatenate([row[2] for row in rows])
+            hit = np.isin(neighbor_obj_id, removed)
+            drop[np.repeat(np.arange(len(rows)), row_count)[hit]] = True
+
+        # Rows within the neighborhood of new or moved candidates.
+        if len(added) > 0:
+            reverse_ind, reverse_dist_km = \
+                find_nearest_neighbors_tree(lat2[added],
+                                            lon2[added],
+                                            [row[0] for row in rows],
+                                            [row[1] for row in rows],
+                                            self.neighborhood_radius_km,
+                                            0,
+                                            len(rows))
+            for row_ind_list in reverse_ind:
+                drop[row_ind_list] = True
+
+        for ri in np.flatnonzero(drop):
+            del self._rows[row_obj_id[ri]]
+
+    def find(self, obj_id1, lat1, lon1, obj_id2, lat2, lon2):
+
+        """
+        Get the nhood_ind and nhood_dist_km lists that
+        find_nearest_neighbors_tree(lat1, lon1, lat2, lon2, ...) would
+        return, for target stations obj_id1 at lat1/lon1 and candidate
+        stations obj_id2 at lat2/lon2.
+        """
+
+        t1 = dt.datetime.utcnow()
+
+        obj_id1 = np.asarray(obj_id1, dtype=np.int64)
+        obj_id2 = np.asarray(obj_id2, dtype=np.int64)
+        lat1 = np.asarray(lat1, dtype=np.float64)
+        lon1 = np.asarray(lon1, dtype=np.float64)
+        lat2 = np.asarray(lat2, dtype=np.float64)
+        lon2 = np.asarray(lon2, dtype=np.float64)
+
+        self._update_candidates(obj_id2, lat2, lon2)
+
+        # Find target stations that need their rows computed.
+        row_list = [self._rows.get(obj_id) for obj_id in obj_id1.tolist()]
+        row_lat = np.array([np.nan if row is None else row[0]
+                            for row in row_list])
+        row_lon = np.array([np.nan if row is None else row[1]
+                            for row in row_list])
+        have_row = np.array([row is not None for row in row_list],
+                            dtype=bool)
+        compute_ind = np.flatnonzero(~(have_row &
+                                       self._same_location(row_lat,
+                                                           row_lon,
+                                                           lat1,
+                                                           lon1)))
+        num_reused = len(obj_id1) - len(compute_ind)
+
+        if len(compute_ind) > 0:
+            new_ind, new_dist_km = \
+                find_nearest_neighbors_tree(lat1[compute_ind],
+                                            lon1[compute_ind],
+                                            lat2,
+                                            lon2,
+                                            self.neighborhood_radius_km,
+                                            0,
+                                            self.max_neighbors)
+            for ci, ind1 in enumerate(compute_ind.tolist()):
+                row_list[ind1] = \
+                    (lat1[ind1],
+                     lon1[ind1],
+                     obj_id2[np.array(new_ind[ci], dtype=np.int64)],
+                     np.array(new_dist_km[ci], dtype=np.float64))
+                self._rows[int(obj_id1[ind1])] = row_list[ind1]
+
+        self.num_rows_reused += num_reused
+        self.num_rows_computed += len(compute_ind)
+
+        # Assemble results in terms of indices into obj_id2.
+        nhood_ind = [[] for i in range(len(obj_id1))]
+        nhood_dist_km = [[] for i in range(len(obj_id1))]
+        if len(obj_id1) > 0:
+            row_count = np.array([len(row[2]) for row in row_list])
+            neighbor_obj_id = np.concatenate([row[2] for row in row_list])
+            neighbor_dist_km = np.concatenate([row[3] for row in row_list])
+            order2 = np.argsort(obj_id2, kind='stable')
+            neighbor_ind = \
+                order2[np.searchsorted(obj_id2[order2], neighbor_obj_id)]
+            bounds = np.concatenate(([0], np.cumsum(row_count)))
+            for ind1 in np.flatnonzero((row_count >= self.min_neighbors) &
+                                       (row_count > 0)).tolist():
+                first = bounds[ind1]
+                last = bounds[ind1 + 1]
+                nhood_ind[ind1] = list(neighbor_ind[first:last])
+                nhood_dist_km[ind1] = list(neighbor_dist_km[first:last])
+
+        t2 = dt.datetime.utcnow()
+        elapsed_time = t2 - t1
+        if self.verbose:
+            print('INFO: found nearest neighbors in {} seconds '.
+                  format(elapsed_time.total_seconds()) +
+                  '({} cached, {} computed).'.
+                  format(num_reused, len(compute_ind)))
+
+        return nhood_ind, nhood_dist_km
+
+
 def dist_crude_euclidian(lat1, lon1, lat2, lon2):
     """
     Calculate a crude euclidian distance on the Earth between
@@ -250,32 +678,6 @@ def dist_crude_euclidian(lat1, lon1, lat2, lon2):
     return distance
 
 
-def station_qc_db_copy(database_path,
-                       verbose=None):
-    """
-    Make a temporary copy of the QC database.
-    """
-    suffix = dt.datetime.utcnow().strftime('%Y%m%d%H%M%S') + \
-             '.{}'.format(os.getpid())
-
-    temp_database_path = database_path + '.' + suffix
-
-    try:
-        shutil.copy(database_path, temp_database_path)
-    except:
-        print('ERROR: Failed to make temporary copy of ' +
-              '{} '.format(database_path) +
-              ' as {}.'.format(temp_database_path),
-              file=sys.stderr)
-        sys.exit(1)
-
-    if verbose:
-        print('INFO: Modifying copy of {} '.format(database_path) +
-              'as {}.'.format(temp_database_path))
-
-    return temp_database_path
-
-
 def progress(count, total, status=''):
     """
     Progress bar:  
@@ -304,16 +706,961 @@ def timedelta_to_int_hours(delta_time):
     return delta_time_hours
 
 
+class StationIndex:
+
+    """
+    Hash index from station object identifiers to rows of a data source,
+    such as the station_obj_id list of a wdb0.get_*_obs result or the
+    obj_identifier variable of the QC database.
+
+    find() looks up one station; find_all() looks up an array of stations
+    at once, returning -1 for stations that are not found. If an object
+    identifier appears more than once, the first row is used, and
+    is_duplicated()/duplicated() identify it. Masked (unset) object
+    identifiers are not indexed.
+    """
+
+    def __init__(self, obj_id):
+
+        obj_id = np.ma.asarray(obj_id)
+        valid = ~np.ma.getmaskarray(obj_id)
+        rows = np.flatnonzero(valid)
+        obj_id = np.ma.getdata(obj_id)[valid].astype(np.int64)
+
+        order = np.argsort(obj_id, kind='stable')
+        sorted_obj_id = obj_id[order]
+        sorted_row = rows[order]
+        first = np.ones(len(sorted_obj_id), dtype=bool)
+        first[1:] = sorted_obj_id[1:] != sorted_obj_id[:-1]
+
+        self._row = dict(zip(sorted_obj_id[first].tolist(),
+                             sorted_row[first].tolist()))
+        self._duplicated = set(sorted_obj_id[~first].tolist())
+        self._sorted_obj_id = sorted_obj_id[first]
+        self._sorted_row = sorted_row[first]
+
+    def __len__(self):
+
+        return len(self._row)
+
+    def find(self, obj_id):
+
+        """
+        Return the row for obj_id, or None if it is not in the index.
+        """
+
+        return self._row.get(int(obj_id))
+
+    def is_duplicated(self, obj_id):
+
+        return int(obj_id) in self._duplicated
+
+    def add(self, obj_id, row):
+
+        """
+        Add a row, e.g. for a station appended to the QC database.
+        """
+
+        obj_id = int(obj_id)
+        if obj_id in self._row:
+            self._duplicated.add(obj_id)
+            return
+        self._row[obj_id] = int(row)
+        # Rebuild the sorted arrays on the next find_all().
+        self._sorted_obj_id = None
+
+    def find_all(self, obj_id):
+
+        """
+        Return an array of rows for an array of object identifiers, with
+        -1 for those not in the index.
+        """
+
+        if self._sorted_obj_id is None:
+            self._sorted_obj_id = np.array(sorted(self._row.keys()),
+                                           dtype=np.int64)
+            self._sorted_row = np.array([self._row[val]
+                                         for val
+                                         in self._sorted_obj_id.tolist()],
+                                        dtype=np.int64)
+
+        obj_id = np.asarray(obj_id, dtype=np.int64)
+        rows = np.full(obj_id.shape, -1, dtype=np.int64)
+        if len(self._sorted_obj_id) == 0:
+            return rows
+        pos = np.minimum(np.searchsorted(self._sorted_obj_id, obj_id),
+                         len(self._sorted_obj_id) - 1)
+        found = self._sorted_obj_id[pos] == obj_id
+        rows[found] = self._sorted_row[pos[found]]
+
+        return rows
+
+    def duplicated(self, obj_id):
+
+        """
+        Return a boolean array identifying object identifiers that appear
+        more than once in the index.
+        """
+
+        return np.isin(np.asarray(obj_id, dtype=np.int64),
+                       np.array(list(self._duplicated), dtype=np.int64))
+
+
+def hyperslab_num_chunks(var, first_row, end_row, first_col, end_col):
+
+    """
+    Number of chunks of a [station, time] netCDF variable overlapping the
+    hyperslab [first_row:end_row, first_col:end_col].
+    """
+
+    if end_row <= first_row or end_col <= first_col:
+        return 0
+    chunking = var.chunking()
+    if chunking == 'contiguous':
+        chunking = var.shape
+    station_chunk = max(int(chunking[0]), 1)
+    time_chunk = max(int(chunking[1]), 1)
+    return ((end_row - 1) // station_chunk -
+            first_row // station_chunk + 1) * \
+           ((end_col - 1) // time_chunk -
+            first_col // time_chunk + 1)
+
+
+def chunk_gap_rows(var, max_gap_rows):
+
+    """
+    Largest gap between rows of a [station, time] netCDF variable worth
+    reading and writing through: at least max_gap_rows, and less than the
+    station chunk size, since rows sharing chunks cost nothing extra.
+    """
+
+    chunking = var.chunking()
+    if chunking == 'contiguous':
+        return max_gap_rows
+    return max(max_gap_rows, int(chunking[0]) - 1)
+
+
+def row_runs(rows, max_gap_rows):
+
+    """
+    Group a sorted array of row indices into runs of rows, joining rows
+    separated by at most max_gap_rows other rows. Returns a list of
+    (first_row, end_row) tuples.
+    """
+
+    if len(rows) == 0:
+        return []
+    run_start = np.flatnonzero(np.diff(rows) > max_gap_rows + 1) + 1
+    return [(int(run[0]), int(run[-1]) + 1)
+            for run in np.split(rows, run_start)]
+
+
+class QCFlagWindow:
+
+    """
+    In-memory copy of the [:, first_time_ind:end_time_ind] hyperslab of a
+    [station, time] QC flag variable in the QC database.
+
+    The QC tests read and OR bits into flags one element at a time. Doing
+    that on the netCDF variable itself means a (zlib-compressed) chunk is
+    read, and often written, for every element. Instead the whole window
+    is read once, elements are indexed here exactly as they would be on the
+    variable (with absolute [station, time] indices), and flush() writes
+    back only the rows that changed, in contiguous slabs. Elements outside
+    the window are passed through to the variable.
+
+    If a QCJournal is given, the window includes changes recorded in the
+    journal but not yet committed, and flush() and add_station() record
+    changed elements in the journal instead of writing them to the
+    variable. Elements outside the window cannot be accessed in that case.
+
+    Stations appended to the QC database are added with add_station().
+    The num_element_* and num_chunk_* attributes count element accesses
+    served from memory and chunks actually read and written.
+    """
+
+    def __init__(self,
+                 var,
+                 first_time_ind,
+                 end_time_ind,
+                 max_gap_rows=8,
+                 journal=None):
+
+        self.var = var
+        self.first_time_ind = first_time_ind
+        self.end_time_ind = end_time_ind
+        self.journal = journal
+        # Changed rows separated by at most this many unchanged rows (or
+        # sharing chunks) are written back together.
+        self.max_gap_rows = chunk_gap_rows(var, max_gap_rows)
+
+        slab = var[:, first_time_ind:end_time_ind]
+        self._num_stations = slab.shape[0]
+        self._data = np.array(np.ma.getdata(slab))
+        self._mask = np.array(np.ma.getmaskarray(slab))
+        self._data_read = self._data
+        self._mask_read = self._mask
+
+        if journal is not None:
+            # Include stations and flags not yet committed to the variable.
+            for station_ind in range(self._num_stations,
+                                     journal.num_rows(var.name)):
+                self._append_station()
+            for station_ind, time_ind, data, mask in \
+                journal.elements_in(var.name, first_time_ind, end_time_ind):
+                self._data[station_ind, time_ind - first_time_ind] = data
+                self._mask[station_ind, time_ind - first_time_ind] = mask
+
+        self._data_read = self._data.copy()
+        self._mask_read = self._mask.copy()
+
+        self.num_element_reads = 0
+        self.num_element_writes = 0
+        self.num_chunk_reads = hyperslab_num_chunks(var,
+                                                    0,
+                                                    slab.shape[0],
+                                                    first_time_ind,
+                                                    end_time_ind)
+        self.num_chunk_writes = 0
+
+    def _column(self, key):
+
+        """
+        Column of the window for a [station, time] key, or None if the key
+        is not a single element within the window.
+        """
+
+        station_ind, time_ind = key
+        if not isinstance(station_ind, (int, np.integer)) or \
+           not isinstance(time_ind, (int, np.integer)) or \
+           station_ind < 0 or station_ind >= self._num_stations or \
+           time_ind < self.first_time_ind or time_ind >= self.end_time_ind:
+            if self.journal is not None:
+                raise IndexError('{} is outside the QC flag window'.
+                                 format(key))
+            return None
+        return time_ind - self.first_time_ind
+
+    def __getitem__(self, key):
+
+        col = self._column(key)
+        if col is None:
+            return self.var[key]
+        self.num_element_reads += 1
+        if self._mask[key[0], col]:
+            return np.ma.masked
+        return self._data[key[0], col]
+
+    def __setitem__(self, key, value):
+
+        col = self._column(key)
+        if col is None:
+            self.var[key] = value
+            return
+        self.num_element_writes += 1
+        if value is np.ma.masked:
+            self._mask[key[0], col] = True
+        else:
+            self._data[key[0], col] = value
+            self._mask[key[0], col] = False
+
+    def getncattr(self, name):
+
+        return self.var.getncattr(name)
+
+    def add_station(self, station_ind):
+
+        """
+        Initialize QC flags to 0 for a station appended to the QC database.
+        """
+
+        if station_ind != self._num_stations:
+            raise IndexError('station {} '.format(station_ind) +
+                             'is not the next station in the window')
+
+        if self.journal is None:
+            self.var[station_ind, :] = 0
+        else:
+            self.journal.zero_row(self.var.name, station_ind)
+
+        self._append_station()
+        self._data_read[station_ind] = 0
+        self._mask_read[station_ind] = False
+
+    def _append_station(self):
+
+        """
+        Add a row of zeros to the window arrays.
+        """
+
+        if self._num_stations == self._data.shape[0]:
+            # Grow the window arrays geometrically, to handle many new
+            # stations (e.g. for a new QC database) efficiently.
+            num_rows = max(2 * self._num_stations, 1024) - \
+                       self._num_stations
+            num_cols = self._data.shape[1]
+            new_data = np.zeros((num_rows, num_cols), dtype=self._data.dtype)
+            new_mask = np.zeros((num_rows, num_cols), dtype=bool)
+            self._data = np.concatenate((self._data, new_data))
+            self._mask = np.concatenate((self._mask, new_mask))
+            self._data_read = np.concatenate((self._data_read, new_data))
+            self._mask_read = np.concatenate((self._mask_read, new_mask))
+
+        self._data[self._num_stations] = 0
+        self._mask[self._num_stations] = False
+        self._num_stations += 1
+
+    def get(self, first_time_ind, end_time_ind):
+
+        """
+        Return a masked array copy of the [:, first_time_ind:end_time_ind]
+        part of the window.
+        """
+
+        cols = slice(first_time_ind - self.first_time_ind,
+                     end_time_ind - self.first_time_ind)
+        return np.ma.masked_array(self._data[:self._num_stations, cols],
+                                  mask=self._mask[:self._num_stations, cols],
+                                  copy=True)
+
+    def or_elements(self, station_ind, time_ind, bits):
+
+        """
+        Turn on bits in the elements [station_ind[i], time_ind[i]] for
+        arrays of absolute indices, which must all be within the window.
+        This does for many elements at once what reading an element and
+        setting it to the result of OR-ing bits into it does, so masked
+        elements are left masked.
+        """
+
+        station_ind = np.asarray(station_ind, dtype=np.int64)
+        col = np.asarray(time_ind, dtype=np.int64) - self.first_time_ind
+        if np.any((station_ind < 0) | (station_ind >= self._num_stations) |
+                  (col < 0) | (col >= self._data.shape[1])):
+            raise IndexError('elements are outside the QC flag window')
+        bits = np.broadcast_to(np.asarray(bits, dtype=self._data.dtype),
+                               station_ind.shape)
+        self.num_element_reads += len(station_ind)
+        self.num_element_writes += len(station_ind)
+        bits = np.where(self._mask[station_ind, col], 0, bits). \
+            astype(self._data.dtype)
+        np.bitwise_or.at(self._data, (station_ind, col), bits)
+
+    def flush(self):
+
+        """
+        Write rows that have changed back to the variable, or record the
+        changed elements in the journal. Changed rows are grouped into
+        runs, and each run is written as one hyperslab spanning the columns
+        that have changed in any row.
+        """
+
+        num_stations = self._num_stations
+        changed = \
+            (self._data[:num_stations] != self._data_read[:num_stations]) | \
+            (self._mask[:num_stations] != self._mask_read[:num_stations])
+
+        if self.journal is not None:
+            station_ind, col = np.nonzero(changed)
+            self.journal.elements(self.var.name,
+                                  station_ind,
+                                  self.first_time_ind + col,
+                                  self._data[station_ind, col],
+                                  self._mask[station_ind, col])
+        elif changed.any():
+            cols = np.flatnonzero(changed.any(axis=0))
+            col_1 = int(cols[0])
+            col_2 = int(cols[-1]) + 1
+            first_col = self.first_time_ind + col_1
+            end_col = self.first_time_ind + col_2
+            for first_row, end_row in \
+                row_runs(np.flatnonzero(changed.any(axis=1)),
+                         self.max_gap_rows):
+                self.var[first_row:end_row, first_col:end_col] = \
+                    np.ma.masked_array(self._data[first_row:end_row,
+                                                  col_1:col_2],
+                                       mask=self._mask[first_row:end_row,
+                                                       col_1:col_2])
+                self.num_chunk_writes += \
+                    hyperslab_num_chunks(self.var,
+                                         first_row, end_row,
+                                         first_col, end_col)
+
+        self._data_read[:num_stations] = self._data[:num_stations]
+        self._mask_read[:num_stations] = self._mask[:num_stations]
+
+
+class QCJournal:
+
+    """
+    All-or-nothing commits of updates to the QC database, made in place
+    rather than by copying the database and moving the copy over it.
+
+    Changes are recorded here instead of being written to the database:
+    station variable values (station_value), rows of QC flags set to zero
+    for new stations (zero_row), (station, time, value) elements of QC
+    flags (elements, normally from QCFlagWindow.flush) and global
+    attributes (attr). commit() appends everything recorded since the last
+    commit to the journal file as one checksummed frame and syncs it to
+    disk, and only then writes the changes to the database, updating QC
+    flags one hyperslab per run of stations. Once the database has been
+    synced to disk as well, the journal file is removed.
+
+    If the process dies before a frame is completely written, the frame is
+    ignored, and the database is as it was after the previous commit. If
+    it dies while changes are being written to the database, recover()
+    (called on startup) writes them again. Records hold values rather than
+    bit operations, so writing them more than once is harmless. (As with
+    any in-place update, a crash in the middle of an HDF5 write could in
+    principle damage the file itself, which the journal cannot repair.)
+
+    An exclusive lock on database_path + '.lock' is held from construction
+    until close(), so only one process updates a database at a time;
+    OSError is raised if another process holds it.
+    """
+
+    MAGIC = b'QCJ1'
+    HEADER = struct.Struct('<4sQI')
+
+    def __init__(self, database_path):
+
+        self.database_path = database_path
+        self.journal_path = database_path + '.journal'
+
+        self._lock_file = open(database_path + '.lock', 'a')
+        try:
+            fcntl.flock(self._lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            self._lock_file.close()
+            raise
+
+        self._records = []
+        self._num_rows = {}
+        self.max_gap_rows = 8
+        self.num_commits = 0
+        self.num_records_committed = 0
+        self.num_chunk_reads = 0
+        self.num_chunk_writes = 0
+
+    def station_value(self, var_name, station_ind, value):
+
+        self._records.append(('station_value',
+                              var_name,
+                              int(station_ind),
+                              value))
+
+    def zero_row(self, var_name, station_ind):
+
+        self._records.append(('zero_row', var_name, int(station_ind)))
+        self._num_rows[var_name] = max(self._num_rows.get(var_name, 0),
+                                       int(station_ind) + 1)
+
+    def elements(self, var_name, station_ind, time_ind, data, mask):
+
+        """
+        Record new values (data, with mask True for masked values) for
+        [station_ind, time_ind] elements of var_name, given as arrays.
+        """
+
+        if len(station_ind) == 0:
+            return
+        self._records.append(('elements',
+                              var_name,
+                              np.array(station_ind, dtype=np.int64),
+                              np.array(time_ind, dtype=np.int64),
+                              np.array(data),
+                              np.array(mask, dtype=bool)))
+
+    def attr(self, name, value):
+
+        self._records.append(('attr', name, value))
+
+    def num_rows(self, var_name):
+
+        """
+        Return the number of rows of var_name that will exist once new
+        stations recorded since the last commit are written (0 if there
+        are none).
+        """
+
+        return self._num_rows.get(var_name, 0)
+
+    def elements_in(self, var_name, first_time_ind, end_time_ind):
+
+        """
+        Generate (station_ind, time_ind, data, mask) arrays for uncommitted
+        elements of var_name with time indices from first_time_ind through
+        end_time_ind - 1, in the order they were recorded.
+        """
+
+        for record in self._records:
+            if record[0] != 'elements' or record[1] != var_name:
+                continue
+            station_ind, time_ind, data, mask = record[2:]
+            keep = (time_ind >= first_time_ind) & (time_ind < end_time_ind)
+            yield station_ind[keep], time_ind[keep], data[keep], mask[keep]
+
+    def _apply(self, qcdb, records):
+
+        """
+        Write journal records to the QC database. New stations are written
+        first, then QC flag elements, which are combined for each variable
+        (later values replacing earlier ones) and written with one read and
+        one write of a hyperslab per run of stations.
+        """
+
+        elements = {}
+        for record in records:
+            if record[0] == 'station_value':
+                var_name, station_ind, value = record[1:]
+                qcdb.variables[var_name][station_ind] = value
+            elif record[0] == 'zero_row':
+                var_name, station_ind = record[1:]
+                qcdb.variables[var_name][station_ind, :] = 0
+            elif record[0] == 'elements':
+                elements.setdefault(record[1], []).append(record[2:])
+            elif record[0] == 'attr':
+                name, value = record[1:]
+                qcdb.setncattr_string(name, value)
+            else:
+                raise ValueError('unknown journal record type ' +
+                                 '"{}"'.format(record[0]))
+
+        for var_name, var_elements in elements.items():
+            var = qcdb.variables[var_name]
+            station_ind, time_ind, data, mask = \
+                [np.concatenate(arrays) for arrays in zip(*var_elements)]
+
+            # Keep the last value recorded for each element.
+            key = station_ind * var.shape[1] + time_ind
+            _, last = np.unique(key[::-1], return_index=True)
+            last = len(key) - 1 - last
+            station_ind = station_ind[last]
+            time_ind = time_ind[last]
+            data = data[last]
+            mask = mask[last]
+
+            first_col = int(time_ind.min())
+            end_col = int(time_ind.max()) + 1
+            for first_row, end_row in \
+                    row_runs(np.unique(station_ind),
+                             chunk_gap_rows(var, self.max_gap_rows)):
+                slab = var[first_row:end_row, first_col:end_col]
+                slab_data = np.array(np.ma.getdata(slab))
+                slab_mask = np.array(np.ma.getmaskarray(slab))
+                in_run = (station_ind >= first_row) & (station_ind < end_row)
+                rows = station_ind[in_run] - first_row
+                cols = time_ind[in_run] - first_col
+                slab_data[rows, cols] = data[in_run]
+                slab_mask[rows, cols] = mask[in_run]
+                var[first_row:end_row, first_col:end_col] = \
+                    np.ma.masked_array(slab_data, mask=slab_mask)
+                num_chunks = hyperslab_num_chunks(var,
+                                                  first_row, end_row,
+                                                  first_col, end_col)
+                self.num_chunk_reads += num_chunks
+                self.num_chunk_writes += num_chunks
+
+    def _sync_dir(self):
+
+        dir_fd = os.open(os.path.dirname(os.path.abspath(self.journal_path)),
+                         os.O_RDONLY)
+        try:
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
+
+    def _sync_database(self, qcdb):
+
+        """
+        Sync the QC database to disk, then remove the journal file.
+        """
+
+        qcdb.sync()
+        database_fd = os.open(self.database_path, os.O_RDONLY)
+        try:
+            os.fsync(database_fd)
+        finally:
+            os.close(database_fd)
+        os.remove(self.journal_path)
+        self._sync_dir()
+
+    def commit(self, qcdb):
+
+        """
+        Commit changes recorded since the last commit to the QC database
+        qcdb (open for writing). Returns the number of records committed.
+        """
+
+        if len(self._records) == 0:
+            return 0
+
+        frame = pickle.dumps(self._records, protocol=4)
+        with open(self.journal_path, 'ab') as journal_file:
+            journal_file.write(self.HEADER.pack(self.MAGIC,
+                                                len(frame),
+                                                zlib.crc32(frame)))
+            journal_file.write(frame)
+            journal_file.flush()
+            os.fsync(journal_file.fileno())
+        self._sync_dir()
+
+        # The commit is now durable; write it to the database.
+        self._apply(qcdb, self._records)
+        self._sync_database(qcdb)
+
+        num_records = len(self._records)
+        self.num_commits += 1
+        self.num_records_committed += num_records
+        self._records = []
+        self._num_rows = {}
+
+        return num_records
+
+    def recover(self, qcdb):
+
+        """
+        Write any commits left in the journal file by an interrupted update
+        to the QC database qcdb (open for writing), and remove the journal
+        file. An incomplete frame at the end of the file (from a commit
+        that was interrupted before it was synced) is discarded. Returns
+        the number of commits written.
+        """
+
+        if not os.path.exists(self.journal_path):
+            return 0
+
+        frames = []
+        with open(self.journal_path, 'rb') as journal_file:
+            while True:
+                header = journal_file.read(self.HEADER.size)
+                if len(header) < self.HEADER.size:
+                    break
+                magic, length, crc = self.HEADER.unpack(header)
+                if magic != self.MAGIC:
+                    break
+                frame = journal_file.read(length)
+                if len(frame) < length or zlib.crc32(frame) != crc:
+                    break
+                frames.append(pickle.loads(frame))
+
+        for records in frames:
+            self._apply(qcdb, records)
+        self._sync_database(qcdb)
+
+        return len(frames)
+
+    def close(self):
+
+        """
+        Release the lock. Changes that have not been committed are
+        discarded.
+        """
+
+        self._records = []
+        self._num_rows = {}
+        fcntl.flock(self._lock_file, fcntl.LOCK_UN)
+        self._lock_file.close()
+
+
+class QCPrefetcher:
+
+    """
+    Fetch the inputs for upcoming QC hours in a background thread, so that
+    database queries and climatology sampling for hours t+1 through t+depth
+    overlap with QC of hour t.
+
+    fetch is called as fetch(obs_datetime) for each datetime in
+    obs_datetime_list, in order, and must return a dictionary. Results are
+    passed to the main thread through a queue holding at most depth
+    entries; with depth 0 no thread is started and each hour is fetched
+    when get() is called. Any exception raised by fetch (including the
+    SystemExit raised by wdb0 on query failure) is re-raised by get().
+    """
+
+    _done = object()
+
+    def __init__(self, fetch, obs_datetime_list, depth=2):
+
+        self.fetch = fetch
+        self.obs_datetime_list = list(obs_datetime_list)
+        self.depth = depth
+        self._next_ind = 0
+        self._thread = None
+        if self.depth > 0:
+            self._queue = queue.Queue(maxsize=self.depth)
+            self._stop = threading.Event()
+            self._thread = threading.Thread(target=self._run,
+                                            name='qc_prefetch',
+                                            daemon=True)
+            self._thread.start()
+
+    def _put(self, item):
+
+        # Block until there is room in the queue, or until close() is
+        # called.
+        while not self._stop.is_set():
+            try:
+                self._queue.put(item, timeout=0.5)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _run(self):
+
+        for obs_datetime in self.obs_datetime_list:
+            if self._stop.is_set():
+                return
+            try:
+                result = self.fetch(obs_datetime)
+            except BaseException as err:
+                self._put((obs_datetime, None, err))
+                return
+            if not self._put((obs_datetime, result, None)):
+                return
+        self._put((None, QCPrefetcher._done, None))
+
+    def get(self, obs_datetime):
+
+        """
+        Return the fetch result for obs_datetime, which must be the next
+        datetime in obs_datetime_list.
+        """
+
+        if self._next_ind >= len(self.obs_datetime_list) or \
+           self.obs_datetime_list[self._next_ind] != obs_datetime:
+            raise ValueError('prefetch requested out of order for {}'.
+                             format(obs_datetime))
+        self._next_ind += 1
+
+        if self._thread is None:
+            return(self.fetch(obs_datetime))
+
+        item_datetime, result, err = self._queue.get()
+        if err is not None:
+            self.close()
+            raise err
+        if result is QCPrefetcher._done or item_datetime != obs_datetime:
+            self.close()
+            raise RuntimeError('prefetch thread returned {} '.
+                               format(item_datetime) +
+                               'when {} was expected'.format(obs_datetime))
+        return(result)
+
+    def close(self):
+
+        """
+        Stop the background thread, discarding any prefetched results.
+        """
+
+        if self._thread is None:
+            return
+        self._stop.set()
+        while True:
+            try:
+                self._queue.get_nowait()
+            except queue.Empty:
+                break
+        self._thread.join()
+        self._thread = None
+
+
+class _ProfileSection:
+
+    """
+    Context manager timing one section for QCProfiler.section.
+    """
+
+    __slots__ = ('profiler', 'name', 'rows', 'start')
+
+    def __init__(self, profiler, name, rows):
+
+        self.profiler = profiler
+        self.name = name
+        self.rows = rows
+
+    def __enter__(self):
+
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+
+        self.profiler.add(self.name,
+                          time.perf_counter() - self.start,
+                          rows=self.rows)
+        return False
+
+
+class _NullSection:
+
+    """
+    Context manager that does nothing, returned by QCProfiler.section when
+    profiling is off. Its rows attribute may be set, and is ignored.
+    """
+
+    rows = 0
+
+    def __enter__(self):
+
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+
+        return False
+
+
+class QCProfiler:
+
+    """
+    Record wall time, number of calls and number of rows (stations,
+    journal records, ...) processed by each section of the hourly QC loop,
+    and write them to file_path as JSON lines: one "hour" record per hour
+    updated, and a "summary" record with totals for the run.
+
+    Sections are timed with
+
+        with profiler.section('neighbors', rows=num_stations):
+            ...
+
+    (the rows attribute of the object returned may also be set inside the
+    block), or recorded with add() when they were timed elsewhere, e.g. in
+    the prefetch thread. Section names are grouped by a prefix such as
+    "fetch.", "netcdf." or "snwd.".
+
+    If file_path is None no file is written, but totals are still kept
+    for print_summary() if enabled is True. If enabled is False (the
+    default when there is no file_path) profiling is off: section() returns
+    a shared context manager that does nothing and add() returns
+    immediately, so the instrumentation costs next to nothing.
+    """
+
+    _null_section = _NullSection()
+
+    def __init__(self, file_path=None, enabled=None):
+
+        self.enabled = bool(enabled) or file_path is not None
+        self.file_path = file_path
+        self.num_hours = 0
+        self._hour = {}
+        self._total = {}
+        self._hour_start = time.perf_counter()
+        self._run_start = self._hour_start
+        self._file = None
+        if file_path is not None:
+            self._file = open(file_path, 'w')
+
+    def section(self, name, rows=0):
+
+        if not self.enabled:
+            return QCProfiler._null_section
+        return _ProfileSection(self, name, rows)
+
+    def add(self, name, seconds, calls=1, rows=0):
+
+        """
+        Add seconds, calls and rows to the totals for section name in the
+        current hour.
+        """
+
+        if not self.enabled:
+            return
+        entry = self._hour.get(name)
+        if entry is None:
+            entry = {'seconds': 0.0, 'calls': 0, 'rows': 0}
+            self._hour[name] = entry
+        entry['seconds'] += seconds
+        entry['calls'] += calls
+        entry['rows'] += int(rows)
+
+    def _add_hour_to_total(self):
+
+        for name, entry in self._hour.items():
+            total = self._total.setdefault(name,
+                                           {'seconds': 0.0,
+                                            'calls': 0,
+                                            'rows': 0})
+            for key in total:
+                total[key] += entry[key]
+        self._hour = {}
+
+    def _write(self, record):
+
+        self._file.write(json.dumps(record, sort_keys=True) + '\n')
+        self._file.flush()
+
+    def end_hour(self, obs_datetime):
+
+        """
+        Write the record for the hour obs_datetime, add it to the run
+        totals and start a new hour.
+        """
+
+        if not self.enabled:
+            return
+        now = time.perf_counter()
+        if self._file is not None:
+            self._write({'record': 'hour',
+                         'obs_datetime':
+                         obs_datetime.strftime('%Y-%m-%d %H:%M:%S UTC'),
+                         'wall_seconds': now - self._hour_start,
+                         'sections': self._hour})
+        self._add_hour_to_total()
+        self._hour_start = now
+        self.num_hours += 1
+
+    def close(self):
+
+        """
+        Add sections recorded since the last hour ended to the run totals,
+        and write the summary record and close the file.
+        """
+
+        if not self.enabled:
+            return
+        self._add_hour_to_total()
+        for entry in self._total.values():
+            entry['seconds_per_hour'] = \
+                entry['seconds'] / max(self.num_hours, 1)
+        if self._file is None:
+            return
+        self._write({'record': 'summary',
+                     'num_hours': self.num_hours,
+                     'wall_seconds': time.perf_counter() - self._run_start,
+                     'sections': self._total})
+        self._file.close()
+        self._file = None
+
+    def print_summary(self):
+
+        """
+        Print the run totals for each section, after close().
+        """
+
+        if not self.enabled:
+            return
+        print('INFO: time spent by section over {} hours:'.
+              format(self.num_hours))
+        for name in sorted(self._total.keys()):
+            entry = self._total[name]
+            print('INFO:   {:36s} {:10.3f} seconds {:8d} calls '.
+                  format(name, entry['seconds'], entry['calls']) +
+                  '{:10d} rows'.format(entry['rows']))
+
+
 def update_qc_db_metadata(qcdb,
                           qcdb_obj_id_var,
                           qcdb_lon_var,
                           qcdb_lat_var,
                           qcdb_station_vars,
                           wdb_col_list,
-                          verbose=False):
+                          verbose=False,
+                          journal=None):
     """
     Confirm/update metadata for stations in the QC database using the webdb
-    allstation table.
+    allstation table. If a QCJournal is provided, changes are recorded in
+    it rather than written to the QC database directly.
     """
 
     # Verify that there are metadata present.
@@ -344,12 +1691,6 @@ def update_qc_db_metadata(qcdb,
     qcdb_min_obj_id = qcdb_obj_id_var[:].min()
     qcdb_max_obj_id = qcdb_obj_id_var[:].max()
 
-    # Open the web database.
-    conn_string = "host='wdb0.dmz.nohrsc.noaa.gov' dbname='web_data'"
-    conn = psycopg2.connect(conn_string)
-    conn.set_client_encoding("utf-8")
-    cursor = conn.cursor()
-
     sql_cmd = "SELECT " + wdb_col_list_str + " " + \
               "FROM point.allstation " + \
               "WHERE coordinates[0]" \
@@ -370,9 +1711,12 @@ def update_qc_db_metadata(qcdb,
     # This should be done just before reading the allstation table.
     this_station_update_datetime = dt.datetime.utcnow()
 
-    cursor.execute(sql_cmd)
-    # allstation is just a huge list of tuples.
-    allstation = cursor.fetchall()
+    with wdb0.connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(sql_cmd)
+        # allstation is just a huge list of tuples.
+        allstation = cursor.fetchall()
+        cursor.close()
     #print(len(allstation))
     wdb_df = pd.DataFrame(allstation, columns=wdb_col_list)
 
@@ -457,7 +1801,12 @@ def update_qc_db_metadata(qcdb,
                           'variable "{}" '.format(qcdb_station_var.name) +
                           'from {} '.format(old) +
                           'to {}'.format(new))
-                    qcdb_station_var[qcdb_ind] = wdb_value
+                    if journal is None:
+                        qcdb_station_var[qcdb_ind] = wdb_value
+                    else:
+                        journal.station_value(qcdb_station_var.name,
+                                              qcdb_ind,
+                                              wdb_value)
 
         qcdb_sort_count += 1
 
@@ -467,13 +1816,74 @@ def update_qc_db_metadata(qcdb,
 
     if verbose: print('')
 
-    qcdb.setncattr_string('last_station_update_datetime',
-                          this_station_update_datetime.
-                          strftime('%Y-%m-%d %H:%M:%S UTC'))
+    if journal is None:
+        qcdb.setncattr_string('last_station_update_datetime',
+                              this_station_update_datetime.
+                              strftime('%Y-%m-%d %H:%M:%S UTC'))
+    else:
+        journal.attr('last_station_update_datetime',
+                     this_station_update_datetime.
+                     strftime('%Y-%m-%d %H:%M:%S UTC'))
 
     return None
 
 
+def append_qc_db_station(journal,
+                         station_ind,
+                         obj_id,
+                         qcdb_station_vars,
+                         wdb_col_list,
+                         wdb_col_list_str):
+    """
+    Read metadata for the station with object identifier obj_id from the
+    webdb allstation table (columns wdb_col_list, for qcdb_station_vars)
+    and record them in the journal as QC database station station_ind.
+    Returns the list of values recorded, or None on failure.
+    """
+
+    sql_cmd = "SELECT " + wdb_col_list_str + " " + \
+              "FROM point.allstation " + \
+              "WHERE obj_identifier = {};".format(obj_id)
+    with wdb0.connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(sql_cmd)
+        wdb_station_meta = cursor.fetchall()
+        cursor.close()
+    if len(wdb_station_meta) != 1:
+        print('ERROR: found {} matches in SQL statement '.
+              format(len(wdb_station_meta)) +
+              'for station object ID {}; expecting 1.'.format(obj_id),
+              file=sys.stderr)
+        return None
+    wdb_station_meta = wdb_station_meta[0]
+
+    column_data = []
+    for ind, qcdb_station_var in enumerate(qcdb_station_vars):
+
+        if isinstance(wdb_station_meta[ind], dt.datetime):
+            # Format as "YYYY-MM-DD HH:MM:SS"
+            if qcdb_station_var.dtype is not str:
+                print('ERROR: NetCDF variable {} '.
+                      format(qcdb_station_var.name) +
+                      'must be of "str" type.',
+                      file=sys.stderr)
+                return None
+            wdb_allstation_column_data = \
+                wdb_station_meta[ind].strftime('%Y-%m-%d %H:%M:%S')
+        else:
+            wdb_allstation_column_data = wdb_station_meta[ind]
+            if isinstance(wdb_allstation_column_data, str):
+                wdb_allstation_column_data = \
+                    wdb_allstation_column_data.strip()
+
+        journal.station_value(qcdb_station_var.name,
+                              station_ind,
+                              wdb_allstation_column_data)
+        column_data.append(wdb_allstation_column_data)
+
+    return column_data
+
+
 def qc_durre_snwd_wre(value_cm):
     """
     Basic integrity checks:
@@ -551,6 +1961,70 @@ def qc_durre_snwd_streak(snow_depth_value_cm,
         return False
 
 
+def obs_rate_categories(obs, min_sub_period_proportion=0.5):
+    """
+    Array version of obs_rate_category, classifying the reporting rate of
+    many stations at once. obs is a [station, hour] numpy masked array of
+    observations, or a boolean [station, hour] array that is True where
+    observations are missing. Returns an integer [station] array of rate
+    categories (0 = sporadic, ..., 4 = hourly), with -1 for stations with
+    no observations.
+
+    Reports in each sub-period are counted from cumulative sums of the
+    number of reports, rather than by slicing the series.
+    """
+
+    if isinstance(obs, np.ma.MaskedArray):
+        reported = ~np.ma.getmaskarray(obs)
+    else:
+        reported = ~np.asarray(obs, dtype=bool)
+    reported = np.atleast_2d(reported)
+
+    num_stations, qa_period_hours = reported.shape
+
+    # Number of reports in the first h hours is cum_reports[:, h].
+    cum_reports = np.zeros((num_stations, qa_period_hours + 1),
+                           dtype=np.int64)
+    np.cumsum(reported, axis=1, out=cum_reports[:, 1:])
+    num_reports = cum_reports[:, -1]
+
+    category = np.full(num_stations, -1, dtype=np.int64)
+    if qa_period_hours == 0:
+        return category
+
+    ave_reporting_rate = \
+        num_reports.astype(np.float64) / float(qa_period_hours) * 24.0
+
+    reporting_rate_threshold = [0.0, 0.25, 0.75, 6.0, 18.0]
+
+    # Consider rates from highest to lowest; each station takes the first
+    # one it meets on average and in enough sub-periods.
+    undecided = num_reports > 0
+    for rc, r0 in enumerate(sorted(reporting_rate_threshold, reverse=True)):
+
+        if (r0 > 0.0):
+            qa_sub_period_hours = int(max(24.0 / r0, 24.0))
+        else:
+            qa_sub_period_hours = qa_period_hours
+        num_qa_sub_periods = qa_period_hours // qa_sub_period_hours
+
+        bounds = np.arange(num_qa_sub_periods + 1) * qa_sub_period_hours
+        qa_sub_period_num_reports = np.diff(cum_reports[:, bounds], axis=1)
+        qa_sub_period_rate = \
+            qa_sub_period_num_reports.astype(np.float64) / \
+            float(qa_sub_period_hours) * 24.0
+        num_sub_periods_met = np.sum(qa_sub_period_rate >= r0, axis=1)
+
+        met = undecided & \
+              (ave_reporting_rate >= r0) & \
+              (num_sub_periods_met >=
+               min_sub_period_proportion * num_qa_sub_periods)
+        category[met] = len(reporting_rate_threshold) - 1 - rc
+        undecided &= ~met
+
+    return category
+
+
 def obs_rate_category(obs, min_sub_period_proportion=0.5, verbose=False):
     """
     Given a list of hourly observations in the form of a numpy masked
@@ -565,92 +2039,23 @@ def obs_rate_category(obs, min_sub_period_proportion=0.5, verbose=False):
 
     A given criteron must be met on average, but also consistently,
     or the next "lower" criterion is considered.
-    """
-    qa_period_hours = len(obs)
 
-    # ind = np.where(obs.mask == False)
-    # num_reports = len(ind[0])
-    # if num_reports == 0:
-    num_reports = obs.count()
-    if num_reports == 0:
-        return None
+    This is a single-station wrapper around obs_rate_categories.
+    """
+    obs_missing = np.ma.getmaskarray(obs)
 
-    ave_reporting_rate = \
-        np.float(num_reports) / np.float(qa_period_hours) * 24.0
-    if verbose:
+    if verbose and len(obs_missing) > 0:
+        ave_reporting_rate = \
+            float(np.count_nonzero(~obs_missing)) / \
+            float(len(obs_missing)) * 24.0
         print('average reporting rate: {} obs/day'.format(ave_reporting_rate))
 
-    reporting_rate_threshold = [0.0, 0.25, 0.75, 6.0, 18.0]
-
-    reporting_rate_name = ['sporadic',
-                           'quasi-daily',
-                           'daily',
-                           'synoptic',
-                           'hourly']
-    demoted = False
-    found_a_category = False
-
-    for rc, r0 in enumerate(sorted(reporting_rate_threshold, reverse=True)):
-
-        if ave_reporting_rate < r0:
-            continue
-
-        # if verbose:
-        #     print('checking for rate >= {}'.format(r0))
-
-        # Determine the number of individual sub periods where the criterion
-        # is met.
-        if (r0 > 0.0):
-            qa_sub_period_hours = int(max(24.0 / r0, 24.0))
-        else:
-            qa_sub_period_hours = qa_period_hours
-        num_qa_sub_periods = np.int(np.floor(qa_period_hours /
-                                             qa_sub_period_hours))
-        num_sub_periods_met = 0
-        for spc in range(num_qa_sub_periods):
-            oc1 = spc * qa_sub_period_hours
-            oc2 = oc1 + qa_sub_period_hours
-            qa_sub_period_obs = obs[oc1:oc2]
-            qa_sub_period_num_reports = \
-                len(np.where(qa_sub_period_obs.mask == False)[0])
-            qa_sub_period_rate = \
-                np.float(qa_sub_period_num_reports) / \
-                np.float(qa_sub_period_hours) * 24.0
-            if (qa_sub_period_rate >= r0):
-                num_sub_periods_met += 1
-        # if verbose:
-        #     print('met criteria for {} of {} sub-periods'.
-        #           format(num_sub_periods_met, num_qa_sub_periods))
-        if num_sub_periods_met < \
-           (min_sub_period_proportion * num_qa_sub_periods):
-            # if verbose:
-            #     print('that is less than {}%; '.
-            #           format(min_sub_period_proportion * 100) + 
-            #           'will check next lower frequency')
-            # print('  no - ' + 
-            #       'met criteria for only {} '.format(num_sub_periods_met) +
-            #       'of {} sub-periods'.format(num_qa_sub_periods))
-            demoted = True
-        else:
-            # if verbose:
-            #     print('that is >= {}% - consistently reports >= {} obs/day'.
-            #           format(min_sub_period_proportion * 100,
-            #                  r0))
-            # print('  yes')
-            found_a_category = True
-            break
-
-    if found_a_category:
-        # print('{} reports, '.format(num_reports) +
-        #       'reporting rate {} '.format(r0) + 
-        #       '({})'.format(reporting_rate_name[len(reporting_rate_name) - 1 - rc]))
-        # print('demoted ', demoted)
-        return len(reporting_rate_name) - 1 - rc
-    else:
-        # print('FAILED')
+    category = obs_rate_categories(obs_missing[np.newaxis, :],
+                                   min_sub_period_proportion)[0]
+    if category < 0:
         return None
 
-    return None
+    return int(category)
 
 
 def qc_durre_snwd_gap(snow_depth_value_cm,
@@ -1030,6 +2435,763 @@ def qc_durre_snwd_tair_spatial(snow_depth_value_cm,
         return False, ref_ind
 
 
+# Snow depth tests evaluated by qc_durre_snwd_batch, in the order they are
+# performed in main.
+SNWD_BATCH_TESTS = ['world_record_exceedance',
+                    'world_record_increase_exceedance',
+                    'streak',
+                    'temperature_consistency',
+                    'snowfall_consistency',
+                    'precip_consistency',
+                    'precip_ratio']
+
+
+def _batch_prev_snwd(prev_sd_value_cm, prev_sd_qc, num_hours):
+    """
+    Get the last num_hours of [station, hour] previous snow depth data,
+    along with a boolean array identifying values that are neither missing
+    nor have any QC flags set (i.e., those left unmasked by the
+    np.ma.masked_where calls in the scalar tests).
+    """
+    first_ind = prev_sd_value_cm.shape[1] - num_hours
+    values = np.ma.getdata(prev_sd_value_cm)[:, first_ind:]
+    usable = ~np.ma.getmaskarray(prev_sd_value_cm)[:, first_ind:] & \
+             ~np.ma.filled(prev_sd_qc[:, first_ind:] != 0, True)
+    return values, usable
+
+
+def qc_durre_snwd_batch(snwd_val_cm,
+                        prev_snwd_val_cm,
+                        prev_snwd_qc,
+                        prev_tair_val_deg_c,
+                        snfl_val_cm,
+                        prcp_val_mm,
+                        qc_bits,
+                        num_hrs_wre=24,
+                        num_hrs_streak=15*24,
+                        num_hrs_prev_tair=24,
+                        num_hrs_snowfall=24,
+                        num_hrs_prcp=24,
+                        streak_value_threshold=None):
+    """
+    Array-at-a-time versions of qc_durre_snwd_wre,
+    qc_durre_snwd_change_wre, qc_durre_snwd_streak, qc_durre_snwd_temp,
+    qc_durre_snwd_snfl, qc_durre_snwd_prcp and qc_durre_snwd_prcp_ratio,
+    evaluated for all stations reporting snow depth in an hour at once.
+    snwd_val_cm - [station] snow depth values being QCed
+    prev_snwd_val_cm - [station, hour] previous snow depth values, ending
+                       the hour before snwd_val_cm (fully masked for
+                       stations with no previous data)
+    prev_snwd_qc - [station, hour] QC flags for prev_snwd_val_cm
+    prev_tair_val_deg_c - [station, hour] air temperatures for the
+                          num_hrs_prev_tair hours before and the hour of
+                          snwd_val_cm (fully masked for stations with no
+                          air temperature data)
+    snfl_val_cm - [station] snowfall accumulation (masked for stations with
+                  no snowfall report)
+    prcp_val_mm - [station] precipitation accumulation (masked for
+                  stations with no precipitation report)
+    qc_bits - dictionary of QC bits for the tests to perform, keyed by the
+              names in SNWD_BATCH_TESTS
+
+    Returns a dictionary of [station] arrays: "flag" and "checked" QC
+    bitmasks, in which the bit for a test is turned on where the value was
+    flagged and where the test was possible, respectively, and "ref_ind", a
+    dictionary of reference indices (into the previous snow depth window of
+    each test, or -1) keyed by test name; "qc_bits" is included as well.
+    For each station these match the results of the scalar functions bit
+    for bit (see qc_durre_snwd_scalar). "seconds" is a dictionary of the
+    time taken by each test, for profiling; time spent on inputs shared by
+    several tests is counted for the first of them.
+    """
+
+    if streak_value_threshold is None:
+        streak_value_threshold = 0.1
+
+    snwd_ok = ~np.ma.getmaskarray(snwd_val_cm)
+    snwd = np.ma.getdata(snwd_val_cm)
+    num_stations = len(snwd)
+    station_ind = np.arange(num_stations)
+
+    flag_bits = np.zeros(num_stations, dtype=np.int64)
+    checked_bits = np.zeros(num_stations, dtype=np.int64)
+    ref_ind = {}
+    seconds = {}
+    test_start = time.perf_counter()
+
+    def record(qc_test_name, flag, checked, test_ref_ind=None):
+        nonlocal test_start
+        bit = np.int64(1) << qc_bits[qc_test_name]
+        flag_bits[flag & checked] |= bit
+        checked_bits[checked] |= bit
+        if test_ref_ind is not None:
+            ref_ind[qc_test_name] = np.where(checked, test_ref_ind, -1)
+        test_end = time.perf_counter()
+        seconds[qc_test_name] = test_end - test_start
+        test_start = test_end
+
+    def first_usable(usable):
+        return np.argmax(usable, axis=1)
+
+    def last_usable(usable):
+        return usable.shape[1] - 1 - np.argmax(usable[:, ::-1], axis=1)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+
+        # Snow depth world record exceedance.
+        if 'world_record_exceedance' in qc_bits:
+            record('world_record_exceedance',
+                   snwd_ok & ((snwd < 0.0) | (snwd > 1146.0)),
+                   np.ones(num_stations, dtype=bool))
+
+        # Snow depth increase world record exceedance, relative to the
+        # minimum usable previous value (first one, for ties).
+        if 'world_record_increase_exceedance' in qc_bits:
+            values, usable = _batch_prev_snwd(prev_snwd_val_cm,
+                                              prev_snwd_qc,
+                                              num_hrs_wre)
+            ref = np.argmin(np.where(usable, values, np.inf), axis=1)
+            ref_val = values[station_ind, ref]
+            record('world_record_increase_exceedance',
+                   snwd_ok & (snwd - ref_val > 192.5),
+                   usable.any(axis=1),
+                   ref)
+
+        # Streak check, on previous and current values together.
+        if 'streak' in qc_bits:
+            values, usable = _batch_prev_snwd(prev_snwd_val_cm,
+                                              prev_snwd_qc,
+                                              num_hrs_streak)
+            values = np.column_stack((values, snwd))
+            usable = np.column_stack((usable, snwd_ok))
+            max_val = np.max(np.where(usable, values, -np.inf), axis=1)
+            min_val = np.min(np.where(usable, values, np.inf), axis=1)
+            possible = (np.sum(usable, axis=1) >= 10) & \
+                       ~(max_val <= streak_value_threshold)
+            record('streak',
+                   max_val - min_val < streak_value_threshold,
+                   possible)
+
+        # Snow-temperature consistency check, relative to the latest usable
+        # previous value, with temperatures from that hour on.
+        if 'temperature_consistency' in qc_bits:
+            values, usable = _batch_prev_snwd(prev_snwd_val_cm,
+                                              prev_snwd_qc,
+                                              num_hrs_prev_tair)
+            ref = last_usable(usable)
+            ref_val = values[station_ind, ref]
+            tair_ok = ~np.ma.getmaskarray(prev_tair_val_deg_c)
+            tair = np.where(tair_ok,
+                            np.ma.getdata(prev_tair_val_deg_c),
+                            np.inf)
+            # Count and minimum of temperatures from each hour on.
+            tair_count = np.cumsum(tair_ok[:, ::-1], axis=1)[:, ::-1]
+            tair_min = np.minimum.accumulate(tair[:, ::-1], axis=1)[:, ::-1]
+            possible = usable.any(axis=1) & \
+                       (tair_count[station_ind, ref] >= 2)
+            record('temperature_consistency',
+                   ~(snwd_ok & (snwd <= ref_val)) &
+                   (tair_min[station_ind, ref] >= 7.0),
+                   possible,
+                   ref)
+
+        # Snowfall-snow depth consistency check, relative to the earliest
+        # usable previous value.
+        if 'snowfall_consistency' in qc_bits:
+            values, usable = _batch_prev_snwd(prev_snwd_val_cm,
+                                              prev_snwd_qc,
+                                              num_hrs_snowfall)
+            ref = first_usable(usable)
+            ref_val = values[station_ind, ref]
+            snfl = np.ma.getdata(snfl_val_cm)
+            record('snowfall_consistency',
+                   snwd_ok & (snwd - ref_val > snfl + 6.0),
+                   usable.any(axis=1) & ~np.ma.getmaskarray(snfl_val_cm),
+                   ref)
+
+        # Precipitation-snow depth consistency checks, relative to the
+        # earliest usable previous value.
+        if 'precip_consistency' in qc_bits or 'precip_ratio' in qc_bits:
+            values, usable = _batch_prev_snwd(prev_snwd_val_cm,
+                                              prev_snwd_qc,
+                                              num_hrs_prcp)
+            ref = first_usable(usable)
+            change = snwd - values[station_ind, ref]
+            prcp = np.ma.getdata(prcp_val_mm)
+            possible = usable.any(axis=1) & \
+                       ~np.ma.getmaskarray(prcp_val_mm)
+            if 'precip_consistency' in qc_bits:
+                record('precip_consistency',
+                       snwd_ok & (change >= 10.0) & (prcp < 0.1),
+                       possible,
+                       ref)
+            if 'precip_ratio' in qc_bits:
+                record('precip_ratio',
+                       snwd_ok & (prcp != 0.0) & (change >= 20.0) &
+                       (10.0 * change / prcp >= 100),
+                       possible,
+                       ref)
+
+    return {'flag': flag_bits,
+            'checked': checked_bits,
+            'ref_ind': ref_ind,
+            'qc_bits': dict(qc_bits),
+            'seconds': seconds}
+
+
+def qc_durre_snwd_scalar(snwd_val_cm,
+                         prev_snwd_val_cm,
+                         prev_snwd_qc,
+                         prev_tair_val_deg_c,
+                         snfl_val_cm,
+                         prcp_val_mm,
+                         qc_bits,
+                         num_hrs_wre=24,
+                         num_hrs_streak=15*24,
+                         num_hrs_prev_tair=24,
+                         num_hrs_snowfall=24,
+                         num_hrs_prcp=24,
+                         streak_value_threshold=None):
+    """
+    Reference for qc_durre_snwd_batch: the same inputs and results, but
+    calling the scalar test functions one station at a time, as main does.
+    """
+
+    num_hrs_prev_snwd = prev_snwd_val_cm.shape[1]
+    num_stations = len(snwd_val_cm)
+
+    flag_bits = np.zeros(num_stations, dtype=np.int64)
+    checked_bits = np.zeros(num_stations, dtype=np.int64)
+    ref_ind = {qc_test_name: np.full(num_stations, -1, dtype=np.int64)
+               for qc_test_name in SNWD_BATCH_TESTS[1:]
+               if qc_test_name != 'streak' and qc_test_name in qc_bits}
+
+    def record(si, qc_test_name, flag, test_ref_ind=None):
+        if flag is None:
+            return
+        bit = np.int64(1) << qc_bits[qc_test_name]
+        if flag:
+            flag_bits[si] |= bit
+        checked_bits[si] |= bit
+        if test_ref_ind is not None:
+            ref_ind[qc_test_name][si] = test_ref_ind
+
+    for si in range(num_stations):
+
+        site_snwd_val_cm = snwd_val_cm[si]
+        have_prev_snwd = \
+            not np.all(np.ma.getmaskarray(prev_snwd_val_cm[si]))
+        have_prev_tair = \
+            not np.all(np.ma.getmaskarray(prev_tair_val_deg_c[si]))
+        have_snfl = not np.ma.getmaskarray(snfl_val_cm)[si]
+        have_prcp = not np.ma.getmaskarray(prcp_val_mm)[si]
+
+        def window(num_hours):
+            prev_snwd_ti = num_hrs_prev_snwd - num_hours
+            return prev_snwd_val_cm[si, prev_snwd_ti:], \
+                   prev_snwd_qc[si, prev_snwd_ti:]
+
+        if 'world_record_exceedance' in qc_bits:
+            record(si, 'world_record_exceedance',
+                   qc_durre_snwd_wre(site_snwd_val_cm))
+
+        if not have_prev_snwd:
+            continue
+
+        if 'world_record_increase_exceedance' in qc_bits:
+            flag, si_ref_ind = \
+                qc_durre_snwd_change_wre(site_snwd_val_cm,
+                                         *window(num_hrs_wre))
+            record(si, 'world_record_increase_exceedance', flag, si_ref_ind)
+
+        if 'streak' in qc_bits:
+            record(si, 'streak',
+                   qc_durre_snwd_streak(site_snwd_val_cm,
+                                        *window(num_hrs_streak),
+                                        streak_value_threshold=
+                                        streak_value_threshold))
+
+        if 'temperature_consistency' in qc_bits and have_prev_tair:
+            flag, si_ref_ind = \
+                qc_durre_snwd_temp(site_snwd_val_cm,
+                                   *window(num_hrs_prev_tair),
+                                   prev_tair_val_deg_c[si, :])
+            record(si, 'temperature_consistency', flag, si_ref_ind)
+
+        if 'snowfall_consistency' in qc_bits and have_snfl:
+            flag, si_ref_ind = \
+                qc_durre_snwd_snfl(site_snwd_val_cm,
+                                   *window(num_hrs_snowfall),
+                                   snfl_val_cm[si])
+            record(si, 'snowfall_consistency', flag, si_ref_ind)
+
+        if 'precip_consistency' in qc_bits and have_prcp:
+            flag, si_ref_ind = \
+                qc_durre_snwd_prcp(site_snwd_val_cm,
+                                   *window(num_hrs_prcp),
+                                   prcp_val_mm[si])
+            record(si, 'precip_consistency', flag, si_ref_ind)
+
+        if 'precip_ratio' in qc_bits and have_prcp:
+            flag, si_ref_ind = \
+                qc_durre_snwd_prcp_ratio(site_snwd_val_cm,
+                                         *window(num_hrs_prcp),
+                                         prcp_val_mm[si])
+            record(si, 'precip_ratio', flag, si_ref_ind)
+
+    return {'flag': flag_bits,
+            'checked': checked_bits,
+            'ref_ind': ref_ind,
+            'qc_bits': dict(qc_bits)}
+
+
+def save_snwd_batch_inputs(file_path, batch_inputs):
+    """
+    Save the keyword arguments for one call to qc_durre_snwd_batch to an
+    .npz file, keeping the masks of masked arrays.
+    """
+    arrays = {}
+    for key, val in batch_inputs.items():
+        if key == 'qc_bits':
+            arrays['qc_bits_names'] = np.array(list(val.keys()))
+            arrays['qc_bits_bits'] = np.array(list(val.values()),
+                                              dtype=np.int64)
+        elif val is None:
+            continue
+        elif isinstance(val, np.ma.MaskedArray):
+            arrays[key + '_data'] = np.ma.getdata(val)
+            arrays[key + '_mask'] = np.ma.getmaskarray(val)
+        else:
+            arrays[key] = np.array(val)
+    np.savez_compressed(file_path, **arrays)
+
+
+def load_snwd_batch_inputs(file_path):
+    """
+    Read keyword arguments for qc_durre_snwd_batch saved by
+    save_snwd_batch_inputs.
+    """
+    batch_inputs = {}
+    with np.load(file_path) as npz:
+        for key in npz.files:
+            if key.endswith('_data'):
+                name = key[:-len('_data')]
+                batch_inputs[name] = \
+                    np.ma.masked_array(npz[key], mask=npz[name + '_mask'])
+            elif key.endswith('_mask'):
+                continue
+            elif key == 'qc_bits_names':
+                batch_inputs['qc_bits'] = \
+                    dict(zip(npz['qc_bits_names'].tolist(),
+                             npz['qc_bits_bits'].tolist()))
+            elif key == 'qc_bits_bits':
+                continue
+            else:
+                batch_inputs[key] = npz[key].item()
+    return batch_inputs
+
+
+def snwd_batch_result(batch, station_ind, qc_test_name):
+    """
+    Get the result of one test for one station from the output of
+    qc_durre_snwd_batch, in the form the scalar test function returns:
+    the flag (None if the test was not possible) and, for tests that use
+    one, the reference index (None if the test was not possible).
+    """
+    bit = 1 << batch['qc_bits'][qc_test_name]
+    if not batch['checked'][station_ind] & bit:
+        flag = None
+    else:
+        flag = bool(batch['flag'][station_ind] & bit)
+    if qc_test_name not in batch['ref_ind']:
+        return flag
+    if flag is None:
+        return None, None
+    return flag, int(batch['ref_ind'][qc_test_name][station_ind])
+
+
+def _gap_batch(values,
+               usable,
+               gap_threshold,
+               ref_ceiling=None,
+               ref_default=None):
+    """
+    Gap check for a [station, hour] array of time series (values), of which
+    only the elements identified by the boolean array usable are
+    considered. gap_threshold is a list of thresholds for each rate
+    category. ref_ceiling and ref_default are optional [station] arrays;
+    the reference value for a station is overridden where both are
+    available and its median exceeds ref_ceiling, as in qc_durre_snwd_gap.
+
+    Each row is sorted, and the differences between consecutive sorted
+    values above (below) the reference value are compared with the
+    threshold. The scalar tests do not advance the reference value past
+    the first difference that exceeds the threshold, so that value and all
+    values beyond it are flagged; here those are found with a cumulative
+    "first exceedance" mask.
+    """
+    num_stations, num_hours = values.shape
+
+    values = np.where(usable, values, np.nan)
+    rate_category = obs_rate_categories(~usable)
+    checked = rate_category >= 0
+
+    # Sort each row. Missing values are NaN, which sort to the end, as
+    # masked values do in np.ma.argsort.
+    sort_ind = np.argsort(values, axis=1)
+    obs_sorted = np.take_along_axis(values, sort_ind, axis=1)
+
+    # Median of usable values in each row, as calculated by np.ma.median.
+    count = np.count_nonzero(usable, axis=1)
+    rows = np.flatnonzero(count > 0)
+    low_ind = (count[rows] - 1) // 2
+    high_ind = count[rows] // 2
+    ref_obs_init = np.full(num_stations, np.nan, dtype=values.dtype)
+    ref_obs_init[rows] = (obs_sorted[rows, low_ind] +
+                          obs_sorted[rows, high_ind]) / 2.0
+    odd = (count[rows] % 2) == 1
+    ref_obs_init[rows[odd]] = obs_sorted[rows[odd], low_ind[odd]]
+
+    # Replace the median with the usable value nearest to ref_default
+    # (typically the climatological median) where the median exceeds
+    # ref_ceiling, in the same order as the scalar tests. A masked
+    # ref_ceiling never overrides the median. Where ref_default is masked,
+    # the scalar argmin of an all-masked difference picks the first
+    # element of the time series (for an unmasked NaN, the first usable
+    # element). If that element is not usable the reference value is
+    # np.ma.masked, which splits the time series at zero (its data value),
+    # and the first value on each side is never flagged (ref_masked).
+    ref_masked = np.zeros(num_stations, dtype=bool)
+    if ref_ceiling is not None and ref_default is not None:
+        ref_ceiling = np.ma.filled(np.ma.asarray(ref_ceiling,
+                                                 dtype=np.float64),
+                                   np.nan)
+        ref_default = np.ma.asarray(ref_default, dtype=np.float64)
+        default_masked = np.ma.getmaskarray(ref_default)
+        ref_default = np.ma.filled(ref_default, np.nan)
+        with np.errstate(invalid='ignore'):
+            override = np.flatnonzero(checked &
+                                      (ref_obs_init > ref_ceiling))
+        if len(override) > 0:
+            ind = np.where(usable[override],
+                           np.abs(values[override] -
+                                  ref_default[override, np.newaxis]),
+                           np.inf).argmin(axis=1)
+            no_default = np.isnan(ref_default[override])
+            ind[no_default] = usable[override[no_default]].argmax(axis=1)
+            ind[default_masked[override]] = 0
+            ref_obs_init[override] = values[override, ind]
+            masked_ref = override[default_masked[override] &
+                                  ~usable[override, 0]]
+            ref_masked[masked_ref] = True
+            ref_obs_init[masked_ref] = 0.0
+
+    threshold = np.full(num_stations, np.inf)
+    threshold[checked] = np.array(gap_threshold)[rate_category[checked]]
+    threshold = threshold[:, np.newaxis]
+    ref_obs_init = ref_obs_init[:, np.newaxis]
+    ref_masked = ref_masked[:, np.newaxis]
+
+    valid = ~np.isnan(obs_sorted)
+    with np.errstate(invalid='ignore'):
+        upper = valid & (obs_sorted >= ref_obs_init)
+        lower = valid & (obs_sorted < ref_obs_init)
+
+    # Upper gap check. Sorted values at and above the reference value
+    # occupy a contiguous block of each row, walked in ascending order;
+    # the first value in the block is compared with the reference value and
+    # the rest with the value before them.
+    prev_obs = np.empty_like(obs_sorted)
+    prev_obs[:, 0] = np.nan
+    prev_obs[:, 1:] = obs_sorted[:, :-1]
+    first = upper.copy()
+    first[:, 1:] &= ~upper[:, :-1]
+    prev_obs = np.where(first, ref_obs_init, prev_obs)
+    prev_obs = np.where(first & ref_masked, obs_sorted, prev_obs)
+    with np.errstate(invalid='ignore'):
+        exceed = upper & ((obs_sorted - prev_obs) > threshold)
+    upper_flag = upper & np.logical_or.accumulate(exceed, axis=1)
+    upper_first = exceed.argmax(axis=1)
+    ref_upper = prev_obs[np.arange(num_stations), upper_first]
+
+    # Lower gap check. Sorted values below the reference value are walked
+    # in descending order from the end of their block.
+    prev_obs = np.empty_like(obs_sorted)
+    prev_obs[:, -1] = np.nan
+    prev_obs[:, :-1] = obs_sorted[:, 1:]
+    last = lower.copy()
+    last[:, :-1] &= ~lower[:, 1:]
+    prev_obs = np.where(last, ref_obs_init, prev_obs)
+    prev_obs = np.where(last & ref_masked, obs_sorted, prev_obs)
+    with np.errstate(invalid='ignore'):
+        exceed = lower & ((prev_obs - obs_sorted) > threshold)
+    lower_flag = lower & \
+                 np.logical_or.accumulate(exceed[:, ::-1], axis=1)[:, ::-1]
+    lower_first = num_hours - 1 - exceed[:, ::-1].argmax(axis=1)
+    ref_lower = prev_obs[np.arange(num_stations), lower_first]
+
+    return {'checked': checked,
+            'rate_category': rate_category,
+            'sort_ind': sort_ind,
+            'upper_flag': upper_flag & checked[:, np.newaxis],
+            'lower_flag': lower_flag & checked[:, np.newaxis],
+            'ref_upper': ref_upper,
+            'ref_lower': ref_lower}
+
+
+def qc_durre_snwd_gap_batch(snwd_val_cm,
+                            prev_snwd_val_cm,
+                            prev_snwd_qc,
+                            num_hrs_gap=15*24,
+                            ref_ceiling_cm=None,
+                            ref_default_cm=None):
+    """
+    Array version of qc_durre_snwd_gap, performing the gap check for all
+    stations reporting snow depth in an hour at once.
+    snwd_val_cm - [station] snow depth values being QCed
+    prev_snwd_val_cm - [station, hour] previous snow depth values, ending
+                       the hour before snwd_val_cm
+    prev_snwd_qc - [station, hour] QC flags for prev_snwd_val_cm
+    num_hrs_gap - number of previous hours included in the check
+    ref_ceiling_cm, ref_default_cm - optional [station] arrays used to
+                                     override the median reference value
+                                     (see qc_durre_snwd_gap); stations where
+                                     either is masked are not overridden
+    Use gap_batch_result to get the result for one station.
+    """
+    gap_threshold_cm = [100.0,
+                        75.0,
+                        60.0,
+                        45.0,
+                        30.0]
+
+    values, usable = _batch_prev_snwd(prev_snwd_val_cm,
+                                      prev_snwd_qc,
+                                      num_hrs_gap)
+    values = np.concatenate((values,
+                             np.ma.getdata(snwd_val_cm)[:, np.newaxis]),
+                            axis=1)
+    usable = np.concatenate((usable,
+                             ~np.ma.getmaskarray(snwd_val_cm)[:, np.newaxis]),
+                            axis=1)
+
+    return _gap_batch(values,
+                      usable,
+                      gap_threshold_cm,
+                      ref_ceiling=ref_ceiling_cm,
+                      ref_default=ref_default_cm)
+
+
+def gap_batch_result(gap, station_ind):
+    """
+    Get the gap check result for one station from the output of
+    qc_durre_snwd_gap_batch, in the form qc_durre_snwd_gap returns: a list
+    of indices of flagged values in the time series (upper gap first, in
+    ascending order of value, then lower gap, in descending order) and a
+    list of the reference values they were compared with. Both are None if
+    the test was not possible.
+    """
+    if not gap['checked'][station_ind]:
+        return None, None
+    sort_ind = gap['sort_ind'][station_ind]
+    upper_oc = np.flatnonzero(gap['upper_flag'][station_ind])
+    lower_oc = np.flatnonzero(gap['lower_flag'][station_ind])[::-1]
+    ts_flag_ind = sort_ind[upper_oc].tolist() + sort_ind[lower_oc].tolist()
+    ref_obs = [gap['ref_upper'][station_ind]] * len(upper_oc) + \
+              [gap['ref_lower'][station_ind]] * len(lower_oc)
+    return ts_flag_ind, ref_obs
+
+
+class SharedBatchInputs:
+
+    """
+    Copies of the [station, ...] array inputs to the batch snow depth QC
+    tests for an hour in shared memory, so that worker processes can read
+    their partitions of stations without the arrays being pickled and
+    piped to them. Masked arrays are held as separate data and mask
+    blocks. The spec attribute identifies the blocks to
+    attach_shared_batch_inputs.
+    """
+
+    def __init__(self, arrays):
+
+        self._blocks = []
+        self.spec = {}
+        for name, array in arrays.items():
+            masked = np.ma.isMaskedArray(array)
+            parts = [np.ma.getdata(array)]
+            if masked:
+                parts.append(np.ma.getmaskarray(array))
+            part_spec = []
+            for part in parts:
+                block = shared_memory.SharedMemory(create=True,
+                                                   size=max(part.nbytes, 1))
+                self._blocks.append(block)
+                np.ndarray(part.shape, dtype=part.dtype,
+                           buffer=block.buf)[...] = part
+                part_spec.append((block.name, part.shape, part.dtype.str))
+            self.spec[name] = (masked, part_spec)
+
+    def close(self):
+
+        """
+        Release the shared memory blocks.
+        """
+
+        for block in self._blocks:
+            block.close()
+            block.unlink()
+        self._blocks = []
+
+
+def attach_shared_batch_inputs(spec, first_station, end_station):
+    """
+    Copy stations [first_station:end_station] of the arrays described by
+    the spec of a SharedBatchInputs out of shared memory. Returns a
+    dictionary of arrays keyed by input name.
+    """
+    arrays = {}
+    for name, (masked, part_spec) in spec.items():
+        parts = []
+        for block_name, shape, dtype in part_spec:
+            # The creating process owns the block. Before Python 3.13,
+            # attaching registers it with the resource tracker too, which
+            # would unlink it (with warnings) when this process exits.
+            try:
+                block = shared_memory.SharedMemory(name=block_name,
+                                                   track=False)
+            except TypeError:
+                block = shared_memory.SharedMemory(name=block_name)
+                resource_tracker.unregister(block._name, 'shared_memory')
+            parts.append(np.array(np.ndarray(shape,
+                                             dtype=np.dtype(dtype),
+                                             buffer=block.buf)
+                                  [first_station:end_station]))
+            block.close()
+        if masked:
+            arrays[name] = np.ma.masked_array(parts[0], mask=parts[1])
+        else:
+            arrays[name] = parts[0]
+    return arrays
+
+
+def _snwd_batch_partition(spec,
+                          first_station,
+                          end_station,
+                          batch_kwargs,
+                          gap_kwargs):
+    """
+    Run qc_durre_snwd_batch and qc_durre_snwd_gap_batch for one partition
+    of stations in a worker process. See qc_durre_snwd_batch_parallel.
+    """
+    arrays = attach_shared_batch_inputs(spec, first_station, end_station)
+    batch = qc_durre_snwd_batch(snwd_val_cm=arrays['snwd_val_cm'],
+                                prev_snwd_val_cm=arrays['prev_snwd_val_cm'],
+                                prev_snwd_qc=arrays['prev_snwd_qc'],
+                                prev_tair_val_deg_c=
+                                arrays['prev_tair_val_deg_c'],
+                                snfl_val_cm=arrays['snfl_val_cm'],
+                                prcp_val_mm=arrays['prcp_val_mm'],
+                                **batch_kwargs)
+    t1 = time.perf_counter()
+    gap = qc_durre_snwd_gap_batch(arrays['snwd_val_cm'],
+                                  arrays['prev_snwd_val_cm'],
+                                  arrays['prev_snwd_qc'],
+                                  ref_ceiling_cm=
+                                  arrays.get('ref_ceiling_cm'),
+                                  ref_default_cm=
+                                  arrays.get('ref_default_cm'),
+                                  **gap_kwargs)
+    batch['seconds']['gap'] = time.perf_counter() - t1
+    return batch, gap
+
+
+def qc_durre_snwd_batch_parallel(pool,
+                                 num_partitions,
+                                 batch_inputs,
+                                 num_hrs_gap=15*24,
+                                 ref_ceiling_cm=None,
+                                 ref_default_cm=None,
+                                 min_partition_stations=500):
+    """
+    Run qc_durre_snwd_batch (with the arguments in the batch_inputs
+    dictionary) and qc_durre_snwd_gap_batch for all stations reporting
+    snow depth in an hour, with the stations split into up to
+    num_partitions contiguous partitions of at least
+    min_partition_stations stations each, processed by the
+    multiprocessing pool (pool). Every test depends only on the data for
+    the station it is applied to, and the results for each partition are
+    concatenated in station order, so both results are identical to
+    those of the serial functions. Returns the two results; the "seconds"
+    of the first (including "gap", for the gap check) are summed over
+    worker processes.
+    """
+
+    array_names = ['snwd_val_cm',
+                   'prev_snwd_val_cm',
+                   'prev_snwd_qc',
+                   'prev_tair_val_deg_c',
+                   'snfl_val_cm',
+                   'prcp_val_mm']
+    batch_kwargs = {key: value for key, value in batch_inputs.items()
+                    if key not in array_names}
+    gap_kwargs = {'num_hrs_gap': num_hrs_gap}
+
+    num_stations = len(batch_inputs['snwd_val_cm'])
+    num_partitions = min(num_partitions,
+                         num_stations // max(min_partition_stations, 1))
+    if pool is None or num_partitions < 2:
+        batch = qc_durre_snwd_batch(**batch_inputs)
+        t1 = time.perf_counter()
+        gap = qc_durre_snwd_gap_batch(batch_inputs['snwd_val_cm'],
+                                      batch_inputs['prev_snwd_val_cm'],
+                                      batch_inputs['prev_snwd_qc'],
+                                      ref_ceiling_cm=ref_ceiling_cm,
+                                      ref_default_cm=ref_default_cm,
+                                      **gap_kwargs)
+        batch['seconds']['gap'] = time.perf_counter() - t1
+        return batch, gap
+
+    arrays = {name: batch_inputs[name] for name in array_names}
+    if ref_ceiling_cm is not None and ref_default_cm is not None:
+        arrays['ref_ceiling_cm'] = ref_ceiling_cm
+        arrays['ref_default_cm'] = ref_default_cm
+
+    bounds = np.linspace(0, num_stations, num_partitions + 1).astype(int)
+    shared = SharedBatchInputs(arrays)
+    try:
+        results = pool.starmap(_snwd_batch_partition,
+                               [(shared.spec,
+                                 int(bounds[part]),
+                                 int(bounds[part + 1]),
+                                 batch_kwargs,
+                                 gap_kwargs)
+                                for part in range(num_partitions)])
+    finally:
+        shared.close()
+
+    # Merge partitions in station order.
+    batch_parts = [batch for batch, gap in results]
+    gap_parts = [gap for batch, gap in results]
+    batch = {'flag': np.concatenate([part['flag']
+                                     for part in batch_parts]),
+             'checked': np.concatenate([part['checked']
+                                        for part in batch_parts]),
+             'ref_ind': {qc_test_name:
+                         np.concatenate([part['ref_ind'][qc_test_name]
+                                         for part in batch_parts])
+                         for qc_test_name in batch_parts[0]['ref_ind']},
+             'qc_bits': batch_parts[0]['qc_bits'],
+             'seconds': {qc_test_name:
+                         sum(part['seconds'][qc_test_name]
+                             for part in batch_parts)
+                         for qc_test_name in batch_parts[0]['seconds']}}
+    gap = {key: np.concatenate([part[key] for part in gap_parts])
+           for key in gap_parts[0]}
+
+    return batch, gap
+
+
 def qc_durre_swe_wre(value_mm):
     """
     Basic integrity checks:
@@ -1306,6 +3468,176 @@ def qc_durre_swe_prcp_ratio(site_swe_val_mm,
     else:
         return False, ref_ind
 
+# SWE tests evaluated by qc_durre_swe_batch. There are no SWE versions of
+# the temperature, snowfall or spatial consistency tests.
+SWE_BATCH_TESTS = ['world_record_exceedance',
+                   'world_record_increase_exceedance',
+                   'streak',
+                   'precip_consistency',
+                   'precip_ratio']
+
+
+def qc_durre_swe_batch(swe_val_mm,
+                       prev_swe_val_mm,
+                       prev_swe_qc,
+                       prcp_val_mm,
+                       qc_bits,
+                       num_hrs_wre=24,
+                       num_hrs_streak=15*24,
+                       num_hrs_prcp=24,
+                       streak_value_threshold=None):
+    """
+    Array-at-a-time versions of qc_durre_swe_wre, qc_durre_swe_change_wre,
+    qc_durre_swe_streak, qc_durre_swe_prcp and qc_durre_swe_prcp_ratio,
+    evaluated for all stations reporting SWE in an hour at once.
+    swe_val_mm - [station] SWE values being QCed
+    prev_swe_val_mm - [station, hour] previous SWE values, ending the hour
+                      before swe_val_mm (fully masked for stations with no
+                      previous data)
+    prev_swe_qc - [station, hour] QC flags for prev_swe_val_mm
+    prcp_val_mm - [station] precipitation accumulation (masked for
+                  stations with no precipitation report)
+    qc_bits - dictionary of QC bits for the tests to perform, keyed by the
+              names in SWE_BATCH_TESTS
+
+    Returns a dictionary in the form qc_durre_snwd_batch returns, including
+    "seconds" (use snwd_batch_result to get the result for one station).
+    """
+
+    if streak_value_threshold is None:
+        streak_value_threshold = 0.1
+
+    swe_ok = ~np.ma.getmaskarray(swe_val_mm)
+    swe = np.ma.getdata(swe_val_mm)
+    num_stations = len(swe)
+    station_ind = np.arange(num_stations)
+
+    flag_bits = np.zeros(num_stations, dtype=np.int64)
+    checked_bits = np.zeros(num_stations, dtype=np.int64)
+    ref_ind = {}
+    seconds = {}
+    test_start = time.perf_counter()
+
+    def record(qc_test_name, flag, checked, test_ref_ind=None):
+        nonlocal test_start
+        bit = np.int64(1) << qc_bits[qc_test_name]
+        flag_bits[flag & checked] |= bit
+        checked_bits[checked] |= bit
+        if test_ref_ind is not None:
+            ref_ind[qc_test_name] = np.where(checked, test_ref_ind, -1)
+        test_end = time.perf_counter()
+        seconds[qc_test_name] = test_end - test_start
+        test_start = test_end
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+
+        # SWE world record exceedance.
+        if 'world_record_exceedance' in qc_bits:
+            record('world_record_exceedance',
+                   swe_ok & ((swe < 0.0) | (swe > 1146.0)),
+                   np.ones(num_stations, dtype=bool))
+
+        # SWE increase world record exceedance, relative to the minimum
+        # usable previous value (first one, for ties).
+        if 'world_record_increase_exceedance' in qc_bits:
+            values, usable = _batch_prev_snwd(prev_swe_val_mm,
+                                              prev_swe_qc,
+                                              num_hrs_wre)
+            ref = np.argmin(np.where(usable, values, np.inf), axis=1)
+            ref_val = values[station_ind, ref]
+            record('world_record_increase_exceedance',
+                   swe_ok & (swe - ref_val > 192.5),
+                   usable.any(axis=1),
+                   ref)
+
+        # Streak check, on previous and current values together.
+        if 'streak' in qc_bits:
+            values, usable = _batch_prev_snwd(prev_swe_val_mm,
+                                              prev_swe_qc,
+                                              num_hrs_streak)
+            values = np.column_stack((values, swe))
+            usable = np.column_stack((usable, swe_ok))
+            max_val = np.max(np.where(usable, values, -np.inf), axis=1)
+            min_val = np.min(np.where(usable, values, np.inf), axis=1)
+            possible = (np.sum(usable, axis=1) >= 10) & \
+                       ~(max_val <= streak_value_threshold)
+            record('streak',
+                   max_val - min_val < streak_value_threshold,
+                   possible)
+
+        # Precipitation-SWE consistency checks, relative to the earliest
+        # usable previous value.
+        if 'precip_consistency' in qc_bits or 'precip_ratio' in qc_bits:
+            values, usable = _batch_prev_snwd(prev_swe_val_mm,
+                                              prev_swe_qc,
+                                              num_hrs_prcp)
+            ref = np.argmax(usable, axis=1)
+            change = swe - values[station_ind, ref]
+            prcp = np.ma.getdata(prcp_val_mm)
+            possible = usable.any(axis=1) & \
+                       ~np.ma.getmaskarray(prcp_val_mm)
+            if 'precip_consistency' in qc_bits:
+                record('precip_consistency',
+                       swe_ok & (change >= 10.0) & (prcp < 0.1),
+                       possible,
+                       ref)
+            if 'precip_ratio' in qc_bits:
+                record('precip_ratio',
+                       swe_ok & (prcp != 0.0) & (change >= 20.0) &
+                       (change / prcp >= 100),
+                       possible,
+                       ref)
+
+    return {'flag': flag_bits,
+            'checked': checked_bits,
+            'ref_ind': ref_ind,
+            'qc_bits': dict(qc_bits),
+            'seconds': seconds}
+
+
+def qc_durre_swe_gap_batch(swe_val_mm,
+                           prev_swe_val_mm,
+                           prev_swe_qc,
+                           num_hrs_gap=15*24):
+    """
+    Array version of qc_durre_swe_gap, performing the gap check for all
+    stations reporting SWE in an hour at once. Arguments are as for
+    qc_durre_snwd_gap_batch, and so is the result (use gap_batch_result to
+    get the result for one station).
+    """
+    gap_threshold_mm = [100.0,
+                        75.0,
+                        60.0,
+                        45.0,
+                        30.0]
+
+    values, usable = _batch_prev_snwd(prev_swe_val_mm,
+                                      prev_swe_qc,
+                                      num_hrs_gap)
+    values = np.concatenate((values,
+                             np.ma.getdata(swe_val_mm)[:, np.newaxis]),
+                            axis=1)
+    usable = np.concatenate((usable,
+                             ~np.ma.getmaskarray(swe_val_mm)[:, np.newaxis]),
+                            axis=1)
+
+    return _gap_batch(values, usable, gap_threshold_mm)
+
+
+def gap_batch_flags(gap):
+    """
+    Get the gap check results of _gap_batch as a [station, hour] boolean
+    array identifying the flagged elements of each time series (in time
+    order, rather than the sorted order of the upper_flag and lower_flag
+    arrays).
+    """
+    flagged = np.zeros(gap['sort_ind'].shape, dtype=bool)
+    np.put_along_axis(flagged,
+                      gap['sort_ind'],
+                      gap['upper_flag'] | gap['lower_flag'],
+                      axis=1)
+    return flagged
+
 
 def parse_args():
     """
@@ -1357,12 +3689,78 @@ def parse_args():
                         help='Set directory for reading and writing .pkl ' + \
                              'files generated by observational database ' + \
                              'queries; default={}.'.format(default_pkl_dir))
+    parser.add_argument('-f', '--prefetch_depth',
+                        type=int,
+                        metavar='# of hours',
+                        default=2,
+                        help='Set the number of hours of observations ' +
+                             '(and climatology) to fetch in the ' +
+                             'background while the current hour is ' +
+                             'quality controlled; 0 disables ' +
+                             'prefetching; default=2.')
+    parser.add_argument('-w', '--window_refresh_days',
+                        type=int,
+                        metavar='# of days',
+                        default=wdb0.LATE_OBS_DAYS,
+                        help='Fetch previous hours of snow depth, air ' +
+                             'temperature and SWE observations within ' +
+                             'this many days of real time again each ' +
+                             'hour, to pick up observations that arrive ' +
+                             'late; 0 fetches only new hours; ' +
+                             'default={}.'.format(wdb0.LATE_OBS_DAYS))
+    parser.add_argument('-r', '--record_qc_dir',
+                        type=str,
+                        metavar='dir',
+                        help='Save the inputs to the batch snow depth QC ' +
+                             'tests for each hour in this directory, for ' +
+                             'use by verify_snwd_qc_batch.py.')
+    parser.add_argument('-j', '--num_workers',
+                        type=int,
+                        metavar='# of processes',
+                        default=1,
+                        help='Split the stations reporting each hour ' +
+                             'among this many worker processes for the ' +
+                             'batch snow depth QC tests; results are ' +
+                             'identical to those of a single process, ' +
+                             'which is the default.')
+    parser.add_argument('-t', '--profile_file',
+                        type=str,
+                        metavar='file',
+                        help='Write the time taken, number of calls and ' +
+                             'number of stations processed by each ' +
+                             'phase of the update (observation fetches, ' +
+                             'climatology sampling, neighbor search, ' +
+                             'each QC test, QC database reads and ' +
+                             'writes, and commits) to this file, as one ' +
+                             'JSON line per hour and a summary line for ' +
+                             'the run.')
     parser.add_argument('-v', '--verbose',
                         action='store_true',
                         help='Provide verbose output.')
 
     args = parser.parse_args()
 
+    if args.num_workers < 1:
+        print('ERROR: --num_workers argument must be positive.',
+              file=sys.stderr)
+        sys.exit(1)
+
+    if args.num_workers > 1 and shared_memory is None:
+        print('ERROR: --num_workers requires Python 3.8 or later.',
+              file=sys.stderr)
+        sys.exit(1)
+
+    if args.prefetch_depth < 0:
+        print('ERROR: --prefetch_depth argument must be nonnegative.',
+              file=sys.stderr)
+        sys.exit(1)
+
+    if args.window_refresh_days < 0:
+        print('ERROR: --window_refresh_days argument must be ' +
+              'nonnegative.',
+              file=sys.stderr)
+        sys.exit(1)
+
     if args.min_days_latency < 0:
         print('ERROR: --min_days_latency argument must be nonnegative.',
               format=sys.stderr)
@@ -1380,6 +3778,19 @@ def parse_args():
                                     os.strerror(errno.ENOENT),
                                     args.pkl_dir)
 
+    if args.record_qc_dir is not None:
+        if not os.path.isdir(args.record_qc_dir):
+            raise FileNotFoundError(errno.ENOENT,
+                                    os.strerror(errno.ENOENT),
+                                    args.record_qc_dir)
+
+    if args.profile_file is not None:
+        profile_dir = os.path.dirname(os.path.abspath(args.profile_file))
+        if not os.path.isdir(profile_dir):
+            raise FileNotFoundError(errno.ENOENT,
+                                    os.strerror(errno.ENOENT),
+                                    profile_dir)
+
     return args
 
 
@@ -1400,6 +3811,10 @@ def main():
               file=sys.stderr)
         exit(1)
 
+    # Profile the phases of the update (see QCProfiler), writing them to
+    # the profile file if requested and summarizing them if verbose.
+    profiler = QCProfiler(args.profile_file, enabled=args.verbose)
+
     # Set configuration parameters.
 
     # Temporary file storage for observations read from the web database
@@ -1410,37 +3825,49 @@ def main():
     # sys.exit(1)
     # pkl_dir = '/net/scratch/{}'.format(os.getlogin())
 
-    # Copy the QC database.
-    temp_database_path = station_qc_db_copy(args.database_path,
-                                            verbose=args.verbose)
-
     # Set the commit period in hours. This is the number of hours updated
-    # before a "commit" is performed by copying the temp_database_path back
-    # over to args.database_path and generating a new temporary database
-    # copy.
+    # before a "commit" is performed. Changes are made to the QC database in
+    # place, but are recorded in a journal and only written to the database
+    # when they are committed (see QCJournal).
     database_commit_period = 3
 
+    # Lock the QC database for updating.
+    try:
+        journal = QCJournal(args.database_path)
+    except OSError:
+        print('ERROR: QC database {} '.format(args.database_path) +
+              'is locked by another update.',
+              file=sys.stderr)
+        exit(1)
+
     # Open the QC database.
     try:
-        qcdb = Dataset(temp_database_path, 'r+')
+        qcdb = Dataset(args.database_path, 'r+')
     except:
         print('ERROR: Failed to open QC database {}.'
-              .format(temp_database_path),
+              .format(args.database_path),
               file=sys.stderr)
         exit(1)
 
+    # Finish any commit interrupted by a previous update.
+    num_recovered = journal.recover(qcdb)
+    if num_recovered > 0:
+        print('INFO: recovered {} interrupted commits '.
+              format(num_recovered) +
+              'from {}.'.format(journal.journal_path))
+
     # Read the time variable.
     try:
         qcdb_var_time = qcdb.variables['time']
     except:
-        print('ERROR: Database file {} '.format(temp_database_path) +
+        print('ERROR: Database file {} '.format(args.database_path) +
               'has no "time" variable.',
               file=sys.stderr)
         qcdb.close()
         exit(1)
     if (len(qcdb_var_time.dimensions) != 1 or
         qcdb_var_time.dimensions[0] != 'time'):
-        print('ERROR: Database file {} '.format(temp_database_path) +
+        print('ERROR: Database file {} '.format(args.database_path) +
               '"time" variable has unexpected structure.',
               file=sys.stderr)
         qcdb.close()
@@ -1448,7 +3875,7 @@ def main():
     try:
         qcdb_var_time_units = qcdb_var_time.getncattr('units')
     except:
-        print('ERROR: Database file {} '.format(temp_database_path) +
+        print('ERROR: Database file {} '.format(args.database_path) +
               '"time" variable has no "units" attribute.',
               file=sys.stderr)
         qcdb.close()
@@ -1460,14 +3887,14 @@ def main():
     try:
         qcdb_var_station_obj_id = qcdb.variables['station_obj_identifier']
     except:
-        print('ERROR: Database file {} '.format(temp_database_path) +
+        print('ERROR: Database file {} '.format(args.database_path) +
               'has no "station_obj_identifier" variable.',
               file=sys.stderr)
         qcdb.close()
         exit(1)
     if (len(qcdb_var_station_obj_id.dimensions) != 1 or
         qcdb_var_station_obj_id.dimensions[0] != 'station'):
-        print('ERROR: Database file {} '.format(temp_database_path) +
+        print('ERROR: Database file {} '.format(args.database_path) +
               '"station_obj_identifier" variable has unexpected structure.',
               file=sys.stderr)
         qcdb.close()
@@ -1483,7 +3910,7 @@ def main():
     try:
         last_dt_updated_str = qcdb.getncattr('last_datetime_updated')
     except:
-        print('ERROR: Database file {} '.format(temp_database_path) +
+        print('ERROR: Database file {} '.format(args.database_path) +
               'has no "last_datetime_updated" attribute.',
               file=sys.stderr)
         qcdb.close()
@@ -1522,15 +3949,46 @@ def main():
         #                    'date,val_cm,ob_med_val_cm,ref_val_cm,' +
         #                    'cl_med_val_cm,cl_max_val_cm,cl_iqr_val_cm\n')
 
-    qcdb_snwd_qc_flag = qcdb.variables['snow_depth_qc']
-    qcdb_snwd_qc_chkd = qcdb.variables['snow_depth_qc_checked']
+    qcdb_snwd_qc_flag_var = qcdb.variables['snow_depth_qc']
+    qcdb_snwd_qc_chkd_var = qcdb.variables['snow_depth_qc_checked']
+
+    # SWE is quality controlled along with snow depth if the QC database has
+    # SWE QC variables (older ones do not).
+    if 'swe_qc' in qcdb.variables and 'swe_qc_checked' in qcdb.variables:
+        qcdb_swe_qc_flag_var = qcdb.variables['swe_qc']
+        qcdb_swe_qc_chkd_var = qcdb.variables['swe_qc_checked']
+        swe_qc_test_names = qcdb_swe_qc_flag_var.getncattr('qc_test_names')
+        swe_qc_test_bits = qcdb_swe_qc_flag_var.getncattr('qc_test_bits')
+        if list(qcdb_swe_qc_chkd_var.getncattr('qc_test_names')) != \
+           list(swe_qc_test_names) or \
+           list(qcdb_swe_qc_chkd_var.getncattr('qc_test_bits')) != \
+           list(swe_qc_test_bits):
+            print('ERROR: inconsistent SWE qc_test_names/qc_test_bits ' +
+                  'data in QC database.',
+                  file=sys.stderr)
+            qcdb.close()
+            exit(1)
+        swe_batch_qc_bits = {}
+        for qc_test_name in SWE_BATCH_TESTS + ['gap']:
+            if qc_test_name in swe_qc_test_names:
+                swe_batch_qc_bits[qc_test_name] = \
+                    int(swe_qc_test_bits[swe_qc_test_names.
+                                         index(qc_test_name)])
+        swe_gap_qc_bit = swe_batch_qc_bits.pop('gap', None)
+    else:
+        qcdb_swe_qc_flag_var = None
+        qcdb_swe_qc_chkd_var = None
+        if args.verbose:
+            print('INFO: {} has no SWE QC variables; '.
+                  format(args.database_path) +
+                  'only snow depth will be quality controlled.')
 
     # Read the "last_station_update_datetime" attribute.
     try:
         last_station_update_str = \
             qcdb.getncattr('last_station_update_datetime')
     except:
-        print('ERROR: Database file {} '.format(temp_database_path) +
+        print('ERROR: Database file {} '.format(args.database_path) +
               'has no "last_station_update_datetime" attribute.',
               file=sys.stderr)
         qcdb.close()
@@ -1567,7 +4025,7 @@ def main():
     if len(qcdb_update_time_ind) == 0:
         if args.verbose:
             print('INFO: no dates to update in {}.'.
-                  format(temp_database_path))
+                  format(args.database_path))
         qcdb.close()
         sys.exit(0)
 
@@ -1593,14 +4051,14 @@ def main():
     try:
         qcdb_num_stations = qcdb.dimensions['station'].size
     except:
-        print('ERROR: Database file {} '.format(temp_database_path) +
+        print('ERROR: Database file {} '.format(args.database_path) +
               'has no "station" dimension.',
               file=sys.stderr)
         qcdb.close()
         exit(1)
     if args.verbose:
         print('INFO: QC database {} has {} stations.'.
-              format(temp_database_path, qcdb_num_stations))
+              format(args.database_path, qcdb_num_stations))
 
     # Get all qcdb variables along the station dimension that have a
     # "allstation_column_name" attribute.
@@ -1647,21 +4105,21 @@ def main():
             wdb_col_list_str = wdb_col_list_str + ', ' + allstation_column_name
         wdb_col_list.append(allstation_column_name)
     if obj_id_found is False:
-        print('ERROR: No variable in {}'.format(temp_database_path) + 
+        print('ERROR: No variable in {}'.format(args.database_path) + 
               ' using the "station" dimension has an ' +
               '"allstation_column_name" attribute of "obj_identifier".',
               file=sys.stderr)
         qcdb.close()
         exit(1)
     if qcdb_lon_var is None:
-        print('ERROR: No variable in {}'.format(temp_database_path) + 
+        print('ERROR: No variable in {}'.format(args.database_path) + 
               ' using the "station" dimension has an ' +
               '"allstation_column_name" attribute of "longitude".',
               file=sys.stderr)
         qcdb.close()
         exit(1)
     if qcdb_lat_var is None:
-        print('ERROR: No variable in {}'.format(temp_database_path) + 
+        print('ERROR: No variable in {}'.format(args.database_path) + 
               ' using the "station" dimension has an ' +
               '"allstation_column_name" attribute of "latitude".',
               file=sys.stderr)
@@ -1676,7 +4134,7 @@ def main():
         else:
             note = ''
         print('INFO: {} station metadata last updated {}'.
-              format(temp_database_path, last_station_update_str) + note)
+              format(args.database_path, last_station_update_str) + note)
 
     time_since_metadata_update = \
         current_update_datetime - last_station_update_datetime
@@ -1686,13 +4144,17 @@ def main():
        (hours_since_metadata_update >= args.metadata_update_interval_hours):
         if args.verbose:
             print('INFO: updating station metadata.')
-        update_qc_db_metadata(qcdb,
-                              qcdb_obj_id_var,
-                              qcdb_lon_var,
-                              qcdb_lat_var,
-                              qcdb_station_vars,
-                              wdb_col_list,
-                              verbose=args.verbose)
+        with profiler.section('metadata_update',
+                              rows=qcdb_obj_id_var.size):
+            update_qc_db_metadata(qcdb,
+                                  qcdb_obj_id_var,
+                                  qcdb_lon_var,
+                                  qcdb_lat_var,
+                                  qcdb_station_vars,
+                                  wdb_col_list,
+                                  verbose=args.verbose,
+                                  journal=journal)
+            journal.commit(qcdb)
     # else:
     #     print('time since metadata update:')
     #     print(time_since_metadata_update)
@@ -1708,6 +4170,79 @@ def main():
     num_hrs_snowfall = 24
     num_hrs_prcp = 24
 
+    # Previous snow depth data is needed for multiple tests.
+    # - World record increase exceedance check uses 24 hours.
+    # - Streak check uses 15 days.
+    # - Gap check uses 15 days.
+    # - Temperature consistency checks use 24 hours.
+    # - Snowfall consistency check uses 24 hours.
+    # - Precipitation consistency checks use 24 hours.
+    num_hrs_prev_snwd = max(num_hrs_wre,
+                            num_hrs_streak,
+                            num_hrs_gap,
+                            num_hrs_prev_tair,
+                            num_hrs_snowfall,
+                            num_hrs_prcp)
+
+    # SWE tests use the same periods, but there are no SWE temperature or
+    # snowfall consistency tests.
+    num_hrs_prev_swe = max(num_hrs_wre,
+                           num_hrs_streak,
+                           num_hrs_gap,
+                           num_hrs_prcp)
+
+    # Previous snow depth and air temperature observations are kept in
+    # sliding windows, so that moving from one hour to the next only
+    # fetches one new hour of data rather than the entire window. Both
+    # windows include the current hour, which comes from get_qc_bundle.
+    # Hours within window_refresh_days of real time are fetched again each
+    # hour, to pick up late observations as a query for the whole window
+    # would.
+    prev_snwd_window = \
+        wdb0.ObsWindow(lambda begin_datetime, end_datetime:
+                       wdb0.get_snow_depth_obs(begin_datetime,
+                                               end_datetime,
+                                               scratch_dir=args.pkl_dir,
+                                               verbose=args.verbose),
+                       num_hrs_prev_snwd + 1,
+                       'values_cm',
+                       refresh_days=args.window_refresh_days)
+    prev_tair_window = \
+        wdb0.ObsWindow(lambda begin_datetime, end_datetime:
+                       wdb0.get_air_temp_obs(begin_datetime,
+                                             end_datetime,
+                                             scratch_dir=args.pkl_dir,
+                                             verbose=args.verbose),
+                       num_hrs_prev_tair + 1,
+                       'values_deg_c',
+                       refresh_days=args.window_refresh_days)
+    prev_swe_window = \
+        wdb0.ObsWindow(lambda begin_datetime, end_datetime:
+                       wdb0.get_swe_obs(begin_datetime,
+                                        end_datetime,
+                                        scratch_dir=args.pkl_dir,
+                                        verbose=args.verbose),
+                       num_hrs_prev_swe + 1,
+                       'values_mm',
+                       refresh_days=args.window_refresh_days)
+
+    # Neighborhood parameters for air temperature neighbors of snow depth
+    # stations. The neighbor graph is kept from hour to hour (and from run
+    # to run, in the pkl_dir), and only patched where stations come and go.
+    neighborhood_radius_km = 75.0
+    min_tair_neighbors = 3
+    max_tair_neighbors = 7
+    tair_neighbor_cache = NeighborGraphCache(neighborhood_radius_km,
+                                             min_tair_neighbors,
+                                             max_tair_neighbors,
+                                             cache_dir=args.pkl_dir,
+                                             verbose=args.verbose)
+
+    # Index QC database stations by object identifier. The index is kept
+    # up to date as stations are added, so the obj_identifier variable is
+    # only read once.
+    qcdb_station_index = StationIndex(qcdb_obj_id_var[:])
+
     streak_value_threshold = 0.1
 
     # Switch for flagging low values in tests involving snow depth change.
@@ -1729,10 +4264,94 @@ def main():
     num_flagged_sd_sf_cons = 0
     num_flagged_sd_pr_cons = 0
     num_flagged_sd_at_spatial_cons = 0
+    num_flagged_swe = {qc_test_name: 0
+                       for qc_test_name in SWE_BATCH_TESTS + ['gap']}
 
     num_hrs_updated = 0
     qcdb_num_stations_start = 0
 
+    def fetch_qc_hour(obs_datetime):
+
+        """
+        Get all snow depth data for obs_datetime, along with snowfall and
+        precipitation data associated with snow depth observations and the
+        latest hour of air temperature data, in one query, and all SWE data
+        for obs_datetime, and sample the SNODAS climatology at the snow
+        depth stations. This runs in the prefetch thread, so it must not
+        touch the QC database.
+        """
+
+        hour_inputs = {}
+
+        t1 = time.perf_counter()
+        hour_inputs['bundle'] = \
+            wdb0.get_qc_bundle(obs_datetime,
+                               num_hrs_snowfall=num_hrs_snowfall,
+                               num_hrs_prcp=num_hrs_prcp,
+                               scratch_dir=args.pkl_dir,
+                               verbose=args.verbose)
+        hour_inputs['bundle_seconds'] = time.perf_counter() - t1
+        if qcdb_swe_qc_flag_var is not None:
+            hour_inputs['swe'] = wdb0.get_swe_obs(obs_datetime,
+                                                  obs_datetime,
+                                                  scratch_dir=args.pkl_dir,
+                                                  verbose=args.verbose)
+        t2 = time.perf_counter()
+        hour_inputs['fetch_seconds'] = t2 - t1
+
+        if args.check_climatology:
+
+            # Get SNODAS climatology data for this time.
+            wdb_snwd = hour_inputs['bundle']['snow_depth']
+            for metric in ['median', 'max', 'iqr']:
+                hour_inputs['clim_' + metric + '_mm'] = \
+                    snodas_clim.at_loc(sd_clim_dir,
+                                       obs_datetime,
+                                       wdb_snwd['station_lon'],
+                                       wdb_snwd['station_lat'],
+                                       element='snow_depth',
+                                       metric=metric,
+                                       sampling='neighbor')
+        hour_inputs['clim_seconds'] = time.perf_counter() - t2
+
+        return(hour_inputs)
+
+    # Times to update, in the order they will be processed.
+    update_datetime_list = \
+        [num2date(qcdb_var_time[qcdb_ti], qcdb_var_time_units)
+         for qcdb_ti in qcdb_update_time_ind]
+    if args.max_update_hours is not None:
+        update_datetime_list = \
+            update_datetime_list[0:args.max_update_hours]
+
+    # Start the worker processes for the batch QC tests before the prefetch
+    # thread, so that they are not forked from a multithreaded process.
+    if args.num_workers > 1:
+        qc_pool = multiprocessing.Pool(args.num_workers)
+        if args.verbose:
+            print('INFO: running batch QC tests in {} worker processes.'.
+                  format(args.num_workers))
+    else:
+        qc_pool = None
+
+    # Fetch observations and climatology for upcoming hours in the
+    # background while the current hour is quality controlled.
+    prefetcher = QCPrefetcher(fetch_qc_hour,
+                              update_datetime_list,
+                              depth=args.prefetch_depth)
+    if args.verbose:
+        print('INFO: prefetching up to {} hours ahead.'.
+              format(args.prefetch_depth))
+
+    # Counts of QC flag element accesses handled in memory by QCFlagWindow,
+    # each of which would otherwise read (and for writes, also write) a
+    # chunk of a QC flag variable, and of chunks read and written instead
+    # (by the windows and by journal commits).
+    qc_window_io = {'element_reads': 0,
+                    'element_writes': 0,
+                    'chunk_reads': 0,
+                    'chunk_writes': 0}
+
     ##################################
     # Loop over all times to update. #
     ##################################
@@ -1743,69 +4362,51 @@ def main():
         if args.verbose:
             print('INFO: updating data for {}'.format(obs_datetime))
 
-        # Get all snow depth data for this datetime.
-        t1 = dt.datetime.utcnow()
-        wdb_snwd = wdb0.get_snow_depth_obs(obs_datetime,
-                                                 obs_datetime,
-                                                 scratch_dir=args.pkl_dir,
-                                                 verbose=args.verbose)
-        t2 = dt.datetime.utcnow()
-        elapsed_time = t2 - t1
+        t1 = time.perf_counter()
+        hour_inputs = prefetcher.get(obs_datetime)
+        hour_start = time.perf_counter()
+
+        wdb_bundle = hour_inputs['bundle']
+        wdb_snwd = wdb_bundle['snow_depth']
+
+        # The fetch and climatology phases ran in the prefetch thread
+        # (unless prefetching is disabled); "prefetch_wait" is the time the
+        # main thread spent waiting for them.
+        profiler.add('prefetch_wait', hour_start - t1)
+        profiler.add('fetch.qc_bundle',
+                     hour_inputs['bundle_seconds'],
+                     rows=wdb_snwd['num_stations'])
+        if 'swe' in hour_inputs:
+            profiler.add('fetch.swe',
+                         hour_inputs['fetch_seconds'] -
+                         hour_inputs['bundle_seconds'],
+                         rows=hour_inputs['swe']['num_stations'])
+        if args.check_climatology:
+            profiler.add('climatology',
+                         hour_inputs['clim_seconds'],
+                         calls=3,
+                         rows=wdb_snwd['num_stations'])
         if args.verbose:
             print('INFO: found {} snow depth reports.'.
                   format(wdb_snwd['num_stations']))
-            print('INFO: query ran in {} seconds.'.
-                  format(elapsed_time.total_seconds()))
-
-        # Previous snow depth data is needed for multiple tests.
-        # - World record increase exceedance check uses 24 hours.
-        # - Streak check uses 15 days.
-        # - Gap check uses 15 days.
-        # - Temperature consistency checks use 24 hours.
-        # - Snowfall consistency check uses 24 hours.
-        # - Precipitation consistency checks use 24 hours.
-        num_hrs_prev_snwd = max(num_hrs_wre,
-                                num_hrs_streak,
-                                num_hrs_gap,
-                                num_hrs_prev_tair,
-                                num_hrs_snowfall,
-                                num_hrs_prcp)
+            print('INFO: query ran in {} seconds; '.
+                  format(hour_inputs['fetch_seconds']) +
+                  'waited {} seconds for it.'.format(hour_start - t1))
 
         if args.check_climatology:
+            wdb_snwd_clim_med_mm = hour_inputs['clim_median_mm']
+            wdb_snwd_clim_max_mm = hour_inputs['clim_max_mm']
+            wdb_snwd_clim_iqr_mm = hour_inputs['clim_iqr_mm']
 
-            # Get SNODAS climatology data for the current time.
-            wdb_snwd_clim_med_mm = \
-                snodas_clim.at_loc(sd_clim_dir,
-                                   obs_datetime,
-                                   wdb_snwd['station_lon'],
-                                   wdb_snwd['station_lat'],
-                                   element='snow_depth',
-                                   metric='median',
-                                   sampling='neighbor')
-            wdb_snwd_clim_max_mm = \
-                snodas_clim.at_loc(sd_clim_dir,
-                                   obs_datetime,
-                                   wdb_snwd['station_lon'],
-                                   wdb_snwd['station_lat'],
-                                   element='snow_depth',
-                                   metric='max',
-                                   sampling='neighbor')
-            wdb_snwd_clim_iqr_mm = \
-                snodas_clim.at_loc(sd_clim_dir,
-                                   obs_datetime,
-                                   wdb_snwd['station_lon'],
-                                   wdb_snwd['station_lat'],
-                                   element='snow_depth',
-                                   metric='iqr',
-                                   sampling='neighbor')
-
-        # Get previous num_hrs_prev_snwd hours of snow depth data.
+        # Get previous num_hrs_prev_snwd hours of snow depth data, for
+        # stations reporting snow depth at obs_datetime. This gives the same
+        # result as wdb0.get_prev_snow_depth_obs.
         t1 = dt.datetime.utcnow()
-        wdb_prev_snwd = \
-            wdb0.get_prev_snow_depth_obs(obs_datetime,
-                                         num_hrs_prev_snwd,
-                                         scratch_dir=args.pkl_dir,
-                                         verbose=args.verbose)
+        with profiler.section('fetch.prev_snwd_window') as section:
+            prev_snwd_window.advance(obs_datetime, new_obs=wdb_snwd)
+            wdb_prev_snwd = prev_snwd_window.get(wdb_snwd['station_obj_id'],
+                                                 skip_last_hours=1)
+            section.rows = wdb_prev_snwd['num_stations']
         t2 = dt.datetime.utcnow()
         elapsed_time = t2 - t1
 
@@ -1834,7 +4435,36 @@ def main():
         left_ind = max(t1_ind, 0)
         right_ind = max(t2_ind + 1, 0)
 
-        qcdb_prev_snwd_qc_flag = qcdb_snwd_qc_flag[:, left_ind:right_ind]
+        # Read the snow depth QC flags for the previous num_hrs_prev_snwd
+        # hours and the current hour, which are all the QC tests touch, into
+        # memory. Updates are recorded at the end of the hour.
+        with profiler.section('netcdf.read_qc_windows') as section:
+            qcdb_snwd_qc_flag = QCFlagWindow(qcdb_snwd_qc_flag_var,
+                                             left_ind,
+                                             qcdb_ti + 1,
+                                             journal=journal)
+            qcdb_snwd_qc_chkd = QCFlagWindow(qcdb_snwd_qc_chkd_var,
+                                             left_ind,
+                                             qcdb_ti + 1,
+                                             journal=journal)
+            qc_windows = [qcdb_snwd_qc_chkd, qcdb_snwd_qc_flag]
+
+            # Do the same for SWE, which is quality controlled after snow
+            # depth (see below).
+            if qcdb_swe_qc_flag_var is not None:
+                swe_left_ind = max(qcdb_ti - num_hrs_prev_swe, 0)
+                qcdb_swe_qc_flag = QCFlagWindow(qcdb_swe_qc_flag_var,
+                                                swe_left_ind,
+                                                qcdb_ti + 1,
+                                                journal=journal)
+                qcdb_swe_qc_chkd = QCFlagWindow(qcdb_swe_qc_chkd_var,
+                                                swe_left_ind,
+                                                qcdb_ti + 1,
+                                                journal=journal)
+                qc_windows += [qcdb_swe_qc_chkd, qcdb_swe_qc_flag]
+            section.rows = qcdb_num_stations * len(qc_windows)
+
+        qcdb_prev_snwd_qc_flag = qcdb_snwd_qc_flag.get(left_ind, right_ind)
 
         # Calculate the number of hours to add at the start of
         # qcdb_prev_snwd_qc_flag, for cases where num_hrs_prev_snwd extends
@@ -1865,19 +4495,10 @@ def main():
                                   axis=1)
 
         # Get snowfall data associated with snow depth observations.
-        t1 = dt.datetime.utcnow()
-        wdb_snfl = \
-            wdb0.get_snwd_snowfall_obs(obs_datetime,
-                                       num_hrs_snowfall,
-                                       scratch_dir=args.pkl_dir,
-                                       verbose=args.verbose)
-        t2 = dt.datetime.utcnow()
-        elapsed_time = t2 - t1
+        wdb_snfl = wdb_bundle['snowfall']
         if args.verbose:
             print('INFO: found {} snowfall reports.'.
                   format(wdb_snfl['num_stations']))
-            print('INFO: query ran in {} seconds.'.
-                  format(elapsed_time.total_seconds()))
 
         # Extract snowfall values and station object identifiers, for
         # convenience (shorter variable names).
@@ -1885,19 +4506,10 @@ def main():
         wdb_snfl_obj_id = wdb_snfl['station_obj_id']
 
         # Get precipitation data associated with snow depth observations.
-        t1 = dt.datetime.utcnow()
-        wdb_prcp = \
-            wdb0.get_snwd_prcp_obs(obs_datetime,
-                                   num_hrs_prcp,
-                                   scratch_dir=args.pkl_dir,
-                                   verbose=args.verbose)
-        t2 = dt.datetime.utcnow()
-        elapsed_time = t2 - t1
+        wdb_prcp = wdb_bundle['precip']
         if args.verbose:
             print('INFO: found {} precipitation reports.'.
-                  format(wdb_snfl['num_stations']))
-            print('INFO: query ran in {} seconds.'.
-                  format(elapsed_time.total_seconds()))
+                  format(wdb_prcp['num_stations']))
 
         # Extract snowfall values and station object identifiers, for
         # convenience (shorter variable names).
@@ -1908,12 +4520,11 @@ def main():
         # reporters (for the snow-temperature consistency check) and for other
         # sites as well (for the spatial snow-temperature consistency check).
         t1 = dt.datetime.utcnow()
-        wdb_prev_tair = \
-            wdb0.get_air_temp_obs(obs_datetime -
-                                  dt.timedelta(hours=num_hrs_prev_tair),
-                                  obs_datetime,
-                                  scratch_dir=args.pkl_dir,
-                                  verbose=args.verbose)
+        with profiler.section('fetch.prev_tair_window') as section:
+            prev_tair_window.advance(obs_datetime,
+                                     new_obs=wdb_bundle['air_temp'])
+            wdb_prev_tair = prev_tair_window.get()
+            section.rows = wdb_prev_tair['num_stations']
         t2 = dt.datetime.utcnow()
         elapsed_time = t2 - t1
 
@@ -1932,18 +4543,14 @@ def main():
 
         # Find neighboring indices from wdb_prev_tair for each snow depth
         # observation in wdb_snwd.
-        neighborhood_radius_km = 75.0
-        min_tair_neighbors = 3
-        max_tair_neighbors = 7
-        nhood_ind, nhood_dist_km = \
-            find_nearest_neighbors(wdb_snwd['station_lat'],
-                                   wdb_snwd['station_lon'],
-                                   wdb_prev_tair['station_lat'],
-                                   wdb_prev_tair['station_lon'],
-                                   neighborhood_radius_km,
-                                   min_tair_neighbors,
-                                   max_tair_neighbors,
-                                   verbose=args.verbose)
+        with profiler.section('neighbors', rows=wdb_snwd['num_stations']):
+            nhood_ind, nhood_dist_km = \
+                tair_neighbor_cache.find(wdb_snwd['station_obj_id'],
+                                         wdb_snwd['station_lat'],
+                                         wdb_snwd['station_lon'],
+                                         wdb_prev_tair['station_obj_id'],
+                                         wdb_prev_tair['station_lat'],
+                                         wdb_prev_tair['station_lon'])
 
         # Initialize counters for the current time.
         num_stations_added_this_time = 0
@@ -1961,9 +4568,125 @@ def main():
         wdb_snwd_station_id = wdb_snwd['station_id']
         wdb_snwd_val_cm = wdb_snwd['values_cm'][:,0]
 
+        # Locate all snow depth reporters in the QC database and in the
+        # data needed for QC tests, using an index for each data source.
+        qcdb_si_all = qcdb_station_index.find_all(wdb_snwd_obj_id)
+        source_si_all = {}
+        for source_name, source_obj_id, source_desc in \
+            [('prev_snwd', wdb_prev_snwd_obj_id,
+              'preceding snow depth data'),
+             ('prev_tair', wdb_prev_tair_obj_id,
+              'previous + current air temperature data'),
+             ('snfl', wdb_snfl_obj_id, 'snowfall data'),
+             ('prcp', wdb_prcp_obj_id, 'precipitation data')]:
+            source_index = StationIndex(source_obj_id)
+            dup_ind = np.flatnonzero(source_index.duplicated(wdb_snwd_obj_id))
+            if len(dup_ind) > 0:
+                print('ERROR: multiple matches for station ' +
+                      'object ID {} '.format(wdb_snwd_obj_id[dup_ind[0]]) +
+                      'in {}.'.format(source_desc),
+                      file=sys.stderr)
+                qcdb.close()
+                exit(1)
+            source_si_all[source_name] = \
+                source_index.find_all(wdb_snwd_obj_id)
+
+        # Perform the basic integrity and internal and temporal consistency
+        # checks for all reporting stations at once. The results are picked
+        # up station by station in the loop below. Stations with no data for
+        # a test are left masked.
+        num_reporters = wdb_snwd['num_stations']
+        batch_prev_snwd_val_cm = \
+            np.ma.masked_all((num_reporters, num_hrs_prev_snwd))
+        found = source_si_all['prev_snwd'] >= 0
+        batch_prev_snwd_val_cm[found] = \
+            wdb_prev_snwd_val_cm[source_si_all['prev_snwd'][found]]
+        # QC flags for stations new to the QC database are zero.
+        batch_prev_snwd_qc = \
+            np.ma.masked_array(np.zeros((num_reporters, num_hrs_prev_snwd),
+                                        dtype=qcdb_prev_snwd_qc_flag.dtype),
+                               mask=False)
+        found = qcdb_si_all >= 0
+        batch_prev_snwd_qc[found] = qcdb_prev_snwd_qc_flag[qcdb_si_all[found]]
+        batch_prev_tair_val_deg_c = \
+            np.ma.masked_all((num_reporters, num_hrs_prev_tair + 1))
+        found = source_si_all['prev_tair'] >= 0
+        batch_prev_tair_val_deg_c[found] = \
+            wdb_prev_tair_val[source_si_all['prev_tair'][found]]
+        batch_snfl_val_cm = np.ma.masked_all(num_reporters)
+        found = source_si_all['snfl'] >= 0
+        batch_snfl_val_cm[found] = \
+            wdb_snfl_val_cm[source_si_all['snfl'][found]]
+        batch_prcp_val_mm = np.ma.masked_all(num_reporters)
+        found = source_si_all['prcp'] >= 0
+        batch_prcp_val_mm[found] = \
+            wdb_prcp_val_mm[source_si_all['prcp'][found]]
+
+        snwd_qc_test_names = qcdb_snwd_qc_flag.getncattr('qc_test_names')
+        snwd_qc_test_bits = qcdb_snwd_qc_flag.getncattr('qc_test_bits')
+        batch_qc_bits = {}
+        for qc_test_name in SNWD_BATCH_TESTS:
+            # "depth_precip_ratio" is the older name for "precip_ratio".
+            for name in [qc_test_name, 'depth_' + qc_test_name]:
+                if name in snwd_qc_test_names:
+                    batch_qc_bits[qc_test_name] = \
+                        int(snwd_qc_test_bits[snwd_qc_test_names.index(name)])
+                    break
+
+        batch_inputs = {'snwd_val_cm': wdb_snwd_val_cm,
+                        'prev_snwd_val_cm': batch_prev_snwd_val_cm,
+                        'prev_snwd_qc': batch_prev_snwd_qc,
+                        'prev_tair_val_deg_c': batch_prev_tair_val_deg_c,
+                        'snfl_val_cm': batch_snfl_val_cm,
+                        'prcp_val_mm': batch_prcp_val_mm,
+                        'qc_bits': batch_qc_bits,
+                        'num_hrs_wre': num_hrs_wre,
+                        'num_hrs_streak': num_hrs_streak,
+                        'num_hrs_prev_tair': num_hrs_prev_tair,
+                        'num_hrs_snowfall': num_hrs_snowfall,
+                        'num_hrs_prcp': num_hrs_prcp}
+        if args.record_qc_dir is not None:
+            save_snwd_batch_inputs(os.path.join(args.record_qc_dir,
+                                                'snwd_qc_inputs_' +
+                                                obs_datetime.
+                                                strftime('%Y%m%d%H') +
+                                                '.npz'),
+                                   batch_inputs)
+
+        # Perform the gap check for all reporting stations at once as well.
+        # With --num_workers, the stations are split among worker
+        # processes for both.
+        if args.check_climatology:
+            gap_ref_ceiling_cm = \
+                (wdb_snwd_clim_max_mm + wdb_snwd_clim_iqr_mm) * 0.1
+            gap_ref_default_cm = wdb_snwd_clim_med_mm * 0.1
+        else:
+            gap_ref_ceiling_cm = None
+            gap_ref_default_cm = None
+        with profiler.section('snwd.batch',
+                              rows=wdb_snwd['num_stations']):
+            snwd_batch, snwd_gap = \
+                qc_durre_snwd_batch_parallel(qc_pool,
+                                             args.num_workers,
+                                             batch_inputs,
+                                             num_hrs_gap=num_hrs_gap,
+                                             ref_ceiling_cm=gap_ref_ceiling_cm,
+                                             ref_default_cm=gap_ref_default_cm)
+
+        # Record the time taken by each test. With --num_workers these are
+        # summed over worker processes, so they may exceed "snwd.batch".
+        for qc_test_name, seconds in snwd_batch['seconds'].items():
+            profiler.add('snwd.' + qc_test_name,
+                         seconds,
+                         rows=wdb_snwd['num_stations'])
+
         if args.verbose:
             print('Performing snow depth QC for {}'.format(obs_datetime))
 
+        snwd_loop_start = time.perf_counter()
+        num_spatial_calls = 0
+        spatial_seconds = 0.0
+
         ####################################################
         # Loop over all reports for the current date/time. #
         ####################################################
@@ -1981,83 +4704,34 @@ def main():
                 site_snwd_clim_iqr_mm = wdb_snwd_clim_iqr_mm[wdb_snwd_si]
 
             # Locate station index in QC database.
-            qcdb_si = np.where(qcdb_obj_id_var[:] == site_snwd_obj_id)
+            qcdb_si = qcdb_si_all[wdb_snwd_si]
 
             debug_this_station = False
             if debug_station_id is not None and \
                site_snwd_station_id == debug_station_id:
                 debug_this_station = True
 
-            if len(qcdb_si[0]) == 0:
-
-                # New station - get its metadata.
-
-                # Open the web database.
-                conn_string = "host='wdb0.dmz.nohrsc.noaa.gov' " + \
-                              "dbname='web_data'"
-                conn = psycopg2.connect(conn_string)
-                conn.set_client_encoding("utf-8")
-                cursor = conn.cursor()
-
-                # Read metadata for the current station.
-                sql_cmd = "SELECT " + wdb_col_list_str + " " + \
-                          "FROM point.allstation " + \
-                          "WHERE obj_identifier = {};". \
-                          format(site_snwd_obj_id)
-                cursor.execute(sql_cmd)
-                wdb_station_meta = cursor.fetchall()
-                cursor.close()
-                conn.close()
-                if len(wdb_station_meta) != 1:
-                    print('ERROR: found {} matches in SQL statement ' +
-                          'for station object ID {}; expecting 1.'.
-                          format(len(wdb_station_meta), site_snwd_obj_id),
-                          file=sys.stderr)
+            if qcdb_si < 0:
+
+                # New station - get its metadata and append it to the QC
+                # database. THIS ADDS 1 TO THE STATION DIMENSION (when the
+                # journal is committed).
+                if append_qc_db_station(journal,
+                                        qcdb_num_stations,
+                                        site_snwd_obj_id,
+                                        qcdb_station_vars,
+                                        wdb_col_list,
+                                        wdb_col_list_str) is None:
                     qcdb.close()
                     exit(1)
-                wdb_station_meta = wdb_station_meta[0]
-
-                # For all station variables append or confirm/update data.
-                for ind, qcdb_station_var in enumerate(qcdb_station_vars):
-                    allstation_column_name = wdb_col_list[ind]
-
-                    if isinstance(wdb_station_meta[ind], dt.datetime):
-                        # Format as "YYYY-MM-DD HH:MM:SS"
-                        if not qcdb_station_var.dtype is np.str:
-                            print('ERROR: NetCDF variable {}'.
-                                  format(qcdb_station_var.name) +
-                                  'must be of "str" type.',
-                                  file=sys.stderr)
-                            qcdb.close()
-                            exit(1)
-                        wdb_allstation_column_data = \
-                            wdb_station_meta[ind].strftime('%Y-%m-%d %H:%M:%S')
-                    else:
-                        wdb_allstation_column_data = wdb_station_meta[ind]
-                        if isinstance(wdb_allstation_column_data, str):
-                            wdb_allstation_column_data = \
-                                wdb_allstation_column_data.strip()
-
-                    if allstation_column_name == 'station_id':
-                        if len(qcdb_si[0]) == 0:
-                            # This is a new station.
-                            if qcdb_num_stations_start > 0 and args.verbose:
-                                print('INFO: adding station "{}".'.
-                                      format(wdb_allstation_column_data))
-
-                    if len(qcdb_si[0]) == 0:
-                        # Station (si) object ID not in QC database.
-                        # Append. THIS ADDS 1 TO THE STATION DIMENSION.
-                        # if ind == 0:
-                        #     print(qcdb.dimensions['station'].size)
-                        qcdb_station_var[qcdb_num_stations] = \
-                            wdb_allstation_column_data
-                        # if ind == 0:
-                        #     print(qcdb.dimensions['station'].size)
-
-                # Metadata was appended above. Now QC data needs to
+                if qcdb_num_stations_start > 0 and args.verbose:
+                    print('INFO: adding station "{}".'.
+                          format(site_snwd_station_id))
+
+                # Metadata was recorded above. Now QC data needs to
                 # be appended as well.
                 qcdb_si = qcdb_num_stations
+                qcdb_station_index.add(site_snwd_obj_id, qcdb_si)
                 qcdb_station_is_new = True
                 qcdb_num_stations += 1
                 num_stations_added += 1
@@ -2066,8 +4740,8 @@ def main():
                     print('INFO: QC database now includes {} stations.'.
                           format(qcdb_num_stations))
                 # Initialize qc variables to 0 for this (new) station.
-                qcdb_snwd_qc_chkd[qcdb_si,:] = 0
-                qcdb_snwd_qc_flag[qcdb_si,:] = 0
+                for qc_window in qc_windows:
+                    qc_window.add_station(qcdb_si)
 
                 # Add artificial qc data to qcdb_prev_snwd_qc_flag for
                 # the new station.
@@ -2083,7 +4757,7 @@ def main():
 
             else:                  
 
-                qcdb_si = qcdb_si[0][0]
+                qcdb_si = int(qcdb_si)
                 qcdb_station_is_new = False
 
             ########################################################
@@ -2091,87 +4765,19 @@ def main():
             # performing QC tests.                                 #
             ########################################################
 
-            # Locate station index in previous snow depth data.
-            # TODO: fix this brute force method. Maybe try the index method
-            # with a try/except arrangement.
-            wdb_prev_snwd_si = []
-            for ind, val in enumerate(wdb_prev_snwd_obj_id):
-                if val == site_snwd_obj_id:
-                    wdb_prev_snwd_si.append(ind)
-
-            if len(wdb_prev_snwd_si) != 0:
-                # The object ID for this station was found in the
-                # preceding snow depth data.
-                if len(wdb_prev_snwd_si) > 1:
-                    print('ERROR: multiple matches for station ' +
-                          'object ID {} '.format(site_snwd_obj_id) +
-                          'in preceding snow depth data.',
-                          file=sys.stderr)
-                    qcdb.close()
-                    exit(1)
-                wdb_prev_snwd_si = wdb_prev_snwd_si[0]
-            else:
-                wdb_prev_snwd_si = None
-
-            # Locate station index in previous air temperature data.
-            wdb_prev_tair_si = []
-            for ind, val in enumerate(wdb_prev_tair_obj_id):
-                if val == site_snwd_obj_id:
-                    wdb_prev_tair_si.append(ind)
-
-            if len(wdb_prev_tair_si) != 0:
-                # The object ID for this station was found in the
-                # previous + current air temperature data.
-                if len(wdb_prev_tair_si) > 1:
-                    print('ERROR: multiple matches for station ' +
-                          'object ID {} '.format(site_snwd_obj_id) +
-                          'in previous + current air temperature data.',
-                          file=sys.stderr)
-                    qcdb.close()
-                    exit(1)
-                wdb_prev_tair_si = wdb_prev_tair_si[0]
-            else:
-                wdb_prev_tair_si = None
-
-            # Locate station index in snowfall data.
-            wdb_snfl_si = []
-            for ind, val in enumerate(wdb_snfl_obj_id):
-                if val == site_snwd_obj_id:
-                    wdb_snfl_si.append(ind)
-
-            if len(wdb_snfl_si) != 0:
-                # The object ID for this station was found in the snowfall
-                # data.
-                if len(wdb_snfl_si) > 1:
-                    print('ERROR: multiple matches for station ' +
-                          'object ID {} '.format(site_snwd_obj_id) +
-                          'in snowfall data.',
-                          file=sys.stderr)
-                    qcdb.close()
-                    exit(1)
-                wdb_snfl_si = wdb_snfl_si[0]
-            else:
-                wdb_snfl_si = None
-
-            # Locate station index in precipitation data.
-            wdb_prcp_si = []
-            for ind, val in enumerate(wdb_prcp_obj_id):
-                if val == site_snwd_obj_id:
-                    wdb_prcp_si.append(ind)
-
-            if len(wdb_prcp_si) != 0:
-                # The object ID for this station was found in the snowfall
-                # data.
-                if len(wdb_prcp_si) > 1:
-                    print('ERROR: multiple matches for station ' +
-                          'object ID {} '.format(site_prcp_obj_id) +
-                          'in precipitation data.',
-                          file=sys.stderr)
-                    qcdb.close()
-                    exit(1)
-                wdb_prcp_si = wdb_prcp_si[0]
-            else:
-                wdb_prcp_si = None
+            # Locate station index in previous snow depth, previous +
+            # current air temperature, snowfall and precipitation data
+            # (None where the station has no data).
+            wdb_prev_snwd_si = source_si_all['prev_snwd'][wdb_snwd_si]
+            wdb_prev_snwd_si = \
+                None if wdb_prev_snwd_si < 0 else int(wdb_prev_snwd_si)
+            wdb_prev_tair_si = source_si_all['prev_tair'][wdb_snwd_si]
+            wdb_prev_tair_si = \
+                None if wdb_prev_tair_si < 0 else int(wdb_prev_tair_si)
+            wdb_snfl_si = source_si_all['snfl'][wdb_snwd_si]
+            wdb_snfl_si = None if wdb_snfl_si < 0 else int(wdb_snfl_si)
+            wdb_prcp_si = source_si_all['prcp'][wdb_snwd_si]
+            wdb_prcp_si = None if wdb_prcp_si < 0 else int(wdb_prcp_si)
 
 
             ################################################
@@ -2213,7 +4819,7 @@ def main():
 
             if not qcdb_snwd_qc_chkd[qcdb_si, qcdb_ti] & (1 << qc_bit):
 
-                if qc_durre_snwd_wre(site_snwd_val_cm):
+                if snwd_batch_result(snwd_batch, wdb_snwd_si, qc_test_name):
                     # Value has been flagged.
                     if args.verbose:
                         print('INFO: flagging snow depth value {} '.
@@ -2298,9 +4904,9 @@ def main():
                         qcdb_prev_snwd_qc_flag[qcdb_si, prev_snwd_ti:]
 
                     flag, ref_ind = \
-                        qc_durre_snwd_change_wre(site_snwd_val_cm,
-                                                 site_prev_snwd_val_cm,
-                                                 site_prev_snwd_qc)
+                        snwd_batch_result(snwd_batch,
+                                          wdb_snwd_si,
+                                          qc_test_name)
 
                     if debug_this_station:
                         print('***** values: {} {}'.
@@ -2431,9 +5037,9 @@ def main():
                     site_prev_snwd_qc = \
                         qcdb_prev_snwd_qc_flag[qcdb_si, prev_snwd_ti:]
 
-                    flag = qc_durre_snwd_streak(site_snwd_val_cm,
-                                                site_prev_snwd_val_cm,
-                                                site_prev_snwd_qc)
+                    flag = snwd_batch_result(snwd_batch,
+                                             wdb_snwd_si,
+                                             qc_test_name)
 
                     if flag:
 
@@ -2518,36 +5124,11 @@ def main():
                     site_prev_snwd_val_cm = \
                         wdb_prev_snwd_val_cm[wdb_prev_snwd_si, prev_snwd_ti:]
 
-                    site_prev_snwd_qc = \
-                        qcdb_prev_snwd_qc_flag[qcdb_si, prev_snwd_ti:]
-
                     station_time_series = \
                         np.ma.append(site_prev_snwd_val_cm, site_snwd_val_cm)
 
-                    if args.check_climatology:
-
-                        snwd_ref_ceiling_cm = (site_snwd_clim_max_mm + \
-                                          site_snwd_clim_iqr_mm) * 0.1
-
-                        snwd_ref_default_cm = site_snwd_clim_med_mm * 0.1
-
-                        ts_flag_ind, ref_obs = \
-                            qc_durre_snwd_gap(site_snwd_val_cm,
-                                              site_prev_snwd_val_cm,
-                                              site_prev_snwd_qc,
-                                              ref_ceiling_cm=
-                                              snwd_ref_ceiling_cm,
-                                              ref_default_cm=
-                                              snwd_ref_default_cm,
-                                              verbose=args.verbose)
-
-                    else:
-
-                        ts_flag_ind, ref_obs = \
-                            qc_durre_snwd_gap(site_snwd_val_cm,
-                                              site_prev_snwd_val_cm,
-                                              site_prev_snwd_qc,
-                                              verbose=args.verbose)
+                    ts_flag_ind, ref_obs = gap_batch_result(snwd_gap,
+                                                            wdb_snwd_si)
 
                     if ts_flag_ind is None:
                         print('ERROR: gap check failed ' +
@@ -2716,8 +5297,11 @@ def main():
                         exit(1)
 
                     # Programming check on station indices in different
-                    # variables.
-                    if (qcdb_obj_id_var[qcdb_si] != site_snwd_obj_id or
+                    # variables. Stations added this hour are not in the
+                    # obj_identifier variable until the journal is
+                    # committed, so the station index is checked instead.
+                    if (qcdb_station_index.find(site_snwd_obj_id) !=
+                        qcdb_si or
                         wdb_prev_snwd_obj_id[wdb_prev_snwd_si] != \
                         site_snwd_obj_id):
                         print('ERROR: (programming) object ID mismatch ' +
@@ -2751,10 +5335,9 @@ def main():
                         exit(1)
 
                     flag, ref_ind = \
-                        qc_durre_snwd_temp(site_snwd_val_cm,
-                                           site_prev_snwd_val_cm,
-                                           site_prev_snwd_qc,
-                                           site_prev_tair_val_deg_c)
+                        snwd_batch_result(snwd_batch,
+                                          wdb_snwd_si,
+                                          qc_test_name)
 
                     if flag:
 
@@ -2894,10 +5477,9 @@ def main():
                     site_snfl_val_cm = wdb_snfl_val_cm[wdb_snfl_si]
 
                     flag, ref_ind = \
-                        qc_durre_snwd_snfl(site_snwd_val_cm,
-                                           site_prev_snwd_val_cm,
-                                           site_prev_snwd_qc,
-                                           site_snfl_val_cm)
+                        snwd_batch_result(snwd_batch,
+                                          wdb_snwd_si,
+                                          qc_test_name)
 
                     if flag:
  
@@ -3059,10 +5641,9 @@ def main():
                         sys.exit(1)
 
                     flag, ref_ind = \
-                        qc_durre_snwd_prcp(site_snwd_val_cm,
-                                           site_prev_snwd_val_cm,
-                                           site_prev_snwd_qc,
-                                           site_prcp_val_mm)
+                        snwd_batch_result(snwd_batch,
+                                          wdb_snwd_si,
+                                          qc_test_name)
 
                     if flag:
  
@@ -3222,10 +5803,9 @@ def main():
                     site_prcp_val_mm = wdb_prcp_val_mm[wdb_prcp_si]
 
                     flag, ref_ind = \
-                        qc_durre_snwd_prcp_ratio(site_snwd_val_cm,
-                                                 site_prev_snwd_val_cm,
-                                                 site_prev_snwd_qc,
-                                                 site_prcp_val_mm)
+                        snwd_batch_result(snwd_batch,
+                                          wdb_snwd_si,
+                                          'precip_ratio')
 
                     if flag:
  
@@ -3388,11 +5968,14 @@ def main():
                         ind2 = nhood_ind[wdb_snwd_si][nc]
                         nhood_tair_deg_c[nc,:] = wdb_prev_tair_val[ind2,:]
 
+                    t1 = time.perf_counter()
                     flag, ref_ind = \
                         qc_durre_snwd_tair_spatial(site_snwd_val_cm,
                                                    site_prev_snwd_val_cm,
                                                    site_prev_snwd_qc,
                                                    nhood_tair_deg_c)
+                    spatial_seconds += time.perf_counter() - t1
+                    num_spatial_calls += 1
 
                     if flag:
 
@@ -3507,53 +6090,251 @@ def main():
                   'snow depth obs. at {} '.format(obs_datetime) +
                   'for snow depth/precipitation consistency.')
 
+        ###############################################################
+        # Perform SWE QC for all reports for the current date/time at #
+        # once.                                                       #
+        ###############################################################
+
+        swe_start = time.perf_counter()
+
+        # The spatial test runs per station inside the loop above; its time
+        # is part of "snwd.station_loop".
+        profiler.add('snwd.station_loop',
+                     swe_start - snwd_loop_start,
+                     rows=wdb_snwd['num_stations'])
+        profiler.add('snwd.spatial_temperature_consistency',
+                     spatial_seconds,
+                     calls=num_spatial_calls,
+                     rows=num_spatial_calls)
+
+        if qcdb_swe_qc_flag_var is not None:
+
+            # Get previous num_hrs_prev_swe hours of SWE data for stations
+            # reporting SWE at obs_datetime.
+            wdb_swe = hour_inputs['swe']
+            num_swe_reporters = wdb_swe['num_stations']
+            wdb_swe_obj_id = wdb_swe['station_obj_id']
+            wdb_swe_station_id = wdb_swe['station_id']
+            wdb_swe_val_mm = wdb_swe['values_mm'][:, 0]
+            with profiler.section('fetch.prev_swe_window',
+                                  rows=num_swe_reporters):
+                prev_swe_window.advance(obs_datetime, new_obs=wdb_swe)
+                wdb_prev_swe = prev_swe_window.get(wdb_swe_obj_id,
+                                                   skip_last_hours=1)
+            if args.verbose:
+                print('INFO: found {} SWE reports '.
+                      format(num_swe_reporters) +
+                      'and {} preceding SWE reports.'.
+                      format(wdb_prev_swe['values_mm'].count()))
+
+            # Append SWE reporters that are not yet in the QC database, as
+            # for snow depth.
+            qcdb_swe_si = qcdb_station_index.find_all(wdb_swe_obj_id)
+            for wdb_swe_si in np.flatnonzero(qcdb_swe_si < 0):
+                if append_qc_db_station(journal,
+                                        qcdb_num_stations,
+                                        wdb_swe_obj_id[wdb_swe_si],
+                                        qcdb_station_vars,
+                                        wdb_col_list,
+                                        wdb_col_list_str) is None:
+                    qcdb.close()
+                    exit(1)
+                qcdb_swe_si[wdb_swe_si] = qcdb_num_stations
+                qcdb_station_index.add(wdb_swe_obj_id[wdb_swe_si],
+                                       qcdb_num_stations)
+                for qc_window in qc_windows:
+                    qc_window.add_station(qcdb_num_stations)
+                qcdb_num_stations += 1
+                num_stations_added += 1
+                num_stations_added_this_time += 1
+
+            # Locate SWE reporters in the preceding SWE data and in the
+            # precipitation data already fetched for snow depth reporters;
+            # SWE reporters that do not report snow depth have no
+            # precipitation data, so the precipitation tests are not
+            # possible for them.
+            source_si_all = {}
+            for source_name, source_obj_id, source_desc in \
+                [('prev_swe', wdb_prev_swe['station_obj_id'],
+                  'preceding SWE data'),
+                 ('prcp', wdb_prcp_obj_id, 'precipitation data')]:
+                source_index = StationIndex(source_obj_id)
+                dup_ind = \
+                    np.flatnonzero(source_index.duplicated(wdb_swe_obj_id))
+                if len(dup_ind) > 0:
+                    print('ERROR: multiple matches for station ' +
+                          'object ID {} '.format(wdb_swe_obj_id[dup_ind[0]]) +
+                          'in {}.'.format(source_desc),
+                          file=sys.stderr)
+                    qcdb.close()
+                    exit(1)
+                source_si_all[source_name] = \
+                    source_index.find_all(wdb_swe_obj_id)
+
+            # Assemble [station, hour] inputs as for the batch snow depth
+            # tests. Previous QC flags are padded with zeroes for hours
+            # before the start of the QC database.
+            batch_prev_swe_val_mm = \
+                np.ma.masked_all((num_swe_reporters, num_hrs_prev_swe))
+            has_prev_swe = source_si_all['prev_swe'] >= 0
+            batch_prev_swe_val_mm[has_prev_swe] = \
+                wdb_prev_swe['values_mm'][source_si_all['prev_swe']
+                                          [has_prev_swe]]
+            qcdb_prev_swe_qc_flag = qcdb_swe_qc_flag.get(swe_left_ind,
+                                                         qcdb_ti)
+            num_pad_hours = num_hrs_prev_swe - qcdb_prev_swe_qc_flag.shape[1]
+            batch_prev_swe_qc = \
+                np.ma.masked_array(np.zeros((num_swe_reporters,
+                                             num_hrs_prev_swe),
+                                            dtype=qcdb_prev_swe_qc_flag.dtype),
+                                   mask=False)
+            batch_prev_swe_qc[:, num_pad_hours:] = \
+                qcdb_prev_swe_qc_flag[qcdb_swe_si]
+            batch_prcp_val_mm = np.ma.masked_all(num_swe_reporters)
+            found = source_si_all['prcp'] >= 0
+            batch_prcp_val_mm[found] = \
+                wdb_prcp_val_mm[source_si_all['prcp'][found]]
+
+            swe_batch = \
+                qc_durre_swe_batch(wdb_swe_val_mm,
+                                   batch_prev_swe_val_mm,
+                                   batch_prev_swe_qc,
+                                   batch_prcp_val_mm,
+                                   swe_batch_qc_bits,
+                                   num_hrs_wre=num_hrs_wre,
+                                   num_hrs_streak=num_hrs_streak,
+                                   num_hrs_prcp=num_hrs_prcp,
+                                   streak_value_threshold=
+                                   streak_value_threshold)
+            for qc_test_name, seconds in swe_batch['seconds'].items():
+                profiler.add('swe.' + qc_test_name,
+                             seconds,
+                             rows=num_swe_reporters)
+
+            # Perform tests only where they have not been performed already,
+            # i.e. where the QC checked bit is off (or the flag is unset).
+            swe_done = \
+                np.ma.filled(qcdb_swe_qc_chkd.get(qcdb_ti, qcdb_ti + 1)
+                             [qcdb_swe_si, 0], 0).astype(np.int64)
+            swe_checked = swe_batch['checked'] & ~swe_done
+            swe_flag = swe_batch['flag'] & swe_checked
+
+            # The gap check flags values in the preceding num_hrs_gap hours
+            # as well as the current one. As for snow depth, it is only
+            # performed where there are preceding data.
+            if swe_gap_qc_bit is not None:
+                gap_bit = 1 << swe_gap_qc_bit
+                with profiler.section('swe.gap', rows=num_swe_reporters):
+                    swe_gap = qc_durre_swe_gap_batch(wdb_swe_val_mm,
+                                                     batch_prev_swe_val_mm,
+                                                     batch_prev_swe_qc,
+                                                     num_hrs_gap=num_hrs_gap)
+                gap_checked = swe_gap['checked'] & has_prev_swe & \
+                              (swe_done & gap_bit == 0)
+                swe_checked[gap_checked] |= gap_bit
+                gap_si, gap_ts_ind = \
+                    np.nonzero(gap_batch_flags(swe_gap) &
+                               gap_checked[:, np.newaxis])
+                gap_ti = qcdb_ti - num_hrs_gap + gap_ts_ind
+                # Skip values that do not fit in the QC database.
+                gap_si = gap_si[gap_ti >= 0]
+                gap_ts_ind = gap_ts_ind[gap_ti >= 0]
+                gap_ti = gap_ti[gap_ti >= 0]
+                qcdb_swe_qc_flag.or_elements(qcdb_swe_si[gap_si],
+                                             gap_ti,
+                                             gap_bit)
+                num_flagged_swe_this_time = {'gap': len(gap_si)}
+            else:
+                num_flagged_swe_this_time = {'gap': 0}
+
+            # Turn on QC bits for flagged values and QC checked bits for
+            # all tests performed.
+            swe_ti = np.full(num_swe_reporters, qcdb_ti)
+            qcdb_swe_qc_flag.or_elements(qcdb_swe_si, swe_ti, swe_flag)
+            qcdb_swe_qc_chkd.or_elements(qcdb_swe_si, swe_ti, swe_checked)
+
+            for qc_test_name, qc_bit in swe_batch_qc_bits.items():
+                flagged = np.flatnonzero(swe_flag & (1 << qc_bit))
+                num_flagged_swe_this_time[qc_test_name] = len(flagged)
+                if args.verbose:
+                    for wdb_swe_si in flagged:
+                        print('INFO: flagging SWE value {} '.
+                              format(wdb_swe_val_mm[wdb_swe_si]) +
+                              'at station {} '.
+                              format(wdb_swe_station_id[wdb_swe_si]) +
+                              '({}) '.format(wdb_swe_obj_id[wdb_swe_si]) +
+                              '("{}").'.format(qc_test_name))
+            if args.verbose and num_flagged_swe_this_time['gap'] > 0:
+                for wdb_swe_si, ts_ind, ti in zip(gap_si, gap_ts_ind, gap_ti):
+                    if ts_ind < num_hrs_gap:
+                        value = batch_prev_swe_val_mm[wdb_swe_si,
+                                                      num_hrs_prev_swe -
+                                                      num_hrs_gap + ts_ind]
+                    else:
+                        value = wdb_swe_val_mm[wdb_swe_si]
+                    print('INFO: flagging SWE data for "gap" check ' +
+                          'at station {} '.
+                          format(wdb_swe_station_id[wdb_swe_si]) +
+                          '({}), '.format(wdb_swe_obj_id[wdb_swe_si]) +
+                          'value {}, '.format(value) +
+                          'time {}.'.
+                          format(num2date(qcdb_var_time[0] + ti,
+                                          units=qcdb_var_time_units)))
+
+            for qc_test_name, num_flagged in \
+                num_flagged_swe_this_time.items():
+                num_flagged_swe[qc_test_name] += num_flagged
+                if args.verbose:
+                    print('INFO: flagged {} '.format(num_flagged) +
+                          'SWE obs. at {} '.format(obs_datetime) +
+                          'for {}.'.format(qc_test_name.replace('_', ' ')))
+
+        swe_seconds = time.perf_counter() - swe_start
+        if qcdb_swe_qc_flag_var is not None:
+            profiler.add('swe.total', swe_seconds, rows=num_swe_reporters)
+
+        # Record QC flag updates in the journal.
+        with profiler.section('netcdf.flush_qc_windows') as section:
+            for qc_window in qc_windows:
+                qc_window.flush()
+                qc_window_io['element_reads'] += qc_window.num_element_reads
+                qc_window_io['element_writes'] += \
+                    qc_window.num_element_writes
+                qc_window_io['chunk_reads'] += qc_window.num_chunk_reads
+                qc_window_io['chunk_writes'] += qc_window.num_chunk_writes
+                section.rows += qc_window.num_element_writes
+
         # Update the "last_datetime_updated" attribute.
         # NOTE: Possibly only do this if the obs_datetime is earlier than the
         # current time(dt.datetime.utcnow) by more than e.g. 3 days.
         # min_days_of_latency = 2
         # if current_update_datetime - obs_datetime > \
         #    dt.timedelta(days=min_days_of_latency):
-        qcdb.setncattr_string('last_datetime_updated',
-                              obs_datetime.strftime('%Y-%m-%d %H:%M:%S UTC'))
+        journal.attr('last_datetime_updated',
+                     obs_datetime.strftime('%Y-%m-%d %H:%M:%S UTC'))
         num_hrs_updated += 1
 
+        t1 = time.perf_counter()
+        profiler.add('qc', t1 - hour_start - swe_seconds,
+                     rows=wdb_snwd['num_stations'])
+
         if num_hrs_updated % database_commit_period == 0:
 
-            # Close the temporary database copy.
-            qcdb.close()
+            # Save the neighbor graph along with the database.
+            tair_neighbor_cache.save()
 
-            # Move the database copy into place.
-            try:
-                shutil.move(temp_database_path, args.database_path)
-            except:
-                print('ERROR: Failed to replace {} '.
-                      format(args.database_path) +
-                      'with temporary copy {}.'.format(temp_database_path),
-                      file=sys.stderr)
-                sys.exit(1)
+            # Commit the updates for the last database_commit_period hours.
+            with profiler.section('netcdf.commit') as section:
+                num_records = journal.commit(qcdb)
+                section.rows = num_records
             if args.verbose:
                 print('INFO: Committed updates through {} '.
                       format(obs_datetime.strftime('%Y-%m-%d %H:%M:%S UTC')) +
-                      'to {}'.format(args.database_path))
-
-            # Create a new copy of the QC database.
-            temp_database_path = station_qc_db_copy(args.database_path,
-                                                    verbose=args.verbose)
-
-            # Open the new copy of the QC database.
-            try:
-                qcdb = Dataset(temp_database_path, 'r+')
-            except:
-                print('ERROR: Failed to open QC database {}.'
-                      .format(temp_database_path),
-                      file=sys.stderr)
-                exit(1)
-
-            just_committed = True
-
-        else:
+                      'to {} '.format(args.database_path) +
+                      '({} journal records).'.format(num_records))
 
-            just_committed = False
+        profiler.add('commit', time.perf_counter() - t1)
+        profiler.end_hour(obs_datetime)
 
         if args.max_update_hours is not None:
             if num_hrs_updated >= args.max_update_hours:
@@ -3566,7 +6347,42 @@ def main():
         #   - Else
         #     - Verify metadata for this station; change if necessary.
 
+    prefetcher.close()
+    tair_neighbor_cache.save()
+    if qc_pool is not None:
+        qc_pool.close()
+        qc_pool.join()
+
+    # Commit updates made since the last commit.
+    with profiler.section('netcdf.commit') as section:
+        section.rows = journal.commit(qcdb)
+    profiler.close()
+    if args.verbose and args.profile_file is not None:
+        print('INFO: wrote profile for {} hours to {}.'.
+              format(profiler.num_hours, args.profile_file))
+    qc_window_io['chunk_reads'] += journal.num_chunk_reads
+    qc_window_io['chunk_writes'] += journal.num_chunk_writes
+
     if args.verbose:
+        print('INFO: prefetch depth {}.'.format(args.prefetch_depth))
+        profiler.print_summary()
+        print('INFO: reused {} and computed {} air temperature '.
+              format(tair_neighbor_cache.num_rows_reused,
+                     tair_neighbor_cache.num_rows_computed) +
+              'neighborhoods.')
+        print('INFO: QC flag windows served {} element reads '.
+              format(qc_window_io['element_reads']) +
+              'and {} element writes '.
+              format(qc_window_io['element_writes']) +
+              'with {} chunk reads and {} chunk writes, '.
+              format(qc_window_io['chunk_reads'],
+                     qc_window_io['chunk_writes']) +
+              'avoiding {} chunk reads and {} chunk writes.'.
+              format(qc_window_io['element_reads'] +
+                     qc_window_io['element_writes'] -
+                     qc_window_io['chunk_reads'],
+                     qc_window_io['element_writes'] -
+                     qc_window_io['chunk_writes']))
         print('INFO: added {} '.format(num_stations_added_this_time) +
               'stations to the database.')
         print('INFO: flagged {} snow depth obs. for world record exceedance.'.
@@ -3586,6 +6402,10 @@ def main():
         print('INFO: flagged {} snow depth obs.'.
               format(num_flagged_sd_pr_cons) +
               'for snow depth/precipitation consistency.')
+        if qcdb_swe_qc_flag_var is not None:
+            for qc_test_name, num_flagged in num_flagged_swe.items():
+                print('INFO: flagged {} SWE obs. for {}.'.
+                      format(num_flagged, qc_test_name.replace('_', ' ')))
 
     # if args.check_climatology:
     #     for i, id in enumerate(sd_gap_station_id):
@@ -3604,52 +6424,12 @@ def main():
     #     csv_file.close()
 
     qcdb.close()
+    journal.close()
 
     if args.verbose:
         print('INFO: database updated to {}.'.
               format(obs_datetime.strftime('%Y-%m-%d %H:%M:%S UTC')))
 
-    if just_committed:
-
-        # The temporary copy of the QC database was opened and closed with no
-        # modifications. Delete it.
-        try:
-            os.remove(temp_database_path)
-        except:
-            print('ERROR: Failed to delete unmodified database copy {}.'.
-                  format(temp_database_path),
-                  file=sys.stderr)
-            sys.exit(1)
-        if args.verbose:
-            print('INFO: De;eted unmodified database copy {}.'.
-                  format(temp_database_path))
-    else:
-
-        # Move the database copy into place.
-        try:
-            shutil.move(temp_database_path, args.database_path)
-        except:
-            print('ERROR: Failed to replace {} '.
-                  format(args.database_path) +
-                  'with temporary copy {}.'.format(temp_database_path),
-                  file=sys.stderr)
-            sys.exit(1)
-        if args.verbose:
-            print('INFO: Database copy {} moved to {}.'.
-                  format(temp_database_path, args.database_path))
-
-    # try:
-    #     shutil.move(temp_database_path, args.database_path)
-    # except:
-    #     print('ERROR: Failed to replace {} '.format(args.database_path) +
-    #           'with temporary copy {}.'.format(temp_database_path),
-    #           file=sys.stderr)
-    #     sys.exit(1)
-
-    # if args.verbose:
-    #     print('INFO: Database copy {} moved to {}.'.
-    #           format(temp_database_path, args.database_path))
-
     if args.verbose:
         print('So far so good.')
 
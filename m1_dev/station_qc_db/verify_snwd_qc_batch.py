@@ -0,0 +1,245 @@
+#!/usr/bin/python3.6
+
+"""
+Verify the batch snow depth QC tests (qc_durre_snwd_batch and
+qc_durre_snwd_gap_batch) against the scalar test functions, using inputs
+recorded by update_station_qc_db.py with the --record_qc_dir option, and
+synthetic inputs for the gap check with climatological reference values
+(see gap_reference_inputs), which recorded inputs do not include.
+"""
+
+import argparse
+import glob
+import os
+import sys
+import time
+import numpy as np
+import update_station_qc_db as qc
+
+
+def parse_args():
+    """
+    Parse command line arguments.
+    """
+
+    parser = argparse.ArgumentParser(description='Compare batch and ' +
+                                     'scalar snow depth QC test results ' +
+                                     'for recorded inputs.')
+    parser.add_argument('record_qc_dir',
+                        type=str,
+                        help='Directory of snwd_qc_inputs_*.npz files.')
+    parser.add_argument('-v', '--verbose',
+                        action='store_true',
+                        help='Provide verbose output.')
+
+    args = parser.parse_args()
+
+    if not os.path.isdir(args.record_qc_dir):
+        print('ERROR: directory {} not found.'.format(args.record_qc_dir),
+              file=sys.stderr)
+        sys.exit(1)
+
+    return args
+
+
+def compare_results(batch, scalar):
+    """
+    Return a list of (test name, number of mismatched stations) for tests
+    whose batch and scalar results differ.
+    """
+    mismatch = []
+    for qc_test_name, qc_bit in batch['qc_bits'].items():
+        bit = 1 << qc_bit
+        bad = ((batch['flag'] ^ scalar['flag']) & bit != 0) | \
+              ((batch['checked'] ^ scalar['checked']) & bit != 0)
+        if qc_test_name in batch['ref_ind']:
+            bad |= batch['ref_ind'][qc_test_name] != \
+                   scalar['ref_ind'][qc_test_name]
+        if np.any(bad):
+            mismatch.append((qc_test_name, np.count_nonzero(bad)))
+    return mismatch
+
+
+def scalar_gap(batch_inputs, num_hrs_gap, ref_ceiling_cm=None,
+               ref_default_cm=None):
+    """
+    Run qc_durre_snwd_gap for each station, returning a list of
+    (ts_flag_ind, ref_obs) results in the form of qc.gap_batch_result.
+    """
+    prev_snwd_val_cm = batch_inputs['prev_snwd_val_cm'][:, -num_hrs_gap:]
+    prev_snwd_qc = batch_inputs['prev_snwd_qc'][:, -num_hrs_gap:]
+    result = []
+    for si, snwd_val_cm in enumerate(batch_inputs['snwd_val_cm']):
+        ref_kwargs = {}
+        if ref_ceiling_cm is not None and ref_default_cm is not None:
+            ref_kwargs = {'ref_ceiling_cm': ref_ceiling_cm[si],
+                          'ref_default_cm': ref_default_cm[si]}
+        gap = qc.qc_durre_snwd_gap(snwd_val_cm,
+                                   prev_snwd_val_cm[si],
+                                   prev_snwd_qc[si],
+                                   **ref_kwargs)
+        if gap is None:
+            result.append((None, None))
+        else:
+            result.append(([int(ts_ind) for ts_ind in gap[0]],
+                           [float(ref) for ref in gap[1]]))
+    return result
+
+
+def compare_gap(gap, gap_scalar):
+    """
+    Return the number of stations whose batch and scalar gap check results
+    differ.
+    """
+    num_bad = 0
+    for si, (ts_flag_ind, ref_obs) in enumerate(gap_scalar):
+        batch_flag_ind, batch_ref_obs = qc.gap_batch_result(gap, si)
+        if batch_ref_obs is not None:
+            batch_ref_obs = [float(ref) for ref in batch_ref_obs]
+        if batch_flag_ind != ts_flag_ind or batch_ref_obs != ref_obs:
+            num_bad += 1
+    return num_bad
+
+
+def gap_reference_inputs(num_stations=400, num_hrs_gap=15*24, seed=0):
+    """
+    Make synthetic gap check inputs exercising the override of the median
+    reference value by ref_default_cm where it exceeds ref_ceiling_cm,
+    including masked (and NaN) ceilings and defaults, with and without a
+    usable first element in the time series. Returns the batch inputs and
+    the ref_ceiling_cm and ref_default_cm arrays.
+    """
+    rng = np.random.default_rng(seed)
+
+    # Snow depth with occasional spikes, reported at a random rate, and
+    # some flagged values.
+    depth = rng.uniform(0.0, 150.0, size=(num_stations, 1))
+    prev = depth + rng.normal(0.0, 5.0, size=(num_stations, num_hrs_gap))
+    spike = rng.random((num_stations, num_hrs_gap)) < 0.02
+    prev[spike] += rng.uniform(-200.0, 200.0, size=np.count_nonzero(spike))
+    rate = rng.choice([0.01, 0.05, 0.3, 0.9], size=(num_stations, 1))
+    missing = rng.random((num_stations, num_hrs_gap)) > rate
+    missing[:, 0] = rng.random(num_stations) < 0.5
+    prev_qc = np.where(rng.random((num_stations, num_hrs_gap)) < 0.02,
+                       1, 0).astype(np.int32)
+    snwd = depth[:, 0] + rng.uniform(-100.0, 200.0, size=num_stations)
+
+    # Ceilings mostly below the median, so the override applies.
+    ref_ceiling_cm = np.ma.masked_array(depth[:, 0] *
+                                        rng.uniform(0.2, 1.5, num_stations),
+                                        mask=rng.random(num_stations) < 0.1)
+    ref_default_cm = np.ma.masked_array(rng.uniform(0.0, 100.0,
+                                                    num_stations),
+                                        mask=rng.random(num_stations) < 0.4)
+    ref_default_cm[rng.random(num_stations) < 0.1] = np.nan
+
+    batch_inputs = {'snwd_val_cm': np.ma.masked_array(snwd),
+                    'prev_snwd_val_cm': np.ma.masked_array(prev,
+                                                           mask=missing),
+                    'prev_snwd_qc': prev_qc}
+    return batch_inputs, ref_ceiling_cm, ref_default_cm
+
+
+def check_gap_reference(verbose=False):
+    """
+    Compare batch and scalar gap check results for gap_reference_inputs.
+    Returns the number of stations whose results differ.
+    """
+    num_hrs_gap = 15 * 24
+    batch_inputs, ref_ceiling_cm, ref_default_cm = \
+        gap_reference_inputs(num_hrs_gap=num_hrs_gap)
+    gap = qc.qc_durre_snwd_gap_batch(batch_inputs['snwd_val_cm'],
+                                     batch_inputs['prev_snwd_val_cm'],
+                                     batch_inputs['prev_snwd_qc'],
+                                     num_hrs_gap=num_hrs_gap,
+                                     ref_ceiling_cm=ref_ceiling_cm,
+                                     ref_default_cm=ref_default_cm)
+    gap_scalar = scalar_gap(batch_inputs,
+                            num_hrs_gap,
+                            ref_ceiling_cm=ref_ceiling_cm,
+                            ref_default_cm=ref_default_cm)
+    num_bad = compare_gap(gap, gap_scalar)
+    if num_bad > 0:
+        print('ERROR: synthetic reference value inputs: "gap" results ' +
+              'differ for {} stations.'.format(num_bad),
+              file=sys.stderr)
+    elif verbose:
+        print('INFO: synthetic reference value inputs: ' +
+              '{} stations agree.'.format(len(gap_scalar)))
+    return num_bad
+
+
+def main():
+    """
+    Run both versions of the tests for each recorded hour.
+    """
+
+    args = parse_args()
+
+    file_list = sorted(glob.glob(os.path.join(args.record_qc_dir,
+                                              'snwd_qc_inputs_*.npz')))
+    if len(file_list) == 0:
+        print('ERROR: no recorded inputs found in {}.'.
+              format(args.record_qc_dir),
+              file=sys.stderr)
+        sys.exit(1)
+
+    num_reference_bad = check_gap_reference(args.verbose)
+
+    num_failed = 0
+    batch_seconds = 0.0
+    scalar_seconds = 0.0
+
+    for file_path in file_list:
+
+        batch_inputs = qc.load_snwd_batch_inputs(file_path)
+
+        t1 = time.perf_counter()
+        batch = qc.qc_durre_snwd_batch(**batch_inputs)
+        t2 = time.perf_counter()
+        scalar = qc.qc_durre_snwd_scalar(**batch_inputs)
+        t3 = time.perf_counter()
+        batch_seconds += t2 - t1
+        scalar_seconds += t3 - t2
+
+        mismatch = compare_results(batch, scalar)
+
+        num_hrs_gap = 15 * 24
+        t1 = time.perf_counter()
+        gap = qc.qc_durre_snwd_gap_batch(batch_inputs['snwd_val_cm'],
+                                         batch_inputs['prev_snwd_val_cm'],
+                                         batch_inputs['prev_snwd_qc'],
+                                         num_hrs_gap=num_hrs_gap)
+        t2 = time.perf_counter()
+        gap_scalar = scalar_gap(batch_inputs, num_hrs_gap)
+        t3 = time.perf_counter()
+        batch_seconds += t2 - t1
+        scalar_seconds += t3 - t2
+
+        num_bad = compare_gap(gap, gap_scalar)
+        if num_bad > 0:
+            mismatch.append(('gap', num_bad))
+        if len(mismatch) > 0:
+            num_failed += 1
+            for qc_test_name, num_bad in mismatch:
+                print('ERROR: {}: "{}" results differ for {} stations.'.
+                      format(os.path.basename(file_path),
+                             qc_test_name,
+                             num_bad),
+                      file=sys.stderr)
+        elif args.verbose:
+            print('INFO: {}: {} stations agree.'.
+                  format(os.path.basename(file_path),
+                         len(batch['flag'])))
+
+    print('INFO: {} of {} hours agree; '.
+          format(len(file_list) - num_failed, len(file_list)) +
+          'batch {:.3f} seconds, scalar {:.3f} seconds.'.
+          format(batch_seconds, scalar_seconds))
+
+    if num_failed > 0 or num_reference_bad > 0:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
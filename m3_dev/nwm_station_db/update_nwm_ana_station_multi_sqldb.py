@@ -24,7 +24,7 @@ import sqlite3
 import pyproj
 import pandas as pd
 import matplotlib.pyplot as plt
-import psycopg2
+import wdb0
 import numpy as np
 from netCDF4 import Dataset, num2date
 import getpass
@@ -2243,13 +2243,6 @@ def update_nwm_db_allstation(db_file,
         max_obj_id = -1
     print('max_obj_id =', max_obj_id)
 
-    # Open the web database.
-    #web_conn_string = "host='wdb0' dbname='web_data'"
-    web_conn_string = "host='wdb0.dmz.nohrsc.noaa.gov' dbname='web_data'"
-    web_conn = psycopg2.connect(web_conn_string)
-    web_conn.set_client_encoding("utf-8")
-    web_cursor = web_conn.cursor()
-
     # Generate a list of point.allstation columns to retrieve, and
     # corresponding column names for the resulting pandas dataframe
     # that will be created.
@@ -2331,9 +2324,13 @@ def update_nwm_db_allstation(db_file,
     #this_station_update_datetime = dt.datetime.utcnow()
     this_station_update_datetime_ep = time.time()
 
-    web_cursor.execute(sql_meta_with_snow)
-    # allstation is just a huge list of tuples.
-    allstation = web_cursor.fetchall()
+    # Query the web database using a pooled connection (see wdb0.py).
+    with wdb0.connection() as web_conn:
+        web_cursor = web_conn.cursor()
+        web_cursor.execute(sql_meta_with_snow)
+        # allstation is just a huge list of tuples.
+        allstation = web_cursor.fetchall()
+        web_cursor.close()
     wdb_df = pd.DataFrame(allstation, columns=sqldb_column_names)
     finish_station_update_datetime_ep = time.time()
     print('\nINFO: Time spending on query is {} minutes.'.format
@@ -2450,10 +2447,6 @@ def update_nwm_db_allstation(db_file,
           '\n actual final number of stations now is {}.'.format
            (len(wdb_df) - num_out_of_bounds))
 
-    #close web-database connection
-    web_cursor.close()
-    web_conn.close()
-
     #return db_ind
     return total_stations
 
@@ -0,0 +1,236 @@
+"""
+Vectorized distances between large numbers of latitude/longitude point
+pairs on the WGS84 ellipsoid.
+
+inverse_km solves the Vincenty inverse problem for arrays of point pairs
+with numpy, agreeing with geopy.distance.distance to well under a
+millimeter at a tiny fraction of the cost. Because most uses only need
+distances for pairs within some radius, pairs can first be screened with
+the much cheaper spherical great circle distance (prefilter) and only the
+survivors passed to inverse_km (see pairs_within_km).
+"""
+
+import numpy as np
+from geopy import distance
+
+# WGS84 ellipsoid.
+WGS84_SEMI_MAJOR_KM = 6378.137
+WGS84_FLATTENING = 1.0 / 298.257223563
+WGS84_SEMI_MINOR_KM = (1.0 - WGS84_FLATTENING) * WGS84_SEMI_MAJOR_KM
+
+# Mean radius of the Earth (the IUGG mean radius R1 of the WGS84 ellipsoid).
+MEAN_EARTH_RADIUS_KM = 6371.0088
+
+# Great circle distances on the R1 sphere differ from WGS84 geodesic
+# distances by less than 0.6%, so a prefilter radius this much larger than
+# the target radius never rejects a pair that is inside it.
+PREFILTER_MARGIN = 0.01
+
+# Number of point pairs handled at a time by inverse_km, which limits the
+# memory used for temporary arrays (roughly 200 bytes per pair).
+DEFAULT_BLOCK_SIZE = 1000000
+
+
+def _as_pair_arrays(lat1, lon1, lat2, lon2):
+
+    """
+    Broadcast point pair coordinates to float64 arrays of the same shape.
+    """
+
+    return(np.broadcast_arrays(np.asarray(lat1, dtype=np.float64),
+                               np.asarray(lon1, dtype=np.float64),
+                               np.asarray(lat2, dtype=np.float64),
+                               np.asarray(lon2, dtype=np.float64)))
+
+
+def unit_vectors(lat, lon):
+
+    """
+    Convert arrays of latitude and longitude (degrees) to [n, 3] Earth-
+    centered unit vectors, in which the Euclidean (chord) distance between
+    two points increases monotonically with their great circle distance.
+    """
+
+    lat_rad = np.radians(np.asarray(lat, dtype=np.float64))
+    lon_rad = np.radians(np.asarray(lon, dtype=np.float64))
+    cos_lat = np.cos(lat_rad)
+
+    return(np.column_stack((cos_lat * np.cos(lon_rad),
+                            cos_lat * np.sin(lon_rad),
+                            np.sin(lat_rad))))
+
+
+def great_circle_km(lat1, lon1, lat2, lon2):
+
+    """
+    Great circle distance in km between lat1/lon1 and lat2/lon2 (degrees)
+    on a sphere with the mean radius of the Earth. These are within 0.6% of
+    WGS84 geodesic distances.
+    """
+
+    lat1, lon1, lat2, lon2 = _as_pair_arrays(lat1, lon1, lat2, lon2)
+
+    # Haversine formula.
+    sin_half_dlat = np.sin(0.5 * np.radians(lat2 - lat1))
+    sin_half_dlon = np.sin(0.5 * np.radians(lon2 - lon1))
+    h = sin_half_dlat ** 2 + \
+        np.cos(np.radians(lat1)) * np.cos(np.radians(lat2)) * \
+        sin_half_dlon ** 2
+
+    return(2.0 * MEAN_EARTH_RADIUS_KM *
+           np.arcsin(np.sqrt(np.minimum(h, 1.0))))
+
+
+def _vincenty_inverse_km(lat1, lon1, lat2, lon2, max_iters, tolerance):
+
+    """
+    Vincenty inverse solution for 1-D arrays of point pairs. Returns
+    distances in km and a boolean array indicating which pairs did not
+    converge. Pairs with missing coordinates are not iterated on.
+    """
+
+    a_km = WGS84_SEMI_MAJOR_KM
+    b_km = WGS84_SEMI_MINOR_KM
+    f = WGS84_FLATTENING
+
+    L = np.radians(lon2 - lon1)
+    U1 = np.arctan((1.0 - f) * np.tan(np.radians(lat1)))
+    U2 = np.arctan((1.0 - f) * np.tan(np.radians(lat2)))
+    sin_U1 = np.sin(U1)
+    cos_U1 = np.cos(U1)
+    sin_U2 = np.sin(U2)
+    cos_U2 = np.cos(U2)
+
+    missing = ~(np.isfinite(L) & np.isfinite(U1) & np.isfinite(U2))
+    lam = L.copy()
+    converged = np.zeros(L.shape, dtype=bool)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        for i in range(max_iters):
+            sin_lam = np.sin(lam)
+            cos_lam = np.cos(lam)
+            sin_sigma = np.sqrt((cos_U2 * sin_lam) ** 2 +
+                                (cos_U1 * sin_U2 -
+                                 sin_U1 * cos_U2 * cos_lam) ** 2)
+            cos_sigma = sin_U1 * sin_U2 + cos_U1 * cos_U2 * cos_lam
+            sigma = np.arctan2(sin_sigma, cos_sigma)
+            sin_alpha = np.where(sin_sigma == 0.0,
+                                 0.0,
+                                 cos_U1 * cos_U2 * sin_lam / sin_sigma)
+            cos2_alpha = 1.0 - sin_alpha ** 2
+            # Equatorial lines have cos2_alpha = 0.
+            cos_2sigma_m = np.where(cos2_alpha == 0.0,
+                                    0.0,
+                                    cos_sigma -
+                                    2.0 * sin_U1 * sin_U2 / cos2_alpha)
+            C = f / 16.0 * cos2_alpha * (4.0 + f * (4.0 - 3.0 * cos2_alpha))
+            lam_prev = lam
+            lam = L + (1.0 - C) * f * sin_alpha * \
+                  (sigma + C * sin_sigma *
+                   (cos_2sigma_m + C * cos_sigma *
+                    (-1.0 + 2.0 * cos_2sigma_m ** 2)))
+            converged = (np.abs(lam - lam_prev) <= tolerance) | missing
+            if np.all(converged):
+                break
+
+    u2 = cos2_alpha * (a_km ** 2 - b_km ** 2) / b_km ** 2
+    A = 1.0 + u2 / 16384.0 * \
+        (4096.0 + u2 * (-768.0 + u2 * (320.0 - 175.0 * u2)))
+    B = u2 / 1024.0 * (256.0 + u2 * (-128.0 + u2 * (74.0 - 47.0 * u2)))
+    delta_sigma = B * sin_sigma * \
+                  (cos_2sigma_m + B / 4.0 *
+                   (cos_sigma * (-1.0 + 2.0 * cos_2sigma_m ** 2) -
+                    B / 6.0 * cos_2sigma_m *
+                    (-3.0 + 4.0 * sin_sigma ** 2) *
+                    (-3.0 + 4.0 * cos_2sigma_m ** 2)))
+
+    return(b_km * A * (sigma - delta_sigma), ~converged)
+
+
+def inverse_km(lat1,
+               lon1,
+               lat2,
+               lon2,
+               max_iters=200,
+               tolerance=1.0e-12,
+               block_size=DEFAULT_BLOCK_SIZE):
+
+    """
+    Vectorized Vincenty inverse solution for the distance in km between
+    lat1/lon1 and lat2/lon2 on the WGS84 ellipsoid. Inputs are numpy arrays
+    (or scalars) of degrees, and are broadcast against each other. Results
+    agree with geopy.distance.distance to well under a millimeter; for the
+    rare (nearly antipodal) pairs where the iteration does not converge,
+    geopy.distance.distance is used instead. Pairs with missing (NaN)
+    coordinates have NaN distances.
+
+    Pairs are processed block_size at a time to limit memory use.
+    """
+
+    lat1, lon1, lat2, lon2 = _as_pair_arrays(lat1, lon1, lat2, lon2)
+    shape = lat1.shape
+    lat1 = lat1.ravel()
+    lon1 = lon1.ravel()
+    lat2 = lat2.ravel()
+    lon2 = lon2.ravel()
+
+    dist_km = np.empty(len(lat1), dtype=np.float64)
+    for block_start in range(0, len(lat1), max(1, block_size)):
+        block = slice(block_start, block_start + max(1, block_size))
+        block_dist_km, failed = \
+            _vincenty_inverse_km(lat1[block], lon1[block],
+                                 lat2[block], lon2[block],
+                                 max_iters, tolerance)
+        for ind in (np.flatnonzero(failed) + block_start).tolist():
+            block_dist_km[ind - block_start] = \
+                distance.distance((lat1[ind], lon1[ind]),
+                                  (lat2[ind], lon2[ind])).km
+        dist_km[block] = block_dist_km
+
+    return(dist_km.reshape(shape))
+
+
+def prefilter(lat1, lon1, lat2, lon2, max_km):
+
+    """
+    Return a boolean array identifying the lat1/lon1, lat2/lon2 point pairs
+    that may be within max_km of each other on the WGS84 ellipsoid, based
+    on their great circle distance. No pair within max_km is rejected; some
+    pairs slightly beyond it may be accepted.
+    """
+
+    lat1, lon1, lat2, lon2 = _as_pair_arrays(lat1, lon1, lat2, lon2)
+
+    # Reject pairs whose latitudes alone are too far apart before doing any
+    # trigonometry. A degree of latitude is at least 110.5 km.
+    search_km = max_km * (1.0 + PREFILTER_MARGIN)
+    candidate = np.abs(lat2 - lat1) * 110.5 <= search_km
+    candidate[candidate] = \
+        great_circle_km(lat1[candidate], lon1[candidate],
+                        lat2[candidate], lon2[candidate]) <= search_km
+
+    return(candidate)
+
+
+def pairs_within_km(lat1, lon1, lat2, lon2, max_km, **kwargs):
+
+    """
+    Find the lat1/lon1, lat2/lon2 point pairs that are within max_km of each
+    other on the WGS84 ellipsoid, by applying prefilter and then computing
+    inverse_km for the pairs that pass it. Inputs are broadcast against
+    each other and flattened. Returns the indices of the pairs within
+    max_km and their distances in km. Additional keyword arguments are
+    passed to inverse_km.
+    """
+
+    lat1, lon1, lat2, lon2 = _as_pair_arrays(lat1, lon1, lat2, lon2)
+    lat1 = lat1.ravel()
+    lon1 = lon1.ravel()
+    lat2 = lat2.ravel()
+    lon2 = lon2.ravel()
+
+    ind = np.flatnonzero(prefilter(lat1, lon1, lat2, lon2, max_km))
+    dist_km = inverse_km(lat1[ind], lon1[ind], lat2[ind], lon2[ind],
+                         **kwargs)
+    keep = dist_km <= max_km
+
+    return(ind[keep], dist_km[keep])
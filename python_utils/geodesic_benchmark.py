@@ -0,0 +1,156 @@
+#!/usr/bin/python3
+
+"""
+Benchmark the geodesic.py distance kernels against geopy.
+
+For each requested number of point pairs, random pairs are generated over
+the conterminous US, with the second point of each pair offset from the
+first by up to a few degrees. Then the time taken to compute distances with
+geopy.distance.distance (on a sample of pairs, extrapolated to all of
+them), with geodesic.inverse_km, and with geodesic.pairs_within_km (the
+prefilter-then-refine path) is reported, along with the largest difference
+from geopy.
+"""
+
+import argparse
+import sys
+import time
+import numpy as np
+from geopy import distance
+import geodesic
+
+
+def parse_args():
+
+    """
+    Parse command line arguments.
+    """
+
+    parser = argparse.ArgumentParser(description='Benchmark geodesic ' +
+                                     'distance kernels against geopy.')
+
+    parser.add_argument('-n', '--num_pairs',
+                        type=int,
+                        nargs='+',
+                        default=[100000, 1000000, 10000000],
+                        help='Numbers of point pairs to benchmark.')
+
+    parser.add_argument('-g', '--geopy_sample',
+                        type=int,
+                        default=20000,
+                        help='Number of pairs to time geopy on; its time ' +
+                        'for all pairs is extrapolated from these.')
+
+    parser.add_argument('-r', '--radius_km',
+                        type=float,
+                        default=75.0,
+                        help='Radius for pairs_within_km.')
+
+    parser.add_argument('-s', '--spread_deg',
+                        type=float,
+                        default=3.0,
+                        help='Largest latitude and longitude offset ' +
+                        'between the points of a pair.')
+
+    parser.add_argument('-v', '--verbose',
+                        action='store_true',
+                        help='Provide verbose output.')
+
+    args = parser.parse_args()
+
+    if min(args.num_pairs) < 1:
+        print('ERROR: numbers of pairs must be positive.', file=sys.stderr)
+        sys.exit(1)
+
+    if args.geopy_sample < 1:
+        print('ERROR: geopy sample size must be positive.', file=sys.stderr)
+        sys.exit(1)
+
+    return(args)
+
+
+def random_pairs(num_pairs, spread_deg, rng):
+
+    """
+    Generate random point pairs over the conterminous US.
+    """
+
+    lat1 = rng.uniform(25.0, 50.0, num_pairs)
+    lon1 = rng.uniform(-125.0, -67.0, num_pairs)
+    lat2 = lat1 + rng.uniform(-spread_deg, spread_deg, num_pairs)
+    lon2 = lon1 + rng.uniform(-spread_deg, spread_deg, num_pairs)
+
+    return(lat1, lon1, lat2, lon2)
+
+
+def main():
+
+    """
+    Time each distance kernel and compare results with geopy.
+    """
+
+    args = parse_args()
+
+    rng = np.random.default_rng(0)
+
+    print('{:>10s} {:>12s} {:>12s} {:>9s} {:>12s} {:>9s} {:>10s}'.
+          format('pairs', 'geopy (s)', 'inverse (s)', 'speedup',
+                 'within (s)', 'speedup', 'max err (m)'))
+
+    for num_pairs in args.num_pairs:
+
+        lat1, lon1, lat2, lon2 = random_pairs(num_pairs,
+                                              args.spread_deg,
+                                              rng)
+
+        # geopy, on a sample.
+        num_sample = min(num_pairs, args.geopy_sample)
+        t1 = time.perf_counter()
+        geopy_km = np.array([distance.distance((lat1[ind], lon1[ind]),
+                                               (lat2[ind], lon2[ind])).km
+                             for ind in range(num_sample)])
+        geopy_time = (time.perf_counter() - t1) * num_pairs / num_sample
+
+        # All pairs with inverse_km.
+        t1 = time.perf_counter()
+        dist_km = geodesic.inverse_km(lat1, lon1, lat2, lon2)
+        inverse_time = time.perf_counter() - t1
+
+        # Pairs within the radius with pairs_within_km.
+        t1 = time.perf_counter()
+        within_ind, within_km = geodesic.pairs_within_km(lat1, lon1,
+                                                         lat2, lon2,
+                                                         args.radius_km)
+        within_time = time.perf_counter() - t1
+
+        max_err_m = np.max(np.abs(dist_km[0:num_sample] - geopy_km)) * \
+                    1000.0
+
+        # The prefilter must not lose any pairs. (Distances can differ by
+        # micrometers, as the Vincenty iteration count depends on which
+        # pairs are computed together.)
+        expected_ind = np.flatnonzero(dist_km <= args.radius_km)
+        if not np.array_equal(within_ind, expected_ind) or \
+           not np.allclose(within_km, dist_km[expected_ind],
+                           rtol=0.0, atol=1.0e-6):
+            print('ERROR: pairs_within_km disagrees with inverse_km for ' +
+                  '{} pairs.'.format(num_pairs),
+                  file=sys.stderr)
+            sys.exit(1)
+
+        if args.verbose:
+            print('INFO: {} of {} pairs within {} km.'.
+                  format(len(within_ind), num_pairs, args.radius_km))
+
+        print('{:10d} {:12.3f} {:12.3f} {:8.0f}x {:12.3f} {:8.0f}x {:10.2e}'.
+              format(num_pairs,
+                     geopy_time,
+                     inverse_time,
+                     geopy_time / inverse_time,
+                     within_time,
+                     geopy_time / within_time,
+                     max_err_m))
+
+
+if __name__ == '__main__':
+    main()
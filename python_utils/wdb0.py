@@ -1,4 +1,15 @@
+import io
 import os
+import re
+import json
+import decimal
+import shutil
+import sqlite3
+import sys
+import time
+import atexit
+import threading
+import contextlib
 import psycopg2
 import pandas as pd
 import numpy as np
@@ -9,13 +20,1859 @@ import datetime as dt
 Functions for reading data from wdb0.
 """
 
-def get_snow_depth_obs(begin_datetime,
+# Default connection string for the "web_data" database on wdb0. This may be
+# overridden with the WDB0_DSN environment variable or with configure().
+DEFAULT_DSN = "host='wdb0.dmz.nohrsc.noaa.gov' dbname='web_data'"
+
+
+def _psycopg2_connect(dsn):
+
+    """
+    Open a psycopg2 connection to the web database.
+    """
+
+    conn = psycopg2.connect(dsn)
+    conn.set_client_encoding("utf-8")
+    return(conn)
+
+
+class ConnectionPool:
+
+    """
+    A small pool of open connections to the web database, so that repeated
+    queries reuse connections instead of opening a new one each time.
+
+    The connect argument is a function that takes the DSN and returns a
+    DB-API connection; it defaults to psycopg2, but e.g. sqlite3.connect can
+    be used to test against a local stand-in database.
+
+    Idle connections that have not been used for health_check_seconds are
+    checked with a trivial query before being handed out, and replaced if
+    the check fails.
+    """
+
+    def __init__(self,
+                 dsn,
+                 connect=None,
+                 max_idle=2,
+                 health_check_seconds=60.0):
+        self.dsn = dsn
+        if connect is None:
+            connect = _psycopg2_connect
+        self.connect = connect
+        self.max_idle = max_idle
+        self.health_check_seconds = health_check_seconds
+        self.num_connects = 0
+        self.num_reuses = 0
+        self.num_failed_checks = 0
+        self._idle = []
+        self._lock = threading.Lock()
+
+    def _is_healthy(self, conn):
+        if getattr(conn, 'closed', 0):
+            return False
+        try:
+            cursor = conn.cursor()
+            cursor.execute('SELECT 1;')
+            cursor.fetchall()
+            cursor.close()
+            conn.rollback()
+        except Exception:
+            return False
+        return True
+
+    def _discard(self, conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def get(self):
+
+        """
+        Get an open connection, from the idle list if possible.
+        """
+
+        while True:
+            with self._lock:
+                if len(self._idle) == 0:
+                    break
+                conn, last_used = self._idle.pop()
+            if time.time() - last_used < self.health_check_seconds or \
+               self._is_healthy(conn):
+                self.num_reuses += 1
+                return(conn)
+            self.num_failed_checks += 1
+            self._discard(conn)
+
+        conn = self.connect(self.dsn)
+        self.num_connects += 1
+        return(conn)
+
+    def put(self, conn):
+
+        """
+        Return a connection to the pool. Any open transaction is rolled
+        back, since all wdb0 queries are read-only.
+        """
+
+        try:
+            conn.rollback()
+        except Exception:
+            self._discard(conn)
+            return
+        with self._lock:
+            if len(self._idle) < self.max_idle:
+                self._idle.append((conn, time.time()))
+                return
+        self._discard(conn)
+
+    def close(self):
+
+        """
+        Close all idle connections.
+        """
+
+        with self._lock:
+            idle = self._idle
+            self._idle = []
+        for conn, last_used in idle:
+            self._discard(conn)
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def configure(dsn=None,
+              connect=None,
+              max_idle=2,
+              health_check_seconds=60.0):
+
+    """
+    Set up the connection pool used by all functions in this module. If dsn
+    is None, the WDB0_DSN environment variable is used if set, and
+    DEFAULT_DSN otherwise. Any existing pool is closed.
+    """
+
+    global _pool
+
+    if dsn is None:
+        dsn = os.environ.get('WDB0_DSN', DEFAULT_DSN)
+
+    pool = ConnectionPool(dsn,
+                          connect=connect,
+                          max_idle=max_idle,
+                          health_check_seconds=health_check_seconds)
+    with _pool_lock:
+        old_pool = _pool
+        _pool = pool
+    if old_pool is not None:
+        old_pool.close()
+
+    return(pool)
+
+
+def get_pool():
+
+    """
+    Get the module connection pool, creating it with default settings if
+    configure() has not been called. The check and the creation are both
+    done under the pool lock, so threads making their first query at the
+    same time share one pool.
+    """
+
+    global _pool
+
+    with _pool_lock:
+        if _pool is None:
+            _pool = ConnectionPool(os.environ.get('WDB0_DSN', DEFAULT_DSN))
+        return(_pool)
+
+
+@contextlib.contextmanager
+def connection():
+
+    """
+    Context manager providing a pooled connection to the web database:
+
+        with wdb0.connection() as conn:
+            cursor = conn.cursor()
+            ...
+
+    The connection is returned to the pool on exit, or closed if an
+    exception occurred while it was in use.
+    """
+
+    pool = get_pool()
+    conn = pool.get()
+    try:
+        yield conn
+    except:
+        pool._discard(conn)
+        raise
+    pool.put(conn)
+
+
+def close_connections():
+
+    """
+    Close all pooled connections to the web database.
+    """
+
+    if _pool is not None:
+        _pool.close()
+
+
+atexit.register(close_connections)
+
+
+def _fetchall(sql_cmd):
+
+    """
+    Run a SQL statement on the web database and return all rows as a list
+    of tuples.
+    """
+
+    with connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(sql_cmd)
+        rows = cursor.fetchall()
+        cursor.close()
+
+    return(rows)
+
+
+# Default number of rows per batch when streaming query results.
+DEFAULT_ITERSIZE = 10000
+
+
+def _iter_batches(sql_cmd, itersize=None):
+
+    """
+    Run a SQL statement on the web database and yield the results in
+    batches of at most itersize rows, as lists of tuples.
+
+    A named (server-side) cursor is used, so the server holds the result
+    set and only one batch of rows is in client memory at a time. For
+    connections that do not support named cursors (e.g. sqlite3 stand-ins),
+    an ordinary cursor is used.
+    """
+
+    if itersize is None:
+        itersize = DEFAULT_ITERSIZE
+
+    with connection() as conn:
+        try:
+            cursor = conn.cursor(name='wdb0_stream_{}'.
+                                 format(threading.get_ident()))
+            cursor.itersize = itersize
+        except TypeError:
+            cursor = conn.cursor()
+        try:
+            cursor.execute(sql_cmd)
+            while True:
+                rows = cursor.fetchmany(itersize)
+                if len(rows) == 0:
+                    break
+                yield rows
+        finally:
+            cursor.close()
+
+
+class _StationHourAccumulator:
+
+    """
+    Build the dictionary returned by the get_*_obs functions one batch of
+    query rows at a time. Rows are tuples of obj_identifier, date and value,
+    and must arrive sorted by obj_identifier.
+
+    Values are scattered directly into preallocated [station, time] buffers
+    (or [station] buffers if num_hours is None), which grow geometrically in
+    the station dimension as needed. Station metadata are attached from a
+    StationCache when the result is requested. The result is identical to
+    that of _pivot_station_hour for the same rows.
+    """
+
+    def __init__(self,
+                 obs_datetime,
+                 num_hours,
+                 no_data_value=-99999.0,
+                 station_capacity=1024):
+        self.obs_datetime = obs_datetime
+        self.num_hours = num_hours
+        self.no_data_value = no_data_value
+        self.num_stations = 0
+        self.station_index = {}
+        self.station_obj_id = []
+        self._obs_data = None
+        self._obs_mask = None
+        self._allocate(station_capacity)
+
+    def _allocate(self, capacity):
+
+        """
+        Allocate buffers for capacity stations, keeping existing data.
+        """
+
+        if self.num_hours is None:
+            shape = [capacity]
+        else:
+            shape = [capacity, self.num_hours]
+        obs_data = np.full(shape, self.no_data_value, dtype=float)
+        obs_mask = np.ones(shape, dtype=bool)
+        if self._obs_data is not None:
+            old_capacity = self._obs_data.shape[0]
+            obs_data[0:old_capacity] = self._obs_data
+            obs_mask[0:old_capacity] = self._obs_mask
+        self._obs_data = obs_data
+        self._obs_mask = obs_mask
+
+    def add_batch(self, rows):
+
+        """
+        Add a batch of query rows.
+        """
+
+        if len(rows) == 0:
+            return
+
+        # Building a dataframe is the fastest way to split rows into
+        # columns and convert the dates.
+        df = pd.DataFrame(rows)
+
+        # Assign station indices.
+        batch_code, batch_obj_id = pd.factorize(df[0], sort=False)
+        batch_station_ind = np.empty(len(batch_obj_id), dtype=np.int64)
+        for bi, obj_id in enumerate(batch_obj_id.tolist()):
+            ind = self.station_index.get(obj_id)
+            if ind is None:
+                ind = self.num_stations
+                self.station_index[obj_id] = ind
+                self.station_obj_id.append(obj_id)
+                self.num_stations += 1
+            batch_station_ind[bi] = ind
+
+        capacity = self._obs_data.shape[0]
+        if self.num_stations > capacity:
+            while capacity < self.num_stations:
+                capacity *= 2
+            self._allocate(capacity)
+
+        station_ind = batch_station_ind[batch_code]
+        values = df[2].to_numpy(dtype=float)
+
+        if self.num_hours is None:
+            ind = (station_ind,)
+        else:
+            # Calculate hour offsets relative to the first hour.
+            time_ind = (df[1].to_numpy(dtype='datetime64[s]') -
+                        np.datetime64(self.obs_datetime, 's')) // \
+                       np.timedelta64(1, 'h')
+            time_ind = time_ind.astype(np.int64)
+            if np.any((time_ind < 0) | (time_ind >= self.num_hours)):
+                print('ERROR: observation times outside the expected ' +
+                      'range of {} hours '.format(self.num_hours) +
+                      'starting {}.'.format(self.obs_datetime),
+                      file=sys.stderr)
+                sys.exit(1)
+            ind = (station_ind, time_ind)
+
+        self._obs_data[ind] = values
+        self._obs_mask[ind] = False
+
+    def result(self, values_key, station_cache, verbose=None):
+
+        """
+        Return the accumulated results as a dictionary, with station
+        metadata from station_cache. Stations that are not in
+        point.allstation are dropped.
+        """
+
+        meta_df = station_cache.lookup(self.station_obj_id, verbose=verbose)
+        keep = np.isin(self.station_obj_id, meta_df['obj_identifier'])
+        keep = np.flatnonzero(keep)
+
+        obs = np.ma.masked_array(self._obs_data[keep],
+                                 mask=self._obs_mask[keep])
+
+        # Place results in a dictionary.
+        result = {'num_stations': len(meta_df)}
+        if self.num_hours is not None:
+            result['num_hours'] = self.num_hours
+        _station_meta_lists(result, meta_df)
+        if self.num_hours is None:
+            result['obs_datetime'] = self.obs_datetime
+        else:
+            result['obs_datetime'] = [self.obs_datetime +
+                                      dt.timedelta(hours=i)
+                                      for i in range(self.num_hours)]
+        result[values_key] = obs
+
+        return(result)
+
+
+def _stream_station_hour(sql_cmd,
+                         values_key,
+                         obs_datetime,
+                         num_hours,
+                         no_data_value=-99999.0,
+                         itersize=None,
+                         scratch_dir=None,
+                         verbose=None):
+
+    """
+    Streaming counterpart of _fetchall followed by _pivot_station_hour:
+    run sql_cmd with a server-side cursor and consume the rows in batches
+    straight into the [station, time] buffers.
+    """
+
+    accum = _StationHourAccumulator(obs_datetime,
+                                    num_hours,
+                                    no_data_value=no_data_value)
+    for rows in _iter_batches(sql_cmd, itersize=itersize):
+        accum.add_batch(rows)
+
+    return(accum.result(values_key,
+                        get_station_cache(scratch_dir),
+                        verbose=verbose))
+
+
+def _station_meta_lists(result, meta_df):
+
+    """
+    Add station metadata lists from meta_df (as returned by
+    StationCache.lookup) to a get_*_obs result dictionary.
+    """
+
+    result['station_obj_id'] = meta_df['obj_identifier'].tolist()
+    result['station_id'] = meta_df['station_id'].tolist()
+    result['station_name'] = meta_df['name'].tolist()
+    result['station_lon'] = meta_df['lon'].tolist()
+    result['station_lat'] = meta_df['lat'].tolist()
+    result['station_elevation'] = meta_df['elevation'].tolist()
+    result['station_rec_elevation'] = \
+        meta_df['recorded_elevation'].tolist()
+
+
+def _pivot_station_hour(df,
+                        value_column,
+                        values_key,
+                        obs_datetime,
+                        num_hours,
+                        no_data_value=-99999.0,
+                        station_cache=None,
+                        verbose=None):
+
+    """
+    Organize query results into the dictionary returned by the get_*_obs
+    functions. The dataframe df must have the obj_identifier and date
+    columns, plus value_column, and must be sorted by obj_identifier.
+
+    Station metadata are taken from station_cache (see StationCache), and
+    observations from stations that are not in point.allstation are
+    dropped, as they would be by a join in SQL. If station_cache is None,
+    df must also have the station_id, name, lon, lat, elevation and
+    recorded_elevation columns, and metadata are taken from there.
+
+    If num_hours is given, values are placed in a 2-d [station, time] masked
+    array whose first hour is obs_datetime. If num_hours is None, values are
+    placed in a 1-d [station] masked array and obs_datetime is stored as is.
+
+    Stations are numbered in order of first appearance by factorizing
+    obj_identifier, and all values are scattered into a preallocated array
+    in one step, rather than growing the array one station at a time.
+    """
+
+    if station_cache is None:
+        # Locate the first row for each station, for station metadata.
+        first_row = np.unique(df['obj_identifier'].to_numpy(),
+                              return_index=True)[1]
+        meta_df = df[_copy_meta_column_list].iloc[np.sort(first_row)]
+    else:
+        meta_df = station_cache.lookup(pd.unique(df['obj_identifier']),
+                                       verbose=verbose)
+        df = df[df['obj_identifier'].isin(meta_df['obj_identifier'])]
+
+    station_code, station_obj_id = pd.factorize(df['obj_identifier'],
+                                                sort=False)
+    num_stations = len(station_obj_id)
+
+    if num_hours is None:
+        shape = [num_stations]
+    else:
+        shape = [num_stations, num_hours]
+    obs_data = np.full(shape, no_data_value, dtype=float)
+    obs_mask = np.ones(shape, dtype=bool)
+
+    if num_stations > 0:
+
+        values = df[value_column].to_numpy(dtype=float)
+
+        if num_hours is None:
+            ind = (station_code,)
+        else:
+            # Calculate hour offsets relative to the first hour.
+            time_ind = (df['date'].to_numpy(dtype='datetime64[s]') -
+                        np.datetime64(obs_datetime, 's')) // \
+                       np.timedelta64(1, 'h')
+            time_ind = time_ind.astype(np.int64)
+            if np.any((time_ind < 0) | (time_ind >= num_hours)):
+                print('ERROR: observation times outside the expected ' +
+                      'range of {} hours '.format(num_hours) +
+                      'starting {}.'.format(obs_datetime),
+                      file=sys.stderr)
+                sys.exit(1)
+            ind = (station_code, time_ind)
+
+        obs_data[ind] = values
+        obs_mask[ind] = False
+
+    obs = np.ma.masked_array(obs_data, mask=obs_mask)
+
+    # Place results in a dictionary.
+    result = {'num_stations': num_stations}
+    if num_hours is not None:
+        result['num_hours'] = num_hours
+    _station_meta_lists(result, meta_df)
+    if num_hours is None:
+        result['obs_datetime'] = obs_datetime
+    else:
+        result['obs_datetime'] = [obs_datetime + dt.timedelta(hours=i)
+                                  for i in range(num_hours)]
+    result[values_key] = obs
+
+    return(result)
+
+
+###############################################################################
+# Columnar observation cache.
+#
+# Query results are cached in scratch_dir as one directory per query window,
+# holding a small JSON header plus one .npy file per column. Value arrays
+# (and their masks) are memory-mapped when read, so only the parts that are
+# actually used are paged in. Older .pkl cache files are still read, and can
+# be converted with wdb0_cache_migrate.py.
+###############################################################################
+
+CACHE_FORMAT_VERSION = 1
+CACHE_HEADER_NAME = 'header.json'
+
+
+def cache_dir_name(pkl_file_name):
+
+    """
+    Get the columnar cache directory corresponding to a .pkl cache file.
+    """
+
+    return(os.path.splitext(pkl_file_name)[0] + '.cache')
+
+
+def _cache_array(values):
+
+    """
+    Convert a list of station metadata or datetimes to an array that can be
+    saved without pickling. Returns the array, the kind of list, and a
+    boolean array marking None entries (None if there are none).
+    """
+
+    is_none = np.array([val is None for val in values], dtype=bool)
+    present = [val for val in values if val is not None]
+    if not is_none.any():
+        is_none = None
+
+    if len(present) > 0 and \
+       all(hasattr(val, 'strftime') for val in present):
+        # None becomes NaT, which converts back to None when read.
+        return(np.array([np.datetime64(val, 's') if val is not None
+                         else np.datetime64('NaT', 's')
+                         for val in values]),
+               'datetime_list', None)
+
+    if is_none is None:
+        return(np.array(values), 'list', None)
+
+    if all(isinstance(val, (int, float, np.number)) for val in present):
+        # None becomes NaN here; is_none restores it when read.
+        return(np.array(values, dtype=float), 'list', is_none)
+
+    # Strings (e.g. station names) mixed with None.
+    return(np.array(['' if val is None else str(val) for val in values]),
+           'list', is_none)
+
+
+def _cache_list(array, is_none):
+
+    """
+    Convert an array written by _cache_array back to a list, restoring None
+    entries.
+    """
+
+    values = array.tolist()
+    if is_none is not None:
+        for ind in np.flatnonzero(is_none):
+            values[ind] = None
+
+    return(values)
+
+
+def write_obs_cache(cache_dir, obs):
+
+    """
+    Write the result of a get_*_obs function (a dictionary) or of
+    get_swe_obs_df (a dataframe) to a columnar cache directory. The cache is
+    written to a temporary directory first and then renamed, so readers
+    never see a partial cache.
+    """
+
+    header = {'format_version': CACHE_FORMAT_VERSION,
+              'fields': []}
+    arrays = {}
+
+    if isinstance(obs, pd.DataFrame):
+        header['type'] = 'dataframe'
+        for ci, column in enumerate(obs.columns):
+            array = obs[column].to_numpy()
+            is_none = None
+            if array.dtype == object:
+                array, kind, is_none = _cache_array(obs[column].tolist())
+            field = {'name': column,
+                     'kind': 'column',
+                     'file': 'column_{}.npy'.format(ci)}
+            arrays[field['file']] = array
+            if is_none is not None:
+                field['none_file'] = 'column_{}.none.npy'.format(ci)
+                arrays[field['none_file']] = is_none
+            header['fields'].append(field)
+    else:
+        header['type'] = 'dict'
+        for key, val in obs.items():
+            field = {'name': key}
+            if isinstance(val, np.ma.MaskedArray):
+                field['kind'] = 'masked_array'
+                field['file'] = key + '.data.npy'
+                field['mask_file'] = key + '.mask.npy'
+                arrays[field['file']] = np.ma.getdata(val)
+                arrays[field['mask_file']] = np.ma.getmaskarray(val)
+            elif isinstance(val, np.ndarray):
+                field['kind'] = 'array'
+                field['file'] = key + '.npy'
+                arrays[field['file']] = val
+            elif isinstance(val, list):
+                array, field['kind'], is_none = _cache_array(val)
+                field['file'] = key + '.npy'
+                arrays[field['file']] = array
+                if is_none is not None:
+                    field['none_file'] = key + '.none.npy'
+                    arrays[field['none_file']] = is_none
+            elif hasattr(val, 'strftime'):
+                field['kind'] = 'datetime'
+                field['value'] = str(np.datetime64(val, 's'))
+            else:
+                field['kind'] = 'scalar'
+                field['value'] = val
+            header['fields'].append(field)
+
+    # The prefetch thread writes cache entries too, so the temporary
+    # directory is unique per thread as well as per process.
+    tmp_dir = cache_dir + '.tmp{}.{}'.format(os.getpid(),
+                                             threading.get_ident())
+    if os.path.isdir(tmp_dir):
+        shutil.rmtree(tmp_dir)
+    os.makedirs(tmp_dir)
+    for file_name, array in arrays.items():
+        np.save(os.path.join(tmp_dir, file_name), array, allow_pickle=False)
+    with open(os.path.join(tmp_dir, CACHE_HEADER_NAME), 'w') as file_obj:
+        json.dump(header, file_obj, indent=1)
+
+    if os.path.isdir(cache_dir):
+        shutil.rmtree(cache_dir)
+    os.rename(tmp_dir, cache_dir)
+
+
+def read_obs_cache(cache_dir):
+
+    """
+    Read a columnar cache directory written by write_obs_cache, returning
+    the same structure that was written. Masked arrays are memory-mapped
+    copy-on-write, so they may be modified without changing the cache.
+    """
+
+    with open(os.path.join(cache_dir, CACHE_HEADER_NAME), 'r') as file_obj:
+        header = json.load(file_obj)
+
+    if header['format_version'] != CACHE_FORMAT_VERSION:
+        print('ERROR: unsupported cache format version {} in {}.'.
+              format(header['format_version'], cache_dir),
+              file=sys.stderr)
+        sys.exit(1)
+
+    def load(file_name, mmap_mode=None):
+        return(np.load(os.path.join(cache_dir, file_name),
+                       mmap_mode=mmap_mode,
+                       allow_pickle=False))
+
+    def load_none(field):
+        if 'none_file' not in field:
+            return(None)
+        return(load(field['none_file']))
+
+    if header['type'] == 'dataframe':
+        columns = {}
+        for field in header['fields']:
+            is_none = load_none(field)
+            if is_none is None:
+                columns[field['name']] = load(field['file'])
+            else:
+                columns[field['name']] = \
+                    pd.Series(_cache_list(load(field['file']), is_none),
+                              dtype=object)
+        return(pd.DataFrame(columns))
+
+    obs = {}
+    for field in header['fields']:
+        kind = field['kind']
+        if kind == 'masked_array':
+            obs[field['name']] = \
+                np.ma.masked_array(load(field['file'], mmap_mode='c'),
+                                   mask=load(field['mask_file'],
+                                             mmap_mode='c'))
+        elif kind == 'array':
+            obs[field['name']] = load(field['file'], mmap_mode='c')
+        elif kind == 'list':
+            obs[field['name']] = _cache_list(load(field['file']),
+                                             load_none(field))
+        elif kind == 'datetime_list':
+            obs[field['name']] = \
+                load(field['file']).astype('datetime64[s]'). \
+                astype(object).tolist()
+        elif kind == 'datetime':
+            obs[field['name']] = np.datetime64(field['value'], 's'). \
+                astype(object)
+        else:
+            obs[field['name']] = field['value']
+
+    return(obs)
+
+
+# Name of the cache index database kept in each scratch directory.
+CACHE_INDEX_NAME = 'wdb0_cache_index.sqlite'
+
+# Default byte budget for a scratch directory cache. This may be overridden
+# with the WDB0_CACHE_MAX_BYTES environment variable or with
+# configure_cache().
+DEFAULT_CACHE_MAX_BYTES = 20 * 1024 ** 3
+
+# When the budget is exceeded, entries are evicted until the cache is
+# below this fraction of the budget.
+CACHE_LOW_WATER_FRACTION = 0.9
+
+
+def _cache_entry_size(path):
+
+    """
+    Get the size in bytes of a cache entry (a .pkl file or a columnar cache
+    directory).
+    """
+
+    if os.path.isdir(path):
+        return(sum(entry.stat().st_size for entry in os.scandir(path)
+                   if entry.is_file()))
+    return(os.path.getsize(path))
+
+
+def _remove_cache_entry(path):
+
+    """
+    Remove a cache entry (a .pkl file or a columnar cache directory).
+    """
+
+    if os.path.isdir(path):
+        shutil.rmtree(path, ignore_errors=True)
+    elif os.path.exists(path):
+        os.remove(path)
+
+
+class CacheManager:
+
+    """
+    Manage the wdb0 cache entries in one scratch directory: keep an index of
+    entries, their sizes and last access times, so that lookups do not need
+    to stat the (often very large) directory, and evict the least recently
+    used entries when the total size exceeds max_bytes.
+
+    The index is a small sqlite3 database in the scratch directory, so it is
+    shared by all processes using the same directory. Hits and misses are
+    counted there too. If the index does not exist, it is built by scanning
+    the directory once.
+    """
+
+    def __init__(self, scratch_dir, max_bytes=None):
+        self.scratch_dir = scratch_dir
+        if max_bytes is None:
+            max_bytes = int(os.environ.get('WDB0_CACHE_MAX_BYTES',
+                                           DEFAULT_CACHE_MAX_BYTES))
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        index_path = os.path.join(scratch_dir, CACHE_INDEX_NAME)
+        new_index = not os.path.isfile(index_path)
+        self._db = sqlite3.connect(index_path,
+                                   timeout=60.0,
+                                   check_same_thread=False)
+        self._db.execute('CREATE TABLE IF NOT EXISTS entries (' +
+                         'name TEXT PRIMARY KEY, ' +
+                         'size INTEGER, ' +
+                         'created REAL, ' +
+                         'last_access REAL)')
+        self._db.execute('CREATE INDEX IF NOT EXISTS entries_last_access ' +
+                         'ON entries (last_access)')
+        self._db.execute('CREATE TABLE IF NOT EXISTS stats (' +
+                         'key TEXT PRIMARY KEY, ' +
+                         'value INTEGER)')
+        self._db.execute('INSERT OR IGNORE INTO stats VALUES ' +
+                         '(\'hits\', 0), (\'misses\', 0)')
+        self._db.commit()
+        if new_index:
+            self.rebuild()
+
+    def rebuild(self):
+
+        """
+        Rebuild the index by scanning the scratch directory. Last access
+        times are taken from modification times.
+        """
+
+        rows = []
+        for entry in os.scandir(self.scratch_dir):
+            if not entry.name.startswith('wdb0_') or \
+               not (entry.name.endswith('.pkl') or
+                    entry.name.endswith('.cache')):
+                continue
+            path = os.path.join(self.scratch_dir, entry.name)
+            mtime = entry.stat().st_mtime
+            rows.append((entry.name,
+                         _cache_entry_size(path),
+                         mtime,
+                         mtime))
+        with self._lock:
+            self._db.execute('DELETE FROM entries')
+            self._db.executemany('INSERT INTO entries VALUES (?, ?, ?, ?)',
+                                 rows)
+            self._db.commit()
+
+    def lookup(self, name):
+
+        """
+        Check whether an entry is in the cache, updating its last access
+        time if so. Hits and misses are not counted here; see
+        record_hit and record_miss.
+        """
+
+        with self._lock:
+            cursor = self._db.execute('UPDATE entries ' +
+                                      'SET last_access = ? ' +
+                                      'WHERE name = ?',
+                                      (time.time(), name))
+            self._db.commit()
+        return(cursor.rowcount > 0)
+
+    def _count(self, key):
+        with self._lock:
+            self._db.execute('UPDATE stats SET value = value + 1 ' +
+                             'WHERE key = ?', (key,))
+            self._db.commit()
+
+    def record_hit(self):
+        self._count('hits')
+
+    def record_miss(self):
+        self._count('misses')
+
+    def add(self, name):
+
+        """
+        Add (or update) an entry that has just been written, then evict
+        least recently used entries if the cache is over budget.
+        """
+
+        size = _cache_entry_size(os.path.join(self.scratch_dir, name))
+        now = time.time()
+        with self._lock:
+            self._db.execute('INSERT OR REPLACE INTO entries ' +
+                             'VALUES (?, ?, ?, ?)',
+                             (name, size, now, now))
+            self._db.commit()
+        if self.total_bytes() > self.max_bytes:
+            self.prune(int(self.max_bytes * CACHE_LOW_WATER_FRACTION),
+                       keep=[name])
+
+    def remove(self, name):
+
+        """
+        Remove an entry from the cache and the index.
+        """
+
+        _remove_cache_entry(os.path.join(self.scratch_dir, name))
+        with self._lock:
+            self._db.execute('DELETE FROM entries WHERE name = ?', (name,))
+            self._db.commit()
+
+    def total_bytes(self):
+        with self._lock:
+            total = self._db.execute('SELECT COALESCE(SUM(size), 0) ' +
+                                     'FROM entries').fetchone()[0]
+        return(total)
+
+    def prune(self, max_bytes=None, max_age_seconds=None, keep=None):
+
+        """
+        Evict least recently used entries until the total size is at most
+        max_bytes, and evict entries not accessed in max_age_seconds.
+        Entries named in keep are never evicted. Returns the number of
+        entries and bytes evicted.
+        """
+
+        with self._lock:
+            rows = self._db.execute('SELECT name, size, last_access ' +
+                                    'FROM entries ' +
+                                    'ORDER BY last_access').fetchall()
+
+        if keep is None:
+            keep = []
+        total = sum(row[1] for row in rows)
+        now = time.time()
+        num_evicted = 0
+        bytes_evicted = 0
+        for name, size, last_access in rows:
+            if name in keep:
+                continue
+            too_big = max_bytes is not None and total > max_bytes
+            too_old = max_age_seconds is not None and \
+                now - last_access > max_age_seconds
+            if not too_big and not too_old:
+                if max_age_seconds is None:
+                    break
+                continue
+            self.remove(name)
+            total -= size
+            num_evicted += 1
+            bytes_evicted += size
+
+        return(num_evicted, bytes_evicted)
+
+    def report(self):
+
+        """
+        Get cache statistics as a dictionary.
+        """
+
+        with self._lock:
+            num_entries, total, oldest, newest = \
+                self._db.execute('SELECT COUNT(*), ' +
+                                 'COALESCE(SUM(size), 0), ' +
+                                 'MIN(last_access), ' +
+                                 'MAX(last_access) ' +
+                                 'FROM entries').fetchone()
+            stats = dict(self._db.execute('SELECT key, value ' +
+                                          'FROM stats').fetchall())
+        lookups = stats['hits'] + stats['misses']
+        if lookups > 0:
+            hit_rate = stats['hits'] / lookups
+        else:
+            hit_rate = None
+
+        return({'scratch_dir': self.scratch_dir,
+                'num_entries': num_entries,
+                'total_bytes': total,
+                'max_bytes': self.max_bytes,
+                'hits': stats['hits'],
+                'misses': stats['misses'],
+                'hit_rate': hit_rate,
+                'oldest_access': oldest,
+                'newest_access': newest})
+
+    def reset_stats(self):
+        with self._lock:
+            self._db.execute('UPDATE stats SET value = 0')
+            self._db.commit()
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+_cache_managers = {}
+_cache_managers_lock = threading.Lock()
+_cache_max_bytes = None
+
+
+def configure_cache(max_bytes=None):
+
+    """
+    Set the byte budget for scratch directory caches. If max_bytes is None,
+    the WDB0_CACHE_MAX_BYTES environment variable is used if set, and
+    DEFAULT_CACHE_MAX_BYTES otherwise.
+    """
+
+    global _cache_max_bytes
+
+    with _cache_managers_lock:
+        _cache_max_bytes = max_bytes
+        for manager in _cache_managers.values():
+            if max_bytes is None:
+                manager.max_bytes = \
+                    int(os.environ.get('WDB0_CACHE_MAX_BYTES',
+                                       DEFAULT_CACHE_MAX_BYTES))
+            else:
+                manager.max_bytes = max_bytes
+
+
+def get_cache_manager(scratch_dir):
+
+    """
+    Get the CacheManager for a scratch directory.
+    """
+
+    key = os.path.realpath(scratch_dir)
+    with _cache_managers_lock:
+        if key not in _cache_managers:
+            _cache_managers[key] = CacheManager(scratch_dir,
+                                                max_bytes=_cache_max_bytes)
+        manager = _cache_managers[key]
+
+    return(manager)
+
+
+def _read_cache(file_name):
+
+    """
+    Read cached query results for the .pkl cache file name used by a get_*
+    function, from the columnar cache if present, or else from the .pkl
+    file itself. Returns None if neither exists.
+
+    If file_name is in a scratch directory, the directory's CacheManager
+    index is consulted instead of the file system.
+    """
+
+    cache_dir = cache_dir_name(file_name)
+    scratch_dir = os.path.dirname(file_name)
+
+    if scratch_dir == '':
+        if os.path.isfile(os.path.join(cache_dir, CACHE_HEADER_NAME)):
+            return(read_obs_cache(cache_dir))
+        if os.path.isfile(file_name):
+            file_obj = open(file_name, 'rb')
+            obs = pkl.load(file_obj)
+            file_obj.close()
+            return(obs)
+        return(None)
+
+    manager = get_cache_manager(scratch_dir)
+
+    for name in [os.path.basename(cache_dir), os.path.basename(file_name)]:
+        if not manager.lookup(name):
+            continue
+        try:
+            if name.endswith('.cache'):
+                obs = read_obs_cache(cache_dir)
+            else:
+                file_obj = open(file_name, 'rb')
+                obs = pkl.load(file_obj)
+                file_obj.close()
+        except (OSError, ValueError):
+            # The entry was removed or damaged outside of the manager.
+            manager.remove(name)
+            continue
+        manager.record_hit()
+        return(obs)
+
+    manager.record_miss()
+    return(None)
+
+
+def _write_cache(file_name, obs):
+
+    """
+    Cache query results in the columnar format, for the .pkl cache file
+    name used by a get_* function.
+    """
+
+    cache_dir = cache_dir_name(file_name)
+    write_obs_cache(cache_dir, obs)
+
+    scratch_dir = os.path.dirname(file_name)
+    if scratch_dir != '':
+        get_cache_manager(scratch_dir).add(os.path.basename(cache_dir))
+
+
+###############################################################################
+# Station dimension cache.
+#
+# Observation queries select only (obj_identifier, date, value); station
+# metadata from point.allstation are looked up here and attached on the
+# client. Metadata are kept in memory for the life of the process and, if a
+# scratch directory is given, in a small sqlite3 database there so that they
+# survive between runs. Stations not yet known, and stations whose metadata
+# are older than max_age_seconds, are fetched from point.allstation in one
+# query per lookup.
+###############################################################################
+
+# Name of the station metadata database kept in each scratch directory.
+STATION_CACHE_NAME = 'wdb0_station_cache.sqlite'
+
+# Default age after which cached station metadata are fetched again.
+DEFAULT_STATION_MAX_AGE_SECONDS = 86400.0
+
+# Maximum number of obj_identifier values per point.allstation query.
+STATION_QUERY_CHUNK_SIZE = 10000
+
+
+class StationCache:
+
+    """
+    Station metadata (station_id, name, lon, lat, elevation and
+    recorded_elevation) keyed by obj_identifier, refreshed incrementally
+    from point.allstation. If scratch_dir is None the cache is held in
+    memory only.
+
+    Stations that are not in point.allstation are remembered as absent
+    (in memory only) for max_age_seconds as well, so observations from
+    them do not trigger repeated queries.
+    """
+
+    def __init__(self, scratch_dir=None, max_age_seconds=None):
+        self.scratch_dir = scratch_dir
+        if max_age_seconds is None:
+            max_age_seconds = DEFAULT_STATION_MAX_AGE_SECONDS
+        self.max_age_seconds = max_age_seconds
+        self.num_queries = 0
+        self.num_fetched = 0
+        self._meta = {}
+        self._fetched = {}
+        self._lock = threading.Lock()
+        self._db = None
+        if scratch_dir is None:
+            return
+        self._db = sqlite3.connect(os.path.join(scratch_dir,
+                                                STATION_CACHE_NAME),
+                                   timeout=60.0,
+                                   check_same_thread=False)
+        # Columns are left untyped so values are returned as stored.
+        self._db.execute('CREATE TABLE IF NOT EXISTS station (' +
+                         'obj_identifier INTEGER PRIMARY KEY, ' +
+                         'station_id, ' +
+                         'name, ' +
+                         'lon, ' +
+                         'lat, ' +
+                         'elevation, ' +
+                         'recorded_elevation, ' +
+                         'fetched REAL)')
+        self._db.commit()
+        for row in self._db.execute('SELECT * FROM station'):
+            self._meta[row[0]] = row[1:7]
+            self._fetched[row[0]] = row[7]
+
+    def update(self, meta_df):
+
+        """
+        Add or replace metadata for the stations in meta_df, a dataframe
+        with the columns obj_identifier, station_id, name, lon, lat,
+        elevation and recorded_elevation.
+        """
+
+        now = time.time()
+        rows = []
+        for row in meta_df[_copy_meta_column_list]. \
+                itertuples(index=False, name=None):
+            # psycopg2 returns numeric columns as Decimal.
+            row = tuple(float(val) if isinstance(val, decimal.Decimal)
+                        else val for val in row)
+            rows.append((int(row[0]),) + row[1:] + (now,))
+
+        with self._lock:
+            for row in rows:
+                self._meta[row[0]] = row[1:7]
+                self._fetched[row[0]] = now
+            if self._db is not None:
+                self._db.executemany('INSERT OR REPLACE INTO station ' +
+                                     'VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                                     rows)
+                self._db.commit()
+
+    def _refresh(self, obj_id_list, verbose=None):
+
+        """
+        Fetch metadata for obj_id_list from point.allstation.
+        """
+
+        now = time.time()
+        for ci in range(0, len(obj_id_list), STATION_QUERY_CHUNK_SIZE):
+            chunk = obj_id_list[ci:ci + STATION_QUERY_CHUNK_SIZE]
+            sql_cmd = 'SELECT ' + \
+                      'obj_identifier, ' + \
+                      'TRIM(station_id), ' + \
+                      'TRIM(name), ' + \
+                      'coordinates[0] AS lon, ' + \
+                      'coordinates[1] AS lat, ' + \
+                      'elevation, ' + \
+                      'recorded_elevation ' + \
+                      'FROM point.allstation ' + \
+                      'WHERE obj_identifier IN (' + \
+                      ', '.join([str(obj_id) for obj_id in chunk]) + \
+                      ') ' + \
+                      'ORDER BY obj_identifier;'
+            if verbose:
+                print('INFO: psql command "{}"'.
+                      format(sql_cmd[0:200] + '...'))
+            meta_df = pd.DataFrame(_fetchall(sql_cmd),
+                                   columns=_copy_meta_column_list)
+            self.num_queries += 1
+            self.num_fetched += len(meta_df)
+            self.update(meta_df)
+
+            # Forget stations that are no longer in point.allstation.
+            found = set(meta_df['obj_identifier'].tolist())
+            absent = [obj_id for obj_id in chunk if obj_id not in found]
+            with self._lock:
+                for obj_id in absent:
+                    self._meta.pop(obj_id, None)
+                    self._fetched[obj_id] = now
+                if self._db is not None and len(absent) > 0:
+                    self._db.executemany('DELETE FROM station ' +
+                                         'WHERE obj_identifier = ?',
+                                         [(obj_id,) for obj_id in absent])
+                    self._db.commit()
+
+    def lookup(self, obj_id_list, verbose=None):
+
+        """
+        Get metadata for the stations in obj_id_list as a dataframe with
+        the columns obj_identifier, station_id, name, lon, lat, elevation
+        and recorded_elevation, in the order given. Stations that are not
+        in point.allstation are left out.
+        """
+
+        obj_id_list = [int(obj_id) for obj_id in obj_id_list]
+
+        now = time.time()
+        with self._lock:
+            stale = [obj_id for obj_id in obj_id_list
+                     if now - self._fetched.get(obj_id, -np.inf) >
+                     self.max_age_seconds]
+        if len(stale) > 0:
+            self._refresh(sorted(set(stale)), verbose=verbose)
+
+        with self._lock:
+            rows = [(obj_id,) + self._meta[obj_id]
+                    for obj_id in obj_id_list
+                    if obj_id in self._meta]
+
+        return(pd.DataFrame(rows, columns=_copy_meta_column_list))
+
+    def close(self):
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+
+_station_caches = {}
+_station_caches_lock = threading.Lock()
+
+
+def get_station_cache(scratch_dir=None):
+
+    """
+    Get the StationCache for a scratch directory, or the in-memory
+    StationCache if scratch_dir is None.
+    """
+
+    if scratch_dir is None:
+        key = None
+    else:
+        key = os.path.realpath(scratch_dir)
+    with _station_caches_lock:
+        if key not in _station_caches:
+            _station_caches[key] = StationCache(scratch_dir)
+        station_cache = _station_caches[key]
+
+    return(station_cache)
+
+
+def _bounding_box_filter(bounding_box):
+
+    """
+    Get a SQL condition limiting obj_identifier to stations inside
+    bounding_box (lon_min, lon_max, lat_min, lat_max).
+    """
+
+    return('obj_identifier IN (' +
+           'SELECT obj_identifier FROM point.allstation ' +
+           'WHERE coordinates[0] >= ' +
+           '{} '.format(bounding_box[0]) +
+           'AND coordinates[0] < ' +
+           '{} '.format(bounding_box[1]) +
+           'AND coordinates[1] >= ' +
+           '{} '.format(bounding_box[2]) +
+           'AND coordinates[1] < ' +
+           '{}'.format(bounding_box[3]) +
+           ') ')
+
+
+###############################################################################
+# COPY-based bulk fetch backend.
+#
+# Instead of having psycopg2 decode every row into a tuple of Python objects,
+# observations are pulled with "COPY (SELECT ...) TO STDOUT" and the stream
+# is parsed directly into NumPy columns:
+#     obj_id      int32
+#     epoch_hour  int32 (hours since 1970-01-01 00 UTC)
+#     value       float32 (or float64, see get_obs_columns)
+# Station metadata for the stations found are taken from the station cache,
+# and joined on the client.
+###############################################################################
+
+# Observation tables that can be read with get_obs_columns.
+COPY_OBS_TABLES = ['obs_snow_depth',
+                   'obs_swe',
+                   'obs_airtemp',
+                   'obs_snowfall_raw']
+
+# Signature at the start of a PostgreSQL binary COPY stream.
+PGCOPY_SIGNATURE = b'PGCOPY\n\xff\r\n\x00'
+
+_copy_meta_column_list = ['obj_identifier',
+                          'station_id',
+                          'name',
+                          'lon',
+                          'lat',
+                          'elevation',
+                          'recorded_elevation']
+
+
+def _epoch_hour(datetime):
+
+    """
+    Convert a datetime to hours since 1970-01-01 00 UTC.
+    """
+
+    return((datetime - dt.datetime(1970, 1, 1)) // dt.timedelta(hours=1))
+
+
+def _copy_binary_dtype(single_precision):
+
+    """
+    Structured dtype for one tuple of an (obj_id, epoch_hour, value) binary
+    COPY stream: a 16-bit field count, then a 32-bit length and the data for
+    each field, all big-endian. Since none of the fields are ever NULL, all
+    tuples have the same size.
+    """
+
+    if single_precision:
+        value_dtype = '>f4'
+    else:
+        value_dtype = '>f8'
+    return(np.dtype([('num_fields', '>i2'),
+                     ('obj_id_len', '>i4'),
+                     ('obj_id', '>i4'),
+                     ('epoch_hour_len', '>i4'),
+                     ('epoch_hour', '>i4'),
+                     ('value_len', '>i4'),
+                     ('value', value_dtype)]))
+
+
+def _parse_copy_binary(buf, single_precision=True):
+
+    """
+    Parse a binary COPY stream of (obj_id, epoch_hour, value) tuples into
+    NumPy columns.
+    """
+
+    if buf[0:len(PGCOPY_SIGNATURE)] != PGCOPY_SIGNATURE:
+        print('ERROR: invalid binary COPY signature.', file=sys.stderr)
+        sys.exit(1)
+
+    # Skip the flags field and header extension.
+    ext_len = int.from_bytes(buf[15:19], 'big')
+    data_start = 19 + ext_len
+
+    # The stream ends with a 16-bit -1.
+    if buf[-2:] != b'\xff\xff':
+        print('ERROR: binary COPY stream is missing its trailer.',
+              file=sys.stderr)
+        sys.exit(1)
+
+    copy_dtype = _copy_binary_dtype(single_precision)
+    data = memoryview(buf)[data_start:len(buf) - 2]
+    if len(data) % copy_dtype.itemsize != 0:
+        print('ERROR: binary COPY stream is not a whole number of ' +
+              '{}-byte tuples.'.format(copy_dtype.itemsize),
+              file=sys.stderr)
+        sys.exit(1)
+    records = np.frombuffer(data, dtype=copy_dtype)
+
+    value_size = copy_dtype['value'].itemsize
+    if np.any(records['num_fields'] != 3) or \
+       np.any(records['obj_id_len'] != 4) or \
+       np.any(records['epoch_hour_len'] != 4) or \
+       np.any(records['value_len'] != value_size):
+        print('ERROR: unexpected field layout in binary COPY stream.',
+              file=sys.stderr)
+        sys.exit(1)
+
+    if single_precision:
+        value_dtype = np.float32
+    else:
+        value_dtype = np.float64
+
+    return({'obj_id': records['obj_id'].astype(np.int32),
+            'epoch_hour': records['epoch_hour'].astype(np.int32),
+            'value': records['value'].astype(value_dtype)})
+
+
+def _parse_copy_csv(buf, single_precision=True):
+
+    """
+    Parse a CSV COPY stream of (obj_id, epoch_hour, value) rows into NumPy
+    columns.
+    """
+
+    if single_precision:
+        value_dtype = np.float32
+    else:
+        value_dtype = np.float64
+
+    if len(buf) == 0:
+        return({'obj_id': np.empty(0, dtype=np.int32),
+                'epoch_hour': np.empty(0, dtype=np.int32),
+                'value': np.empty(0, dtype=value_dtype)})
+
+    df = pd.read_csv(io.BytesIO(buf),
+                     header=None,
+                     names=['obj_id', 'epoch_hour', 'value'],
+                     float_precision='round_trip',
+                     dtype={'obj_id': np.int32,
+                            'epoch_hour': np.int32,
+                            'value': value_dtype})
+
+    return({'obj_id': df['obj_id'].to_numpy(),
+            'epoch_hour': df['epoch_hour'].to_numpy(),
+            'value': df['value'].to_numpy()})
+
+
+def _copy_expert(sql_cmd):
+
+    """
+    Run a COPY ... TO STDOUT statement on the web database and return the
+    output stream as bytes.
+    """
+
+    buf = io.BytesIO()
+    with connection() as conn:
+        cursor = conn.cursor()
+        cursor.copy_expert(sql_cmd, buf)
+        cursor.close()
+
+    return(buf.getvalue())
+
+
+def get_obs_columns(table,
+                    begin_datetime,
+                    end_datetime,
+                    value_scale=1.0,
+                    duration_hours=None,
+                    bounding_box=None,
+                    copy_format='binary',
+                    single_precision=True,
+                    verbose=None):
+
+    """
+    Get observations from one of the COPY_OBS_TABLES in the "web_data"
+    database on wdb0 using COPY, for begin_datetime through end_datetime
+    inclusive. Values are multiplied by value_scale (e.g. 100.0 to convert
+    snow depth from m to cm). The duration_hours argument selects a
+    duration from tables that have one (obs_snowfall_raw).
+
+    The copy_format may be 'binary' or 'csv'. Results are returned as a
+    dictionary of NumPy arrays "obj_id", "epoch_hour" and "value", sorted by
+    obj_id and time. Values are float32 unless single_precision is False.
+    """
+
+    if table not in COPY_OBS_TABLES:
+        print('ERROR: unsupported table "{}" for COPY.'.format(table),
+              file=sys.stderr)
+        sys.exit(1)
+    if copy_format not in ['binary', 'csv']:
+        print('ERROR: unsupported COPY format "{}".'.format(copy_format),
+              file=sys.stderr)
+        sys.exit(1)
+
+    if single_precision:
+        value_type = 'float4'
+    else:
+        value_type = 'float8'
+
+    # Define a SQL statement.
+    sql_cmd = 'SELECT ' + \
+              'obj_identifier::int4, ' + \
+              'FLOOR(EXTRACT(EPOCH FROM date) / 3600)::int4, ' + \
+              '(value * {})::{} '.format(float(value_scale), value_type) + \
+              'FROM point.' + table + ' ' + \
+              'WHERE date >= \'' + \
+              begin_datetime.strftime('%Y-%m-%d %H:%M:%S') + \
+              '\' ' + \
+              'AND date <= \'' + \
+              end_datetime.strftime('%Y-%m-%d %H:%M:%S') + \
+              '\' ' + \
+              'AND value IS NOT NULL '
+
+    if duration_hours is not None:
+        sql_cmd = sql_cmd + \
+                  'AND duration = {} '.format(duration_hours * 3600)
+
+    if bounding_box is not None:
+        sql_cmd = sql_cmd + \
+                  'AND ' + _bounding_box_filter(bounding_box)
+
+    sql_cmd = 'COPY (' + sql_cmd + 'ORDER BY obj_identifier, date) ' + \
+              'TO STDOUT WITH (FORMAT {});'.format(copy_format)
+
+    if verbose:
+        print('INFO: psql command "{}"'.format(sql_cmd))
+
+    buf = _copy_expert(sql_cmd)
+
+    if copy_format == 'binary':
+        return(_parse_copy_binary(buf, single_precision=single_precision))
+    else:
+        return(_parse_copy_csv(buf, single_precision=single_precision))
+
+
+def get_station_meta(obj_id_list, verbose=None):
+
+    """
+    Get station metadata from point.allstation for a list of obj_identifier
+    values, using a CSV COPY. Results are returned in a pandas dataframe
+    with columns obj_identifier, station_id, name, lon, lat, elevation and
+    recorded_elevation, sorted by obj_identifier.
+    """
+
+    if len(obj_id_list) == 0:
+        return(pd.DataFrame([], columns=_copy_meta_column_list))
+
+    sql_cmd = 'COPY (' + \
+              'SELECT ' + \
+              'obj_identifier, ' + \
+              'TRIM(station_id), ' + \
+              'TRIM(name), ' + \
+              'coordinates[0], ' + \
+              'coordinates[1], ' + \
+              'elevation, ' + \
+              'recorded_elevation ' + \
+              'FROM point.allstation ' + \
+              'WHERE obj_identifier IN (' + \
+              ', '.join([str(int(obj_id)) for obj_id in obj_id_list]) + \
+              ') ' + \
+              'ORDER BY obj_identifier' + \
+              ') TO STDOUT WITH (FORMAT csv);'
+
+    if verbose:
+        print('INFO: psql command "{}"'.format(sql_cmd[0:200] + '...'))
+
+    buf = _copy_expert(sql_cmd)
+
+    if len(buf) == 0:
+        return(pd.DataFrame([], columns=_copy_meta_column_list))
+
+    # Keep station IDs and names as strings (e.g. a station named "NA").
+    meta_df = pd.read_csv(io.BytesIO(buf),
+                          header=None,
+                          names=_copy_meta_column_list,
+                          dtype={'station_id': str, 'name': str},
+                          keep_default_na=False,
+                          float_precision='round_trip',
+                          na_values={'lon': [''],
+                                     'lat': [''],
+                                     'elevation': [''],
+                                     'recorded_elevation': ['']})
+
+    return(meta_df)
+
+
+def _pivot_obs_columns(obs_columns,
+                       meta_df,
+                       values_key,
+                       obs_datetime,
+                       num_hours,
+                       no_data_value=-99999.0):
+
+    """
+    Counterpart of _pivot_station_hour for the output of get_obs_columns
+    and get_station_meta. Observations from stations that are missing from
+    meta_df are dropped, as they would be by the join in the SQL queries.
+    """
+
+    keep = np.isin(obs_columns['obj_id'], meta_df['obj_identifier'])
+    obj_id = obs_columns['obj_id'][keep]
+
+    station_code, station_obj_id = pd.factorize(obj_id, sort=False)
+    num_stations = len(station_obj_id)
+    meta_df = meta_df.set_index('obj_identifier').loc[station_obj_id]
+
+    shape = [num_stations, num_hours]
+    obs_data = np.full(shape, no_data_value, dtype=float)
+    obs_mask = np.ones(shape, dtype=bool)
+
+    if num_stations > 0:
+        # Calculate hour offsets relative to the first hour.
+        time_ind = obs_columns['epoch_hour'][keep].astype(np.int64) - \
+                   _epoch_hour(obs_datetime)
+        if np.any((time_ind < 0) | (time_ind >= num_hours)):
+            print('ERROR: observation times outside the expected ' +
+                  'range of {} hours '.format(num_hours) +
+                  'starting {}.'.format(obs_datetime),
+                  file=sys.stderr)
+            sys.exit(1)
+        obs_data[station_code, time_ind] = obs_columns['value'][keep]
+        obs_mask[station_code, time_ind] = False
+
+    obs = np.ma.masked_array(obs_data, mask=obs_mask)
+
+    # Place results in a dictionary.
+    result = {'num_stations': num_stations,
+              'num_hours': num_hours,
+              'station_obj_id': station_obj_id.tolist(),
+              'station_id': meta_df['station_id'].tolist(),
+              'station_name': meta_df['name'].tolist(),
+              'station_lon': meta_df['lon'].tolist(),
+              'station_lat': meta_df['lat'].tolist(),
+              'station_elevation': meta_df['elevation'].tolist(),
+              'station_rec_elevation':
+              meta_df['recorded_elevation'].tolist(),
+              'obs_datetime': [obs_datetime + dt.timedelta(hours=i)
+                               for i in range(num_hours)],
+              values_key: obs}
+
+    return(result)
+
+
+def _copy_station_hour(table,
+                       value_scale,
+                       values_key,
+                       begin_datetime,
                        end_datetime,
+                       num_hours,
                        no_data_value=-99999.0,
                        bounding_box=None,
+                       copy_format='binary',
                        scratch_dir=None,
                        verbose=None):
 
+    """
+    COPY counterpart of _fetchall followed by _pivot_station_hour. Values
+    are transferred in double precision so results match the other paths.
+    Station metadata come from the station cache for scratch_dir.
+    """
+
+    obs_columns = get_obs_columns(table,
+                                  begin_datetime,
+                                  end_datetime,
+                                  value_scale=value_scale,
+                                  bounding_box=bounding_box,
+                                  copy_format=copy_format,
+                                  single_precision=False,
+                                  verbose=verbose)
+    station_cache = get_station_cache(scratch_dir)
+    meta_df = station_cache.lookup(np.unique(obs_columns['obj_id']),
+                                   verbose=verbose)
+
+    return(_pivot_obs_columns(obs_columns,
+                              meta_df,
+                              values_key,
+                              begin_datetime,
+                              num_hours,
+                              no_data_value=no_data_value))
+
+
+def _encode_copy_binary(obs_columns, single_precision=True):
+
+    """
+    Encode (obj_id, epoch_hour, value) columns as a binary COPY stream; the
+    inverse of _parse_copy_binary.
+    """
+
+    copy_dtype = _copy_binary_dtype(single_precision)
+    records = np.empty(len(obs_columns['obj_id']), dtype=copy_dtype)
+    records['num_fields'] = 3
+    records['obj_id_len'] = 4
+    records['obj_id'] = obs_columns['obj_id']
+    records['epoch_hour_len'] = 4
+    records['epoch_hour'] = obs_columns['epoch_hour']
+    records['value_len'] = copy_dtype['value'].itemsize
+    records['value'] = obs_columns['value']
+
+    return(PGCOPY_SIGNATURE +
+           (0).to_bytes(4, 'big') +
+           (0).to_bytes(4, 'big') +
+           records.tobytes() +
+           b'\xff\xff')
+
+
+class LocalCopyStandIn:
+
+    """
+    A local stand-in for the web database that answers the COPY statements
+    issued by get_obs_columns and get_station_meta, and the metadata
+    queries issued by StationCache, from pandas dataframes, for testing and
+    benchmarking without access to wdb0:
+
+        stand_in = wdb0.LocalCopyStandIn(allstation_df,
+                                         {'obs_snow_depth': snwd_df})
+        wdb0.configure(connect=stand_in.connect)
+
+    The allstation_df dataframe must have the columns obj_identifier,
+    station_id, name, lon, lat, elevation and recorded_elevation. Each
+    observation dataframe must have the columns obj_identifier, date and
+    value (plus duration, in seconds, for obs_snowfall_raw).
+    """
+
+    def __init__(self, allstation_df, obs_df_dict):
+        self.allstation_df = allstation_df
+        self.obs_df_dict = obs_df_dict
+
+    def connect(self, dsn):
+        return(_LocalCopyConnection(self))
+
+
+class _LocalCopyConnection:
+
+    def __init__(self, stand_in):
+        self.stand_in = stand_in
+        self.closed = 0
+
+    def cursor(self, name=None):
+        if name is not None:
+            raise TypeError('named cursors are not supported')
+        return(_LocalCopyCursor(self.stand_in))
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        self.closed = 1
+
+
+class _LocalCopyCursor:
+
+    def __init__(self, stand_in):
+        self.stand_in = stand_in
+        self._rows = []
+
+    def execute(self, sql_cmd):
+        # Only the connection pool health check and the StationCache
+        # metadata query are supported.
+        if sql_cmd.strip() == 'SELECT 1;':
+            self._rows = [(1,)]
+            return
+        match = re.search(r'FROM point\.allstation ' +
+                          r'WHERE obj_identifier IN \(([0-9, ]+)\)',
+                          sql_cmd)
+        if match is None:
+            raise NotImplementedError(sql_cmd)
+        obj_id = [int(val) for val in match.group(1).split(',')]
+        df = self.stand_in.allstation_df
+        df = df[df['obj_identifier'].isin(obj_id)]
+        df = df.sort_values('obj_identifier')
+        self._rows = list(df[_copy_meta_column_list].
+                          itertuples(index=False, name=None))
+
+    def fetchall(self):
+        return(self._rows)
+
+    def close(self):
+        pass
+
+    def copy_expert(self, sql_cmd, file):
+
+        copy_format = re.search(r'FORMAT (\w+)', sql_cmd).group(1)
+
+        match = re.search(r'WHERE obj_identifier IN \(([0-9, ]+)\)',
+                          sql_cmd)
+        if match is not None:
+            # Station metadata query.
+            obj_id = [int(val) for val in match.group(1).split(',')]
+            df = self.stand_in.allstation_df
+            df = df[df['obj_identifier'].isin(obj_id)]
+            df = df.sort_values('obj_identifier')
+            file.write(df[_copy_meta_column_list].
+                       to_csv(header=False, index=False).encode('utf-8'))
+            return
+
+        # Observation query.
+        table = re.search(r'FROM point\.(\w+) ', sql_cmd).group(1)
+        begin, end = re.search(r'date >= \'([^\']+)\' ' +
+                               r'AND date <= \'([^\']+)\'',
+                               sql_cmd).groups()
+        value_scale, value_type = \
+            re.search(r'\(value \* ([-0-9.e]+)\)::(\w+)', sql_cmd).groups()
+        single_precision = value_type == 'float4'
+
+        df = self.stand_in.obs_df_dict[table]
+        date = pd.to_datetime(df['date'])
+        keep = (date >= pd.Timestamp(begin)) & \
+               (date <= pd.Timestamp(end)) & \
+               df['value'].notna()
+        match = re.search(r'AND duration = (\d+) ', sql_cmd)
+        if match is not None:
+            keep &= df['duration'] == int(match.group(1))
+        match = re.search(r'coordinates\[0\] >= (\S+) ' +
+                          r'AND coordinates\[0\] < (\S+) ' +
+                          r'AND coordinates\[1\] >= (\S+) ' +
+                          r'AND coordinates\[1\] < ([^)\s]+)',
+                          sql_cmd)
+        if match is not None:
+            bbox = [float(val) for val in match.groups()]
+            meta = self.stand_in.allstation_df
+            in_box = meta['obj_identifier'][(meta['lon'] >= bbox[0]) &
+                                            (meta['lon'] < bbox[1]) &
+                                            (meta['lat'] >= bbox[2]) &
+                                            (meta['lat'] < bbox[3])]
+            keep &= df['obj_identifier'].isin(in_box)
+
+        df = pd.DataFrame({'obj_id': df['obj_identifier'][keep],
+                           'epoch_hour': (date[keep] -
+                                          pd.Timestamp('1970-01-01')) //
+                           pd.Timedelta(hours=1),
+                           'value': df['value'][keep] * float(value_scale)})
+        df = df.sort_values(['obj_id', 'epoch_hour'], kind='stable')
+        if single_precision:
+            value_dtype = np.float32
+        else:
+            value_dtype = np.float64
+        obs_columns = {'obj_id': df['obj_id'].to_numpy(dtype=np.int32),
+                       'epoch_hour':
+                       df['epoch_hour'].to_numpy(dtype=np.int32),
+                       'value': df['value'].to_numpy(dtype=value_dtype)}
+
+        if copy_format == 'binary':
+            file.write(_encode_copy_binary(obs_columns,
+                                           single_precision=
+                                           single_precision))
+        else:
+            file.write(pd.DataFrame(obs_columns).
+                       to_csv(header=False, index=False).encode('utf-8'))
+
+
+def get_snow_depth_obs(begin_datetime,
+                       end_datetime,
+                       no_data_value=-99999.0,
+                       bounding_box=None,
+                       scratch_dir=None,
+                       verbose=None,
+                       stream=False,
+                       itersize=None,
+                       copy_format=None):
+
     """
     Get hourly snow depth observations from the "web_data" database on
     wdb0.
@@ -28,6 +1885,13 @@ def get_snow_depth_obs(begin_datetime,
     example, if begin_datetime is 2019-01-01 00 and end_datetime is
     2019-01-31 23, then 31 * 24 = 744 hours of data are gathered, from
     2019-01-01 00 to 2019-01-31 23.
+
+    If stream is True, rows are read in batches of itersize (default
+    DEFAULT_ITERSIZE) from a server-side cursor, so that the full list of
+    result tuples is never held in memory at once.
+
+    If copy_format is 'binary' or 'csv', observations are instead read with
+    COPY (see get_obs_columns), which avoids decoding rows into tuples.
     """
 
     file_name = 'wdb0_obs_snow_depth_' + \
@@ -39,157 +1903,96 @@ def get_snow_depth_obs(begin_datetime,
     if scratch_dir is not None:
         file_name = os.path.join(scratch_dir, file_name)
 
-    if os.path.isfile(file_name):
-
-        # Retrieve data from pkl file and return.
-        file_obj = open(file_name, 'rb')
-        obs_snow_depth = pkl.load(file_obj)
-        file_obj.close()
+    # Retrieve data from the cache and return, if available.
+    obs_snow_depth = _read_cache(file_name)
+    if obs_snow_depth is not None:
         return(obs_snow_depth)
 
     time_range = end_datetime - begin_datetime
     num_hours = time_range.days * 24 + time_range.seconds // 3600 + 1
     # print('num_hours = {}'.format(num_hours))
 
-    # Open the web database.
-    conn_string = "host='wdb0.dmz.nohrsc.noaa.gov' dbname='web_data'"
-    conn = psycopg2.connect(conn_string)
-    conn.set_client_encoding("utf-8")
-    cursor = conn.cursor()
-
     # Define a SQL statement.
     sql_cmd = 'SELECT ' + \
-              'point.allstation.obj_identifier, ' + \
-              'TRIM(point.allstation.station_id), ' + \
-              'TRIM(point.allstation.name), ' + \
-              'point.allstation.coordinates[0] AS lon, ' + \
-              'point.allstation.coordinates[1] AS lat, ' + \
-              'point.allstation.elevation, ' + \
-              'point.allstation.recorded_elevation, ' + \
+              'obj_identifier, ' + \
               'date, ' + \
               'value * 100.0 AS obs_snow_depth_cm ' + \
-              'FROM point.allstation, ' + \
-              'point.obs_snow_depth ' + \
+              'FROM point.obs_snow_depth ' + \
               'WHERE date >= \'' + \
               begin_datetime.strftime('%Y-%m-%d %H:%M:%S') + \
               '\' ' + \
               'AND date <= \'' + \
               end_datetime.strftime('%Y-%m-%d %H:%M:%S') + \
               '\' ' + \
-              'AND point.allstation.obj_identifier = ' + \
-              'point.obs_snow_depth.obj_identifier ' + \
               'AND value IS NOT NULL '
 
     if bounding_box is not None:
         sql_cmd = sql_cmd + \
-                  'AND point.allstation.coordinates[0] >= ' + \
-                  '{} '.format(bounding_box[0]) + \
-                  'AND point.allstation.coordinates[0] < ' + \
-                  '{} '.format(bounding_box[1]) + \
-                  'AND point.allstation.coordinates[1] >= ' + \
-                  '{} '.format(bounding_box[2]) + \
-                  'AND point.allstation.coordinates[1] < ' + \
-                  '{} '.format(bounding_box[3])
+                  'AND ' + _bounding_box_filter(bounding_box)
 
     sql_cmd = sql_cmd + 'ORDER BY obj_identifier, date;'
 
     if verbose:
         print('INFO: psql command "{}"'.format(sql_cmd))
 
-    cursor.execute(sql_cmd)
-
-    # The result below is just a huge list of tuples.
-    obs_depth = cursor.fetchall()
-
-    obs_depth_column_list = ['obj_identifier',
-                             'station_id',
-                             'name',
-                             'lon',
-                             'lat',
-                             'elevation',
-                             'recorded_elevation',
-                             'date',
-                             'obs_snow_depth_cm']
-
-    df = pd.DataFrame(obs_depth, columns=obs_depth_column_list)
-
-    # This section organizes the query results into lists and arrays.
-
-    station_ind = -1
-    current_station_obj_id = -1
-    station_obj_id = []
-    station_id = []
-    station_name = []
-    station_lon = []
-    station_lat = []
-    station_elevation = []
-    station_rec_elevation = []
-    # Create a 2-d [time, station] array.
-    obs = np.ma.empty([1, num_hours], dtype=float)
-    obs[0,:] = no_data_value
-    obs[0,:] = np.ma.masked
-    for ind, row in df.iterrows():
-        if row['obj_identifier'] != current_station_obj_id:
-            station_ind += 1
-            if station_ind > 0:
-                # Just finished all data for previous station.
-                obs = np.ma.append(obs,
-                                   np.ma.empty([1,
-                                                num_hours],
-                                               dtype=float),
-                                   axis=0)
-                obs[station_ind,:] = no_data_value
-                obs[station_ind,:] = np.ma.masked
-            # New station
-            station_obj_id.append(row['obj_identifier'])
-            station_id.append(row['station_id'])
-            station_name.append(row['name'])
-            station_lon.append(row['lon'])
-            station_lat.append(row['lat'])
-            station_elevation.append(row['elevation'])
-            station_rec_elevation.append(row['recorded_elevation'])
-
-            current_station_obj_id = station_obj_id[station_ind]
-
-        # Add the observation to the obs array.
-        time_diff = row['date'] - begin_datetime
-        time_ind = time_diff.days * 24 + time_diff.seconds // 3600
-
-        try:
-            obs[station_ind, time_ind] = row['obs_snow_depth_cm']
-        except:
-            print(num_hours)
-            print(station_ind, time_ind)
-            print(obs)
-            print(obs.shape)
-            print(row)
-            exit(1)
-
-    num_stations = station_ind + 1
-
-    obs_datetime = [begin_datetime +
-                    dt.timedelta(hours=i) for i in range(num_hours)]
-
-    # Place results in a dictionary.
-    obs_snow_depth = {'num_stations': num_stations,
-                      'num_hours': num_hours,
-                      'station_obj_id': station_obj_id,
-                      'station_id': station_id,
-                      'station_name': station_name,
-                      'station_lon': station_lon,
-                      'station_lat': station_lat,
-                      'station_elevation': station_elevation,
-                      'station_rec_elevation': station_rec_elevation,
-                      'obs_datetime': obs_datetime,
-                      'values_cm': obs}
-
-    # Create the pkl file if all data fetched is more than 60 days earlier
+    if copy_format is not None:
+
+        # Read the observations with COPY and join station metadata on the
+        # client.
+        obs_snow_depth = _copy_station_hour('obs_snow_depth',
+                                            100.0,
+                                            'values_cm',
+                                            begin_datetime,
+                                            end_datetime,
+                                            num_hours,
+                                            no_data_value=no_data_value,
+                                            bounding_box=bounding_box,
+                                            copy_format=copy_format,
+                                            scratch_dir=scratch_dir,
+                                            verbose=verbose)
+
+    elif stream:
+
+        # Read the query results in batches directly into station metadata
+        # lists and a 2-d [station, time] array.
+        obs_snow_depth = _stream_station_hour(sql_cmd,
+                                              'values_cm',
+                                              begin_datetime,
+                                              num_hours,
+                                              no_data_value=no_data_value,
+                                              itersize=itersize,
+                                              scratch_dir=scratch_dir,
+                                              verbose=verbose)
+
+    else:
+
+        # The result below is just a huge list of tuples.
+        obs_depth = _fetchall(sql_cmd)
+
+        obs_depth_column_list = ['obj_identifier',
+                                 'date',
+                                 'obs_snow_depth_cm']
+
+        df = pd.DataFrame(obs_depth, columns=obs_depth_column_list)
+
+        station_cache = get_station_cache(scratch_dir)
+
+        # Organize the query results into station metadata lists (from
+        # the station cache) and a 2-d [station, time] array.
+        obs_snow_depth = _pivot_station_hour(df,
+                                             'obs_snow_depth_cm',
+                                             'values_cm',
+                                             begin_datetime,
+                                             num_hours,
+                                             no_data_value=no_data_value,
+                                             station_cache=station_cache,
+                                             verbose=verbose)
+
+    # Cache the results if all data fetched is more than 60 days earlier
     # than the current date/time.
     lag = dt.datetime.utcnow() - end_datetime
     if lag > dt.timedelta(days=60):
-        file_obj = open(file_name, 'wb')
-        pkl.dump(obs_snow_depth, file_obj)
-        file_obj.close()
+        _write_cache(file_name, obs_snow_depth)
 
     return(obs_snow_depth)
 
@@ -199,7 +2002,10 @@ def get_swe_obs(begin_datetime,
                 no_data_value=-99999.0,
                 bounding_box=None,
                 scratch_dir=None,
-                verbose=None):
+                verbose=None,
+                stream=False,
+                itersize=None,
+                copy_format=None):
 
     """
     Get hourly snow water equivalent observations from the "web_data" database
@@ -208,6 +2014,13 @@ def get_swe_obs(begin_datetime,
     example, if begin_datetime is 2019-01-01 00 and end_datetime is
     2019-01-31 23, then 31 * 24 = 744 hours of data are gathered, from
     2019-01-01 00 to 2019-01-31 23.
+
+    If stream is True, rows are read in batches of itersize (default
+    DEFAULT_ITERSIZE) from a server-side cursor, so that the full list of
+    result tuples is never held in memory at once.
+
+    If copy_format is 'binary' or 'csv', observations are instead read with
+    COPY (see get_obs_columns), which avoids decoding rows into tuples.
     """
 
     file_name = 'wdb0_obs_snow_water_equivalent_' + \
@@ -219,146 +2032,95 @@ def get_swe_obs(begin_datetime,
     if scratch_dir is not None:
         file_name = os.path.join(scratch_dir, file_name)
 
-    if os.path.isfile(file_name):
-
-        # Retrieve data from pkl file and return.
-        file_obj = open(file_name, 'rb')
-        obs_swe = pkl.load(file_obj)
-        file_obj.close()
+    # Retrieve data from the cache and return, if available.
+    obs_swe = _read_cache(file_name)
+    if obs_swe is not None:
         return(obs_swe)
 
     time_range = end_datetime - begin_datetime
     num_hours = time_range.days * 24 + time_range.seconds // 3600 + 1
 
-    # Open the web database.
-    conn_string = "host='wdb0.dmz.nohrsc.noaa.gov' dbname='web_data'"
-    conn = psycopg2.connect(conn_string)
-    conn.set_client_encoding("utf-8")
-    cursor = conn.cursor()
-
     # Define a SQL statement.
     sql_cmd = 'SELECT ' + \
-              'point.allstation.obj_identifier, ' + \
-              'TRIM(point.allstation.station_id), ' + \
-              'TRIM(point.allstation.name), ' + \
-              'point.allstation.coordinates[0] AS lon, ' + \
-              'point.allstation.coordinates[1] AS lat, ' + \
-              'point.allstation.elevation, ' + \
-              'point.allstation.recorded_elevation, ' + \
+              'obj_identifier, ' + \
               'date, ' + \
               'value * 1000.0 AS obs_swe_mm ' + \
-              'FROM point.allstation, ' + \
-              'point.obs_swe ' + \
+              'FROM point.obs_swe ' + \
               'WHERE date >= \'' + \
               begin_datetime.strftime('%Y-%m-%d %H:%M:%S') + \
               '\' ' + \
               'AND date <= \'' + \
               end_datetime.strftime('%Y-%m-%d %H:%M:%S') + \
               '\' ' + \
-              'AND point.allstation.obj_identifier = ' + \
-              'point.obs_swe.obj_identifier ' + \
               'AND value IS NOT NULL '
 
     if bounding_box is not None:
         sql_cmd = sql_cmd + \
-                  'AND point.allstation.coordinates[0] >= ' + \
-                  '{} '.format(bounding_box[0]) + \
-                  'AND point.allstation.coordinates[0] < ' + \
-                  '{} '.format(bounding_box[1]) + \
-                  'AND point.allstation.coordinates[1] >= ' + \
-                  '{} '.format(bounding_box[2]) + \
-                  'AND point.allstation.coordinates[1] < ' + \
-                  '{} '.format(bounding_box[3])
+                  'AND ' + _bounding_box_filter(bounding_box)
 
     sql_cmd = sql_cmd + 'ORDER BY obj_identifier, date;'
 
     if verbose:
         print('INFO: psql command "{}"'.format(sql_cmd))
 
-    cursor.execute(sql_cmd)
-
-    # The result below is just a huge list of tuples.
-    obs_swe = cursor.fetchall()
-
-    obs_swe_column_list = ['obj_identifier',
-                           'station_id',
-                           'name',
-                           'lon',
-                           'lat',
-                           'elevation',
-                           'recorded_elevation',
-                           'date',
-                           'obs_swe_mm']
-
-    df = pd.DataFrame(obs_swe, columns=obs_swe_column_list)
-
-    # This section organizes the query results into lists and arrays.
-
-    station_ind = -1
-    current_station_obj_id = -1
-    station_obj_id = []
-    station_id = []
-    station_name = []
-    station_lon = []
-    station_lat = []
-    station_elevation = []
-    station_rec_elevation = []
-    # Create a 2-d [time, station] array.
-    obs = np.ma.empty([1, num_hours], dtype=float)
-    obs[0,:] = no_data_value
-    obs[0,:] = np.ma.masked
-    for ind, row in df.iterrows():
-        if row['obj_identifier'] != current_station_obj_id:
-            station_ind += 1
-            if station_ind > 0:
-                # Just finished all data for previous station.
-                obs = np.ma.append(obs,
-                                   np.ma.empty([1, num_hours],
-                                               dtype=float),
-                                   axis=0)
-                obs[station_ind,:] = no_data_value
-                obs[station_ind,:] = np.ma.masked
-            # New station
-            station_obj_id.append(row['obj_identifier'])
-            station_id.append(row['station_id'])
-            station_name.append(row['name'])
-            station_lon.append(row['lon'])
-            station_lat.append(row['lat'])
-            station_elevation.append(row['elevation'])
-            station_rec_elevation.append(row['recorded_elevation'])
-
-            current_station_obj_id = station_obj_id[station_ind]
-
-        # Add the observation to the obs array.
-        time_diff = row['date'] - begin_datetime
-        time_ind = time_diff.days * 24 + time_diff.seconds // 3600
-        obs[station_ind, time_ind] = row['obs_swe_mm']
-
-    num_stations = station_ind + 1
-
-    obs_datetime = [begin_datetime +
-                    dt.timedelta(hours=i) for i in range(num_hours)]
-
-    # Place results in a dictionary.
-    obs_swe = {'num_stations': num_stations,
-               'num_hours': num_hours,
-               'station_obj_id': station_obj_id,
-               'station_id': station_id,
-               'station_name': station_name,
-               'station_lon': station_lon,
-               'station_lat': station_lat,
-               'station_elevation': station_elevation,
-               'station_rec_elevation': station_rec_elevation,
-               'obs_datetime': obs_datetime,
-               'values_mm': obs}
-
-    # Create the pkl file if all data fetched is more than 60 days earlier
+    if copy_format is not None:
+
+        # Read the observations with COPY and join station metadata on the
+        # client.
+        obs_swe = _copy_station_hour('obs_swe',
+                                     1000.0,
+                                     'values_mm',
+                                     begin_datetime,
+                                     end_datetime,
+                                     num_hours,
+                                     no_data_value=no_data_value,
+                                     bounding_box=bounding_box,
+                                     copy_format=copy_format,
+                                     scratch_dir=scratch_dir,
+                                     verbose=verbose)
+
+    elif stream:
+
+        # Read the query results in batches directly into station metadata
+        # lists and a 2-d [station, time] array.
+        obs_swe = _stream_station_hour(sql_cmd,
+                                       'values_mm',
+                                       begin_datetime,
+                                       num_hours,
+                                       no_data_value=no_data_value,
+                                       itersize=itersize,
+                                       scratch_dir=scratch_dir,
+                                       verbose=verbose)
+
+    else:
+
+        # The result below is just a huge list of tuples.
+        obs_swe = _fetchall(sql_cmd)
+
+        obs_swe_column_list = ['obj_identifier',
+                               'date',
+                               'obs_swe_mm']
+
+        df = pd.DataFrame(obs_swe, columns=obs_swe_column_list)
+
+        station_cache = get_station_cache(scratch_dir)
+
+        # Organize the query results into station metadata lists (from
+        # the station cache) and a 2-d [station, time] array.
+        obs_swe = _pivot_station_hour(df,
+                                      'obs_swe_mm',
+                                      'values_mm',
+                                      begin_datetime,
+                                      num_hours,
+                                      no_data_value=no_data_value,
+                                      station_cache=station_cache,
+                                      verbose=verbose)
+
+    # Cache the results if all data fetched is more than 60 days earlier
     # than the current date/time.
     lag = dt.datetime.utcnow() - end_datetime
     if lag > dt.timedelta(days=60):
-        file_obj = open(file_name, 'wb')
-        pkl.dump(obs_swe, file_obj)
-        file_obj.close()
+        _write_cache(file_name, obs_swe)
 
     return(obs_swe)
 
@@ -374,7 +2136,9 @@ def get_swe_obs_df(begin_datetime,
                    no_data_value=-99999.0,
                    bounding_box=None,
                    scratch_dir=None,
-                   verbose=None):
+                   verbose=None,
+                   stream=False,
+                   itersize=None):
 
     """
     Get hourly snow water equivalent observations from the "web_data" database
@@ -383,6 +2147,10 @@ def get_swe_obs_df(begin_datetime,
     example, if begin_datetime is 2019-01-01 00 and end_datetime is
     2019-01-31 23, then 31 * 24 = 744 hours of data are gathered, from
     2019-01-01 00 to 2019-01-31 23.
+
+    If stream is True, rows are read in batches of itersize (default
+    DEFAULT_ITERSIZE) from a server-side cursor, so that the full list of
+    result tuples is never held in memory at once.
     """
 
     file_name = 'wdb0_obs_snow_water_equivalent_df_' + \
@@ -394,87 +2162,74 @@ def get_swe_obs_df(begin_datetime,
     if scratch_dir is not None:
         file_name = os.path.join(scratch_dir, file_name)
 
-    if os.path.isfile(file_name):
-
-        # Retrieve data from pkl file and return.
-        file_obj = open(file_name, 'rb')
-        obs_swe_df = pkl.load(file_obj)
-        file_obj.close()
+    # Retrieve data from the cache and return, if available.
+    obs_swe_df = _read_cache(file_name)
+    if obs_swe_df is not None:
         return(obs_swe_df)
 
     time_range = end_datetime - begin_datetime
     num_hours = time_range.days * 24 + time_range.seconds // 3600 + 1
 
-    # Open the web database.
-    conn_string = "host='wdb0.dmz.nohrsc.noaa.gov' dbname='web_data'"
-    conn = psycopg2.connect(conn_string)
-    conn.set_client_encoding("utf-8")
-    cursor = conn.cursor()
-
     # Define a SQL statement.
     sql_cmd = 'SELECT ' + \
-              'point.allstation.obj_identifier, ' + \
-              'TRIM(point.allstation.station_id), ' + \
-              'TRIM(point.allstation.name), ' + \
-              'point.allstation.coordinates[0] AS lon, ' + \
-              'point.allstation.coordinates[1] AS lat, ' + \
-              'point.allstation.elevation, ' + \
-              'point.allstation.recorded_elevation, ' + \
+              'obj_identifier, ' + \
               'date, ' + \
               'value * 1000.0 AS obs_swe_mm ' + \
-              'FROM point.allstation, ' + \
-              'point.obs_swe ' + \
+              'FROM point.obs_swe ' + \
               'WHERE date >= \'' + \
               begin_datetime.strftime('%Y-%m-%d %H:%M:%S') + \
               '\' ' + \
               'AND date <= \'' + \
               end_datetime.strftime('%Y-%m-%d %H:%M:%S') + \
               '\' ' + \
-              'AND point.allstation.obj_identifier = ' + \
-              'point.obs_swe.obj_identifier ' + \
               'AND value IS NOT NULL '
 
     if bounding_box is not None:
         sql_cmd = sql_cmd + \
-                  'AND point.allstation.coordinates[0] >= ' + \
-                  '{} '.format(bounding_box[0]) + \
-                  'AND point.allstation.coordinates[0] < ' + \
-                  '{} '.format(bounding_box[1]) + \
-                  'AND point.allstation.coordinates[1] >= ' + \
-                  '{} '.format(bounding_box[2]) + \
-                  'AND point.allstation.coordinates[1] < ' + \
-                  '{} '.format(bounding_box[3])
+                  'AND ' + _bounding_box_filter(bounding_box)
 
     sql_cmd = sql_cmd + 'ORDER BY obj_identifier, date;'
 
     if verbose:
         print('INFO: psql command "{}"'.format(sql_cmd))
 
-    cursor.execute(sql_cmd)
-
-    # The result below is just a huge list of tuples.
-    obs_swe = cursor.fetchall()
-
     obs_swe_column_list = ['obj_identifier',
-                           'station_id',
-                           'name',
-                           'lon',
-                           'lat',
-                           'elevation',
-                           'recorded_elevation',
                            'date',
                            'obs_swe_mm']
 
-    obs_swe_df = pd.DataFrame(obs_swe, columns=obs_swe_column_list)
-    conn.close()
+    if stream:
+
+        # Convert each batch of tuples to a dataframe as it arrives, so
+        # only one batch of tuples exists at a time.
+        df_list = [pd.DataFrame(rows, columns=obs_swe_column_list)
+                   for rows in _iter_batches(sql_cmd, itersize=itersize)]
+        if len(df_list) == 0:
+            obs_swe_df = pd.DataFrame([], columns=obs_swe_column_list)
+        else:
+            obs_swe_df = pd.concat(df_list, ignore_index=True)
+        del df_list
 
-    # Create the pkl file if all data fetched is more than 60 days earlier
+    else:
+
+        # The result below is just a huge list of tuples.
+        obs_swe = _fetchall(sql_cmd)
+
+        obs_swe_df = pd.DataFrame(obs_swe, columns=obs_swe_column_list)
+
+    # Attach station metadata from the station cache. An inner merge keeps
+    # the order of the observations and drops stations that are not in
+    # point.allstation, as the join in SQL would.
+    station_cache = get_station_cache(scratch_dir)
+    meta_df = station_cache.lookup(pd.unique(obs_swe_df['obj_identifier']),
+                                   verbose=verbose)
+    obs_swe_df = obs_swe_df.merge(meta_df, on='obj_identifier', how='inner')
+    obs_swe_df = obs_swe_df[_copy_meta_column_list + ['date', 'obs_swe_mm']]
+
+    # Cache the results if all data fetched is more than 60 days earlier
     # than the current date/time.
     lag = dt.datetime.utcnow() - end_datetime
     if lag > dt.timedelta(days=60):
-        file_obj = open(file_name, 'wb')
-        pkl.dump(obs_swe_df, file_obj)
-        file_obj.close()
+        _write_cache(file_name, obs_swe_df)
 
     return(obs_swe_df)
 
@@ -498,7 +2253,7 @@ def get_prev_snow_depth_obs(target_datetime,
     begin_datetime = target_datetime - dt.timedelta(hours=num_hours_prev_sd)
     end_datetime = target_datetime - dt.timedelta(hours=1)
 
-    # Only use .pkl files if there is no bounding box.
+    # Only use the cache if there is no bounding box.
     if bounding_box is None:
 
         file_name = 'wdb0_obs_snow_depth_' + \
@@ -510,32 +2265,17 @@ def get_prev_snow_depth_obs(target_datetime,
         if scratch_dir is not None:
             file_name = os.path.join(scratch_dir, file_name)
 
-            if os.path.isfile(file_name):
-
-                # Retrieve data from pkl file and return.
-                file_obj = open(file_name, 'rb')
-                obs_snow_depth = pkl.load(file_obj)
-                file_obj.close()
+            # Retrieve data from the cache and return, if available.
+            obs_snow_depth = _read_cache(file_name)
+            if obs_snow_depth is not None:
                 return(obs_snow_depth)
 
     time_range = end_datetime - begin_datetime
     num_hours = time_range.days * 24 + time_range.seconds // 3600 + 1
 
-    # Open the web database.
-    conn_string = "host='wdb0.dmz.nohrsc.noaa.gov' dbname='web_data'"
-    conn = psycopg2.connect(conn_string)
-    conn.set_client_encoding("utf-8")
-    cursor = conn.cursor()
-
     # Define a SQL statement.
     sql_cmd = 'SELECT ' + \
               't1.obj_identifier, ' + \
-              'TRIM(t3.station_id), ' + \
-              'TRIM(t3.name), ' + \
-              't3.coordinates[0] AS lon, ' + \
-              't3.coordinates[1] AS lat, ' + \
-              't3.elevation, ' + \
-              't3.recorded_elevation, ' + \
               't2.date, ' + \
               't2.value * 100.0 AS obs_snow_depth_cm ' + \
               'FROM ' + \
@@ -549,8 +2289,7 @@ def get_prev_snow_depth_obs(target_datetime,
               'GROUP BY obj_identifier' + \
               ') ' + \
               'AS t1, ' + \
-              'point.obs_snow_depth AS t2, ' + \
-              'point.allstation AS t3 ' + \
+              'point.obs_snow_depth AS t2 ' + \
               'WHERE t2.date >= \'' + \
               begin_datetime.strftime('%Y-%m-%d %H:%M:%S') + \
               '\' ' + \
@@ -558,123 +2297,48 @@ def get_prev_snow_depth_obs(target_datetime,
               end_datetime.strftime('%Y-%m-%d %H:%M:%S') + \
               '\' ' + \
               'AND t1.obj_identifier = t2.obj_identifier ' + \
-              'AND t2.obj_identifier = t3.obj_identifier ' + \
-              'AND t3.obj_identifier = t1.obj_identifier ' + \
               'AND t2.value IS NOT NULL '
 
     if bounding_box is not None:
         sql_cmd = sql_cmd + \
-                  'AND t3.coordinates[0] >= ' + \
-                  '{} '.format(bounding_box[0]) + \
-                  'AND t3.coordinates[0] < ' + \
-                  '{} '.format(bounding_box[1]) + \
-                  'AND t3.coordinates[1] >= ' + \
-                  '{} '.format(bounding_box[2]) + \
-                  'AND t3.coordinates[1] < ' + \
-                  '{} '.format(bounding_box[3])
+                  'AND t2.' + _bounding_box_filter(bounding_box)
 
     sql_cmd = sql_cmd + 'ORDER BY t1.obj_identifier, t2.date;'
 
     if verbose:
         print('INFO: psql command "{}"'.format(sql_cmd))
 
-    cursor.execute(sql_cmd)
-
     # The result below is just a huge list of tuples.
-    obs_depth = cursor.fetchall()
+    obs_depth = _fetchall(sql_cmd)
 
     obs_depth_column_list = ['obj_identifier',
-                             'station_id',
-                             'name',
-                             'lon',
-                             'lat',
-                             'elevation',
-                             'recorded_elevation',
                              'date',
                              'obs_snow_depth_cm']
 
     df = pd.DataFrame(obs_depth, columns=obs_depth_column_list)
 
-    # This section organizes the query results into lists and arrays.
-
-    station_ind = -1
-    current_station_obj_id = -1
-    station_obj_id = []
-    station_id = []
-    station_name = []
-    station_lon = []
-    station_lat = []
-    station_elevation = []
-    station_rec_elevation = []
-    # Create a 2-d [time, station] array.
-    obs = np.ma.empty([1, num_hours], dtype=float)
-    obs[0,:] = no_data_value
-    obs[0,:] = np.ma.masked
-    for ind, row in df.iterrows():
-        if row['obj_identifier'] != current_station_obj_id:
-            station_ind += 1
-            if station_ind > 0:
-                # Just finished all data for previous station.
-                obs = np.ma.append(obs,
-                                   np.ma.empty([1,
-                                                num_hours],
-                                               dtype=float),
-                                   axis=0)
-                obs[station_ind,:] = no_data_value
-                obs[station_ind,:] = np.ma.masked
-            # New station
-            station_obj_id.append(row['obj_identifier'])
-            station_id.append(row['station_id'])
-            station_name.append(row['name'])
-            station_lon.append(row['lon'])
-            station_lat.append(row['lat'])
-            station_elevation.append(row['elevation'])
-            station_rec_elevation.append(row['recorded_elevation'])
-
-            current_station_obj_id = station_obj_id[station_ind]
-
-        # Add the observation to the obs array.
-        time_diff = row['date'] - begin_datetime
-        time_ind = time_diff.days * 24 + time_diff.seconds // 3600
+    station_cache = get_station_cache(scratch_dir)
 
-        try:
-            obs[station_ind, time_ind] = row['obs_snow_depth_cm']
-        except:
-            print(num_hours)
-            print(station_ind, time_ind)
-            print(obs)
-            print(obs.shape)
-            print(row)
-            exit(1)
+    # Organize the query results into station metadata lists (from
+    # the station cache) and a 2-d [station, time] array.
+    obs_snow_depth = _pivot_station_hour(df,
+                                         'obs_snow_depth_cm',
+                                         'values_cm',
+                                         begin_datetime,
+                                         num_hours,
+                                         no_data_value=no_data_value,
+                                         station_cache=station_cache,
+                                         verbose=verbose)
 
-    num_stations = station_ind + 1
-
-    obs_datetime = [begin_datetime +
-                    dt.timedelta(hours=i) for i in range(num_hours)]
-
-    # Place results in a dictionary.
-    obs_snow_depth = {'num_stations': num_stations,
-                      'num_hours': num_hours,
-                      'station_obj_id': station_obj_id,
-                      'station_id': station_id,
-                      'station_name': station_name,
-                      'station_lon': station_lon,
-                      'station_lat': station_lat,
-                      'station_elevation': station_elevation,
-                      'station_rec_elevation': station_rec_elevation,
-                      'obs_datetime': obs_datetime,
-                      'values_cm': obs}
-
-    # Create the pkl file if all data fetched is more than 60 days earlier
+    # Cache the results if all data fetched is more than 60 days earlier
     # than the current date/time.
     lag = dt.datetime.utcnow() - end_datetime
     if bounding_box is None and \
        lag > dt.timedelta(days=60):
-        file_obj = open(file_name, 'wb')
-        pkl.dump(obs_snow_depth, file_obj)
-        file_obj.close()
+        _write_cache(file_name, obs_snow_depth)
         if verbose:
-            print('INFO: wrote query results to {}.'.format(file_name))
+            print('INFO: wrote query results to {}.'.
+                  format(cache_dir_name(file_name)))
 
     return(obs_snow_depth)
 
@@ -684,14 +2348,18 @@ def get_air_temp_obs(begin_datetime,
                      no_data_value=-99999.0,
                      bounding_box=None,
                      scratch_dir=None,
-                     verbose=None):
+                     verbose=None,
+                     copy_format=None):
 
     """
     Get hourly air temperature observations from the "web_data" database on
     wdb0.
+
+    If copy_format is 'binary' or 'csv', observations are read with COPY
+    (see get_obs_columns), which avoids decoding rows into tuples.
     """
 
-    # Only use .pkl files if there is no bounding box.
+    # Only use the cache if there is no bounding box.
     if bounding_box is None:
 
         file_name = 'wdb0_obs_air_temp_' + \
@@ -703,151 +2371,88 @@ def get_air_temp_obs(begin_datetime,
         if scratch_dir is not None:
             file_name = os.path.join(scratch_dir, file_name)
 
-            if os.path.isfile(file_name):
-
-                # Retrieve data from pkl file and return.
-                file_obj = open(file_name, 'rb')
-                obs_air_temp = pkl.load(file_obj)
-                file_obj.close()
+            # Retrieve data from the cache and return, if available.
+            obs_air_temp = _read_cache(file_name)
+            if obs_air_temp is not None:
                 return(obs_air_temp)
 
     time_range = end_datetime - begin_datetime
     num_hours = time_range.days * 24 + time_range.seconds // 3600 + 1
     # print('num_hours = {}'.format(num_hours))
 
-    # Open the web database.
-    conn_string = "host='wdb0.dmz.nohrsc.noaa.gov' dbname='web_data'"
-    conn = psycopg2.connect(conn_string)
-    conn.set_client_encoding("utf-8")
-    cursor = conn.cursor()
-
     # Define a SQL statement.
     sql_cmd = 'SELECT ' + \
-              'point.allstation.obj_identifier, ' + \
-              'TRIM(point.allstation.station_id), ' + \
-              'TRIM(point.allstation.name), ' + \
-              'point.allstation.coordinates[0] as lon, ' + \
-              'point.allstation.coordinates[1] as lat, ' + \
-              'point.allstation.elevation, ' + \
-              'point.allstation.recorded_elevation, ' + \
+              'obj_identifier, ' + \
               'date, ' + \
               'value AS obs_air_temp_deg_c ' + \
-              'FROM point.allstation, point.obs_airtemp ' + \
+              'FROM point.obs_airtemp ' + \
               'WHERE date >= \'' + \
               begin_datetime.strftime('%Y-%m-%d %H:%M:%S') + \
               '\' ' + \
               'AND date <= \'' + \
               end_datetime.strftime('%Y-%m-%d %H:%M:%S') + \
               '\' ' + \
-              'AND point.allstation.obj_identifier = ' + \
-              'point.obs_airtemp.obj_identifier ' + \
               'AND value IS NOT NULL '
 
     if bounding_box is not None:
         sql_cmd = sql_cmd + \
-                  'AND point.allstation.coordinates[0] >= ' + \
-                  '{} '.format(bounding_box[0]) + \
-                  'AND point.allstation.coordinates[0] < ' + \
-                  '{} '.format(bounding_box[1]) + \
-                  'AND point.allstation.coordinates[1] >= ' + \
-                  '{} '.format(bounding_box[2]) + \
-                  'AND point.allstation.coordinates[1] < ' + \
-                  '{} '.format(bounding_box[3])
+                  'AND ' + _bounding_box_filter(bounding_box)
 
     sql_cmd = sql_cmd + 'ORDER BY obj_identifier, date;'
 
     if verbose:
         print('INFO: psql command "{}"'.format(sql_cmd))
 
-    cursor.execute(sql_cmd)
-
-    # The result below is just a huge list of tuples.
-    fetched_airtemp = cursor.fetchall()
-
-    obs_air_temp_column_list = ['obj_identifier',
-                                'station_id',
-                                'name',
-                                'lon',
-                                'lat',
-                                'elevation',
-                                'recorded_elevation',
-                                'date',
-                                'obs_air_temp_deg_c']
-
-    df = pd.DataFrame(fetched_airtemp, columns=obs_air_temp_column_list)
-
-    # This section organizes the query results into lists and arrays.
-
-    station_ind = -1
-    current_station_obj_id = -1
-    station_obj_id = []
-    station_id = []
-    station_name = []
-    station_lon = []
-    station_lat = []
-    station_elevation = []
-    station_rec_elevation = []
-    # Create a 2-d [time, station] array.
-    obs = np.ma.empty([1, num_hours], dtype=float)
-    obs[0,:] = no_data_value
-    obs[0,:] = np.ma.masked
-    for ind, row in df.iterrows():
-        if row['obj_identifier'] != current_station_obj_id:
-            station_ind += 1
-            if station_ind > 0:
-                # Just finished all data for previous station.
-                obs = np.ma.append(obs,
-                                   np.ma.empty([1,
-                                                num_hours],
-                                               dtype=float),
-                                   axis=0)
-                obs[station_ind,:] = no_data_value
-                obs[station_ind,:] = np.ma.masked
-            # New station
-            station_obj_id.append(row['obj_identifier'])
-            station_id.append(row['station_id'])
-            station_name.append(row['name'])
-            station_lon.append(row['lon'])
-            station_lat.append(row['lat'])
-            station_elevation.append(row['elevation'])
-            station_rec_elevation.append(row['recorded_elevation'])
-
-            current_station_obj_id = station_obj_id[station_ind]
-
-        # Add the observation to the obs array.
-        time_diff = row['date'] - begin_datetime
-        time_ind = time_diff.days * 24 + time_diff.seconds // 3600
-
-        obs[station_ind, time_ind] = row['obs_air_temp_deg_c']
-
-    num_stations = station_ind + 1
-
-    obs_datetime = [begin_datetime +
-                    dt.timedelta(hours=i) for i in range(num_hours)]
-
-    # Place results in a dictionary.
-    obs_air_temp = {'num_stations': num_stations,
-                    'num_hours': num_hours,
-                    'station_obj_id': station_obj_id,
-                    'station_id': station_id,
-                    'station_name': station_name,
-                    'station_lon': station_lon,
-                    'station_lat': station_lat,
-                    'station_elevation': station_elevation,
-                    'station_rec_elevation': station_rec_elevation,
-                    'obs_datetime': obs_datetime,
-                    'values_deg_c': obs}
-
-    # Create the pkl file if all data fetched is more than 60 days earlier
+    if copy_format is not None:
+
+        # Read the observations with COPY and join station metadata on the
+        # client.
+        obs_air_temp = _copy_station_hour('obs_airtemp',
+                                          1.0,
+                                          'values_deg_c',
+                                          begin_datetime,
+                                          end_datetime,
+                                          num_hours,
+                                          no_data_value=no_data_value,
+                                          bounding_box=bounding_box,
+                                          copy_format=copy_format,
+                                          scratch_dir=scratch_dir,
+                                          verbose=verbose)
+
+    else:
+
+        # The result below is just a huge list of tuples.
+        fetched_airtemp = _fetchall(sql_cmd)
+
+        obs_air_temp_column_list = ['obj_identifier',
+                                    'date',
+                                    'obs_air_temp_deg_c']
+
+        df = pd.DataFrame(fetched_airtemp,
+                          columns=obs_air_temp_column_list)
+
+        station_cache = get_station_cache(scratch_dir)
+
+        # Organize the query results into station metadata lists (from
+        # the station cache) and a 2-d [station, time] array.
+        obs_air_temp = _pivot_station_hour(df,
+                                           'obs_air_temp_deg_c',
+                                           'values_deg_c',
+                                           begin_datetime,
+                                           num_hours,
+                                           no_data_value=no_data_value,
+                                           station_cache=station_cache,
+                                           verbose=verbose)
+
+    # Cache the results if all data fetched is more than 60 days earlier
     # than the current date/time.
     lag = dt.datetime.utcnow() - end_datetime
     if bounding_box is None and \
        lag > dt.timedelta(days=60):
-        file_obj = open(file_name, 'wb')
-        pkl.dump(obs_air_temp, file_obj)
-        file_obj.close()
+        _write_cache(file_name, obs_air_temp)
         if verbose:
-            print('INFO: wrote query results to {}.'.format(file_name))
+            print('INFO: wrote query results to {}.'.
+                  format(cache_dir_name(file_name)))
 
     return(obs_air_temp)
 
@@ -871,7 +2476,7 @@ def get_prev_air_temp_obs(target_datetime,
     begin_datetime = target_datetime - dt.timedelta(hours=num_hours_prev_sd)
     end_datetime = target_datetime - dt.timedelta(hours=1)
 
-    # Only use .pkl files if there is no bounding box.
+    # Only use the cache if there is no bounding box.
     if bounding_box is None:
 
         file_name = 'wdb0_obs_air_temp_' + \
@@ -883,32 +2488,17 @@ def get_prev_air_temp_obs(target_datetime,
         if scratch_dir is not None:
             file_name = os.path.join(scratch_dir, file_name)
 
-            if os.path.isfile(file_name):
-
-                # Retrieve data from pkl file and return.
-                file_obj = open(file_name, 'rb')
-                obs_air_temp = pkl.load(file_obj)
-                file_obj.close()
+            # Retrieve data from the cache and return, if available.
+            obs_air_temp = _read_cache(file_name)
+            if obs_air_temp is not None:
                 return(obs_air_temp)
 
     time_range = end_datetime - begin_datetime
     num_hours = time_range.days * 24 + time_range.seconds // 3600 + 1
 
-    # Open the web database.
-    conn_string = "host='wdb0.dmz.nohrsc.noaa.gov' dbname='web_data'"
-    conn = psycopg2.connect(conn_string)
-    conn.set_client_encoding("utf-8")
-    cursor = conn.cursor()
-
     # Define a SQL statement.
     sql_cmd = 'SELECT ' + \
               't1.obj_identifier, ' + \
-              'TRIM(t3.station_id), ' + \
-              'TRIM(t3.name), ' + \
-              't3.coordinates[0] AS lon, ' + \
-              't3.coordinates[1] AS lat, ' + \
-              't3.elevation, ' + \
-              't3.recorded_elevation, ' + \
               't2.date, ' + \
               't2.value AS obs_air_temp_deg_c ' + \
               'FROM ' + \
@@ -922,8 +2512,7 @@ def get_prev_air_temp_obs(target_datetime,
               'GROUP BY obj_identifier' + \
               ') ' + \
               'AS t1, ' + \
-              'point.obs_airtemp AS t2, ' + \
-              'point.allstation AS t3 ' + \
+              'point.obs_airtemp AS t2 ' + \
               'WHERE t2.date >= \'' + \
               begin_datetime.strftime('%Y-%m-%d %H:%M:%S') + \
               '\' ' + \
@@ -931,123 +2520,48 @@ def get_prev_air_temp_obs(target_datetime,
               end_datetime.strftime('%Y-%m-%d %H:%M:%S') + \
               '\' ' + \
               'AND t1.obj_identifier = t2.obj_identifier ' + \
-              'AND t2.obj_identifier = t3.obj_identifier ' + \
-              'AND t3.obj_identifier = t1.obj_identifier ' + \
               'AND t2.value IS NOT NULL '
 
     if bounding_box is not None:
         sql_cmd = sql_cmd + \
-                  'AND t3.coordinates[0] >= ' + \
-                  '{} '.format(bounding_box[0]) + \
-                  'AND t3.coordinates[0] < ' + \
-                  '{} '.format(bounding_box[1]) + \
-                  'AND t3.coordinates[1] >= ' + \
-                  '{} '.format(bounding_box[2]) + \
-                  'AND t3.coordinates[1] < ' + \
-                  '{} '.format(bounding_box[3])
+                  'AND t2.' + _bounding_box_filter(bounding_box)
 
     sql_cmd = sql_cmd + 'ORDER BY t1.obj_identifier, t2.date;'
 
     if verbose:
         print('INFO: psql command "{}"'.format(sql_cmd))
 
-    cursor.execute(sql_cmd)
-
     # The result below is just a huge list of tuples.
-    fetched_airtemp = cursor.fetchall()
+    fetched_airtemp = _fetchall(sql_cmd)
 
     obs_air_temp_column_list = ['obj_identifier',
-                                'station_id',
-                                'name',
-                                'lon',
-                                'lat',
-                                'elevation',
-                                'recorded_elevation',
                                 'date',
                                 'obs_air_temp_deg_c']
 
     df = pd.DataFrame(fetched_airtemp, columns=obs_air_temp_column_list)
 
-    # This section organizes the query results into lists and arrays.
-
-    station_ind = -1
-    current_station_obj_id = -1
-    station_obj_id = []
-    station_id = []
-    station_name = []
-    station_lon = []
-    station_lat = []
-    station_elevation = []
-    station_rec_elevation = []
-    # Create a 2-d [time, station] array.
-    obs = np.ma.empty([1, num_hours], dtype=float)
-    obs[0,:] = no_data_value
-    obs[0,:] = np.ma.masked
-    for ind, row in df.iterrows():
-        if row['obj_identifier'] != current_station_obj_id:
-            station_ind += 1
-            if station_ind > 0:
-                # Just finished all data for previous station.
-                obs = np.ma.append(obs,
-                                   np.ma.empty([1,
-                                                num_hours],
-                                               dtype=float),
-                                   axis=0)
-                obs[station_ind,:] = no_data_value
-                obs[station_ind,:] = np.ma.masked
-            # New station
-            station_obj_id.append(row['obj_identifier'])
-            station_id.append(row['station_id'])
-            station_name.append(row['name'])
-            station_lon.append(row['lon'])
-            station_lat.append(row['lat'])
-            station_elevation.append(row['elevation'])
-            station_rec_elevation.append(row['recorded_elevation'])
-
-            current_station_obj_id = station_obj_id[station_ind]
-
-        # Add the observation to the obs array.
-        time_diff = row['date'] - begin_datetime
-        time_ind = time_diff.days * 24 + time_diff.seconds // 3600
-
-        try:
-            obs[station_ind, time_ind] = row['obs_air_temp_deg_c']
-        except:
-            print(num_hours)
-            print(station_ind, time_ind)
-            print(obs)
-            print(obs.shape)
-            print(row)
-            exit(1)
+    station_cache = get_station_cache(scratch_dir)
 
-    num_stations = station_ind + 1
+    # Organize the query results into station metadata lists (from
+    # the station cache) and a 2-d [station, time] array.
+    obs_air_temp = _pivot_station_hour(df,
+                                       'obs_air_temp_deg_c',
+                                       'values_deg_c',
+                                       begin_datetime,
+                                       num_hours,
+                                       no_data_value=no_data_value,
+                                       station_cache=station_cache,
+                                       verbose=verbose)
 
-    obs_datetime = [begin_datetime +
-                    dt.timedelta(hours=i) for i in range(num_hours)]
-
-    # Place results in a dictionary.
-    obs_air_temp = {'num_stations': num_stations,
-                    'num_hours': num_hours,
-                    'station_obj_id': station_obj_id,
-                    'station_id': station_id,
-                    'station_name': station_name,
-                    'station_lon': station_lon,
-                    'station_lat': station_lat,
-                    'station_elevation': station_elevation,
-                    'station_rec_elevation': station_rec_elevation,
-                    'obs_datetime': obs_datetime,
-                    'values_deg_c': obs}
-
-    # Create the pkl file if all data fetched is more than 60 days earlier
+    # Cache the results if all data fetched is more than 60 days earlier
     # than the current date/time.
     lag = dt.datetime.utcnow() - end_datetime
     if bounding_box is None and \
        lag > dt.timedelta(days=60):
-        file_obj = open(file_name, 'wb')
-        pkl.dump(obs_air_temp, file_obj)
-        file_obj.close()
+        _write_cache(file_name, obs_air_temp)
         if verbose:
-            print('INFO: wrote query results to {}.'.format(file_name))
+            print('INFO: wrote query results to {}.'.
+                  format(cache_dir_name(file_name)))
 
     return(obs_air_temp)
 
@@ -1069,7 +2583,7 @@ def get_snwd_snowfall_obs(target_datetime,
     others.
     """
 
-    # Only use .pkl files if there is no bounding box.
+    # Only use the cache if there is no bounding box.
     if bounding_box is None:
 
         file_name = 'wdb0_obs_snowfall_' + \
@@ -1081,29 +2595,14 @@ def get_snwd_snowfall_obs(target_datetime,
         if scratch_dir is not None:
             file_name = os.path.join(scratch_dir, file_name)
 
-            if os.path.isfile(file_name):
-
-                # Retrieve data from pkl file and return.
-                file_obj = open(file_name, 'rb')
-                obs_snowfall = pkl.load(file_obj)
-                file_obj.close()
+            # Retrieve data from the cache and return, if available.
+            obs_snowfall = _read_cache(file_name)
+            if obs_snowfall is not None:
                 return(obs_snowfall)
 
-    # Open the web database.
-    conn_string = "host='wdb0.dmz.nohrsc.noaa.gov' dbname='web_data'"
-    conn = psycopg2.connect(conn_string)
-    conn.set_client_encoding("utf-8")
-    cursor = conn.cursor()
-
     # Define a SQL statement.
     sql_cmd = 'SELECT ' + \
               't1.obj_identifier, ' + \
-              'TRIM(t3.station_id), ' + \
-              'TRIM(t3.name), ' + \
-              't3.coordinates[0] AS lon, ' + \
-              't3.coordinates[1] AS lat, ' + \
-              't3.elevation, ' + \
-              't3.recorded_elevation, ' + \
               't2.date, ' + \
               't2.value * 100.0 AS obs_snowfall_cm ' + \
               'FROM ' + \
@@ -1117,128 +2616,54 @@ def get_snwd_snowfall_obs(target_datetime,
               'GROUP BY obj_identifier' + \
               ') ' + \
               'AS t1, ' + \
-              'point.obs_snowfall_raw AS t2, ' + \
-              'point.allstation AS t3 ' + \
+              'point.obs_snowfall_raw AS t2 ' + \
               'WHERE t2.date = \'' + \
               target_datetime.strftime('%Y-%m-%d %H:%M:%S') + \
               '\' ' + \
               'AND t2.duration = {} '.format(duration_hours * 3600) + \
               'AND t1.obj_identifier = t2.obj_identifier ' + \
-              'AND t2.obj_identifier = t3.obj_identifier ' + \
-              'AND t3.obj_identifier = t1.obj_identifier ' + \
               'AND t2.value IS NOT NULL '
 
     if bounding_box is not None:
         sql_cmd = sql_cmd + \
-                  'AND t3.coordinates[0] >= ' + \
-                  '{} '.format(bounding_box[0]) + \
-                  'AND t3.coordinates[0] < ' + \
-                  '{} '.format(bounding_box[1]) + \
-                  'AND t3.coordinates[1] >= ' + \
-                  '{} '.format(bounding_box[2]) + \
-                  'AND t3.coordinates[1] < ' + \
-                  '{} '.format(bounding_box[3])
+                  'AND t2.' + _bounding_box_filter(bounding_box)
 
     sql_cmd = sql_cmd + 'ORDER BY t1.obj_identifier, t2.date;'
 
     if verbose:
         print('INFO: psql command "{}"'.format(sql_cmd))
 
-    cursor.execute(sql_cmd)
-
     # The result below is just a huge list of tuples.
-    obs_snowfall = cursor.fetchall()
+    obs_snowfall = _fetchall(sql_cmd)
 
     obs_snowfall_column_list = ['obj_identifier',
-                                'station_id',
-                                'name',
-                                'lon',
-                                'lat',
-                                'elevation',
-                                'recorded_elevation',
                                 'date',
                                 'obs_snowfall_cm']
 
     df = pd.DataFrame(obs_snowfall, columns=obs_snowfall_column_list)
 
-    # This section organizes the query results into lists and arrays.
-
-    station_ind = -1
-    current_station_obj_id = -1
-    station_obj_id = []
-    station_id = []
-    station_name = []
-    station_lon = []
-    station_lat = []
-    station_elevation = []
-    station_rec_elevation = []
-    # Create a 2-d [time, station] array.
-    # GF - 2nd dim used to be num_hours
-    obs = np.ma.empty([1], dtype=float)
-    obs[0] = no_data_value
-    obs[0] = np.ma.masked
-    # print(len(df))
-    for ind, row in df.iterrows():
-        if row['obj_identifier'] != current_station_obj_id:
-            station_ind += 1
-            if station_ind > 0:
-                # Just finished all data for previous station.
-                # GF - 2nd dim used to be num_hours
-                obs = np.ma.append(obs,
-                                   np.ma.empty([1],
-                                               dtype=float),
-                                   axis=0)
-                obs[station_ind] = no_data_value
-                obs[station_ind] = np.ma.masked
-            # New station
-            station_obj_id.append(row['obj_identifier'])
-            station_id.append(row['station_id'])
-            station_name.append(row['name'])
-            station_lon.append(row['lon'])
-            station_lat.append(row['lat'])
-            station_elevation.append(row['elevation'])
-            station_rec_elevation.append(row['recorded_elevation'])
-
-            current_station_obj_id = station_obj_id[station_ind]
-
-        # print(type(row['obj_identifier']))
-        # if row['obj_identifier'] == 11929:
-        #     print(row)
-        #     print(row['obs_snowfall_cm'])
-
-        try:
-            obs[station_ind] = row['obs_snowfall_cm']
-        except:
-            print(obs)
-            print(obs.shape)
-            print(row)
-            exit(1)
+    station_cache = get_station_cache(scratch_dir)
 
-    num_stations = station_ind + 1
-    print(len(obs))
+    # Organize the query results into station metadata lists (from
+    # the station cache) and a 1-d [station] array.
+    obs_snowfall = _pivot_station_hour(df,
+                                       'obs_snowfall_cm',
+                                       'values_cm',
+                                       target_datetime,
+                                       None,
+                                       no_data_value=no_data_value,
+                                       station_cache=station_cache,
+                                       verbose=verbose)
 
-    # Place results in a dictionary.
-    obs_snowfall = {'num_stations': num_stations,
-                    'station_obj_id': station_obj_id,
-                    'station_id': station_id,
-                    'station_name': station_name,
-                    'station_lon': station_lon,
-                    'station_lat': station_lat,
-                    'station_elevation': station_elevation,
-                    'station_rec_elevation': station_rec_elevation,
-                    'obs_datetime': target_datetime,
-                    'values_cm': obs}
-
-    # Create the pkl file if all data fetched is more than 60 days earlier
+    # Cache the results if all data fetched is more than 60 days earlier
     # than the current date/time.
     lag = dt.datetime.utcnow() - target_datetime
     if bounding_box is None and \
        lag > dt.timedelta(days=60):
-        file_obj = open(file_name, 'wb')
-        pkl.dump(obs_snowfall, file_obj)
-        file_obj.close()
+        _write_cache(file_name, obs_snowfall)
         if verbose:
-            print('INFO: wrote query results to {}.'.format(file_name))
+            print('INFO: wrote query results to {}.'.
+                  format(cache_dir_name(file_name)))
 
     return(obs_snowfall)
 
@@ -1260,7 +2685,7 @@ def get_snwd_prcp_obs(target_datetime,
     ignore all others.
     """
 
-    # Only use .pkl files if there is no bounding box.
+    # Only use the cache if there is no bounding box.
     if bounding_box is None:
 
         file_name = 'wdb0_obs_precipitation_' + \
@@ -1272,29 +2697,14 @@ def get_snwd_prcp_obs(target_datetime,
         if scratch_dir is not None:
             file_name = os.path.join(scratch_dir, file_name)
 
-            if os.path.isfile(file_name):
-
-                # Retrieve data from pkl file and return.
-                file_obj = open(file_name, 'rb')
-                obs_precip = pkl.load(file_obj)
-                file_obj.close()
+            # Retrieve data from the cache and return, if available.
+            obs_precip = _read_cache(file_name)
+            if obs_precip is not None:
                 return(obs_precip)
 
-    # Open the web database.
-    conn_string = "host='wdb0.dmz.nohrsc.noaa.gov' dbname='web_data'"
-    conn = psycopg2.connect(conn_string)
-    conn.set_client_encoding("utf-8")
-    cursor = conn.cursor()
-
     # Define a SQL statement.
     sql_cmd = 'SELECT ' + \
               't1.obj_identifier, ' + \
-              'TRIM(t3.station_id), ' + \
-              'TRIM(t3.name), ' + \
-              't3.coordinates[0] AS lon, ' + \
-              't3.coordinates[1] AS lat, ' + \
-              't3.elevation, ' + \
-              't3.recorded_elevation, ' + \
               't2.date, ' + \
               't2.value * 1000.0 AS obs_precip_mm ' + \
               'FROM ' + \
@@ -1308,123 +2718,54 @@ def get_snwd_prcp_obs(target_datetime,
               'GROUP BY obj_identifier' + \
               ') ' + \
               'AS t1, ' + \
-              'point.obs_precip_raw AS t2, ' + \
-              'point.allstation AS t3 ' + \
+              'point.obs_precip_raw AS t2 ' + \
               'WHERE t2.date = \'' + \
               target_datetime.strftime('%Y-%m-%d %H:%M:%S') + \
               '\' ' + \
               'AND t2.duration = {} '.format(duration_hours * 3600) + \
               'AND t1.obj_identifier = t2.obj_identifier ' + \
-              'AND t2.obj_identifier = t3.obj_identifier ' + \
-              'AND t3.obj_identifier = t1.obj_identifier ' + \
               'AND t2.value IS NOT NULL '
 
     if bounding_box is not None:
         sql_cmd = sql_cmd + \
-                  'AND t3.coordinates[0] >= ' + \
-                  '{} '.format(bounding_box[0]) + \
-                  'AND t3.coordinates[0] < ' + \
-                  '{} '.format(bounding_box[1]) + \
-                  'AND t3.coordinates[1] >= ' + \
-                  '{} '.format(bounding_box[2]) + \
-                  'AND t3.coordinates[1] < ' + \
-                  '{} '.format(bounding_box[3])
+                  'AND t2.' + _bounding_box_filter(bounding_box)
 
     sql_cmd = sql_cmd + 'ORDER BY t1.obj_identifier, t2.date;'
 
     if verbose:
         print('INFO: psql command "{}"'.format(sql_cmd))
 
-    cursor.execute(sql_cmd)
-
     # The result below is just a huge list of tuples.
-    obs_precip = cursor.fetchall()
+    obs_precip = _fetchall(sql_cmd)
 
     obs_precip_column_list = ['obj_identifier',
-                              'station_id',
-                              'name',
-                              'lon',
-                              'lat',
-                              'elevation',
-                              'recorded_elevation',
                               'date',
                               'obs_precip_mm']
 
     df = pd.DataFrame(obs_precip, columns=obs_precip_column_list)
 
-    # This section organizes the query results into lists and arrays.
-
-    station_ind = -1
-    current_station_obj_id = -1
-    station_obj_id = []
-    station_id = []
-    station_name = []
-    station_lon = []
-    station_lat = []
-    station_elevation = []
-    station_rec_elevation = []
-    # Create a 2-d [time, station] array.
-    # GF - 2nd dim used to be num_hours
-    obs = np.ma.empty([1], dtype=float)
-    obs[0] = no_data_value
-    obs[0] = np.ma.masked
-    # print(len(df))
-    for ind, row in df.iterrows():
-        if row['obj_identifier'] != current_station_obj_id:
-            station_ind += 1
-            if station_ind > 0:
-                # Just finished all data for previous station.
-                # GF - 2nd dim used to be num_hours
-                obs = np.ma.append(obs,
-                                   np.ma.empty([1],
-                                               dtype=float),
-                                   axis=0)
-                obs[station_ind] = no_data_value
-                obs[station_ind] = np.ma.masked
-            # New station
-            station_obj_id.append(row['obj_identifier'])
-            station_id.append(row['station_id'])
-            station_name.append(row['name'])
-            station_lon.append(row['lon'])
-            station_lat.append(row['lat'])
-            station_elevation.append(row['elevation'])
-            station_rec_elevation.append(row['recorded_elevation'])
-
-            current_station_obj_id = station_obj_id[station_ind]
+    station_cache = get_station_cache(scratch_dir)
 
-        try:
-            obs[station_ind] = row['obs_precip_mm']
-        except:
-            print(obs)
-            print(obs.shape)
-            print(row)
-            exit(1)
+    # Organize the query results into station metadata lists (from
+    # the station cache) and a 1-d [station] array.
+    obs_precip = _pivot_station_hour(df,
+                                     'obs_precip_mm',
+                                     'values_mm',
+                                     target_datetime,
+                                     None,
+                                     no_data_value=no_data_value,
+                                     station_cache=station_cache,
+                                     verbose=verbose)
 
-    num_stations = station_ind + 1
-    print(len(obs))
-
-    # Place results in a dictionary.
-    obs_precip = {'num_stations': num_stations,
-                  'station_obj_id': station_obj_id,
-                  'station_id': station_id,
-                  'station_name': station_name,
-                  'station_lon': station_lon,
-                  'station_lat': station_lat,
-                  'station_elevation': station_elevation,
-                  'station_rec_elevation': station_rec_elevation,
-                  'obs_datetime': target_datetime,
-                  'values_mm': obs}
-
-    # Create the pkl file if all data fetched is more than 60 days earlier
+    # Cache the results if all data fetched is more than 60 days earlier
     # than the current date/time.
     lag = dt.datetime.utcnow() - target_datetime
     if bounding_box is None and \
        lag > dt.timedelta(days=60):
-        file_obj = open(file_name, 'wb')
-        pkl.dump(obs_precip, file_obj)
-        file_obj.close()
+        _write_cache(file_name, obs_precip)
         if verbose:
-            print('INFO: wrote query results to {}.'.format(file_name))
+            print('INFO: wrote query results to {}.'.
+                  format(cache_dir_name(file_name)))
 
     return(obs_precip)
 
@@ -1469,7 +2810,7 @@ def  get_prv_air_temp_obs(target_datetime,
     begin_datetime = target_datetime - dt.timedelta(hours=num_hours_prev)
     end_datetime = target_datetime - dt.timedelta(hours=1)
 
-    # Only use .pkl files if there is no bounding box.
+    # Only use the cache if there is no bounding box.
     if bounding_box is None:
 
         file_name = 'wdb0_obs_air_temp_' + \
@@ -1479,150 +2820,525 @@ def  get_prv_air_temp_obs(target_datetime,
         if scratch_dir is not None:
             file_name = os.path.join(scratch_dir, file_name)
 
-            if os.path.isfile(file_name):
-
-                # Retrieve data from pkl file and return.
-                file_obj = open(file_name, 'rb')
-                obs_air_temp = pkl.load(file_obj)
-                file_obj.close()
+            # Retrieve data from the cache and return, if available.
+            obs_air_temp = _read_cache(file_name)
+            if obs_air_temp is not None:
                 return(obs_air_temp)
 
     time_range = end_datetime - begin_datetime
     num_hours = time_range.days * 24 + time_range.seconds // 3600 + 1
 
-    # Open the web database.
-    conn_string = "host='wdb0.dmz.nohrsc.noaa.gov' dbname='web_data'"
-    conn = psycopg2.connect(conn_string)
-    conn.set_client_encoding("utf-8")
-    cursor = conn.cursor()
-
     # Define a SQL statement.
     sql_cmd = 'SELECT ' + \
-              't3.obj_identifier, ' + \
-              'TRIM(t3.station_id), ' + \
-              'TRIM(t3.name), ' + \
-              't3.coordinates[0] AS lon, ' + \
-              't3.coordinates[1] AS lat, ' + \
-              't3.elevation, ' + \
-              't3.recorded_elevation, ' + \
+              't2.obj_identifier, ' + \
               't2.date, ' + \
               't2.value AS obs_air_temp_deg_c ' + \
               'FROM ' + \
-              'point.obs_airtemp AS t2, ' + \
-              'point.allstation AS t3 ' + \
+              'point.obs_airtemp AS t2 ' + \
               'WHERE t2.date >= \'' + \
               begin_datetime.strftime('%Y-%m-%d %H:%M:%S') + \
               '\' ' + \
               'AND t2.date <= \'' + \
               end_datetime.strftime('%Y-%m-%d %H:%M:%S') + \
               '\' ' + \
-              'AND t2.obj_identifier = t3.obj_identifier ' + \
               'AND t2.value IS NOT NULL '
 
     if bounding_box is not None:
         sql_cmd = sql_cmd + \
-                  'AND t3.coordinates[0] >= ' + \
-                  '{} '.format(bounding_box[0]) + \
-                  'AND t3.coordinates[0] < ' + \
-                  '{} '.format(bounding_box[1]) + \
-                  'AND t3.coordinates[1] >= ' + \
-                  '{} '.format(bounding_box[2]) + \
-                  'AND t3.coordinates[1] < ' + \
-                  '{} '.format(bounding_box[3])
+                  'AND t2.' + _bounding_box_filter(bounding_box)
 
-    sql_cmd = sql_cmd + 'ORDER BY t3.obj_identifier, t2.date;'
+    sql_cmd = sql_cmd + 'ORDER BY t2.obj_identifier, t2.date;'
 
     if verbose:
         print('INFO: psql command "{}"'.format(sql_cmd))
 
-    cursor.execute(sql_cmd)
-
     # The result below is just a huge list of tuples.
-    fetched_airtemp = cursor.fetchall()
+    fetched_airtemp = _fetchall(sql_cmd)
 
     obs_air_temp_column_list = ['obj_identifier',
-                                'station_id',
-                                'name',
-                                'lon',
-                                'lat',
-                                'elevation',
-                                'recorded_elevation',
                                 'date',
                                 'obs_air_temp_deg_c']
 
     df = pd.DataFrame(fetched_airtemp, columns=obs_air_temp_column_list)
 
-    # This section organizes the query results into lists and arrays.
-
-    station_ind = -1
-    current_station_obj_id = -1
-    station_obj_id = []
-    station_id = []
-    station_name = []
-    station_lon = []
-    station_lat = []
-    station_elevation = []
-    station_rec_elevation = []
-    # Create a 2-d [time, station] array.
-    obs = np.ma.empty([1, num_hours], dtype=float)
-    obs[0,:] = no_data_value
-    obs[0,:] = np.ma.masked
-    for ind, row in df.iterrows():
-        if row['obj_identifier'] != current_station_obj_id:
-            station_ind += 1
-            if station_ind > 0:
-                # Just finished all data for previous station.
-                obs = np.ma.append(obs,
-                                   np.ma.empty([1,
-                                                num_hours],
-                                               dtype=float),
-                                   axis=0)
-                obs[station_ind,:] = no_data_value
-                obs[station_ind,:] = np.ma.masked
-            # New station
-            station_obj_id.append(row['obj_identifier'])
-            station_id.append(row['station_id'])
-            station_name.append(row['name'])
-            station_lon.append(row['lon'])
-            station_lat.append(row['lat'])
-            station_elevation.append(row['elevation'])
-            station_rec_elevation.append(row['recorded_elevation'])
-
-            current_station_obj_id = station_obj_id[station_ind]
-
-        # Add the observation to the obs array.
-        time_diff = row['date'] - begin_datetime
-        time_ind = time_diff.days * 24 + time_diff.seconds // 3600
-
-        obs[station_ind, time_ind] = row['obs_air_temp_deg_c']
-
-    num_stations = station_ind + 1
-
-    obs_datetime = [begin_datetime +
-                    dt.timedelta(hours=i) for i in range(num_hours)]
+    station_cache = get_station_cache(scratch_dir)
 
-    # Place results in a dictionary.
-    obs_air_temp = {'num_stations': num_stations,
-                    'num_hours': num_hours,
-                    'station_obj_id': station_obj_id,
-                    'station_id': station_id,
-                    'station_name': station_name,
-                    'station_lon': station_lon,
-                    'station_lat': station_lat,
-                    'station_elevation': station_elevation,
-                    'station_rec_elevation': station_rec_elevation,
-                    'obs_datetime': obs_datetime,
-                    'values_deg_c': obs}
-
-    # Create the pkl file if all data fetched is more than 60 days earlier
+    # Organize the query results into station metadata lists (from
+    # the station cache) and a 2-d [station, time] array.
+    obs_air_temp = _pivot_station_hour(df,
+                                       'obs_air_temp_deg_c',
+                                       'values_deg_c',
+                                       begin_datetime,
+                                       num_hours,
+                                       no_data_value=no_data_value,
+                                       station_cache=station_cache,
+                                       verbose=verbose)
+
+    # Cache the results if all data fetched is more than 60 days earlier
     # than the current date/time.
     lag = dt.datetime.utcnow() - end_datetime
     if bounding_box is None and \
        lag > dt.timedelta(days=60):
-        file_obj = open(file_name, 'wb')
-        pkl.dump(obs_air_temp, file_obj)
-        file_obj.close()
+        _write_cache(file_name, obs_air_temp)
         if verbose:
-            print('INFO: wrote query results to {}.'.format(file_name))
+            print('INFO: wrote query results to {}.'.
+                  format(cache_dir_name(file_name)))
 
     return(obs_air_temp)
+
+
+# Observations for hours within this many days of real time may still
+# change, e.g. when reports arrive late; query results for later hours are
+# cached (see the get_*_obs functions), and ObsWindow refetches buffered
+# hours within it.
+LATE_OBS_DAYS = 60
+
+
+class ObsWindow:
+
+    """
+    A sliding window of the most recent num_hours hours of station x hour
+    observations, kept in a ring buffer so that moving the window forward
+    one hour only requires fetching one new hour of data.
+
+    The fetch argument is a function taking (begin_datetime, end_datetime)
+    and returning a dictionary like those from get_snow_depth_obs or
+    get_air_temp_obs, e.g.
+
+        window = wdb0.ObsWindow(lambda b, e:
+                                wdb0.get_air_temp_obs(b, e),
+                                25,
+                                'values_deg_c')
+        window.advance(end_datetime)
+        obs_air_temp = window.get()
+
+    After advance(end_datetime), get() returns the observations for
+    end_datetime - (num_hours - 1) hours through end_datetime as fetch
+    would, and get(station_obj_id) limits them to the given stations.
+    Station metadata are those from the most recent fetch that included
+    each station.
+
+    Hours already in the buffer that are within refresh_days of real time
+    are fetched again on each advance(), so observations that arrive late
+    for them are picked up as they would be by a new query for the whole
+    window. Older hours are not fetched again. Setting refresh_days to 0
+    or None turns refetching off, and late observations are then missed.
+    """
+
+    def __init__(self,
+                 fetch,
+                 num_hours,
+                 values_key,
+                 no_data_value=-99999.0,
+                 station_capacity=1024,
+                 refresh_days=LATE_OBS_DAYS):
+        self.fetch = fetch
+        self.num_hours = num_hours
+        self.refresh_days = refresh_days
+        self.values_key = values_key
+        self.no_data_value = no_data_value
+        self.end_datetime = None
+        self.num_fetches = 0
+        self.num_hours_fetched = 0
+        self.num_stations = 0
+        self.station_index = {}
+        self.station_obj_id = np.empty(station_capacity, dtype=np.int64)
+        self.station_meta = {key: [] for key in ['station_id',
+                                                 'station_name',
+                                                 'station_lon',
+                                                 'station_lat',
+                                                 'station_elevation',
+                                                 'station_rec_elevation']}
+        self._head = 0
+        self._data = np.full([station_capacity, num_hours],
+                             no_data_value,
+                             dtype=float)
+        self._mask = np.ones([station_capacity, num_hours], dtype=bool)
+
+    def _grow(self, num_stations):
+
+        """
+        Make room for num_stations stations.
+        """
+
+        capacity = self._data.shape[0]
+        if num_stations <= capacity:
+            return
+        while capacity < num_stations:
+            capacity *= 2
+        data = np.full([capacity, self.num_hours],
+                       self.no_data_value,
+                       dtype=float)
+        mask = np.ones([capacity, self.num_hours], dtype=bool)
+        obj_id = np.empty(capacity, dtype=np.int64)
+        data[0:self.num_stations] = self._data[0:self.num_stations]
+        mask[0:self.num_stations] = self._mask[0:self.num_stations]
+        obj_id[0:self.num_stations] = \
+            self.station_obj_id[0:self.num_stations]
+        self._data = data
+        self._mask = mask
+        self.station_obj_id = obj_id
+
+    def _insert(self, obs, first_slot, num_new_hours):
+
+        """
+        Copy the hours of obs into ring buffer slots first_slot,
+        first_slot + 1, ... (modulo num_hours), adding new stations and
+        updating station metadata.
+        """
+
+        rows = np.empty(obs['num_stations'], dtype=np.int64)
+        for si, obj_id in enumerate(obs['station_obj_id']):
+            row = self.station_index.get(obj_id)
+            if row is None:
+                row = self.num_stations
+                self._grow(row + 1)
+                self.station_index[obj_id] = row
+                self.station_obj_id[row] = obj_id
+                self.num_stations += 1
+                for key, meta in self.station_meta.items():
+                    meta.append(obs[key][si])
+            else:
+                for key, meta in self.station_meta.items():
+                    meta[row] = obs[key][si]
+            rows[si] = row
+
+        slots = (first_slot + np.arange(num_new_hours)) % self.num_hours
+        values = obs[self.values_key]
+        self._data[np.ix_(rows, slots)] = np.ma.getdata(values)
+        self._mask[np.ix_(rows, slots)] = np.ma.getmaskarray(values)
+
+    def advance(self, end_datetime, new_obs=None):
+
+        """
+        Move the window so that it ends at end_datetime, fetching the
+        hours that are not already in the buffer, plus those that are
+        within refresh_days of real time. If the new hours have already been
+        fetched, e.g. by get_qc_bundle, they may be passed in as new_obs;
+        new_obs is ignored if it does not cover exactly the hours needed.
+        """
+
+        one_hour = dt.timedelta(hours=1)
+
+        if self.end_datetime is not None:
+            num_new_hours = (end_datetime - self.end_datetime) // one_hour
+        else:
+            num_new_hours = None
+
+        if num_new_hours == 0:
+            return
+
+        if num_new_hours is None or \
+           num_new_hours < 0 or \
+           num_new_hours >= self.num_hours:
+            # Refill the whole window.
+            num_new_hours = self.num_hours
+            self._data[:] = self.no_data_value
+            self._mask[:] = True
+            self._head = 0
+
+        # Most recent hours already in the buffer to fetch again (those
+        # later than refresh_datetime), which occupy the slots just before
+        # the head.
+        num_refresh_hours = 0
+        if self.refresh_days and num_new_hours < self.num_hours:
+            refresh_datetime = dt.datetime.utcnow() - \
+                dt.timedelta(days=self.refresh_days)
+            lag = self.end_datetime - refresh_datetime
+            if lag > dt.timedelta(0):
+                num_refresh_hours = min(-((-lag) // one_hour),
+                                        self.num_hours - num_new_hours)
+        refresh_slot = (self._head - num_refresh_hours) % self.num_hours
+
+        # Clear the slots of the hours being replaced, which are the
+        # oldest in the buffer, and of the hours being refreshed.
+        slots = (refresh_slot +
+                 np.arange(num_refresh_hours + num_new_hours)) % \
+            self.num_hours
+        self._data[:, slots] = self.no_data_value
+        self._mask[:, slots] = True
+
+        begin_datetime = end_datetime - (num_new_hours - 1) * one_hour
+        if new_obs is not None and \
+           new_obs['num_hours'] == num_new_hours and \
+           new_obs['obs_datetime'][0] == begin_datetime:
+            if num_refresh_hours > 0:
+                obs = self.fetch(begin_datetime -
+                                 num_refresh_hours * one_hour,
+                                 begin_datetime - one_hour)
+                self.num_fetches += 1
+                self.num_hours_fetched += num_refresh_hours
+                self._insert(obs, refresh_slot, num_refresh_hours)
+            self._insert(new_obs, self._head, num_new_hours)
+        else:
+            # Fetch the refreshed and new hours together.
+            obs = self.fetch(begin_datetime - num_refresh_hours * one_hour,
+                             end_datetime)
+            self.num_fetches += 1
+            self.num_hours_fetched += num_refresh_hours + num_new_hours
+            self._insert(obs, refresh_slot,
+                         num_refresh_hours + num_new_hours)
+
+        self._head = (self._head + num_new_hours) % self.num_hours
+        self.end_datetime = end_datetime
+
+    def get(self, station_obj_id=None, skip_last_hours=0):
+
+        """
+        Get the window contents as a dictionary, for stations with at least
+        one observation in the window, sorted by obj_identifier. If
+        station_obj_id is given, only those stations are included. If
+        skip_last_hours is given, the most recent hours are left out.
+        """
+
+        if self.end_datetime is None:
+            print('ERROR: (programming) ObsWindow.get called before ' +
+                  'advance.',
+                  file=sys.stderr)
+            sys.exit(1)
+
+        num_hours = self.num_hours - skip_last_hours
+
+        # Ring buffer slots in time order, oldest hour first.
+        slots = (self._head + np.arange(num_hours)) % self.num_hours
+
+        rows = np.arange(self.num_stations)
+        if station_obj_id is not None:
+            rows = rows[np.isin(self.station_obj_id[rows], station_obj_id)]
+        rows = rows[~np.all(self._mask[np.ix_(rows, slots)], axis=1)]
+        rows = rows[np.argsort(self.station_obj_id[rows], kind='stable')]
+
+        obs = np.ma.masked_array(self._data[np.ix_(rows, slots)],
+                                 mask=self._mask[np.ix_(rows, slots)])
+
+        begin_datetime = self.end_datetime - \
+            dt.timedelta(hours=self.num_hours - 1)
+
+        result = {'num_stations': len(rows),
+                  'num_hours': num_hours,
+                  'station_obj_id': self.station_obj_id[rows].tolist()}
+        for key, meta in self.station_meta.items():
+            result[key] = [meta[row] for row in rows]
+        result['obs_datetime'] = [begin_datetime + dt.timedelta(hours=i)
+                                  for i in range(num_hours)]
+        result[self.values_key] = obs
+
+        return(result)
+
+
+def get_qc_bundle(target_datetime,
+                  num_hrs_prev_snwd=0,
+                  num_hrs_snowfall=24,
+                  num_hrs_prcp=24,
+                  num_hrs_prev_tair=0,
+                  no_data_value=-99999.0,
+                  scratch_dir=None,
+                  verbose=None):
+
+    """
+    Get all observations needed to QC snow depth at target_datetime from
+    the "web_data" database on wdb0 in a single query. The result is a
+    dictionary of the following, each identical to what the corresponding
+    function returns:
+
+    "snow_depth"        get_snow_depth_obs(target_datetime, target_datetime)
+    "prev_snow_depth"   get_prev_snow_depth_obs(target_datetime,
+                                                num_hrs_prev_snwd)
+    "snowfall"          get_snwd_snowfall_obs(target_datetime,
+                                              num_hrs_snowfall)
+    "precip"            get_snwd_prcp_obs(target_datetime, num_hrs_prcp)
+    "air_temp"          get_air_temp_obs(target_datetime -
+                                         num_hrs_prev_tair hours,
+                                         target_datetime)
+
+    Setting num_hrs_prev_snwd, num_hrs_snowfall or num_hrs_prcp to None
+    leaves that element out. The stations reporting snow depth at
+    target_datetime are found once, in a common table expression, and the
+    element tables are combined with UNION ALL. Station metadata are
+    attached on the client from the station cache (see StationCache).
+
+    The results are cached in scratch_dir under the same names the
+    individual functions use, so either can reuse the other's cache.
+    """
+
+    target_str = target_datetime.strftime('%Y-%m-%d %H:%M:%S')
+    target_ymdh = target_datetime.strftime('%Y%m%d%H')
+    one_hour = dt.timedelta(hours=1)
+    tair_begin_datetime = target_datetime - num_hrs_prev_tair * one_hour
+
+    # Describe each element: cache file name, SQL, values key, first hour
+    # and number of hours (None for 1-d [station] results).
+    element_list = []
+
+    element_list.append({'name': 'snow_depth',
+                         'file_name': 'wdb0_obs_snow_depth_' +
+                         target_ymdh + '_to_' + target_ymdh + '.pkl',
+                         'sql': 'SELECT {} AS element, ' +
+                         'obj_identifier, date, ' +
+                         'value * 100.0 AS value ' +
+                         'FROM point.obs_snow_depth ' +
+                         'WHERE date = \'' + target_str + '\' ' +
+                         'AND value IS NOT NULL',
+                         'values_key': 'values_cm',
+                         'obs_datetime': target_datetime,
+                         'num_hours': 1})
+
+    if num_hrs_prev_snwd is not None and num_hrs_prev_snwd > 0:
+        begin_datetime = target_datetime - num_hrs_prev_snwd * one_hour
+        end_datetime = target_datetime - one_hour
+        element_list.append({'name': 'prev_snow_depth',
+                             'file_name': 'wdb0_obs_snow_depth_' +
+                             '{}_hours_prior_to_'.
+                             format(num_hrs_prev_snwd) +
+                             target_ymdh + '_snow_depth.pkl',
+                             'sql': 'SELECT {} AS element, ' +
+                             't2.obj_identifier, t2.date, ' +
+                             't2.value * 100.0 AS value ' +
+                             'FROM reporting AS t1, ' +
+                             'point.obs_snow_depth AS t2 ' +
+                             'WHERE t2.date >= \'' +
+                             begin_datetime.strftime('%Y-%m-%d %H:%M:%S') +
+                             '\' ' +
+                             'AND t2.date <= \'' +
+                             end_datetime.strftime('%Y-%m-%d %H:%M:%S') +
+                             '\' ' +
+                             'AND t1.obj_identifier = t2.obj_identifier ' +
+                             'AND t2.value IS NOT NULL',
+                             'values_key': 'values_cm',
+                             'obs_datetime': begin_datetime,
+                             'num_hours': num_hrs_prev_snwd})
+
+    if num_hrs_snowfall is not None:
+        element_list.append({'name': 'snowfall',
+                             'file_name': 'wdb0_obs_snowfall_' +
+                             '{}_hours_ending_'.format(num_hrs_snowfall) +
+                             target_ymdh + '_snow_depth.pkl',
+                             'sql': 'SELECT {} AS element, ' +
+                             't2.obj_identifier, t2.date, ' +
+                             't2.value * 100.0 AS value ' +
+                             'FROM reporting AS t1, ' +
+                             'point.obs_snowfall_raw AS t2 ' +
+                             'WHERE t2.date = \'' + target_str + '\' ' +
+                             'AND t2.duration = {} '.
+                             format(num_hrs_snowfall * 3600) +
+                             'AND t1.obj_identifier = t2.obj_identifier ' +
+                             'AND t2.value IS NOT NULL',
+                             'values_key': 'values_cm',
+                             'obs_datetime': target_datetime,
+                             'num_hours': None})
+
+    if num_hrs_prcp is not None:
+        element_list.append({'name': 'precip',
+                             'file_name': 'wdb0_obs_precipitation_' +
+                             '{}_hours_ending_'.format(num_hrs_prcp) +
+                             target_ymdh + '_snow_depth.pkl',
+                             'sql': 'SELECT {} AS element, ' +
+                             't2.obj_identifier, t2.date, ' +
+                             't2.value * 1000.0 AS value ' +
+                             'FROM reporting AS t1, ' +
+                             'point.obs_precip_raw AS t2 ' +
+                             'WHERE t2.date = \'' + target_str + '\' ' +
+                             'AND t2.duration = {} '.
+                             format(num_hrs_prcp * 3600) +
+                             'AND t1.obj_identifier = t2.obj_identifier ' +
+                             'AND t2.value IS NOT NULL',
+                             'values_key': 'values_mm',
+                             'obs_datetime': target_datetime,
+                             'num_hours': None})
+
+    element_list.append({'name': 'air_temp',
+                         'file_name': 'wdb0_obs_air_temp_' +
+                         tair_begin_datetime.strftime('%Y%m%d%H') +
+                         '_to_' + target_ymdh + '.pkl',
+                         'sql': 'SELECT {} AS element, ' +
+                         'obj_identifier, date, ' +
+                         'value AS value ' +
+                         'FROM point.obs_airtemp ' +
+                         'WHERE date >= \'' +
+                         tair_begin_datetime.strftime('%Y-%m-%d %H:%M:%S') +
+                         '\' ' +
+                         'AND date <= \'' + target_str + '\' ' +
+                         'AND value IS NOT NULL',
+                         'values_key': 'values_deg_c',
+                         'obs_datetime': tair_begin_datetime,
+                         'num_hours': num_hrs_prev_tair + 1})
+
+    bundle = {}
+
+    # Retrieve all elements from the cache and return, if available.
+    if scratch_dir is not None:
+        for element in element_list:
+            element['file_name'] = os.path.join(scratch_dir,
+                                                element['file_name'])
+        for element in element_list:
+            obs = _read_cache(element['file_name'])
+            if obs is None:
+                break
+            bundle[element['name']] = obs
+        if len(bundle) == len(element_list):
+            return(bundle)
+        bundle = {}
+
+    # Define a SQL statement.
+    sql_cmd = 'WITH reporting AS (' + \
+              'SELECT obj_identifier ' + \
+              'FROM point.obs_snow_depth ' + \
+              'WHERE date = \'' + target_str + '\' ' + \
+              'AND value IS NOT NULL ' + \
+              'GROUP BY obj_identifier' + \
+              '), ' + \
+              'obs AS (' + \
+              ' UNION ALL '.join([element['sql'].format(ei)
+                                  for ei, element
+                                  in enumerate(element_list)]) + \
+              ') ' + \
+              'SELECT ' + \
+              'obs.element, ' + \
+              'obs.obj_identifier, ' + \
+              'obs.date, ' + \
+              'obs.value ' + \
+              'FROM obs ' + \
+              'ORDER BY obs.element, obs.obj_identifier, obs.date;'
+
+    if verbose:
+        print('INFO: psql command "{}"'.format(sql_cmd))
+
+    # The result below is just a huge list of tuples.
+    obs_bundle = _fetchall(sql_cmd)
+
+    obs_bundle_column_list = ['element',
+                              'obj_identifier',
+                              'date',
+                              'value']
+
+    df = pd.DataFrame(obs_bundle, columns=obs_bundle_column_list)
+
+    # Fetch metadata for all stations in the bundle at once, so the
+    # lookups for each element below are answered from memory.
+    station_cache = get_station_cache(scratch_dir)
+    station_cache.lookup(pd.unique(df['obj_identifier']), verbose=verbose)
+
+    lag = dt.datetime.utcnow() - target_datetime
+
+    for ei, element in enumerate(element_list):
+
+        # Organize the query results for this element into station
+        # metadata lists and a 2-d [station, time] (or 1-d [station])
+        # array.
+        element_df = df[df['element'] == ei]
+        bundle[element['name']] = \
+            _pivot_station_hour(element_df,
+                                'value',
+                                element['values_key'],
+                                element['obs_datetime'],
+                                element['num_hours'],
+                                no_data_value=no_data_value,
+                                station_cache=station_cache,
+                                verbose=verbose)
+
+        # Cache the results if all data fetched is more than 60 days
+        # earlier than the current date/time.
+        if scratch_dir is not None and lag > dt.timedelta(days=60):
+            _write_cache(element['file_name'], bundle[element['name']])
+
+    return(bundle)
@@ -0,0 +1,187 @@
+#!/usr/bin/python3
+
+"""
+Convert wdb0.py .pkl cache files in a scratch directory to the columnar
+cache format (see wdb0.write_obs_cache). Each converted cache is read back
+and compared with the original before the .pkl file is (optionally)
+deleted. Converted and deleted entries are recorded in the scratch
+directory's cache index (see wdb0.CacheManager), so that wdb0 finds them.
+"""
+
+import argparse
+import glob
+import os
+import sys
+import pickle as pkl
+import numpy as np
+import pandas as pd
+import wdb0
+
+
+def parse_args():
+
+    """
+    Parse command line arguments.
+    """
+
+    parser = argparse.ArgumentParser(description='Convert wdb0 .pkl ' +
+                                     'cache files to the columnar cache ' +
+                                     'format.')
+
+    parser.add_argument('scratch_dir',
+                        type=str,
+                        help='Directory containing wdb0_*.pkl files.')
+
+    parser.add_argument('-d', '--delete',
+                        action='store_true',
+                        help='Delete each .pkl file once it has been ' +
+                        'converted and verified.')
+
+    parser.add_argument('-f', '--force',
+                        action='store_true',
+                        help='Convert .pkl files even if a columnar cache ' +
+                        'already exists for them.')
+
+    parser.add_argument('-v', '--verbose',
+                        action='store_true',
+                        help='Provide verbose output.')
+
+    args = parser.parse_args()
+
+    if not os.path.isdir(args.scratch_dir):
+        print('ERROR: scratch directory {} not found.'.
+              format(args.scratch_dir),
+              file=sys.stderr)
+        sys.exit(1)
+
+    return(args)
+
+
+def same_obs(obs_a, obs_b):
+
+    """
+    Check that cached results read back match the original results.
+    """
+
+    if isinstance(obs_a, pd.DataFrame):
+        if not isinstance(obs_b, pd.DataFrame):
+            return False
+        if list(obs_a.columns) != list(obs_b.columns):
+            return False
+        for column in obs_a.columns:
+            if not np.array_equal(obs_a[column].to_numpy(),
+                                  obs_b[column].to_numpy()):
+                return False
+        return True
+
+    if list(obs_a.keys()) != list(obs_b.keys()):
+        return False
+
+    for key in obs_a.keys():
+        val_a = obs_a[key]
+        val_b = obs_b[key]
+        if isinstance(val_a, np.ndarray):
+            if not np.array_equal(np.ma.getdata(val_a),
+                                  np.ma.getdata(val_b)) or \
+               not np.array_equal(np.ma.getmaskarray(val_a),
+                                  np.ma.getmaskarray(val_b)):
+                return False
+        elif isinstance(val_a, list):
+            # NaN != NaN, and None is stored as NaN (or '' for strings)
+            # with a separate mask of None entries.
+            array_a, kind_a, is_none_a = wdb0._cache_array(val_a)
+            array_b, kind_b, is_none_b = wdb0._cache_array(val_b)
+            if (is_none_a is None) != (is_none_b is None):
+                return False
+            if is_none_a is not None and \
+               not np.array_equal(is_none_a, is_none_b):
+                return False
+            if array_a.dtype.kind in 'fM':
+                # Floats with NaN, or datetimes with NaT.
+                if not np.array_equal(array_a, array_b, equal_nan=True):
+                    return False
+            elif not np.array_equal(array_a, array_b):
+                return False
+        elif hasattr(val_a, 'strftime'):
+            if np.datetime64(val_a, 's') != np.datetime64(val_b, 's'):
+                return False
+        elif val_a != val_b:
+            return False
+
+    return True
+
+
+def main():
+
+    """
+    Convert all wdb0 .pkl cache files in the scratch directory.
+    """
+
+    args = parse_args()
+
+    pkl_list = sorted(glob.glob(os.path.join(args.scratch_dir,
+                                             'wdb0_*.pkl')))
+    if args.verbose:
+        print('INFO: found {} .pkl files in {}.'.
+              format(len(pkl_list), args.scratch_dir))
+
+    manager = wdb0.get_cache_manager(args.scratch_dir)
+
+    num_converted = 0
+    num_skipped = 0
+    num_failed = 0
+
+    for pkl_path in pkl_list:
+
+        cache_dir = wdb0.cache_dir_name(pkl_path)
+        if os.path.isdir(cache_dir) and not args.force:
+            if args.verbose:
+                print('INFO: {} already exists; skipping.'.format(cache_dir))
+            num_skipped += 1
+            continue
+
+        if not os.path.isfile(pkl_path):
+            # Evicted while other entries were added.
+            num_skipped += 1
+            continue
+
+        file_obj = open(pkl_path, 'rb')
+        obs = pkl.load(file_obj)
+        file_obj.close()
+
+        try:
+            wdb0.write_obs_cache(cache_dir, obs)
+        except (ValueError, TypeError) as err:
+            print('WARNING: failed to convert {}: {}'.format(pkl_path, err),
+                  file=sys.stderr)
+            num_failed += 1
+            continue
+
+        if not same_obs(obs, wdb0.read_obs_cache(cache_dir)):
+            print('WARNING: columnar cache {} does not match {}; '.
+                  format(cache_dir, pkl_path) +
+                  'removing it.',
+                  file=sys.stderr)
+            manager.remove(os.path.basename(cache_dir))
+            num_failed += 1
+            continue
+
+        if args.delete:
+            manager.remove(os.path.basename(pkl_path))
+
+        # Adding the entry may evict least recently used ones.
+        manager.add(os.path.basename(cache_dir))
+
+        num_converted += 1
+        if args.verbose:
+            print('INFO: converted {} to {}.'.format(pkl_path, cache_dir))
+
+    print('INFO: converted {}, skipped {}, failed {}.'.
+          format(num_converted, num_skipped, num_failed))
+
+    if num_failed > 0:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
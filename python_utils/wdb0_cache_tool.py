@@ -0,0 +1,128 @@
+#!/usr/bin/python3
+
+"""
+Report on and prune the wdb0.py cache in a scratch directory.
+
+With no options, print the number of entries, total size, byte budget and
+hit rate of the cache. Entries can be pruned to a size (least recently used
+first) and/or by age.
+"""
+
+import argparse
+import datetime as dt
+import os
+import sys
+import wdb0
+
+
+def parse_args():
+
+    """
+    Parse command line arguments.
+    """
+
+    parser = argparse.ArgumentParser(description='Report on and prune the ' +
+                                     'wdb0 scratch directory cache.')
+
+    parser.add_argument('scratch_dir',
+                        type=str,
+                        help='Scratch directory holding the wdb0 cache.')
+
+    parser.add_argument('-s', '--prune_gb',
+                        type=float,
+                        metavar='GB',
+                        help='Evict least recently used entries until the ' +
+                        'cache is at most this many GB.')
+
+    parser.add_argument('-a', '--prune_days',
+                        type=float,
+                        metavar='DAYS',
+                        help='Evict entries not accessed for this many days.')
+
+    parser.add_argument('-r', '--rebuild',
+                        action='store_true',
+                        help='Rebuild the cache index by scanning the ' +
+                        'scratch directory.')
+
+    parser.add_argument('-z', '--reset_stats',
+                        action='store_true',
+                        help='Reset the hit and miss counts.')
+
+    args = parser.parse_args()
+
+    if not os.path.isdir(args.scratch_dir):
+        print('ERROR: scratch directory {} not found.'.
+              format(args.scratch_dir),
+              file=sys.stderr)
+        sys.exit(1)
+
+    if args.prune_gb is not None and args.prune_gb < 0:
+        print('ERROR: prune size must be non-negative.', file=sys.stderr)
+        sys.exit(1)
+
+    if args.prune_days is not None and args.prune_days < 0:
+        print('ERROR: prune age must be non-negative.', file=sys.stderr)
+        sys.exit(1)
+
+    return(args)
+
+
+def format_time(epoch_seconds):
+    if epoch_seconds is None:
+        return('n/a')
+    return(dt.datetime.utcfromtimestamp(epoch_seconds).
+           strftime('%Y-%m-%d %H:%M:%S UTC'))
+
+
+def main():
+
+    """
+    Report on and optionally prune the cache.
+    """
+
+    args = parse_args()
+
+    manager = wdb0.get_cache_manager(args.scratch_dir)
+
+    if args.rebuild:
+        manager.rebuild()
+
+    if args.prune_gb is not None or args.prune_days is not None:
+        max_bytes = None
+        if args.prune_gb is not None:
+            max_bytes = int(args.prune_gb * 1024 ** 3)
+        max_age_seconds = None
+        if args.prune_days is not None:
+            max_age_seconds = args.prune_days * 86400.0
+        num_evicted, bytes_evicted = \
+            manager.prune(max_bytes=max_bytes,
+                          max_age_seconds=max_age_seconds)
+        print('INFO: evicted {} entries ({:.3f} GB).'.
+              format(num_evicted, bytes_evicted / 1024 ** 3))
+
+    if args.reset_stats:
+        manager.reset_stats()
+
+    report = manager.report()
+    if report['hit_rate'] is None:
+        hit_rate = 'n/a'
+    else:
+        hit_rate = '{:.1f}%'.format(100.0 * report['hit_rate'])
+
+    print('scratch directory: {}'.format(report['scratch_dir']))
+    print('entries:           {}'.format(report['num_entries']))
+    print('size:              {:.3f} GB'.
+          format(report['total_bytes'] / 1024 ** 3))
+    print('budget:            {:.3f} GB'.
+          format(report['max_bytes'] / 1024 ** 3))
+    print('hits:              {}'.format(report['hits']))
+    print('misses:            {}'.format(report['misses']))
+    print('hit rate:          {}'.format(hit_rate))
+    print('oldest access:     {}'.format(format_time(report['oldest_access'])))
+    print('newest access:     {}'.format(format_time(report['newest_access'])))
+
+    manager.close()
+
+
+if __name__ == '__main__':
+    main()
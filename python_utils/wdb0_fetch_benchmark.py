@@ -0,0 +1,300 @@
+#!/usr/bin/python3
+
+"""
+Benchmark the wdb0.py fetch backends (fetchall, streaming cursor, binary
+COPY and CSV COPY) against each other.
+
+By default, snow depth observations are fetched from wdb0 for the given
+time range with each backend, and the results are checked for agreement.
+
+With --local, no database is used. Instead, synthetic observations for the
+given number of stations are generated, and only the client-side work of
+each path is timed: building a dataframe from a list of row tuples and
+pivoting it (the fetchall path), versus parsing binary or CSV COPY streams
+and pivoting the resulting columns.
+"""
+
+import argparse
+import datetime as dt
+import sys
+import tempfile
+import time
+import numpy as np
+import pandas as pd
+import wdb0
+
+
+def parse_args():
+
+    """
+    Parse command line arguments.
+    """
+
+    parser = argparse.ArgumentParser(description='Benchmark wdb0 fetch ' +
+                                     'backends.')
+
+    parser.add_argument('begin_datetime',
+                        type=str,
+                        metavar='YYYYMMDDHH',
+                        help='First hour of observations to fetch.')
+
+    parser.add_argument('end_datetime',
+                        type=str,
+                        metavar='YYYYMMDDHH',
+                        help='Last hour of observations to fetch.')
+
+    parser.add_argument('-b', '--bounding_box',
+                        type=float,
+                        nargs=4,
+                        metavar=('LON_MIN', 'LON_MAX', 'LAT_MIN', 'LAT_MAX'),
+                        help='Only fetch stations inside this box.')
+
+    parser.add_argument('-n', '--num_repeats',
+                        type=int,
+                        default=3,
+                        help='Number of times to run each backend; the ' +
+                        'best time is reported.')
+
+    parser.add_argument('-l', '--local',
+                        type=int,
+                        metavar='NUM_STATIONS',
+                        help='Benchmark client-side parsing only, using ' +
+                        'synthetic data for this many stations.')
+
+    parser.add_argument('-v', '--verbose',
+                        action='store_true',
+                        help='Provide verbose output.')
+
+    args = parser.parse_args()
+
+    if args.num_repeats < 1:
+        print('ERROR: number of repeats must be positive.', file=sys.stderr)
+        sys.exit(1)
+
+    return(args)
+
+
+def best_time(func, num_repeats):
+
+    """
+    Run func num_repeats times and return the shortest elapsed time in
+    seconds, along with the result of the last run.
+    """
+
+    best = None
+    for i in range(num_repeats):
+        t1 = time.perf_counter()
+        result = func()
+        elapsed = time.perf_counter() - t1
+        if best is None or elapsed < best:
+            best = elapsed
+
+    return(best, result)
+
+
+def same_result(obs_a, obs_b, values_key):
+
+    """
+    Check that two get_*_obs results are identical.
+    """
+
+    for key in obs_a.keys():
+        if key == values_key:
+            if not np.array_equal(obs_a[key].mask, obs_b[key].mask):
+                return False
+            if not np.array_equal(obs_a[key].data, obs_b[key].data):
+                return False
+        elif obs_a[key] != obs_b[key]:
+            return False
+
+    return True
+
+
+def synthetic_data(num_stations, begin_datetime, num_hours):
+
+    """
+    Generate synthetic station metadata and hourly snow depth observations,
+    with about 10% of hours missing.
+    """
+
+    rng = np.random.default_rng(0)
+
+    obj_id = np.arange(1, num_stations + 1) * 7
+    allstation_df = pd.DataFrame({'obj_identifier': obj_id,
+                                  'station_id': ['S{:07d}'.format(val)
+                                                 for val in obj_id],
+                                  'name': ['STATION {}'.format(val)
+                                           for val in obj_id],
+                                  'lon': rng.uniform(-125.0, -67.0,
+                                                     num_stations),
+                                  'lat': rng.uniform(25.0, 50.0,
+                                                     num_stations),
+                                  'elevation': rng.uniform(0.0, 3000.0,
+                                                           num_stations),
+                                  'recorded_elevation':
+                                  rng.uniform(0.0, 3000.0, num_stations)})
+
+    station_ind, time_ind = np.nonzero(rng.random((num_stations, num_hours))
+                                       > 0.1)
+    date = pd.Timestamp(begin_datetime) + pd.to_timedelta(time_ind, unit='h')
+    obs_df = pd.DataFrame({'obj_identifier': obj_id[station_ind],
+                           'date': date,
+                           'value': np.round(rng.uniform(0.0, 2.0,
+                                                         len(time_ind)),
+                                             3)})
+
+    return(allstation_df, obs_df)
+
+
+def run_local(args, begin_datetime, end_datetime, num_hours):
+
+    """
+    Benchmark client-side parsing with synthetic data.
+    """
+
+    allstation_df, obs_df = synthetic_data(args.local,
+                                           begin_datetime,
+                                           num_hours)
+    stand_in = wdb0.LocalCopyStandIn(allstation_df,
+                                     {'obs_snow_depth': obs_df})
+    print('INFO: {} synthetic stations, {} hours, {} observations.'.
+          format(args.local, num_hours, len(obs_df)))
+
+    # Rows as psycopg2 would return them for get_snow_depth_obs.
+    df = obs_df[obs_df['obj_identifier'].
+                isin(allstation_df['obj_identifier'])]
+    rows = list(zip(df['obj_identifier'].tolist(),
+                    df['date'].dt.to_pydatetime().tolist(),
+                    (df['value'] * 100.0).tolist()))
+    del df
+
+    # Station metadata are attached from an in-memory station cache, as
+    # they would be after the first query of a run.
+    station_cache = wdb0.StationCache()
+    station_cache.update(allstation_df)
+
+    column_list = ['obj_identifier', 'date', 'obs_snow_depth_cm']
+
+    def fetchall_path():
+        df = pd.DataFrame(rows, columns=column_list)
+        return(wdb0._pivot_station_hour(df,
+                                        'obs_snow_depth_cm',
+                                        'values_cm',
+                                        begin_datetime,
+                                        num_hours,
+                                        station_cache=station_cache))
+
+    def stream_path():
+        accum = wdb0._StationHourAccumulator(begin_datetime, num_hours)
+        for i in range(0, len(rows), wdb0.DEFAULT_ITERSIZE):
+            accum.add_batch(rows[i:i + wdb0.DEFAULT_ITERSIZE])
+        return(accum.result('values_cm', station_cache))
+
+    # Capture the COPY streams so that only parsing is timed.
+    copy_sql = {}
+    for copy_format in ['binary', 'csv']:
+        copy_sql[copy_format] = \
+            'COPY (SELECT obj_identifier::int4, ' + \
+            'FLOOR(EXTRACT(EPOCH FROM date) / 3600)::int4, ' + \
+            '(value * 100.0)::float8 ' + \
+            'FROM point.obs_snow_depth ' + \
+            'WHERE date >= \'' + \
+            begin_datetime.strftime('%Y-%m-%d %H:%M:%S') + '\' ' + \
+            'AND date <= \'' + \
+            end_datetime.strftime('%Y-%m-%d %H:%M:%S') + '\' ' + \
+            'AND value IS NOT NULL ' + \
+            'ORDER BY obj_identifier, date) ' + \
+            'TO STDOUT WITH (FORMAT {});'.format(copy_format)
+    wdb0.configure(connect=stand_in.connect)
+    copy_buf = {copy_format: wdb0._copy_expert(copy_sql[copy_format])
+                for copy_format in copy_sql.keys()}
+    def copy_path(copy_format):
+        if copy_format == 'binary':
+            obs_columns = wdb0._parse_copy_binary(copy_buf[copy_format],
+                                                  single_precision=False)
+        else:
+            obs_columns = wdb0._parse_copy_csv(copy_buf[copy_format],
+                                               single_precision=False)
+        meta_df = station_cache.lookup(np.unique(obs_columns['obj_id']))
+        return(wdb0._pivot_obs_columns(obs_columns,
+                                       meta_df,
+                                       'values_cm',
+                                       begin_datetime,
+                                       num_hours))
+
+    path_list = [('fetchall', fetchall_path),
+                 ('stream', stream_path),
+                 ('copy binary', lambda: copy_path('binary')),
+                 ('copy csv', lambda: copy_path('csv'))]
+
+    return(path_list)
+
+
+def run_wdb0(args, begin_datetime, end_datetime):
+
+    """
+    Benchmark fetches from wdb0.
+    """
+
+    def fetch(**kwargs):
+        # Use an empty scratch directory so no .pkl files are reused.
+        with tempfile.TemporaryDirectory() as scratch_dir:
+            return(wdb0.get_snow_depth_obs(begin_datetime,
+                                           end_datetime,
+                                           bounding_box=args.bounding_box,
+                                           scratch_dir=scratch_dir,
+                                           verbose=args.verbose,
+                                           **kwargs))
+
+    path_list = [('fetchall', lambda: fetch()),
+                 ('stream', lambda: fetch(stream=True)),
+                 ('copy binary', lambda: fetch(copy_format='binary')),
+                 ('copy csv', lambda: fetch(copy_format='csv'))]
+
+    return(path_list)
+
+
+def main():
+
+    """
+    Time each fetch backend and compare results.
+    """
+
+    args = parse_args()
+
+    begin_datetime = dt.datetime.strptime(args.begin_datetime, '%Y%m%d%H')
+    end_datetime = dt.datetime.strptime(args.end_datetime, '%Y%m%d%H')
+    if end_datetime < begin_datetime:
+        print('ERROR: end datetime precedes begin datetime.',
+              file=sys.stderr)
+        sys.exit(1)
+    time_range = end_datetime - begin_datetime
+    num_hours = time_range.days * 24 + time_range.seconds // 3600 + 1
+
+    if args.local is not None:
+        path_list = run_local(args, begin_datetime, end_datetime, num_hours)
+    else:
+        path_list = run_wdb0(args, begin_datetime, end_datetime)
+
+    reference = None
+    reference_time = None
+    for path_name, func in path_list:
+        elapsed, obs = best_time(func, args.num_repeats)
+        if reference is None:
+            reference = obs
+            reference_time = elapsed
+            agree = 'reference'
+        elif same_result(reference, obs, 'values_cm'):
+            agree = 'identical'
+        else:
+            agree = 'DIFFERENT'
+        print('{:12s} {:10.3f} s {:7.2f}x  {} stations  {}'.
+              format(path_name,
+                     elapsed,
+                     reference_time / elapsed,
+                     obs['num_stations'],
+                     agree))
+
+
+if __name__ == '__main__':
+    main()